@@ -1,14 +1,39 @@
 from pathlib import Path
+import os
+import shutil
 import subprocess
+import tempfile
+import threading
 import json
 
 from enum import Enum
 from fastapi import FastAPI, Response, status
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
+from typing import Iterator, List, Optional
 
 
 api = FastAPI()
 
+# The number of conversions that may run at once. Each conversion runs in its own
+# converter process, so this defaults to the number of available CPUs.
+CONVERTER_POOL_SIZE = int(os.environ.get("CONVERTER_POOL_SIZE", os.cpu_count() or 1))
+
+# The directory holding the batch files that batch conversions may reference.
+BATCH_FILE_DIRECTORY = os.environ.get("BATCH_FILE_DIRECTORY", "/data")
+
+CONVERTER_PROJECT_PATH = (
+    "/build/FHIR-Converter/output/Microsoft.Health.Fhir.Liquid.Converter.Tool.dll"
+)
+TEMPLATE_DIRECTORY_PATHS = {
+    "hl7v2": "/build/FHIR-Converter/data/Templates/Hl7v2",
+    "ccda": "/build/FHIR-Converter/data/Templates/Ccda",
+}
+
+# The extensions the FHIR Converter looks for when converting a directory of
+# messages of each input type.
+INPUT_FILE_EXTENSIONS = {"hl7v2": ".hl7", "ccda": ".xml"}
+
 
 class InputType(str, Enum):
     hl7v2 = "hl7v2"
@@ -95,20 +120,134 @@ class FhirConverterInput(BaseModel):
     root_template: RootTemplate
 
 
+class FhirConverterBatchInput(BaseModel):
+    """
+    Input parameters for a batch conversion with the FHIR Converter. Either
+    `input_data` or `input_file` must be provided.
+    """
+
+    input_type: InputType
+    root_template: RootTemplate
+    input_data: Optional[List[str]] = None
+    input_file: Optional[str] = None
+
+
 @api.get("/")
 async def health_check():
     return {"status": "OK"}
 
 
+class ConverterPool:
+    """
+    Runs conversions with the FHIR Converter, allowing up to `size` converter
+    processes at once. Requests beyond that wait for a converter to become free,
+    rather than all competing for the CPU at once, so throughput scales with the
+    size of the pool.
+    """
+
+    @property
+    def size(self) -> int:
+        return self.__size
+
+    def __init__(self, size: int):
+        """
+        Creates a new ConverterPool object.
+
+        :param size: The maximum number of conversions to run at once.
+        """
+        if size < 1:
+            raise ValueError("The size of the converter pool must be at least 1.")
+        self.__size = size
+        self.__available = threading.BoundedSemaphore(size)
+
+    def convert(self, input_data: str, input_type: str, root_template: str) -> dict:
+        """
+        Converts a message with the FHIR Converter once a converter is free. See
+        `convert_to_fhir` for a description of the parameters and result.
+        """
+        with self.__available:
+            return convert_to_fhir(input_data, input_type, root_template)
+
+    def convert_batch(
+        self, job_directory: Path, input_type: str, root_template: str
+    ) -> subprocess.CompletedProcess:
+        """
+        Converts a directory of messages with the FHIR Converter once a converter
+        is free. See `convert_batch_to_fhir` for a description of the parameters
+        and result.
+        """
+        with self.__available:
+            return convert_batch_to_fhir(job_directory, input_type, root_template)
+
+
+converter_pool = ConverterPool(CONVERTER_POOL_SIZE)
+
+
+# Declared without `async` so that FastAPI runs each request in its thread pool,
+# rather than blocking the event loop while the converter runs
 @api.post("/convert-to-fhir", status_code=200)
-async def convert(input: FhirConverterInput, response: Response):
-    result = convert_to_fhir(**dict(input))
+def convert(input: FhirConverterInput, response: Response):
+    result = converter_pool.convert(**dict(input))
     if "original_request" in result.get("response"):
         response.status_code = status.HTTP_400_BAD_REQUEST
 
     return result
 
 
+@api.post("/convert-to-fhir-batch", status_code=200)
+def convert_batch(input: FhirConverterBatchInput, response: Response):
+    """
+    Converts many messages of the same input type and root template with a single
+    run of the FHIR Converter, so its startup cost is only paid once. The messages
+    are given either as a list in `input_data`, or as the path of a batch file in
+    `input_file` under `BATCH_FILE_DIRECTORY`. A batch file is either an NDJSON
+    file (with a `.ndjson` extension) with one message per line, each a JSON
+    string or an object with an `input_data` string, or an HL7v2 batch file.
+
+    The results are streamed back as NDJSON, one line per message in the order of
+    the messages, with the index of the message and the same `response` as
+    `/convert-to-fhir` would return for it.
+    """
+    if (input.input_data is None) == (input.input_file is None):
+        response.status_code = status.HTTP_400_BAD_REQUEST
+        return "Exactly one of input_data and input_file must be provided."
+
+    if input.input_file is not None:
+        input_file = Path(input.input_file).resolve()
+        if (
+            Path(BATCH_FILE_DIRECTORY).resolve() not in input_file.parents
+            or not input_file.is_file()
+        ):
+            response.status_code = status.HTTP_400_BAD_REQUEST
+            return f"The input_file must be a file in {BATCH_FILE_DIRECTORY}."
+        messages = _read_batch_file(input_file)
+    else:
+        messages = input.input_data
+
+    job_directory = Path(tempfile.mkdtemp(prefix="fhir-converter-batch-"))
+    try:
+        message_count = _write_batch_messages(
+            job_directory, messages, input.input_type.value
+        )
+        converter_response = converter_pool.convert_batch(
+            job_directory, input.input_type.value, input.root_template.value
+        )
+    except BaseException:
+        shutil.rmtree(job_directory, ignore_errors=True)
+        raise
+
+    return StreamingResponse(
+        _stream_batch_results(
+            job_directory,
+            message_count,
+            input.input_type.value,
+            input.root_template.value,
+            converter_response,
+        ),
+        media_type="application/x-ndjson",
+    )
+
+
 def convert_to_fhir(
     input_data: str,
     input_type: str,
@@ -134,50 +273,196 @@ def convert_to_fhir(
     """
 
     # Setup path variables
-    converter_project_path = (
-        "/build/FHIR-Converter/output/Microsoft.Health.Fhir.Liquid.Converter.Tool.dll"
-    )
-    if input_type == "hl7v2":
-        template_directory_path = "/build/FHIR-Converter/data/Templates/Hl7v2"
-    elif input_type == "ccda":
-        template_directory_path = "/build/FHIR-Converter/data/Templates/Ccda"
-    else:
+    converter_project_path = CONVERTER_PROJECT_PATH
+    if input_type not in TEMPLATE_DIRECTORY_PATHS:
         raise ValueError(
             f"Invalid input_type {input_type}. Valid values are 'hl7v2' and 'ccda'."
         )
-    output_data_file_path = "/tmp/output.json"
+    template_directory_path = TEMPLATE_DIRECTORY_PATHS[input_type]
+
+    # Each conversion reads and writes its own temporary files, so that concurrent
+    # conversions can't overwrite each other's input or output
+    with tempfile.TemporaryDirectory(prefix="fhir-converter-") as request_directory:
+        output_data_file_path = Path(request_directory) / "output.json"
+
+        # Write input data to file
+        input_data_file_path = Path(request_directory) / f"{input_type}-input.txt"
+        input_data_file_path.write_text(input_data)
+
+        # Formulate command for the FHIR Converter, run without a shell.
+        fhir_conversion_command = [
+            "dotnet",
+            converter_project_path,
+            "convert",
+            "--",
+            "--TemplateDirectory",
+            template_directory_path,
+            "--RootTemplate",
+            root_template,
+            "--InputDataFile",
+            str(input_data_file_path),
+            "--OutputDataFile",
+            str(output_data_file_path),
+        ]
+
+        # Call the FHIR Converter.
+        converter_response = subprocess.run(
+            fhir_conversion_command, capture_output=True
+        )
+
+        # Process the response from FHIR Converter.
+        if converter_response.returncode == 0:
+            with open(output_data_file_path) as output_data_file:
+                result = json.load(output_data_file)
+        else:
+            result = vars(converter_response)
+            # Include original input data in the result.
+            result["original_request"] = {
+                "input_data": input_data,
+                "input_type": input_type,
+                "root_template": root_template,
+            }
+
+    return {"response": result}
+
 
-    # Write input data to file
-    input_data_file_path = Path(f"/tmp/{input_type}-input.txt")
-    input_data_file_path.write_text(input_data)
+def convert_batch_to_fhir(
+    job_directory: Path, input_type: str, root_template: str
+) -> subprocess.CompletedProcess:
+    """
+    Call the Microsoft FHIR Converter CLI tool once to convert every message in the
+    `input` directory of a batch job to FHIR R4, writing the result for each message
+    to a JSON file of the same name in the job's `output` directory. Messages that
+    fail to convert have no output file.
+
+    :param job_directory: The working directory of the batch job.
+    :param input_type: The type of the messages to be converted. Valid values are
+        "hl7v2" and "ccda".
+    :param root_template: Name of the liquid template within to be used for
+        conversion. Options are listed in the FHIR-Converter README.md.
+    :return: The completed converter process.
+    """
+    if input_type not in TEMPLATE_DIRECTORY_PATHS:
+        raise ValueError(
+            f"Invalid input_type {input_type}. Valid values are 'hl7v2' and 'ccda'."
+        )
 
-    # Formulate command for the FHIR Converter.
     fhir_conversion_command = [
-        f"dotnet {converter_project_path} ",
-        "convert -- ",
-        f"--TemplateDirectory {template_directory_path} ",
-        f"--RootTemplate {root_template} ",
-        f"--InputDataFile {str(input_data_file_path)} "
-        f"--OutputDataFile {str(output_data_file_path)} ",
+        "dotnet",
+        CONVERTER_PROJECT_PATH,
+        "convert",
+        "--",
+        "--TemplateDirectory",
+        TEMPLATE_DIRECTORY_PATHS[input_type],
+        "--RootTemplate",
+        root_template,
+        "--InputDataFolder",
+        str(job_directory / "input"),
+        "--OutputDataFolder",
+        str(job_directory / "output"),
     ]
+    return subprocess.run(fhir_conversion_command, capture_output=True)
 
-    fhir_conversion_command = "".join(fhir_conversion_command)
 
-    # Call the FHIR Converter.
-    converter_response = subprocess.run(
-        fhir_conversion_command, shell=True, capture_output=True
-    )
+def _read_batch_file(input_file: Path) -> Iterator[str]:
+    """
+    Reads the messages of a batch file, one at a time.
 
-    # Process the response from FHIR Converter.
-    if converter_response.returncode == 0:
-        result = json.load(open(output_data_file_path))
-    else:
-        result = vars(converter_response)
-        # Include original input data in the result.
-        result["original_request"] = {
-            "input_data": input_data,
-            "input_type": input_type,
-            "root_template": root_template,
-        }
+    :param input_file: The path of an NDJSON file, with one message per line given
+        either as a JSON string or an object with an `input_data` string, or of an
+        HL7v2 batch file.
+    :return: An iterator of the messages in the file.
+    """
+    with open(input_file) as file:
+        if input_file.suffix == ".ndjson":
+            for line in file:
+                if line.strip():
+                    message = json.loads(line)
+                    yield message if isinstance(message, str) else message["input_data"]
+            return
 
-    return {"response": result}
+        # HL7v2 batch files hold messages each starting with an MSH segment,
+        # optionally wrapped in file and batch header and trailer segments
+        segments = []
+        for line in file.read().replace("\r\n", "\r").replace("\n", "\r").split("\r"):
+            if line[:3] in ("FHS", "BHS", "BTS", "FTS") or not line.strip():
+                continue
+            if line.startswith("MSH") and segments:
+                yield "\r".join(segments)
+                segments = []
+            segments.append(line)
+        if segments:
+            yield "\r".join(segments)
+
+
+def _write_batch_messages(job_directory: Path, messages, input_type: str) -> int:
+    """
+    Writes each message of a batch job to its own file in the job's `input`
+    directory, named after the index of the message.
+
+    :param job_directory: The working directory of the batch job.
+    :param messages: An iterable of the messages to convert.
+    :param input_type: The type of the messages to be converted.
+    :return: The number of messages written.
+    """
+    input_directory = job_directory / "input"
+    input_directory.mkdir()
+    (job_directory / "output").mkdir()
+
+    message_count = 0
+    for index, message in enumerate(messages):
+        input_file = input_directory / f"{index:08d}{INPUT_FILE_EXTENSIONS[input_type]}"
+        with open(input_file, "w", newline="") as file:
+            file.write(message)
+        message_count += 1
+    return message_count
+
+
+def _stream_batch_results(
+    job_directory: Path,
+    message_count: int,
+    input_type: str,
+    root_template: str,
+    converter_response: subprocess.CompletedProcess,
+) -> Iterator[str]:
+    """
+    Streams the results of a batch job as NDJSON, reading the result of one
+    message at a time, and deletes the job's working directory once done.
+
+    :param job_directory: The working directory of the batch job.
+    :param message_count: The number of messages in the batch.
+    :param input_type: The type of the converted messages.
+    :param root_template: The root template used to convert the messages.
+    :param converter_response: The completed converter process.
+    :return: An iterator of NDJSON lines, one per message.
+    """
+    try:
+        for index in range(message_count):
+            output_file = job_directory / "output" / f"{index:08d}.json"
+            if output_file.is_file():
+                with open(output_file) as file:
+                    result = json.load(file)
+                # Wrap bare bundles in the same status wrapper returned for a
+                # single conversion
+                if "FhirResource" not in result:
+                    result = {"Status": "OK", "FhirResource": result}
+            else:
+                input_file = (
+                    job_directory
+                    / "input"
+                    / f"{index:08d}{INPUT_FILE_EXTENSIONS[input_type]}"
+                )
+                with open(input_file, newline="") as file:
+                    input_data = file.read()
+                result = {
+                    "returncode": converter_response.returncode,
+                    "stderr": converter_response.stderr.decode("utf-8", "replace"),
+                    "original_request": {
+                        "input_data": input_data,
+                        "input_type": input_type,
+                        "root_template": root_template,
+                    },
+                }
+            yield json.dumps({"index": index, "response": result}) + "\n"
+    finally:
+        shutil.rmtree(job_directory, ignore_errors=True)
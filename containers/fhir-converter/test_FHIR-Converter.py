@@ -1,8 +1,13 @@
 # flake8: noqa
+import json
+import threading
+import time
+
+from pathlib import Path
 from unittest import mock
 from fastapi.testclient import TestClient
 
-from main import api
+from main import api, ConverterPool
 
 client = TestClient(api)
 
@@ -246,3 +251,181 @@ def test_convert_invalid_root_template(patched_subprocess_run):
     )
     assert actual_response.status_code == 422
     assert actual_response.json() == invalid_root_template_response
+
+
+@mock.patch("main.json.load")
+@mock.patch("main.open")
+@mock.patch("main.subprocess.run")
+def test_converter_pool(patched_subprocess_run, patched_open, patched_json_load):
+    patched_json_load.return_value = valid_response
+    lock = threading.Lock()
+    running = [0]
+    max_running = [0]
+    input_files = []
+
+    def run(command, capture_output):
+        assert command[:3] == [
+            "dotnet",
+            "/build/FHIR-Converter/output/Microsoft.Health.Fhir.Liquid.Converter.Tool.dll",
+            "convert",
+        ]
+        with lock:
+            running[0] += 1
+            max_running[0] = max(max_running[0], running[0])
+            input_files.append(command[command.index("--InputDataFile") + 1])
+        time.sleep(0.05)
+        with lock:
+            running[0] -= 1
+        return mock.Mock(returncode=0)
+
+    patched_subprocess_run.side_effect = run
+
+    pool = ConverterPool(2)
+    results = []
+    threads = [
+        threading.Thread(
+            target=lambda: results.append(
+                pool.convert("VALID_INPUT_DATA", "hl7v2", "ADT_A01")
+            )
+        )
+        for _ in range(6)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == [{"response": valid_response}] * 6
+    # Conversions run in parallel up to the size of the pool, each with its own
+    # input file
+    assert max_running[0] == 2
+    assert len(set(input_files)) == 6
+
+
+def _convert_directory(command, capture_output):
+    # Converts every input file except those holding "INVALID_INPUT_DATA"
+    input_directory = Path(command[command.index("--InputDataFolder") + 1])
+    output_directory = Path(command[command.index("--OutputDataFolder") + 1])
+    for input_file in sorted(input_directory.iterdir()):
+        if input_file.read_text() != "INVALID_INPUT_DATA":
+            (output_directory / f"{input_file.stem}.json").write_text(
+                json.dumps(valid_response)
+            )
+    return mock.Mock(returncode=0, stderr=b"")
+
+
+@mock.patch("main.subprocess.run")
+def test_convert_batch_input_data(patched_subprocess_run):
+    patched_subprocess_run.side_effect = _convert_directory
+
+    actual_response = client.post(
+        "/convert-to-fhir-batch",
+        json={
+            "input_data": [
+                "VALID_INPUT_DATA",
+                "INVALID_INPUT_DATA",
+                "VALID_INPUT_DATA",
+            ],
+            "input_type": "hl7v2",
+            "root_template": "ADT_A01",
+        },
+    )
+    assert actual_response.status_code == 200
+    assert actual_response.headers["content-type"] == "application/x-ndjson"
+
+    results = [json.loads(line) for line in actual_response.text.splitlines()]
+    assert [result["index"] for result in results] == [0, 1, 2]
+    assert results[0]["response"] == valid_response
+    assert results[2]["response"] == valid_response
+    assert results[1]["response"]["original_request"] == {
+        "input_data": "INVALID_INPUT_DATA",
+        "input_type": "hl7v2",
+        "root_template": "ADT_A01",
+    }
+
+    # The converter runs once over the whole batch
+    patched_subprocess_run.assert_called_once()
+    command = patched_subprocess_run.call_args[0][0]
+    assert "--InputDataFolder" in command
+    assert "--OutputDataFolder" in command
+    # The batch's working directory is removed once its results are streamed
+    job_directory = Path(command[command.index("--InputDataFolder") + 1]).parent
+    assert not job_directory.exists()
+
+
+@mock.patch("main.subprocess.run")
+def test_convert_batch_input_file(patched_subprocess_run, tmp_path):
+    messages = []
+
+    def convert_directory(command, capture_output):
+        input_directory = Path(command[command.index("--InputDataFolder") + 1])
+        for input_file in sorted(input_directory.iterdir()):
+            with open(input_file, newline="") as file:
+                messages.append(file.read())
+        return _convert_directory(command, capture_output)
+
+    patched_subprocess_run.side_effect = convert_directory
+    ndjson_file = tmp_path / "messages.ndjson"
+    ndjson_file.write_text('"VALID_INPUT_DATA"\n{"input_data": "VALID_INPUT_DATA"}\n')
+    hl7_file = tmp_path / "messages.hl7"
+    hl7_file.write_text(
+        "FHS|^~\\&\nBHS|^~\\&\nMSH|^~\\&|1\nPID|1\nMSH|^~\\&|2\nPID|2\nBTS|2\nFTS|1\n"
+    )
+
+    with mock.patch("main.BATCH_FILE_DIRECTORY", str(tmp_path)):
+        ndjson_response = client.post(
+            "/convert-to-fhir-batch",
+            json={
+                "input_file": str(ndjson_file),
+                "input_type": "hl7v2",
+                "root_template": "ADT_A01",
+            },
+        )
+        hl7_response = client.post(
+            "/convert-to-fhir-batch",
+            json={
+                "input_file": str(hl7_file),
+                "input_type": "hl7v2",
+                "root_template": "ADT_A01",
+            },
+        )
+
+    assert ndjson_response.status_code == 200
+    assert len(ndjson_response.text.splitlines()) == 2
+    assert hl7_response.status_code == 200
+    assert len(hl7_response.text.splitlines()) == 2
+    assert messages == [
+        "VALID_INPUT_DATA",
+        "VALID_INPUT_DATA",
+        "MSH|^~\\&|1\rPID|1",
+        "MSH|^~\\&|2\rPID|2",
+    ]
+
+
+@mock.patch("main.subprocess.run")
+def test_convert_batch_invalid_input(patched_subprocess_run, tmp_path):
+    # Neither or both of input_data and input_file
+    for request in [
+        {"input_type": "hl7v2", "root_template": "ADT_A01"},
+        {
+            "input_data": ["VALID_INPUT_DATA"],
+            "input_file": "messages.ndjson",
+            "input_type": "hl7v2",
+            "root_template": "ADT_A01",
+        },
+    ]:
+        actual_response = client.post("/convert-to-fhir-batch", json=request)
+        assert actual_response.status_code == 400
+
+    # An input_file outside of the batch file directory
+    with mock.patch("main.BATCH_FILE_DIRECTORY", str(tmp_path / "data")):
+        actual_response = client.post(
+            "/convert-to-fhir-batch",
+            json={
+                "input_file": str(tmp_path / "messages.ndjson"),
+                "input_type": "hl7v2",
+                "root_template": "ADT_A01",
+            },
+        )
+    assert actual_response.status_code == 400
+    patched_subprocess_run.assert_not_called()
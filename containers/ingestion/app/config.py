@@ -4,14 +4,17 @@ from typing import Optional, Literal
 
 
 class Settings(BaseSettings):
-    cred_manager: Optional[Literal["azure", "gcp"]]
+    cred_manager: Optional[Literal["azure", "gcp", "local"]]
     salt_str: Optional[str]
     fhir_url: Optional[str]
     auth_id: Optional[str]
     auth_token: Optional[str]
-    cloud_provider: Optional[Literal["azure", "gcp"]]
+    cloud_provider: Optional[Literal["azure", "gcp", "local", "memory"]]
     bucket_name: Optional[str]
     storage_account_url: Optional[str]
+    local_storage_directory: Optional[str]
+    geocode_max_workers: Optional[int]
+    geocode_rate_limit: Optional[float]
 
 
 @lru_cache()
@@ -18,7 +18,7 @@ router = APIRouter(
 
 class WriteBlobToStorageInput(BaseModel):
     blob: dict = Field(description="Contents of a blob to be written to cloud storage.")
-    cloud_provider: Optional[Literal["azure", "gcp"]] = Field(
+    cloud_provider: Optional[Literal["azure", "gcp", "local", "memory"]] = Field(
         description="The cloud provider hosting the storage resource that the blob will"
         " be uploaded to. Must be provided in the request body or set as an environment"
         " variable of the service."
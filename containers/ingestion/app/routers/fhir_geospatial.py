@@ -1,7 +1,13 @@
 from fastapi import APIRouter, Response, status
 from pydantic import BaseModel, validator, Field
 from typing import Optional, Literal
-from phdi.fhir.geospatial import SmartyFhirGeocodeClient, CensusFhirGeocodeClient
+from phdi.fhir.geospatial import (
+    SmartyFhirGeocodeClient,
+    CensusFhirGeocodeClient,
+    FhirGeocodeExecutor,
+    TokenBucket,
+)
+from app.config import get_settings
 from app.utils import (
     search_for_required_values,
     check_for_fhir_bundle,
@@ -14,6 +20,29 @@ router = APIRouter(
     tags=["fhir/geospatial"],
 )
 
+# The number of geocoding requests made at once for each request, by default.
+DEFAULT_GEOCODE_MAX_WORKERS = 4
+
+# Rate limiters shared by every request using the same geocoding service, so that
+# together they keep within the service's quota.
+rate_limiters = {}
+
+
+def get_rate_limiter(geocode_method: str) -> Optional[TokenBucket]:
+    """
+    Get the rate limiter shared by requests using a geocoding service, limiting
+    lookups to GEOCODE_RATE_LIMIT per second if it's set.
+
+    :param geocode_method: The geocoding service.
+    :return: The service's rate limiter, or None if lookups aren't rate limited.
+    """
+    rate_limit = get_settings().get("geocode_rate_limit")
+    if rate_limit is None:
+        return None
+    if geocode_method not in rate_limiters:
+        rate_limiters[geocode_method] = TokenBucket(rate_limit)
+    return rate_limiters[geocode_method]
+
 
 class GeocodeAddressInBundleInput(BaseModel):
     bundle: dict = Field(description="A FHIR bundle")
@@ -55,6 +84,12 @@ def geocode_bundle_endpoint(
     will be obtained via environment variables.  In the case where smarty is the geocode
     method and auth_id and/or auth_token are not supplied then an HTTP 400 status
     code will be returned.
+
+    Addresses are geocoded concurrently, by up to GEOCODE_MAX_WORKERS requests to
+    the geocode method at a time. The census geocoder is sent one patient per
+    request, and Smarty up to 100 patients per batch request. If GEOCODE_RATE_LIMIT
+    is set, lookups across all requests using the same geocode method are limited
+    to that many per second.
     :param input: A JSON formated request body with schema specified by the
         GeocodeAddressInBundleInput model.
     :return: A FHIR bundle where every patient resource address will now
@@ -76,6 +111,16 @@ def geocode_bundle_endpoint(
     elif input.get("geocode_method") == "census":
         geocode_client = CensusFhirGeocodeClient()
 
+    # Geocode the bundle's addresses concurrently, within the service's quota, in
+    # chunks as large as the service geocodes in one request
+    geocode_executor = FhirGeocodeExecutor(
+        geocode_client,
+        max_workers=get_settings().get("geocode_max_workers")
+        or DEFAULT_GEOCODE_MAX_WORKERS,
+        rate_limiter=get_rate_limiter(input.get("geocode_method")),
+        chunk_size=geocode_client.batch_size,
+    )
+
     # Here we need to remove the parameters that are used here
     #   but are not required in the PHDI function in the SDK
     input.pop("geocode_method", None)
@@ -83,7 +128,7 @@ def geocode_bundle_endpoint(
     input.pop("auth_token", None)
     result = {}
     try:
-        geocoder_result = geocode_client.geocode_bundle(**input)
+        geocoder_result = geocode_executor.geocode_bundle(**input)
         result["status_code"] = "200"
         result["bundle"] = geocoder_result
     except Exception as error:
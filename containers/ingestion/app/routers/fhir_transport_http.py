@@ -24,7 +24,7 @@ class UploadBundleToFhirServerInput(BaseModel):
         "The FHIR API provides additional details on creating [FHIR-conformant "
         "batch/transaction](https://hl7.org/fhir/http.html#transaction) bundles."
     )
-    cred_manager: Optional[Literal["azure", "gcp"]] = Field(
+    cred_manager: Optional[Literal["azure", "gcp", "local"]] = Field(
         description="The credential manager used to authenticate to the FHIR server."
     )
     fhir_url: Optional[str] = Field(
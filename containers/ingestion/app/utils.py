@@ -1,9 +1,12 @@
+from functools import lru_cache
 from pydantic import BaseModel, Field, root_validator
 from typing import Optional, Union
 from app.config import get_settings
 from phdi.cloud.azure import AzureCloudContainerConnection, AzureCredentialManager
 from phdi.cloud.core import BaseCredentialManager
 from phdi.cloud.gcp import GcpCloudStorageConnection, GcpCredentialManager
+from phdi.cloud.local import LocalCloudStorageConnection, LocalCredentialManager
+from phdi.cloud.memory import MemoryCloudStorageConnection
 
 
 class StandardResponse(BaseModel):
@@ -30,8 +33,18 @@ class StandardResponse(BaseModel):
 cloud_providers = {
     "azure": AzureCloudContainerConnection,
     "gcp": GcpCloudStorageConnection,
+    "local": LocalCloudStorageConnection,
+    "memory": MemoryCloudStorageConnection,
 }
-cred_managers = {"azure": AzureCredentialManager, "gcp": GcpCredentialManager}
+cred_managers = {
+    "azure": AzureCredentialManager,
+    "gcp": GcpCredentialManager,
+    "local": LocalCredentialManager,
+}
+
+# The directory the "local" cloud provider stores containers in, unless the
+# LOCAL_STORAGE_DIRECTORY environment variable is set.
+DEFAULT_LOCAL_STORAGE_DIRECTORY = "storage"
 
 
 def check_for_fhir(value: dict) -> dict:
@@ -129,11 +142,46 @@ def get_cloud_provider_storage_connection(
 ) -> BaseCredentialManager:
     """
     Return a cloud provider storage connection for different cloud providers
-    depending upon which one the user requests via the parameter.
+    depending upon which one the user requests via the parameter. Connections
+    are created once per cloud provider and storage location (the storage
+    account URL, or the directory of local storage), and reused.
+
+    :param cloud_provider: A string identifying which cloud provider is desired.
+    :param storage_account_url: The URL of the Azure storage account to connect
+      to. Default: `None`
+    :return: A Google Cloud Storage Connection, an Azure Storage Connection, or a
+    local filesystem or in-memory storage connection, depending upon the value
+    passed in.
+    """
+    storage_location = storage_account_url
+    if cloud_provider == "local":
+        storage_location = (
+            get_settings().get("local_storage_directory")
+            or DEFAULT_LOCAL_STORAGE_DIRECTORY
+        )
+    return _get_storage_connection(cloud_provider, storage_location)
+
+
+def clear_storage_connections() -> None:
+    """
+    Discards the storage connections shared between requests, so new ones are
+    created, e.g. between tests.
+    """
+    _get_storage_connection.cache_clear()
+
+
+@lru_cache()
+def _get_storage_connection(cloud_provider: str, storage_location: str = None):
+    """
+    Creates the storage connection for a cloud provider and storage location,
+    which is cached so it's shared between requests, along with its clients and
+    connection pools.
 
     :param cloud_provider: A string identifying which cloud provider is desired.
-    :return: Either a Google Cloud Storage Connection or an Azure Storage
-    Connection depending upon the value passed in.
+    :param storage_location: The URL of the Azure storage account, or the
+      directory of local storage, to connect to.
+    :return: The storage connection, or `None` if the cloud provider isn't
+      supported.
     """
     cloud_provider_class = cloud_providers.get(cloud_provider)
     result = None
@@ -141,11 +189,13 @@ def get_cloud_provider_storage_connection(
     if cloud_provider_class is not None:
         if cloud_provider == "azure":
             cred_manager = get_cred_manager(
-                cred_manager=cloud_provider, location_url=storage_account_url
+                cred_manager=cloud_provider, location_url=storage_location
             )
             result = cloud_provider_class(
-                storage_account_url=storage_account_url, cred_manager=cred_manager
+                storage_account_url=storage_location, cred_manager=cred_manager
             )
+        elif cloud_provider == "local":
+            result = cloud_provider_class(storage_location)
         else:
             result = cloud_provider_class()
     return result
@@ -89,7 +89,9 @@ def test_cloud_storage_wrong_provider():
     }
 
     expected_detail_loc = "cloud_provider"
-    expected_detail_msg = "unexpected value; permitted: 'azure', 'gcp'"
+    expected_detail_msg = (
+        "unexpected value; permitted: 'azure', 'gcp', 'local', 'memory'"
+    )
     expected_status_code = 422
     actual_response = client.post(client_url, json=test_request)
 
@@ -23,6 +23,9 @@ def test_get_settings_success():
         "cloud_provider": "azure",
         "bucket_name": "my_bucket",
         "storage_account_url": "storage_url",
+        "local_storage_directory": None,
+        "geocode_max_workers": None,
+        "geocode_rate_limit": None,
     }
     os.environ.pop("CRED_MANAGER", None)
     os.environ.pop("CLOUD_PROVIDER", None)
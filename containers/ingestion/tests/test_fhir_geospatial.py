@@ -1,3 +1,4 @@
+import copy
 import pathlib
 import os
 import json
@@ -6,6 +7,7 @@ from fastapi.testclient import TestClient
 from fastapi import Response, status
 from app.main import app
 from app.config import get_settings
+from app.routers.fhir_geospatial import get_rate_limiter, rate_limiters
 
 
 client = TestClient(app)
@@ -16,6 +18,20 @@ test_bundle = json.load(
 )
 
 
+def _geocode_bundle(bundle, overwrite):
+    return copy.deepcopy(bundle)
+
+
+def _assert_geocoded_with(geocode_client):
+    # Entries with addresses are geocoded in chunks, as copies
+    geocode_client.geocode_bundle.assert_called_once()
+    chunk = geocode_client.geocode_bundle.call_args.args[0]
+    assert geocode_client.geocode_bundle.call_args.kwargs == {"overwrite": False}
+    assert chunk["entry"] == [
+        entry for entry in test_bundle["entry"] if entry["resource"].get("address")
+    ]
+
+
 @mock.patch("app.routers.fhir_geospatial.SmartyFhirGeocodeClient")
 def test_geocode_bundle_returns_errors_from_smarty(patched_smarty_client):
     test_request = {
@@ -31,6 +47,7 @@ def test_geocode_bundle_returns_errors_from_smarty(patched_smarty_client):
         "bundle": None,
     }
 
+    patched_smarty_client.return_value.batch_size = 100
     patched_smarty_client.return_value.geocode_bundle.side_effect = Exception(
         "I am a test error message"
     )
@@ -45,12 +62,15 @@ def test_geocode_bundle_returns_errors_from_smarty(patched_smarty_client):
 def test_geocode_bundle_success_census(patched_client):
     test_request = {"bundle": test_bundle, "geocode_method": "census"}
 
-    client.post("/fhir/geospatial/geocode/geocode_bundle", json=test_request)
-
-    patched_client.return_value.geocode_bundle.assert_called_with(
-        bundle=test_bundle, overwrite=True
+    patched_client.return_value.batch_size = 1
+    patched_client.return_value.geocode_bundle.side_effect = _geocode_bundle
+    actual_response = client.post(
+        "/fhir/geospatial/geocode/geocode_bundle", json=test_request
     )
 
+    assert actual_response.json()["status_code"] == "200"
+    _assert_geocoded_with(patched_client.return_value)
+
 
 @mock.patch("app.routers.fhir_geospatial.SmartyFhirGeocodeClient")
 def test_geocode_bundle_success_smarty(patched_client):
@@ -61,12 +81,15 @@ def test_geocode_bundle_success_smarty(patched_client):
         "auth_token": "test_token",
     }
 
-    client.post("/fhir/geospatial/geocode/geocode_bundle", json=test_request)
-
-    patched_client.return_value.geocode_bundle.assert_called_with(
-        bundle=test_bundle, overwrite=True
+    patched_client.return_value.batch_size = 100
+    patched_client.return_value.geocode_bundle.side_effect = _geocode_bundle
+    actual_response = client.post(
+        "/fhir/geospatial/geocode/geocode_bundle", json=test_request
     )
 
+    assert actual_response.json()["status_code"] == "200"
+    _assert_geocoded_with(patched_client.return_value)
+
 
 def test_geocode_bundle_no_method():
     test_request = {"bundle": test_bundle, "geocode_method": ""}
@@ -155,6 +178,7 @@ def test_geocode_bundle_bad_smarty_creds_env(patched_geocode, patched_smarty_cli
     expected_response = Response
     expected_response.status_code = status.HTTP_400_BAD_REQUEST
     expected_response.json = {"error": error}
+    patched_smarty_client.return_value.batch_size = 100
     patched_smarty_client.return_value.geocode_bundle = expected_response
     patched_geocode.geocode_client = patched_smarty_client
     actual_response = client.post(
@@ -164,3 +188,20 @@ def test_geocode_bundle_bad_smarty_creds_env(patched_geocode, patched_smarty_cli
     assert actual_response.status_code == expected_response.status_code
     os.environ.pop("AUTH_ID", None)
     os.environ.pop("AUTH_TOKEN", None)
+
+
+def test_get_rate_limiter():
+    get_settings.cache_clear()
+    assert get_rate_limiter("census") is None
+
+    os.environ["GEOCODE_RATE_LIMIT"] = "50"
+    get_settings.cache_clear()
+    rate_limiter = get_rate_limiter("smarty")
+    assert rate_limiter.rate == 50
+    # Requests using the same geocode method share a rate limiter
+    assert get_rate_limiter("smarty") is rate_limiter
+    assert get_rate_limiter("census") is not rate_limiter
+
+    os.environ.pop("GEOCODE_RATE_LIMIT", None)
+    get_settings.cache_clear()
+    rate_limiters.clear()
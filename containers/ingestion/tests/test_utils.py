@@ -6,10 +6,20 @@ from app.utils import (
     search_for_required_values,
     get_cred_manager,
     get_cloud_provider_storage_connection,
+    clear_storage_connections,
 )
 from app.config import get_settings
 
 
+@pytest.fixture(autouse=True)
+def fresh_storage_connections():
+    # Storage connections are shared for the life of the process, so each test
+    # starts without any
+    clear_storage_connections()
+    yield
+    clear_storage_connections()
+
+
 def test_search_for_required_values_success():
     input = {"salt_str": "request-value"}
     required_values = ["cred_manager"]
@@ -92,12 +102,49 @@ def test_get_cloud_provider_azure():
     assert hasattr(actual_result, "storage_account_url")
 
 
+def test_get_cloud_provider_reuses_connections():
+    first_result = get_cloud_provider_storage_connection("azure", "Storage URL 1")
+    assert get_cloud_provider_storage_connection("azure", "Storage URL 1") is (
+        first_result
+    )
+    assert get_cloud_provider_storage_connection("azure", "Storage URL 2") is not (
+        first_result
+    )
+
+
 def test_get_cloud_provider_gcp():
     actual_result = get_cloud_provider_storage_connection("gcp")
     assert hasattr(actual_result, "__class__")
     assert hasattr(actual_result, "_get_storage_client")
 
 
+def test_get_cloud_provider_local(tmp_path):
+    os.environ["LOCAL_STORAGE_DIRECTORY"] = str(tmp_path / "first")
+    get_settings.cache_clear()
+    local_connection = get_cloud_provider_storage_connection("local")
+    assert get_cloud_provider_storage_connection("local") is local_connection
+
+    # A connection is kept for each local storage directory
+    os.environ["LOCAL_STORAGE_DIRECTORY"] = str(tmp_path / "second")
+    get_settings.cache_clear()
+    second_connection = get_cloud_provider_storage_connection("local")
+    os.environ.pop("LOCAL_STORAGE_DIRECTORY", None)
+    get_settings.cache_clear()
+
+    local_connection.upload_object({"hello": "world"}, "some-bucket", "some-file")
+    second_connection.upload_object({"hello": "world"}, "some-bucket", "other-file")
+    assert (tmp_path / "first" / "some-bucket" / "some-file").exists()
+    assert (tmp_path / "second" / "some-bucket" / "other-file").exists()
+
+    memory_connection = get_cloud_provider_storage_connection("memory")
+    memory_connection.upload_object({"hello": "world"}, "some-bucket", "some-file")
+    assert list(memory_connection.list_objects("some-bucket")) == ["some-file"]
+    assert get_cloud_provider_storage_connection("memory") is memory_connection
+
+    clear_storage_connections()
+    assert get_cloud_provider_storage_connection("memory") is not memory_connection
+
+
 def test_get_cloud_provider_invalid():
     expected_result = None
     actual_result = get_cloud_provider_storage_connection("myown")
@@ -1,18 +1,13 @@
 from fastapi import FastAPI, Response, status
 from pydantic import BaseModel, Field, validator
 from typing import Optional, Literal
-import urllib.parse
 import datetime
 import jsonschema
 from pathlib import Path
 from phdi.cloud.core import BaseCredentialManager
 from phdi.tabulation import validate_schema
-from phdi.tabulation.tables import write_data
-from phdi.fhir.tabulation.tables import (
-    _generate_search_urls,
-    extract_data_from_fhir_search_incremental,
-    tabulate_data,
-)
+from phdi.tabulation.tables import _get_column_types
+from phdi.fhir.tabulation.tables import _write_tables
 from app.config import get_settings
 from app.utils import (
     get_cred_manager,
@@ -20,6 +15,10 @@ from app.utils import (
     check_schema_validity,
 )
 
+# The name of the file, in a tabulation run's output directory, in which the progress
+# of a checkpointed run is saved.
+CHECKPOINT_FILENAME = "checkpoint.json"
+
 # Read settings from environmnent.
 get_settings()
 
@@ -71,6 +70,17 @@ class TabulateInput(BaseModel):
         " FHIR. May be set here or as an environment variable. If not provided anywhere"
         " then un-authenticated FHIR server requests will be attempted."
     )
+    checkpoint: Optional[bool] = Field(
+        default=False,
+        description="Save the progress of the run as each table is written, so that"
+        " it can be resumed if it is interrupted. Parquet tables are then written as"
+        " directories of part files.",
+    )
+    resume_directory: Optional[str] = Field(
+        description="The output directory of a previous, interrupted checkpointed "
+        "run of the same schema to resume. Tables that were completed are skipped, "
+        "and the others are continued from their last checkpoint."
+    )
 
     _check_schema_validity = validator("schema_", allow_reuse=True)(
         check_schema_validity
@@ -126,6 +136,20 @@ async def tabulate_endpoint(input: TabulateInput, response: Response):
     # Extract schema name from schema metadata.
     input["schema_name"] = input["schema_"]["metadata"].get("schema_name")
 
+    # Only allow resuming checkpointed runs of the same schema.
+    if input["resume_directory"] is not None:
+        resume_directory = Path(input["resume_directory"]).resolve()
+        schema_directory = (Path() / "tables" / input["schema_name"]).resolve()
+        if (
+            schema_directory not in resume_directory.parents
+            or not (resume_directory / CHECKPOINT_FILENAME).is_file()
+        ):
+            response.status_code = status.HTTP_400_BAD_REQUEST
+            return (
+                "The resume_directory must be the output directory of a previous "
+                "checkpointed run of this schema."
+            )
+
     # Instantiate a credential manager.
     if input["cred_manager"] is not None:
         input["cred_manager"] = get_cred_manager(
@@ -141,6 +165,8 @@ def tabulate(
     schema_name: Optional[str],
     fhir_url: str,
     cred_manager: BaseCredentialManager = None,
+    checkpoint: bool = False,
+    resume_directory: Optional[str] = None,
 ) -> dict:
     """
     Given a schema and FHIR server, extract the required data from the FHIR server,
@@ -158,49 +184,50 @@ def tabulate(
     :fhir_url: The URL of the FHIR server data should be extracted from.
     :cred_manager: A credential manager that can be used handle authentication with FHIR
         server.
+    :checkpoint: Whether to save the progress of the run in its output directory, so
+        that it can be resumed if it is interrupted.
+    :resume_directory: The output directory of a previous checkpointed run to resume.
     """
-    # Load search_urls to query FHIR server
-    search_urls = _generate_search_urls(schema=schema_)
-    directory = (
-        Path()
-        / "tables"
-        / schema_name
-        / datetime.datetime.now().strftime("%m-%d-%YT%H%M%S")
-    )
-
-    directory.mkdir(parents=True)
-    for table_name, search_url in search_urls.items():
-        next = search_url
-        pq_writer = None
-        while next is not None:
-            # Return set of incremental results and next URL to query
-            incremental_results, next = extract_data_from_fhir_search_incremental(
-                search_url=urllib.parse.urljoin(fhir_url, next),
-                cred_manager=cred_manager,
-            )
-            # Tabulate data for set of incremental results
-            tabulated_incremental_data = tabulate_data(
-                incremental_results, schema_, table_name
-            )
-            # Write set of tabulated incremental data
-            pq_writer = write_data(
-                tabulated_data=tabulated_incremental_data,
-                directory=str(directory),
-                filename=table_name,
-                output_type=output_type,
-                db_file=schema_name,
-                db_tablename=table_name,
-                pq_writer=pq_writer,
-            )
+    if resume_directory is not None:
+        directory = Path(resume_directory)
+        checkpoint = True
+    else:
+        directory = (
+            Path()
+            / "tables"
+            / schema_name
+            / datetime.datetime.now().strftime("%m-%d-%YT%H%M%S")
+        )
+        directory.mkdir(parents=True)
+
+    table_names = list(schema_.get("tables", {}).keys())
+    table_write_params = {
+        table_name: {
+            "directory": str(directory),
+            "filename": table_name,
+            "output_type": output_type,
+            "db_file": schema_name,
+            "db_tablename": table_name,
+            "column_types": _get_column_types(schema_, table_name),
+        }
+        for table_name in table_names
+    }
 
-        if pq_writer is not None:
-            pq_writer.close()
+    # Extract, tabulate and write every table, fetching the results of searches
+    # shared by several tables only once
+    _write_tables(
+        schema_,
+        fhir_url,
+        table_write_params,
+        cred_manager=cred_manager,
+        checkpoint_path=directory / CHECKPOINT_FILENAME if checkpoint else None,
+    )
 
     result = {
         "schema_name": schema_name,
         "output_type": output_type,
         "fhir_url": fhir_url,
-        "tables": list(search_urls.keys()),
+        "tables": table_names,
         "directory": str(directory),
     }
     return result
@@ -5,6 +5,8 @@ import json
 from unittest import mock
 import pathlib
 import copy
+import csv
+import pytest
 import urllib
 import datetime
 from app.main import app, tabulate
@@ -65,6 +67,8 @@ def test_tabulate_endpoint_valid_request(patched_tabulate):
     valid_request = copy.deepcopy(valid_tabulate_request)
     actual_response = client.post("/tabulate", json=valid_request)
     valid_request["cred_manager"] = None
+    valid_request["checkpoint"] = False
+    valid_request["resume_directory"] = None
     valid_request["schema_"] = valid_tabulate_request["schema"]
     valid_request["schema_name"] = valid_request["schema"]["metadata"]["schema_name"]
     valid_request.pop("schema")
@@ -190,6 +194,19 @@ def test_tabulate_endpoint_missing_fhirl_url(patched_tabulate):
     )  # noqa
 
 
+@mock.patch("app.main.tabulate")
+def test_tabulate_endpoint_invalid_resume_directory(patched_tabulate):
+    invalid_tabulate_request = copy.deepcopy(valid_tabulate_request)
+    invalid_tabulate_request["resume_directory"] = "tables/../../"
+    actual_response = client.post("/tabulate", json=invalid_tabulate_request)
+    assert actual_response.status_code == 400
+    assert (
+        actual_response.json()
+        == "The resume_directory must be the output directory of a previous checkpointed run of this schema."
+    )
+    patched_tabulate.assert_not_called()
+
+
 @mock.patch("app.main.get_cred_manager")
 @mock.patch("app.main.tabulate")
 def test_tabulate_endpoint_instantiate_cred_manager(
@@ -206,12 +223,10 @@ def test_tabulate_endpoint_instantiate_cred_manager(
     )
 
 
-@mock.patch("app.main.write_data")
-@mock.patch("app.main.tabulate_data")
-@mock.patch("app.main.extract_data_from_fhir_search_incremental")
-@mock.patch("app.main._generate_search_urls")
+@mock.patch("phdi.fhir.tabulation.tables.write_data")
+@mock.patch("phdi.fhir.tabulation.tables.tabulate_data")
+@mock.patch("phdi.fhir.tabulation.tables.extract_data_from_fhir_search_incremental")
 def test_tabulate(
-    patched_generate_search_urls,
     patched_extract_data_from_fhir_search_incremental,
     patched_tabulate_data,
     patched_write_data,
@@ -220,9 +235,6 @@ def test_tabulate(
     tabulate_request["schema_"] = tabulate_request["schema"]
     tabulate_request.pop("schema")
 
-    search_urls = {"my-table": "my-table-search-url"}
-    patched_generate_search_urls.return_value = search_urls
-
     incremental_results = ("some-incremental-results", None)
     patched_extract_data_from_fhir_search_incremental.return_value = incremental_results
 
@@ -238,25 +250,90 @@ def test_tabulate(
         / datetime.datetime.now().strftime("%m-%d-%YT%H%M%S")
     )
 
-    tabulate(**tabulate_request)
+    result = tabulate(**tabulate_request)
+    assert result["tables"] == ["table 1A", "table 2A"]
 
-    patched_generate_search_urls.assert_called_with(schema=tabulate_request["schema_"])
-    patched_extract_data_from_fhir_search_incremental.assert_called_with(
+    # Both tables are anchored on patients with the same search criteria, so each
+    # page of results is fetched once and tabulated into both tables
+    patched_extract_data_from_fhir_search_incremental.assert_called_once_with(
         search_url=urllib.parse.urljoin(
-            tabulate_request["fhir_url"], search_urls["my-table"]
+            tabulate_request["fhir_url"],
+            "Patient?_count=1000&_since=2020-01-01T00%3A00%3A00"
+            "&_revinclude=Observation%3Asubject"
+            "&_include=Patient%3Ageneral-practitioner",
         ),
         cred_manager=None,
     )
-    patched_tabulate_data.assert_called_with(
-        incremental_results[0], tabulate_request["schema_"], list(search_urls.keys())[0]
+    patched_tabulate_data.assert_has_calls(
+        [
+            mock.call(
+                incremental_results[0], tabulate_request["schema_"], "table 1A", None
+            ),
+            mock.call(
+                incremental_results[0],
+                tabulate_request["schema_"],
+                "table 2A",
+                mock.ANY,
+            ),
+        ]
     )
     patched_write_data.assert_called_with(
         tabulated_data=patched_tabulate_data(),
         directory=str(directory),
-        filename=list(search_urls.keys())[0],
+        filename="table 2A",
         output_type=tabulate_request["output_type"],
         db_file=tabulate_request["schema_name"],
-        db_tablename=list(search_urls.keys())[0],
+        db_tablename="table 2A",
         pq_writer=None,
+        column_types={},
+        sql_writer=None,
+        csv_writer=None,
     )
     assert pq_writer.close.called
+
+
+@mock.patch("phdi.fhir.tabulation.tables.tabulate_data")
+@mock.patch("phdi.fhir.tabulation.tables.extract_data_from_fhir_search_incremental")
+def test_tabulate_resume_from_checkpoint(
+    patched_extract_data_from_fhir_search_incremental,
+    patched_tabulate_data,
+    tmp_path,
+    monkeypatch,
+):
+    monkeypatch.chdir(tmp_path)
+    tabulate_request = copy.deepcopy(valid_tabulate_request)
+    tabulate_request["schema_"] = tabulate_request["schema"]
+    tabulate_request.pop("schema")
+
+    def tabulate_data(data, schema, table_name, reference_store):
+        headers = list(schema["tables"][table_name]["columns"])
+        return [headers, [table_name] * len(headers)]
+
+    patched_tabulate_data.side_effect = tabulate_data
+
+    # The run is interrupted while fetching the second page of results
+    patched_extract_data_from_fhir_search_incremental.side_effect = [
+        ("some-incremental-results", "page-2"),
+        ConnectionError(),
+    ]
+    with pytest.raises(ConnectionError):
+        tabulate(**tabulate_request, checkpoint=True)
+    (directory,) = (tmp_path / "tables" / tabulate_request["schema_name"]).iterdir()
+    assert (directory / "checkpoint.json").is_file()
+
+    patched_extract_data_from_fhir_search_incremental.reset_mock()
+    patched_extract_data_from_fhir_search_incremental.side_effect = [
+        ("some-incremental-results", None),
+    ]
+    result = tabulate(**tabulate_request, resume_directory=str(directory))
+    assert result["directory"] == str(directory)
+    patched_extract_data_from_fhir_search_incremental.assert_called_once_with(
+        search_url=urllib.parse.urljoin(tabulate_request["fhir_url"], "page-2"),
+        cred_manager=None,
+    )
+
+    for table_name in ["table 1A", "table 2A"]:
+        headers = list(valid_schema["tables"][table_name]["columns"])
+        with open(directory / table_name) as csv_file:
+            rows = [row for row in csv.reader(csv_file)]
+        assert rows == [headers] + [[table_name] * len(headers)] * 2
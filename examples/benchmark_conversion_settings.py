@@ -0,0 +1,39 @@
+# This script benchmarks how quickly the FHIR converter settings are detected
+# for the sample eCR document, compared with parsing the whole document as
+# `_get_fhir_conversion_settings` used to. The document is padded with copies of
+# its body to show how detection time scales with the size of large eCRs.
+#
+# Run it from the root of the repository with:
+#   python examples/benchmark_conversion_settings.py
+
+import pathlib
+import timeit
+
+import xml.etree.ElementTree as et
+
+from phdi.fhir.conversion.convert import _get_fhir_conversion_settings
+
+REPEAT = 20
+
+with open(
+    pathlib.Path(__file__).parent / "eCR-sample-data" / "ecr_sample_input.xml"
+) as fp:
+    ecr = fp.read()
+
+# Pad the document's body with copies of itself, keeping it well-formed
+body_start = ecr.index("<component>")
+body_end = ecr.rindex("</ClinicalDocument>")
+body = ecr[body_start:body_end]
+
+for copies in [1, 10, 50]:
+    message = ecr[:body_start] + body * copies + ecr[body_end:]
+
+    full_parse = timeit.timeit(lambda: et.fromstring(message), number=REPEAT)
+    sniff = timeit.timeit(
+        lambda: _get_fhir_conversion_settings(message, use_default_ccda=True),
+        number=REPEAT,
+    )
+    print(
+        f"{len(message) / 1e6:6.2f} MB: full parse {full_parse / REPEAT * 1000:8.2f}"
+        f" ms, sniffing {sniff / REPEAT * 1000:6.2f} ms"
+    )
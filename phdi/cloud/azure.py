@@ -1,11 +1,32 @@
+import itertools
 import json
-
-from phdi.cloud.core import BaseCredentialManager, BaseCloudStorageConnection
+import threading
+import uuid
+
+from requests import Session
+from requests.adapters import HTTPAdapter
+
+from phdi.cloud.core import (
+    BaseCredentialManager,
+    BaseCloudStorageConnection,
+    DEFAULT_MAX_CONCURRENCY,
+    DEFAULT_STREAM_CHUNK_SIZE,
+    ListingPage,
+    _encode_chunks,
+    _map_in_order,
+    _rechunk,
+)
+from azure.core import MatchConditions
 from azure.core.credentials import AccessToken
+from azure.core.pipeline.transport import RequestsTransport
 from azure.identity import DefaultAzureCredential
-from azure.storage.blob import ContainerClient, BlobServiceClient
-from datetime import datetime, timezone
-from typing import List, Union
+from azure.storage.blob import BlobBlock, ContainerClient, BlobServiceClient
+from typing import Iterable, Iterator, Tuple, Union
+
+
+# The maximum number of connections an `AzureCloudContainerConnection` keeps open
+# to its storage account by default, shared between all of its clients.
+DEFAULT_CONNECTION_POOL_SIZE = 32
 
 
 class AzureCredentialManager(BaseCredentialManager):
@@ -33,6 +54,7 @@ class AzureCredentialManager(BaseCredentialManager):
         :param scope: A space-delimited list of scopes to limit access to resource.
           Default: `None`
         """
+        super().__init__()
         self.__resource_location = resource_location
         self.__scope = scope
         self.__access_token = None
@@ -49,40 +71,26 @@ class AzureCredentialManager(BaseCredentialManager):
         """
         return DefaultAzureCredential()
 
-    def get_access_token(self, force_refresh: bool = False) -> str:
-        """
-        Obtains an access token from the Azure identity provider. Returns the
-        access token string, refreshed if expired or force_refresh is specified.
-
-        :param force_refresh: `True` if a new token should be requested, regardless
-          of expiration timestamp. `False` otherwise. Default: `False`
-        :return: An Azure access token.
-        """
-        if force_refresh or (self.access_token is None) or self._need_new_token():
-            creds = self.get_credential_object()
-            self.__access_token = creds.get_token(self.scope)
-
-        return self.access_token.token
-
-    def _need_new_token(self) -> bool:
+    def _request_access_token(self) -> Tuple[str, float]:
         """
-        Determines whether the token already stored for this object can be reused,
-        or if it needs to be re-requested. A new token is needed if a token has not
-        yet been created, or if the current token has expired.
+        Obtains an access token from the Azure identity provider.
 
-        :return: True if a new Azure access token is needed; false otherwise.
+        :return: A tuple holding the Azure access token, and the POSIX timestamp at
+          which it expires.
         """
-        try:
-            current_time_utc = datetime.now(timezone.utc).timestamp()
-            return self.access_token.expires_on < current_time_utc
-        except AttributeError:
-            # access_token not set
-            return True
+        creds = self.get_credential_object()
+        self.__access_token = creds.get_token(self.scope)
+        return self.__access_token.token, self.__access_token.expires_on
 
 
 class AzureCloudContainerConnection(BaseCloudStorageConnection):
     """
     Defines a connection used for interacting with cloud storage in Azure.
+
+    The credential object and the clients for each container are created once
+    and reused, and every client sends its requests through the same pool of
+    connections, so uploading or downloading a small blob takes a single request
+    on an open connection. A connection may be shared between threads.
     """
 
     @property
@@ -93,7 +101,12 @@ class AzureCloudContainerConnection(BaseCloudStorageConnection):
     def cred_manager(self) -> AzureCredentialManager:
         return self.__cred_manager
 
-    def __init__(self, storage_account_url: str, cred_manager: AzureCredentialManager):
+    def __init__(
+        self,
+        storage_account_url: str,
+        cred_manager: AzureCredentialManager,
+        connection_pool_size: int = DEFAULT_CONNECTION_POOL_SIZE,
+    ):
         """
         Creates a new AzureCloudContainerConnection object.
 
@@ -101,9 +114,18 @@ class AzureCloudContainerConnection(BaseCloudStorageConnection):
           resource.
         :param cred_manager: The credential manager used to authenticate to the
           FHIR server.
+        :param connection_pool_size: The maximum number of connections kept open
+          to the storage account. Default: `DEFAULT_CONNECTION_POOL_SIZE`
         """
         self.__storage_account_url = storage_account_url
         self.__cred_manager = cred_manager
+        self.__connection_pool_size = connection_pool_size
+
+        self.__lock = threading.Lock()
+        self.__credential = None
+        self.__transport = None
+        self.__service_client = None
+        self.__container_clients = {}
 
     def _get_container_client(self, container_url: str) -> ContainerClient:
         """
@@ -113,11 +135,52 @@ class AzureCloudContainerConnection(BaseCloudStorageConnection):
         checked, see the Azure documentation:
         https://docs.microsoft.com/en-us/azure/developer/python/sdk/authentication-overview#sequence-of-authentication-methods-when-using-defaultazurecredential
 
+        The client is created the first time it's needed, and reused after that.
+
         :param container_url: The url at which to access the container.
         :return: The Azure `ContainerClient`.
         """
-        creds = self.cred_manager.get_credential_object()
-        return ContainerClient.from_container_url(container_url, credential=creds)
+        with self.__lock:
+            container_client = self.__container_clients.get(container_url)
+            if container_client is None:
+                container_client = ContainerClient.from_container_url(
+                    container_url, **self._get_client_kwargs()
+                )
+                self.__container_clients[container_url] = container_client
+            return container_client
+
+    def _get_service_client(self) -> BlobServiceClient:
+        """
+        Obtains a client connected to the Azure storage account, which is created
+        the first time it's needed and reused after that.
+
+        :return: The Azure `BlobServiceClient`.
+        """
+        with self.__lock:
+            if self.__service_client is None:
+                self.__service_client = BlobServiceClient(
+                    account_url=self.storage_account_url, **self._get_client_kwargs()
+                )
+            return self.__service_client
+
+    def _get_client_kwargs(self) -> dict:
+        """
+        Gets the arguments shared by every client: the credential object and the
+        transport holding the pool of connections to the storage account, which
+        are created the first time they're needed. Must be called with the
+        connection's lock held.
+
+        :return: The keyword arguments to create a client with.
+        """
+        if self.__credential is None:
+            self.__credential = self.cred_manager.get_credential_object()
+        if self.__transport is None:
+            session = Session()
+            adapter = HTTPAdapter(pool_maxsize=self.__connection_pool_size)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            self.__transport = RequestsTransport(session=session, session_owner=False)
+        return {"credential": self.__credential, "transport": self.__transport}
 
     def download_object(
         self, container_name: str, filename: str, encoding: str = "UTF-8"
@@ -164,40 +227,175 @@ class AzureCloudContainerConnection(BaseCloudStorageConnection):
         elif isinstance(message, dict):
             blob_client.upload_blob(json.dumps(message).encode("utf-8"), overwrite=True)
 
-    def list_containers(self) -> List[str]:
+    def download_object_stream(
+        self,
+        container_name: str,
+        filename: str,
+        chunk_size: int = DEFAULT_STREAM_CHUNK_SIZE,
+        max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+    ) -> Iterator[bytes]:
+        """
+        Downloads a blob from Azure blob storage in chunks, without holding the
+        whole blob in memory. Ranges of the blob are downloaded in parallel, ahead
+        of the chunk being read.
+
+        :param container_name: The name of the container containing object to download.
+        :param filename: The location of the file within Azure blob storage.
+        :param chunk_size: The size, in bytes, of the chunks to download.
+          Default: `DEFAULT_STREAM_CHUNK_SIZE`
+        :param max_concurrency: The maximum number of ranges downloaded at once.
+          Default: `DEFAULT_MAX_CONCURRENCY`
+        :return: An iterator of the blob's content, in chunks of bytes.
+        """
+        container_location = f"{self.storage_account_url}/{container_name}"
+        container_client = self._get_container_client(container_location)
+        blob_client = container_client.get_blob_client(filename)
+
+        # Every range is downloaded from the same version of the blob
+        properties = blob_client.get_blob_properties()
+
+        def download_range(offset: int) -> bytes:
+            return blob_client.download_blob(
+                offset=offset,
+                length=min(chunk_size, properties.size - offset),
+                etag=properties.etag,
+                match_condition=MatchConditions.IfNotModified,
+            ).readall()
+
+        yield from _map_in_order(
+            download_range, range(0, properties.size, chunk_size), max_concurrency
+        )
+
+    def upload_object_stream(
+        self,
+        chunks: Iterable[Union[str, bytes]],
+        container_name: str,
+        filename: str,
+        encoding: str = "utf-8",
+        chunk_size: int = DEFAULT_STREAM_CHUNK_SIZE,
+        max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+    ) -> None:
         """
-        Lists names for this CloudContainerConnection's containers.
+        Uploads content to Azure blob storage from an iterator, without holding
+        the whole content in memory. The content is staged as blocks of
+        `chunk_size` bytes, several at once, which are then committed together.
+        Content that fits in a single block is uploaded in a single request.
 
-        :return: A list of container names.
+        :param chunks: An iterable of the content to upload, in chunks of strings
+          or bytes of any size.
+        :param container_name: The name of the target container for upload.
+        :param filename: The location of file to upload within Azure blob storage.
+        :param encoding: The character encoding applied to chunks given as
+          strings. Default: `"utf-8"`
+        :param chunk_size: The size, in bytes, of the blocks to upload.
+          Default: `DEFAULT_STREAM_CHUNK_SIZE`
+        :param max_concurrency: The maximum number of blocks uploaded at once.
+          Default: `DEFAULT_MAX_CONCURRENCY`
         """
-        creds = self.cred_manager.get_credential_object()
-        service_client = BlobServiceClient(
-            account_url=self.storage_account_url, credential=creds
+        container_location = f"{self.storage_account_url}/{container_name}"
+        container_client = self._get_container_client(container_location)
+        blob_client = container_client.get_blob_client(filename)
+
+        blocks = _rechunk(_encode_chunks(chunks, encoding), chunk_size)
+        first_block = next(blocks, b"")
+        second_block = next(blocks, None)
+        if second_block is None:
+            blob_client.upload_blob(first_block, overwrite=True)
+            return
+
+        # Block IDs are unique to this upload, so they can't clash with the
+        # uncommitted blocks of another upload to the same blob
+        upload_id = uuid.uuid4().hex
+
+        def stage_block(indexed_block: Tuple[int, bytes]) -> str:
+            index, block = indexed_block
+            block_id = f"{upload_id}-{index:06d}"
+            blob_client.stage_block(block_id, block)
+            return block_id
+
+        block_ids = list(
+            _map_in_order(
+                stage_block,
+                enumerate(itertools.chain([first_block, second_block], blocks)),
+                max_concurrency,
+            )
         )
-        container_properties_generator = service_client.list_containers()
+        blob_client.commit_block_list([BlobBlock(block_id) for block_id in block_ids])
 
-        container_name_list = []
-        for container_propreties in container_properties_generator:
-            container_name_list.append(container_propreties.name)
+    def list_containers(self) -> Iterator[str]:
+        """
+        Lists names for this CloudContainerConnection's containers, a page at a
+        time as they're consumed.
 
-        return container_name_list
+        :return: An iterator of container names.
+        """
+        for page in self.list_container_pages():
+            yield from page.names
 
-    def list_objects(self, container_name: str, prefix: str = "") -> List[str]:
+    def list_objects(self, container_name: str, prefix: str = "") -> Iterator[str]:
         """
-        Lists names for objects within a container.
+        Lists names for objects within a container, a page at a time as they're
+        consumed.
 
         :param container_name: The name of the container to look for objects.
         :param prefix: Filter the objects returned to filenames beginning
           with this value.
-        :return: A list of names for objects in given container.
+        :return: An iterator of names for objects in given container.
         """
-        container_location = f"{self.storage_account_url}/{container_name}"
-        container_client = self._get_container_client(container_location)
+        for page in self.list_object_pages(container_name, prefix):
+            yield from page.names
 
-        blob_properties_generator = container_client.list_blobs(name_starts_with=prefix)
+    def list_container_pages(
+        self, page_size: int = None, continuation_token: str = None
+    ) -> Iterator[ListingPage]:
+        """
+        Lists names for this CloudContainerConnection's containers, a page at a
+        time.
+
+        :param page_size: The maximum number of names on each page. If not
+          provided, Azure's default of 5000 is used. Default: `None`
+        :param continuation_token: The continuation token of a page from a
+          previous listing, to resume the listing after. Default: `None`
+        :return: An iterator of pages of container names.
+        """
+        service_client = self._get_service_client()
+        pages = service_client.list_containers(results_per_page=page_size).by_page(
+            continuation_token=continuation_token
+        )
+        for page in pages:
+            yield ListingPage(
+                [container_properties.name for container_properties in page],
+                pages.continuation_token or None,
+            )
 
-        blob_name_list = []
-        for blob_propreties in blob_properties_generator:
-            blob_name_list.append(blob_propreties.name)
+    def list_object_pages(
+        self,
+        container_name: str,
+        prefix: str = "",
+        page_size: int = None,
+        continuation_token: str = None,
+    ) -> Iterator[ListingPage]:
+        """
+        Lists names for objects within a container, a page at a time.
+
+        :param container_name: The name of the container to look for objects.
+        :param prefix: Filter the objects returned to filenames beginning
+          with this value. Default: `""`
+        :param page_size: The maximum number of names on each page. If not
+          provided, Azure's default of 5000 is used. Default: `None`
+        :param continuation_token: The continuation token of a page from a
+          previous listing, with the same container and prefix, to resume the
+          listing after. Default: `None`
+        :return: An iterator of pages of names for objects in given container.
+        """
+        container_location = f"{self.storage_account_url}/{container_name}"
+        container_client = self._get_container_client(container_location)
 
-        return blob_name_list
+        pages = container_client.list_blobs(
+            name_starts_with=prefix, results_per_page=page_size
+        ).by_page(continuation_token=continuation_token)
+        for page in pages:
+            yield ListingPage(
+                [blob_properties.name for blob_properties in page],
+                pages.continuation_token or None,
+            )
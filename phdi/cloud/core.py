@@ -1,12 +1,77 @@
+import collections
+import io
+import itertools
+import logging
+import queue
+import threading
+import time
+
 from abc import ABC, abstractmethod
-from typing import List, Union
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple, Union
+
+
+# The number of seconds before a cached access token expires at which a new
+# token starts being requested in the background.
+DEFAULT_TOKEN_REFRESH_MARGIN = 300
+
+# The size, in bytes, of the chunks objects are streamed in by default, which is
+# also the size of the blocks or parts they're uploaded in.
+DEFAULT_STREAM_CHUNK_SIZE = 4 * 1024 * 1024
+
+# The number of chunks of an object transferred at once by default.
+DEFAULT_MAX_CONCURRENCY = 4
+
+# The number of objects uploaded at once by `upload_objects` by default.
+DEFAULT_BULK_UPLOAD_CONCURRENCY = 16
+
+# The number of names in each page of a listing, for implementations that don't
+# page their listings themselves.
+DEFAULT_LIST_PAGE_SIZE = 1000
+
+# The number of prefixes listed at once by `list_objects_parallel` by default.
+DEFAULT_LIST_CONCURRENCY = 8
+
+
+@dataclass
+class ListingPage:
+    """
+    Represents a page of the names listed in storage, along with the
+    continuation token to resume the listing after it, which is `None` on the
+    last page.
+    """
+
+    names: List[str]
+    continuation_token: Optional[str] = None
 
 
 class BaseCredentialManager(ABC):
     """
     Provides a common interface for managing service credentials.
+
+    Access tokens are cached and shared between every caller of
+    `get_access_token`. A token close to expiring is refreshed in the background
+    while callers keep using it, so they never wait for a new token unless the
+    cached one has already expired. Only one refresh is ever in flight: callers
+    that need a new token while it is being requested wait for that request,
+    rather than each requesting a token of their own.
     """
 
+    def __init__(self, token_refresh_margin: float = DEFAULT_TOKEN_REFRESH_MARGIN):
+        """
+        Initializes the access token cache shared by every credential manager.
+
+        :param token_refresh_margin: The number of seconds before the cached access
+          token expires at which a new token starts being requested in the
+          background. Default: `DEFAULT_TOKEN_REFRESH_MARGIN`
+        """
+        self.__token_refresh_margin = token_refresh_margin
+        self.__cached_token = None
+        self.__token_expires_on = None
+        self.__refreshing = False
+        self.__token_condition = threading.Condition()
+
     @abstractmethod
     def get_credential_object(self) -> object:
         """
@@ -17,16 +82,103 @@ class BaseCredentialManager(ABC):
         pass  # pragma: no cover
 
     @abstractmethod
-    def get_access_token(self) -> str:
+    def _request_access_token(self) -> Tuple[str, Union[float, None]]:
         """
-        Gets an access token using the managed credentials.
+        Requests a new access token using the managed credentials.
 
-        :return: An access token.
+        :return: A tuple holding the access token, and the POSIX timestamp at which
+          it expires, or `None` if the expiry is unknown, in which case the token
+          is requested again for every call to `get_access_token`.
         """
         pass  # pragma: no cover
 
+    def get_access_token(self, force_refresh: bool = False) -> str:
+        """
+        Gets an access token using the managed credentials, reusing the cached
+        token until it expires.
+
+        :param force_refresh: `True` if a new token should be requested, regardless
+          of expiration timestamp, e.g. because the cached token was rejected.
+          `False` otherwise. Default: `False`
+        :return: An access token.
+        """
+        with self.__token_condition:
+            waited = False
+            while self.__refreshing:
+                self.__token_condition.wait()
+                waited = True
+
+            # A token requested while this caller waited is as fresh as one it
+            # would have requested itself
+            if (waited or not force_refresh) and not self._need_new_token():
+                if self.__token_expires_on - time.time() < self.__token_refresh_margin:
+                    self.__refreshing = True
+                    threading.Thread(
+                        target=self._refresh_access_token, daemon=True
+                    ).start()
+                return self.__cached_token
+
+            self.__refreshing = True
+
+        return self._refresh_access_token(raise_errors=True)
+
+    def _need_new_token(self) -> bool:
+        """
+        Determines whether the cached access token can be reused, or if a new one
+        needs to be requested. A new token is needed if a token has not yet been
+        requested, if its expiry is unknown, or if it has expired.
+
+        :return: True if a new access token is needed; false otherwise.
+        """
+        return (
+            self.__cached_token is None
+            or self.__token_expires_on is None
+            or self.__token_expires_on < time.time()
+        )
+
+    def _refresh_access_token(self, raise_errors: bool = False) -> Union[str, None]:
+        """
+        Requests a new access token and caches it, waking any callers waiting for
+        it. Must only be called by the caller that started the refresh.
+
+        :param raise_errors: Whether to raise errors encountered requesting the
+          token. Otherwise, they are logged and the previous token is kept.
+          Default: `False`
+        :return: The new access token, or `None` if it couldn't be requested.
+        """
+        token = None
+        try:
+            token, expires_on = self._request_access_token()
+        except Exception:
+            if raise_errors:
+                raise
+            logging.warning("Failed to refresh access token", exc_info=True)
+        finally:
+            with self.__token_condition:
+                if token is not None:
+                    self.__cached_token = token
+                    self.__token_expires_on = expires_on
+                self.__refreshing = False
+                self.__token_condition.notify_all()
+        return token
+
 
 class BaseCloudStorageConnection(ABC):
+    """
+    Provides a common interface for interacting with cloud-based object storage.
+
+    Besides downloading and uploading whole objects as strings, objects can be
+    streamed in chunks, so objects too large to hold in memory (e.g., HL7 batch
+    files or NDJSON exports) can be processed. The default streaming methods
+    hold the whole object in memory; implementations override them to transfer
+    objects chunk by chunk, with several chunks in flight at once.
+
+    Containers and objects are listed lazily, a page at a time, so processing
+    can start before a large container has been listed in full. Listings can be
+    resumed from the continuation token of a page, and listed in parallel by
+    prefix.
+    """
+
     @abstractmethod
     def download_object(
         self, container_name: str, filename: str, encoding: str = "utf-8"
@@ -61,22 +213,381 @@ class BaseCloudStorageConnection(ABC):
         pass  # pragma: no cover
 
     @abstractmethod
-    def list_containers(self) -> List[str]:
+    def list_containers(self) -> Iterator[str]:
         """
         Lists names for this CloudContainerConnection's containers.
 
-        :return: A list of container names.
+        :return: An iterator of container names, listed as they're consumed.
         """
         pass  # pragma: no cover
 
     @abstractmethod
-    def list_objects(self, container_name: str, prefix: str) -> List[str]:
+    def list_objects(self, container_name: str, prefix: str) -> Iterator[str]:
         """
         Lists names for objects within a container.
 
         :param container_name: The name of the container to look for objects.
         :param prefix: Filter the objects returned to filenames beginning
           with this value.
-        :return: A list of objects within a container.
+        :return: An iterator of names for objects within a container, listed as
+          they're consumed.
         """
         pass  # pragma: no cover
+
+    def list_container_pages(
+        self, page_size: int = None, continuation_token: str = None
+    ) -> Iterator[ListingPage]:
+        """
+        Lists names for this CloudContainerConnection's containers, a page at a
+        time. The default implementation splits the names from `list_containers`
+        into pages, using the last name on each page as its continuation token.
+
+        :param page_size: The maximum number of names on each page. If not
+          provided, the storage service's default is used. Default: `None`
+        :param continuation_token: The continuation token of a page from a
+          previous listing, to resume the listing after. Default: `None`
+        :return: An iterator of pages of container names.
+        """
+        return _paginate(self.list_containers(), page_size, continuation_token)
+
+    def list_object_pages(
+        self,
+        container_name: str,
+        prefix: str = "",
+        page_size: int = None,
+        continuation_token: str = None,
+    ) -> Iterator[ListingPage]:
+        """
+        Lists names for objects within a container, a page at a time. The default
+        implementation splits the names from `list_objects` into pages, using the
+        last name on each page as its continuation token.
+
+        :param container_name: The name of the container to look for objects.
+        :param prefix: Filter the objects returned to filenames beginning
+          with this value. Default: `""`
+        :param page_size: The maximum number of names on each page. If not
+          provided, the storage service's default is used. Default: `None`
+        :param continuation_token: The continuation token of a page from a
+          previous listing, with the same container and prefix, to resume the
+          listing after. Default: `None`
+        :return: An iterator of pages of names for objects within a container.
+        """
+        return _paginate(
+            self.list_objects(container_name, prefix), page_size, continuation_token
+        )
+
+    def list_objects_parallel(
+        self,
+        container_name: str,
+        prefixes: Iterable[str],
+        page_size: int = None,
+        max_concurrency: int = DEFAULT_LIST_CONCURRENCY,
+    ) -> Iterator[str]:
+        """
+        Lists names for objects within a container, listing the objects under
+        each of several prefixes in parallel, e.g. one per hex digit or date that
+        object names start with. Names under each prefix are yielded in the order
+        they're listed in, but names under different prefixes are interleaved as
+        their pages arrive. Prefixes should not overlap, or objects under more
+        than one of them are listed more than once.
+
+        :param container_name: The name of the container to look for objects.
+        :param prefixes: The prefixes to list the objects under.
+        :param page_size: The maximum number of names on each page listed. If not
+          provided, the storage service's default is used. Default: `None`
+        :param max_concurrency: The maximum number of prefixes listed at once.
+          Default: `DEFAULT_LIST_CONCURRENCY`
+        :raises Exception: The error listing any of the prefixes raised.
+        :return: An iterator of names for objects within a container under any of
+          the prefixes, listed as they're consumed.
+        """
+        pages = _interleave_in_parallel(
+            lambda prefix: self.list_object_pages(
+                container_name, prefix, page_size=page_size
+            ),
+            prefixes,
+            max_concurrency,
+        )
+        for page in pages:
+            yield from page.names
+
+    def download_object_stream(
+        self,
+        container_name: str,
+        filename: str,
+        chunk_size: int = DEFAULT_STREAM_CHUNK_SIZE,
+        max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+    ) -> Iterator[bytes]:
+        """
+        Downloads a blob from storage in chunks, without holding the whole blob in
+        memory. The default implementation downloads the whole blob with
+        `download_object`, as UTF-8 text, and splits it into chunks.
+
+        :param container_name: The name of the container containing object to download.
+        :param filename: The location of file within storage.
+        :param chunk_size: The size, in bytes, of the chunks to download.
+          Default: `DEFAULT_STREAM_CHUNK_SIZE`
+        :param max_concurrency: The maximum number of chunks downloaded at once,
+          ahead of the chunk being read. Default: `DEFAULT_MAX_CONCURRENCY`
+        :return: An iterator of the blob's content, in chunks of bytes.
+        """
+        content = self.download_object(container_name, filename).encode("utf-8")
+        for start in range(0, len(content), chunk_size):
+            yield content[start : start + chunk_size]
+
+    def download_object_lines(
+        self,
+        container_name: str,
+        filename: str,
+        encoding: str = "utf-8",
+        **kwargs,
+    ) -> Iterator[str]:
+        """
+        Downloads a character blob from storage line by line, without holding the
+        whole blob in memory. Lines are split on newlines only, which are kept, as
+        when iterating over a file; carriage returns (e.g., separating HL7
+        segments) are left in the lines.
+
+        :param container_name: The name of the container containing object to download.
+        :param filename: The location of file within storage.
+        :param encoding: The character encoding applied to the downloaded content.
+          Default: `"utf-8"`
+        :param kwargs: Other arguments to `download_object_stream`.
+        :return: An iterator of the blob's lines.
+        """
+        chunks = self.download_object_stream(container_name, filename, **kwargs)
+        yield from io.TextIOWrapper(
+            io.BufferedReader(_ChunkReader(chunks)), encoding=encoding, newline="\n"
+        )
+
+    def upload_object_stream(
+        self,
+        chunks: Iterable[Union[str, bytes]],
+        container_name: str,
+        filename: str,
+        encoding: str = "utf-8",
+        chunk_size: int = DEFAULT_STREAM_CHUNK_SIZE,
+        max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+    ) -> None:
+        """
+        Uploads content to blob storage from an iterator, e.g. of lines of NDJSON,
+        without holding the whole content in memory. The default implementation
+        joins the content and uploads it with `upload_object`.
+
+        :param chunks: An iterable of the content to upload, in chunks of strings
+          or bytes of any size.
+        :param container_name: The name of the target container for upload.
+        :param filename: The location of file within storage container.
+        :param encoding: The character encoding applied to chunks given as
+          strings. Default: `"utf-8"`
+        :param chunk_size: The size, in bytes, of the blocks or parts to upload.
+          Default: `DEFAULT_STREAM_CHUNK_SIZE`
+        :param max_concurrency: The maximum number of blocks or parts uploaded at
+          once. Default: `DEFAULT_MAX_CONCURRENCY`
+        """
+        content = b"".join(_encode_chunks(chunks, encoding))
+        self.upload_object(content.decode(encoding), container_name, filename)
+
+    def upload_objects(
+        self,
+        objects: Iterable[Tuple[Union[str, dict], str, str]],
+        max_concurrency: int = DEFAULT_BULK_UPLOAD_CONCURRENCY,
+    ) -> None:
+        """
+        Uploads many messages to blob storage concurrently, with `upload_object`.
+        Objects are only taken from `objects` as earlier uploads complete, so it
+        may be a generator of any length.
+
+        :param objects: An iterable of the objects to upload, each given as a
+          tuple of the arguments to `upload_object`: the message, the name of the
+          target container, and the location of the file within it.
+        :param max_concurrency: The maximum number of objects uploaded at once.
+          Default: `DEFAULT_BULK_UPLOAD_CONCURRENCY`
+        :raises Exception: The error the first failed upload raised; objects after
+          it may or may not have been uploaded.
+        """
+        for _ in _map_in_order(
+            lambda arguments: self.upload_object(*arguments), objects, max_concurrency
+        ):
+            pass
+
+
+class _ChunkReader(io.RawIOBase):
+    """
+    A read-only, unbuffered file-like object reading from an iterator of chunks of
+    bytes.
+    """
+
+    def __init__(self, chunks: Iterable[bytes]):
+        self.__chunks = iter(chunks)
+        self.__chunk = b""
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        while not self.__chunk:
+            self.__chunk = next(self.__chunks, None)
+            if self.__chunk is None:
+                self.__chunk = b""
+                return 0
+        size = min(len(buffer), len(self.__chunk))
+        buffer[:size] = self.__chunk[:size]
+        self.__chunk = self.__chunk[size:]
+        return size
+
+
+def _encode_chunks(
+    chunks: Iterable[Union[str, bytes]], encoding: str = "utf-8"
+) -> Iterator[bytes]:
+    """
+    Encodes the chunks of a stream given as strings, skipping empty chunks.
+
+    :param chunks: The chunks, as strings or bytes.
+    :param encoding: The character encoding applied to chunks given as strings.
+      Default: `"utf-8"`
+    :return: An iterator of the chunks as bytes.
+    """
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode(encoding)
+        if chunk:
+            yield chunk
+
+
+def _rechunk(chunks: Iterable[bytes], chunk_size: int) -> Iterator[bytes]:
+    """
+    Regroups a stream of chunks of bytes of any size into chunks of `chunk_size`
+    bytes, except for the last chunk, which may be smaller.
+
+    :param chunks: The chunks.
+    :param chunk_size: The size of the chunks to regroup them into.
+    :return: An iterator of the regrouped chunks.
+    """
+    buffer = bytearray()
+    for chunk in chunks:
+        buffer += chunk
+        while len(buffer) >= chunk_size:
+            yield bytes(buffer[:chunk_size])
+            del buffer[:chunk_size]
+    if buffer:
+        yield bytes(buffer)
+
+
+def _map_in_order(
+    function: Callable, items: Iterable, max_concurrency: int
+) -> Iterator:
+    """
+    Applies a function to items on a thread pool, yielding the results in the
+    order of the items. Items are only taken from `items` as results are
+    consumed, so at most `max_concurrency` items are held at once.
+
+    :param function: The function to apply.
+    :param items: The items to apply the function to.
+    :param max_concurrency: The maximum number of items processed at once.
+    :return: An iterator of the results.
+    """
+    with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        pending = collections.deque()
+        try:
+            for item in items:
+                pending.append(executor.submit(function, item))
+                if len(pending) >= max_concurrency:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+def _paginate(
+    names: Iterable[str], page_size: int = None, continuation_token: str = None
+) -> Iterator[ListingPage]:
+    """
+    Splits a listing of names into pages, using the last name on each page as
+    its continuation token.
+
+    :param names: The names, in an order that's the same every time they're
+      listed.
+    :param page_size: The maximum number of names on each page.
+      Default: `DEFAULT_LIST_PAGE_SIZE`
+    :param continuation_token: The last name of the page to resume the listing
+      after. Default: `None`
+    :return: An iterator of pages of names.
+    """
+    page_size = page_size or DEFAULT_LIST_PAGE_SIZE
+    names = iter(names)
+    if continuation_token is not None:
+        for name in names:
+            if name == continuation_token:
+                break
+
+    page = list(itertools.islice(names, page_size))
+    while page:
+        next_page = list(itertools.islice(names, page_size))
+        yield ListingPage(page, page[-1] if next_page else None)
+        page = next_page
+
+
+def _interleave_in_parallel(
+    function: Callable[[object], Iterable], items: Iterable, max_concurrency: int
+) -> Iterator:
+    """
+    Applies a function returning an iterable to items on a thread pool, yielding
+    the results from every iterable as they're produced. Items are only taken
+    from `items` as earlier iterables are exhausted, and each thread waits for
+    its results to be consumed before producing more, so at most
+    `max_concurrency` items are processed, and results held, at once.
+
+    :param function: The function to apply.
+    :param items: The items to apply the function to.
+    :param max_concurrency: The maximum number of items processed at once.
+    :raises Exception: The first error an item's function or iterable raised.
+    :return: An iterator of the results.
+    """
+    results = queue.Queue(maxsize=max_concurrency)
+    stopped = threading.Event()
+    finished = object()
+
+    def put(result: tuple) -> bool:
+        while not stopped.is_set():
+            try:
+                results.put(result, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce(item) -> None:
+        try:
+            for result in function(item):
+                if not put((result, None)):
+                    return
+        except Exception as error:
+            put((finished, error))
+        else:
+            put((finished, None))
+
+    items = iter(items)
+    with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        running = 0
+        try:
+            for item in itertools.islice(items, max_concurrency):
+                executor.submit(produce, item)
+                running += 1
+            while running:
+                result, error = results.get()
+                if result is not finished:
+                    yield result
+                    continue
+                if error is not None:
+                    raise error
+                running -= 1
+                item = next(items, finished)
+                if item is not finished:
+                    executor.submit(produce, item)
+                    running += 1
+        finally:
+            # Wakes threads waiting to put results that will never be consumed
+            stopped.set()
@@ -1,12 +1,28 @@
-from typing import List, Union
+from datetime import datetime, timezone
+from typing import Iterable, Iterator, Tuple, Union
+import itertools
 import json
-from .core import BaseCredentialManager, BaseCloudStorageConnection
+import uuid
+from .core import (
+    BaseCredentialManager,
+    BaseCloudStorageConnection,
+    DEFAULT_MAX_CONCURRENCY,
+    DEFAULT_STREAM_CHUNK_SIZE,
+    ListingPage,
+    _encode_chunks,
+    _map_in_order,
+    _rechunk,
+)
 import google.auth
 import google.auth.transport.requests
 from google.auth.credentials import Credentials
 from google.cloud import storage
 
 
+# The maximum number of objects GCP can compose into one object in one request.
+GCP_MAX_COMPOSE_SOURCES = 32
+
+
 class GcpCredentialManager(BaseCredentialManager):
     """
     Provides a GCP-specific credential manager.
@@ -30,6 +46,7 @@ class GcpCredentialManager(BaseCredentialManager):
 
         :param scope: A list of scopes to limit access to resource.
         """
+        super().__init__()
         self.__scope = scope
         self.__scoped_credentials = None
         self.__project_id = None
@@ -69,21 +86,26 @@ class GcpCredentialManager(BaseCredentialManager):
             )
         return self.__project_id
 
-    def get_access_token(self) -> str:
+    def _request_access_token(self) -> Tuple[str, Union[float, None]]:
         """
-        Obtains an access token from GCP.
+        Obtains a new access token from GCP. The credentials are always
+        refreshed, since this is only called when a new token is needed, e.g.
+        because the cached one was rejected even though it hadn't expired.
 
-        :return: The access token, refreshed if necessary.
+        :return: A tuple holding the new access token, and the POSIX timestamp at
+          which it expires, if known.
         """
 
         creds = self.get_credential_object()
-        if not creds.valid:
-            request = google.auth.transport.requests.Request()
-            creds.refresh(request=request)
+        request = google.auth.transport.requests.Request()
+        creds.refresh(request=request)
 
-        access_token = creds.token
+        # google.auth reports expiry as a naive datetime in UTC
+        expires_on = None
+        if isinstance(creds.expiry, datetime):
+            expires_on = creds.expiry.replace(tzinfo=timezone.utc).timestamp()
 
-        return access_token
+        return creds.token, expires_on
 
 
 class GcpCloudStorageConnection(BaseCloudStorageConnection):
@@ -158,36 +180,200 @@ class GcpCloudStorageConnection(BaseCloudStorageConnection):
 
         blob.upload_from_string(data=message, content_type=content_type)
 
-    def list_containers(self) -> List[str]:
+    def download_object_stream(
+        self,
+        container_name: str,
+        filename: str,
+        chunk_size: int = DEFAULT_STREAM_CHUNK_SIZE,
+        max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+    ) -> Iterator[bytes]:
         """
-        Lists bucket names in storage.
+        Downloads a blob from GCP blob storage in chunks, without holding the
+        whole blob in memory. Ranges of the blob are downloaded in parallel, ahead
+        of the chunk being read.
+
+        :param container_name: The name of the bucket containing object to download.
+        :param filename: The location of file within GCP blob storage.
+        :param chunk_size: The size, in bytes, of the chunks to download.
+          Default: `DEFAULT_STREAM_CHUNK_SIZE`
+        :param max_concurrency: The maximum number of ranges downloaded at once.
+          Default: `DEFAULT_MAX_CONCURRENCY`
+        :return: An iterator of the blob's content, in chunks of bytes.
+        """
+        storage_client = self._get_storage_client()
+        blob = storage_client.bucket(container_name).blob(filename)
 
-        :return: A list of bucket names in storage.
+        # Every range is downloaded from the same generation of the blob
+        blob.reload()
+
+        def download_range(start: int) -> bytes:
+            return blob.download_as_bytes(
+                start=start,
+                end=min(start + chunk_size, blob.size) - 1,
+                if_generation_match=blob.generation,
+            )
+
+        yield from _map_in_order(
+            download_range, range(0, blob.size, chunk_size), max_concurrency
+        )
+
+    def upload_object_stream(
+        self,
+        chunks: Iterable[Union[str, bytes]],
+        container_name: str,
+        filename: str,
+        encoding: str = "utf-8",
+        chunk_size: int = DEFAULT_STREAM_CHUNK_SIZE,
+        max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+        content_type="application/json",
+    ) -> None:
+        """
+        Uploads content to GCP blob storage from an iterator, without holding the
+        whole content in memory. The content is uploaded as temporary parts of
+        `chunk_size` bytes, several at once, which are then composed into the
+        blob and deleted. Content that fits in a single part is uploaded in a
+        single request.
+
+        :param chunks: An iterable of the content to upload, in chunks of strings
+          or bytes of any size.
+        :param container_name: The name of the target bucket for upload.
+        :param filename: The location of file within GCP blob storage.
+        :param encoding: The character encoding applied to chunks given as
+          strings. Default: `"utf-8"`
+        :param chunk_size: The size, in bytes, of the parts to upload.
+          Default: `DEFAULT_STREAM_CHUNK_SIZE`
+        :param max_concurrency: The maximum number of parts uploaded at once.
+          Default: `DEFAULT_MAX_CONCURRENCY`
+        :param content_type: The content type of the blob.
+          Default: `"application/json"`
         """
         storage_client = self._get_storage_client()
+        bucket = storage_client.bucket(container_name)
+        blob = bucket.blob(filename)
 
-        bucket_name_list = []
-        for bucket in storage_client.list_buckets():
-            bucket_name_list.append(bucket)
-        return bucket_name_list
+        parts = _rechunk(_encode_chunks(chunks, encoding), chunk_size)
+        first_part = next(parts, b"")
+        second_part = next(parts, None)
+        if second_part is None:
+            blob.upload_from_string(data=first_part, content_type=content_type)
+            return
+
+        # Parts are named uniquely to this upload, so they can't clash with the
+        # parts of another upload to the same blob
+        part_prefix = f"{filename}.parts/{uuid.uuid4().hex}/"
+        temporary_blobs = []
+
+        def upload_part(indexed_part: Tuple[int, bytes]) -> storage.Blob:
+            index, part = indexed_part
+            part_blob = bucket.blob(f"{part_prefix}{index:06d}")
+            part_blob.upload_from_string(data=part, content_type=content_type)
+            return part_blob
+
+        try:
+            for part_blob in _map_in_order(
+                upload_part,
+                enumerate(itertools.chain([first_part, second_part], parts)),
+                max_concurrency,
+            ):
+                temporary_blobs.append(part_blob)
+
+            # Compose the parts in groups until few enough remain to compose
+            # into the blob in one request
+            sources = list(temporary_blobs)
+            level = 0
+            while len(sources) > GCP_MAX_COMPOSE_SOURCES:
+                composed = []
+                for start in range(0, len(sources), GCP_MAX_COMPOSE_SOURCES):
+                    composed_blob = bucket.blob(
+                        f"{part_prefix}composed-{level}-{start:06d}"
+                    )
+                    composed_blob.compose(
+                        sources[start : start + GCP_MAX_COMPOSE_SOURCES]
+                    )
+                    composed.append(composed_blob)
+                temporary_blobs.extend(composed)
+                sources = composed
+                level += 1
+
+            blob.content_type = content_type
+            blob.compose(sources)
+        finally:
+            bucket.delete_blobs(temporary_blobs, on_error=lambda _: None)
+
+    def list_containers(self) -> Iterator[str]:
+        """
+        Lists bucket names in storage, a page at a time as they're consumed.
 
-    def list_objects(self, container_name: str, prefix: str = "") -> List[str]:
+        :return: An iterator of bucket names in storage.
         """
-        Lists names for objects within a bucket.
+        for page in self.list_container_pages():
+            yield from page.names
+
+    def list_objects(self, container_name: str, prefix: str = "") -> Iterator[str]:
+        """
+        Lists names for objects within a bucket, a page at a time as they're
+        consumed.
 
         :param container_name: The name of the bucket to look for objects.
         :param prefix: Filter the objects returned to filenames beginning
           with this value.
-        :return: A list of names for objects in given bucket.
+        :return: An iterator of names for objects in given bucket.
+        """
+        for page in self.list_object_pages(container_name, prefix):
+            yield from page.names
+
+    def list_container_pages(
+        self, page_size: int = None, continuation_token: str = None
+    ) -> Iterator[ListingPage]:
+        """
+        Lists bucket names in storage, a page at a time.
+
+        :param page_size: The maximum number of names on each page. If not
+          provided, GCP's default is used. Default: `None`
+        :param continuation_token: The continuation token of a page from a
+          previous listing, to resume the listing after. Default: `None`
+        :return: An iterator of pages of bucket names.
         """
         storage_client = self._get_storage_client()
 
-        blob_properties_generator = storage_client.list_blobs(
-            container_name, prefix=prefix
+        buckets = storage_client.list_buckets(
+            page_size=page_size, page_token=continuation_token
         )
+        for page in buckets.pages:
+            yield ListingPage(
+                [bucket.name for bucket in page], buckets.next_page_token or None
+            )
 
-        blob_name_list = []
-        for blob_propreties in blob_properties_generator:
-            blob_name_list.append(blob_propreties.name)
+    def list_object_pages(
+        self,
+        container_name: str,
+        prefix: str = "",
+        page_size: int = None,
+        continuation_token: str = None,
+    ) -> Iterator[ListingPage]:
+        """
+        Lists names for objects within a bucket, a page at a time.
 
-        return blob_name_list
+        :param container_name: The name of the bucket to look for objects.
+        :param prefix: Filter the objects returned to filenames beginning
+          with this value. Default: `""`
+        :param page_size: The maximum number of names on each page. If not
+          provided, GCP's default of 1000 is used. Default: `None`
+        :param continuation_token: The continuation token of a page from a
+          previous listing, with the same bucket and prefix, to resume the
+          listing after. Default: `None`
+        :return: An iterator of pages of names for objects in given bucket.
+        """
+        storage_client = self._get_storage_client()
+
+        blobs = storage_client.list_blobs(
+            container_name,
+            prefix=prefix,
+            page_size=page_size,
+            page_token=continuation_token,
+        )
+        for page in blobs.pages:
+            yield ListingPage(
+                [blob_properties.name for blob_properties in page],
+                blobs.next_page_token or None,
+            )
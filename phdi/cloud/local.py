@@ -0,0 +1,291 @@
+import contextlib
+import json
+import mmap
+import os
+import pathlib
+import tempfile
+
+from phdi.cloud.core import (
+    BaseCredentialManager,
+    BaseCloudStorageConnection,
+    DEFAULT_MAX_CONCURRENCY,
+    DEFAULT_STREAM_CHUNK_SIZE,
+    _encode_chunks,
+)
+from typing import Iterable, Iterator, Tuple, Union
+
+
+class LocalCredentialManager(BaseCredentialManager):
+    """
+    Defines a credential manager for local services, e.g. for testing, which
+    hands out a fixed access token.
+    """
+
+    @property
+    def access_token(self) -> str:
+        return self.__access_token
+
+    def __init__(self, access_token: str = "local"):
+        """
+        Creates a new LocalCredentialManager object.
+
+        :param access_token: The access token to hand out. Default: `"local"`
+        """
+        super().__init__()
+        self.__access_token = access_token
+
+    def get_credential_object(self) -> None:
+        """
+        Gets a credential object, of which local services have none.
+
+        :return: `None`
+        """
+        return None
+
+    def _request_access_token(self) -> Tuple[str, None]:
+        """
+        Gets the fixed access token.
+
+        :return: A tuple holding the access token, and `None`, as it never
+          expires.
+        """
+        return self.__access_token, None
+
+
+class LocalCloudStorageConnection(BaseCloudStorageConnection):
+    """
+    Defines a connection used for interacting with storage on the local
+    filesystem, e.g. for testing. Each subdirectory of the root directory is a
+    container, and the files within it (at any depth) are its objects, named by
+    their paths relative to the container. Files whose names start with a period,
+    such as those still being written, aren't listed.
+
+    Objects are written atomically, by writing them to a temporary file that
+    replaces the object's file once complete, and read through memory maps, so
+    they're read straight from the operating system's page cache.
+    """
+
+    @property
+    def root_directory(self) -> pathlib.Path:
+        return self.__root_directory
+
+    def __init__(self, root_directory: str):
+        """
+        Creates a new LocalCloudStorageConnection object.
+
+        :param root_directory: The directory holding the containers.
+        """
+        self.__root_directory = pathlib.Path(root_directory)
+
+    def download_object(
+        self, container_name: str, filename: str, encoding: str = "utf-8"
+    ) -> str:
+        """
+        Reads a character file from storage and returns it as a string.
+
+        :param container_name: The name of the container containing object to download.
+        :param filename: The location of the file within the container.
+        :param encoding: The encoding applied to the downloaded content.
+          Default: `"utf-8"`
+        :return: The contents of the file.
+        """
+        with self._map(container_name, filename) as content:
+            return str(content, encoding)
+
+    def upload_object(
+        self,
+        message: Union[str, dict],
+        container_name: str,
+        filename: str,
+    ) -> None:
+        """
+        Writes the content of a given message to a file in storage.
+        The message can be passed either as a raw string or as JSON.
+
+        :param message: The contents of a message, encoded either as a
+          string or a JSON-formatted dictionary.
+        :param container_name: The name of the target container for upload.
+        :param filename: The location of file to upload within the container.
+        """
+        if isinstance(message, dict):
+            message = json.dumps(message)
+        self.upload_object_stream([message], container_name, filename)
+
+    def download_object_stream(
+        self,
+        container_name: str,
+        filename: str,
+        chunk_size: int = DEFAULT_STREAM_CHUNK_SIZE,
+        max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+    ) -> Iterator[bytes]:
+        """
+        Reads a file from storage in chunks, without holding the whole file in
+        memory.
+
+        :param container_name: The name of the container containing object to download.
+        :param filename: The location of the file within the container.
+        :param chunk_size: The size, in bytes, of the chunks to read.
+          Default: `DEFAULT_STREAM_CHUNK_SIZE`
+        :param max_concurrency: Unused, as files are read sequentially.
+        :return: An iterator of the file's content, in chunks of bytes.
+        """
+        with self._map(container_name, filename) as content:
+            for start in range(0, len(content), chunk_size):
+                yield content[start : start + chunk_size]
+
+    def download_object_lines(
+        self,
+        container_name: str,
+        filename: str,
+        encoding: str = "utf-8",
+        **kwargs,
+    ) -> Iterator[str]:
+        """
+        Reads a character file from storage line by line, without holding the
+        whole file in memory. Lines are split on newlines only, which are kept, as
+        when iterating over a file.
+
+        :param container_name: The name of the container containing object to download.
+        :param filename: The location of the file within the container.
+        :param encoding: The character encoding applied to the downloaded content.
+          Default: `"utf-8"`
+        :param kwargs: Unused, as lines are found in the memory-mapped file.
+        :return: An iterator of the file's lines.
+        """
+        with self._map(container_name, filename) as content:
+            start = 0
+            while start < len(content):
+                end = content.find(b"\n", start) + 1 or len(content)
+                yield str(content[start:end], encoding)
+                start = end
+
+    def upload_object_stream(
+        self,
+        chunks: Iterable[Union[str, bytes]],
+        container_name: str,
+        filename: str,
+        encoding: str = "utf-8",
+        chunk_size: int = DEFAULT_STREAM_CHUNK_SIZE,
+        max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+    ) -> None:
+        """
+        Writes content to a file in storage from an iterator, without holding the
+        whole content in memory. The content is written to a temporary file that
+        replaces the file once complete, so readers never see a partial file.
+
+        :param chunks: An iterable of the content to upload, in chunks of strings
+          or bytes of any size.
+        :param container_name: The name of the target container for upload.
+        :param filename: The location of file to upload within the container.
+        :param encoding: The character encoding applied to chunks given as
+          strings. Default: `"utf-8"`
+        :param chunk_size: Unused, as chunks are written as they're given.
+        :param max_concurrency: Unused, as files are written sequentially.
+        """
+        path = self._get_path(container_name, filename)
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        fd, temporary_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+        try:
+            with os.fdopen(fd, "wb") as fp:
+                for chunk in _encode_chunks(chunks, encoding):
+                    fp.write(chunk)
+            os.replace(temporary_path, path)
+        except BaseException:
+            os.remove(temporary_path)
+            raise
+
+    def list_containers(self) -> Iterator[str]:
+        """
+        Lists the names of the containers in storage.
+
+        :return: An iterator of container names.
+        """
+        if not self.__root_directory.is_dir():
+            return iter([])
+        return iter(
+            sorted(
+                path.name for path in self.__root_directory.iterdir() if path.is_dir()
+            )
+        )
+
+    def list_objects(self, container_name: str, prefix: str = "") -> Iterator[str]:
+        """
+        Lists names for objects within a container, in order, reading each
+        directory as it's reached.
+
+        :param container_name: The name of the container to look for objects.
+        :param prefix: Filter the objects returned to filenames beginning
+          with this value.
+        :return: An iterator of names for objects in given container.
+        """
+        return self._list_directory(self._get_path(container_name, "."), "", prefix)
+
+    def _list_directory(
+        self, directory: pathlib.Path, relative_directory: str, prefix: str
+    ) -> Iterator[str]:
+        """
+        Lists names for the objects within a directory of a container, in order,
+        only descending into the subdirectories that may hold objects beginning
+        with `prefix`. Hidden files, such as partially written objects, are
+        skipped.
+
+        :param directory: The directory.
+        :param relative_directory: The path of the directory within its
+          container, ending with a "/" unless it's the container itself.
+        :param prefix: Filter the objects returned to filenames beginning
+          with this value.
+        :return: An iterator of names for objects in the directory.
+        """
+        if not directory.is_dir():
+            return
+
+        # Directories sort by their name and separator, so objects are listed in
+        # the same order as their full names
+        entries = []
+        with os.scandir(directory) as directory_entries:
+            for entry in directory_entries:
+                if entry.is_dir():
+                    entries.append((f"{relative_directory}{entry.name}/", entry))
+                elif not entry.name.startswith("."):
+                    entries.append((f"{relative_directory}{entry.name}", entry))
+        entries.sort(key=lambda name_and_entry: name_and_entry[0])
+
+        for name, entry in entries:
+            if not entry.is_dir():
+                if name.startswith(prefix):
+                    yield name
+            elif name.startswith(prefix) or prefix.startswith(name):
+                yield from self._list_directory(pathlib.Path(entry.path), name, prefix)
+
+    @contextlib.contextmanager
+    def _map(self, container_name: str, filename: str) -> Iterator[bytes]:
+        """
+        Maps an object's file into memory, read-only.
+
+        :param container_name: The name of the object's container.
+        :param filename: The name of the object.
+        :return: A context manager holding the file's content, as a memory map, or
+          as bytes if the file is empty, since empty files can't be mapped.
+        """
+        with open(self._get_path(container_name, filename), "rb") as fp:
+            if os.fstat(fp.fileno()).st_size == 0:
+                yield b""
+                return
+            with mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as content:
+                yield content
+
+    def _get_path(self, container_name: str, filename: str) -> pathlib.Path:
+        """
+        Gets the path of an object's file.
+
+        :param container_name: The name of the object's container.
+        :param filename: The name of the object.
+        :raises ValueError: If the object's path would be outside its container.
+        :return: The path of the object's file.
+        """
+        container = (self.__root_directory / container_name).resolve()
+        path = (container / filename).resolve()
+        if path != container and container not in path.parents:
+            raise ValueError(f"{filename} is not within the container {container_name}")
+        return path
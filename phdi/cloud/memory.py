@@ -0,0 +1,146 @@
+import json
+import threading
+
+from phdi.cloud.core import (
+    BaseCloudStorageConnection,
+    DEFAULT_MAX_CONCURRENCY,
+    DEFAULT_STREAM_CHUNK_SIZE,
+    _encode_chunks,
+)
+from typing import Iterable, Iterator, Union
+
+
+class MemoryCloudStorageConnection(BaseCloudStorageConnection):
+    """
+    Defines a connection used for interacting with storage held in memory, e.g.
+    for testing or profiling without a cloud account. Objects are held as bytes,
+    in containers that are created when an object is first uploaded to them. A
+    connection may be shared between threads.
+    """
+
+    def __init__(self):
+        """
+        Creates a new, empty MemoryCloudStorageConnection object.
+        """
+        self.__containers = {}
+        self.__lock = threading.Lock()
+
+    def download_object(
+        self, container_name: str, filename: str, encoding: str = "utf-8"
+    ) -> str:
+        """
+        Gets a character object from storage as a string.
+
+        :param container_name: The name of the container containing object to download.
+        :param filename: The name of the object within the container.
+        :param encoding: The encoding applied to the downloaded content.
+          Default: `"utf-8"`
+        :raises FileNotFoundError: If there is no such object.
+        :return: The content of the object.
+        """
+        return self._get_content(container_name, filename).decode(encoding)
+
+    def upload_object(
+        self,
+        message: Union[str, dict],
+        container_name: str,
+        filename: str,
+    ) -> None:
+        """
+        Stores the content of a given message in storage.
+        The message can be passed either as a raw string or as JSON.
+
+        :param message: The contents of a message, encoded either as a
+          string or a JSON-formatted dictionary.
+        :param container_name: The name of the target container for upload.
+        :param filename: The name of the object within the container.
+        """
+        if isinstance(message, dict):
+            message = json.dumps(message)
+        self.upload_object_stream([message], container_name, filename)
+
+    def download_object_stream(
+        self,
+        container_name: str,
+        filename: str,
+        chunk_size: int = DEFAULT_STREAM_CHUNK_SIZE,
+        max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+    ) -> Iterator[bytes]:
+        """
+        Gets an object from storage in chunks.
+
+        :param container_name: The name of the container containing object to download.
+        :param filename: The name of the object within the container.
+        :param chunk_size: The size, in bytes, of the chunks to get.
+          Default: `DEFAULT_STREAM_CHUNK_SIZE`
+        :param max_concurrency: Unused, as objects are already in memory.
+        :raises FileNotFoundError: If there is no such object.
+        :return: An iterator of the object's content, in chunks of bytes.
+        """
+        content = self._get_content(container_name, filename)
+        for start in range(0, len(content), chunk_size):
+            yield content[start : start + chunk_size]
+
+    def upload_object_stream(
+        self,
+        chunks: Iterable[Union[str, bytes]],
+        container_name: str,
+        filename: str,
+        encoding: str = "utf-8",
+        chunk_size: int = DEFAULT_STREAM_CHUNK_SIZE,
+        max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+    ) -> None:
+        """
+        Stores content from an iterator in storage. The object is only replaced
+        once all of the content has been read, so readers never see a partial
+        object.
+
+        :param chunks: An iterable of the content to upload, in chunks of strings
+          or bytes of any size.
+        :param container_name: The name of the target container for upload.
+        :param filename: The name of the object within the container.
+        :param encoding: The character encoding applied to chunks given as
+          strings. Default: `"utf-8"`
+        :param chunk_size: Unused, as chunks are stored together.
+        :param max_concurrency: Unused, as chunks are stored together.
+        """
+        content = b"".join(_encode_chunks(chunks, encoding))
+        with self.__lock:
+            self.__containers.setdefault(container_name, {})[filename] = content
+
+    def list_containers(self) -> Iterator[str]:
+        """
+        Lists the names of the containers in storage, as of when it's called.
+
+        :return: An iterator of container names.
+        """
+        with self.__lock:
+            return iter(sorted(self.__containers))
+
+    def list_objects(self, container_name: str, prefix: str = "") -> Iterator[str]:
+        """
+        Lists names for objects within a container, as of when it's called.
+
+        :param container_name: The name of the container to look for objects.
+        :param prefix: Filter the objects returned to filenames beginning
+          with this value.
+        :return: An iterator of names for objects in given container.
+        """
+        with self.__lock:
+            container = self.__containers.get(container_name, {})
+            return iter(sorted(name for name in container if name.startswith(prefix)))
+
+    def _get_content(self, container_name: str, filename: str) -> bytes:
+        """
+        Gets the content of an object.
+
+        :param container_name: The name of the object's container.
+        :param filename: The name of the object.
+        :raises FileNotFoundError: If there is no such object.
+        :return: The content of the object.
+        """
+        with self.__lock:
+            content = self.__containers.get(container_name, {}).get(filename)
+        if content is None:
+            raise FileNotFoundError(f"{container_name}/{filename} does not exist")
+        return content
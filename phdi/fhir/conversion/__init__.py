@@ -1,3 +1,13 @@
-from phdi.fhir.conversion.convert import convert_to_fhir
+from phdi.fhir.conversion.convert import (
+    ConversionError,
+    ConversionResult,
+    FhirConverterClient,
+    convert_to_fhir,
+)
 
-__all__ = ("convert_to_fhir",)
+__all__ = (
+    "convert_to_fhir",
+    "ConversionError",
+    "ConversionResult",
+    "FhirConverterClient",
+)
@@ -1,8 +1,14 @@
-import hl7
+import json
 import requests
 
 import xml.etree.ElementTree as et
 
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from requests.adapters import HTTPAdapter
+from typing import Iterable, Iterator, Union
+from urllib3 import Retry
+
 from phdi.harmonization import standardize_hl7_datetimes
 from phdi.cloud.core import BaseCredentialManager
 from phdi.fhir.transport import http_request_with_reauth
@@ -21,6 +27,10 @@ CCDA_CODES_TO_CONVERSION_RESOURCE = {
     "18761-7": "TransferSummary",
 }
 
+# The number of characters of a CCDA document parsed at a time while looking for
+# its code.
+CCDA_SNIFF_CHUNK_SIZE = 16384
+
 
 def convert_to_fhir(
     message: str,
@@ -59,16 +69,8 @@ def convert_to_fhir(
     # TODO Update documentation with a link to the containerized FHIR converter, once
     # it's been ported over to the phdi repository.
 
-    conversion_settings = _get_fhir_conversion_settings(message, use_default_ccda)
-    if conversion_settings.get("input_type") == "hl7v2":
-        message = standardize_hl7_datetimes(message)
-
     url = f"{url}"
-    data = {
-        "input_data": message,
-        "input_type": conversion_settings.get("input_type"),
-        "root_template": conversion_settings.get("root_template"),
-    }
+    data = _get_conversion_request_data(message, use_default_ccda)
 
     if cred_manager:
         access_token = cred_manager.get_access_token()
@@ -98,6 +100,325 @@ def convert_to_fhir(
     return response
 
 
+@dataclass
+class ConversionResult:
+    """
+    The outcome of converting one message with `FhirConverterClient.convert_many`
+    or `FhirConverterClient.convert_batch`. Exactly one of `response` (for
+    `convert_many`), `bundle` (for `convert_batch`) and `error` is set.
+    """
+
+    index: int
+    response: Union[requests.Response, None] = None
+    error: Union["ConversionError", None] = None
+    bundle: Union[dict, None] = None
+
+
+class FhirConverterClient:
+    """
+    A client for the containerized FHIR converter that keeps a pool of
+    connections open between conversions, rather than opening a new connection
+    for every message as `convert_to_fhir` does. A client may be shared between
+    threads, and should be closed once it's no longer needed.
+    """
+
+    @property
+    def url(self) -> str:
+        return self.__url
+
+    @property
+    def cred_manager(self) -> Union[BaseCredentialManager, None]:
+        return self.__cred_manager
+
+    @property
+    def batch_url(self) -> str:
+        return self.__batch_url
+
+    @property
+    def use_default_ccda(self) -> bool:
+        return self.__use_default_ccda
+
+    def __init__(
+        self,
+        url: str,
+        cred_manager: BaseCredentialManager = None,
+        headers: dict = None,
+        use_default_ccda: bool = False,
+        retry_count: int = 3,
+        pool_size: int = 10,
+        batch_url: str = None,
+    ):
+        """
+        Creates a new FhirConverterClient object.
+
+        :param url: A URL that points to the location of the converter API.
+        :param cred_manager: Service used to get an access token used to
+          make a request. Default: `None`
+        :param headers: JSON-type dictionary of headers to make every request with.
+          Default: `None`
+        :param use_default_ccda: Whether to default to the
+          base "CCD" root template if a resource's LOINC code doesn't
+          map to a specific supported template. Default: `False`
+        :param retry_count: The number of times to retry a request, if the first
+          attempt fails. Default: `3`
+        :param pool_size: The maximum number of connections kept open to the
+          converter. Default: `10`
+        :param batch_url: A URL that points to the location of the converter's
+          batch API. If not provided, `-batch` is appended to `url`, matching the
+          `/convert-to-fhir-batch` endpoint of the containerized converter.
+          Default: `None`
+        """
+        self.__url = url
+        self.__batch_url = batch_url or f"{url}-batch"
+        self.__cred_manager = cred_manager
+        self.__headers = dict(headers or {})
+        self.__use_default_ccda = use_default_ccda
+
+        retry_strategy = Retry(
+            total=retry_count,
+            status_forcelist=[429, 500, 502, 503, 504],
+            allowed_methods=["POST"],
+        )
+        adapter = HTTPAdapter(
+            pool_connections=1, pool_maxsize=pool_size, max_retries=retry_strategy
+        )
+        self.__session = requests.Session()
+        self.__session.mount("http://", adapter)
+        self.__session.mount("https://", adapter)
+
+    def convert(self, message: str) -> requests.Response:
+        """
+        Converts a given message from either HL7 v2 (pipe-delimited flat file) or
+        CCDA (XML) into FHIR format (JSON). See `convert_to_fhir` for details.
+
+        :param message: The raw message that needs to be converted to
+          FHIR. Currently, only HL7v2 or CCDA are supported.
+        :raises ConversionError: If the message could not be converted.
+        :return: A requests.Response object
+        """
+        data = _get_conversion_request_data(message, self.__use_default_ccda)
+        response = self._post(self.__url, data)
+
+        if response.status_code != 200:
+            raise ConversionError(response)
+
+        return response
+
+    def convert_many(
+        self, messages: Iterable[str], concurrency: int = 4
+    ) -> Iterator[ConversionResult]:
+        """
+        Converts any number of messages, with up to `concurrency` conversions in
+        flight at once. Results are yielded as soon as each conversion completes,
+        so they may arrive in a different order than the messages; each result
+        holds the index of its message. A message that fails to convert doesn't
+        stop the others: its result holds the `ConversionError` instead.
+
+        :param messages: An iterable of raw messages to convert to FHIR.
+        :param concurrency: The maximum number of messages converted at once.
+          Default: `4`
+        :raises ValueError: If `concurrency` is not a positive integer.
+        :return: An iterator of the results of the conversions.
+        """
+        if concurrency is None or concurrency < 1:
+            raise ValueError("concurrency must be a positive integer")
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            # Only a few messages are read ahead of the conversions, so the
+            # messages never need to be held in memory all at once
+            pending = set()
+            for index, message in enumerate(messages):
+                if len(pending) >= 2 * concurrency:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield future.result()
+                pending.add(executor.submit(self._convert_result, index, message))
+
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+
+    def convert_batch(
+        self, messages: Iterable[str], batch_size: int = 1000
+    ) -> Iterator[ConversionResult]:
+        """
+        Converts any number of messages with the converter's batch API, which
+        runs the converter once for a whole batch of messages rather than once
+        per message. Messages are grouped into batches of up to `batch_size`
+        messages with the same input type and root template, so results are
+        yielded batch by batch and may arrive in a different order than the
+        messages; each result holds the index of its message and, if it was
+        converted, its FHIR bundle. A message that fails to convert doesn't stop
+        the others: its result holds a `ConversionError` instead.
+
+        :param messages: An iterable of raw messages to convert to FHIR.
+        :param batch_size: The maximum number of messages sent in one request.
+          Default: `1000`
+        :raises ValueError: If `batch_size` is not a positive integer.
+        :return: An iterator of the results of the conversions.
+        """
+        if batch_size is None or batch_size < 1:
+            raise ValueError("batch_size must be a positive integer")
+
+        batches = {}
+        for index, message in enumerate(messages):
+            try:
+                data = _get_conversion_request_data(message, self.__use_default_ccda)
+            except Exception as error:
+                yield ConversionResult(index, error=_to_conversion_error(error))
+                continue
+
+            settings = (data["input_type"], data["root_template"])
+            batch = batches.setdefault(settings, [])
+            batch.append((index, data["input_data"]))
+            if len(batch) >= batch_size:
+                yield from self._convert_batch(settings, batches.pop(settings))
+
+        for settings, batch in batches.items():
+            yield from self._convert_batch(settings, batch)
+
+    def close(self) -> None:
+        """
+        Closes the connections held by the client.
+        """
+        self.__session.close()
+
+    def __enter__(self) -> "FhirConverterClient":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def _convert_result(self, index: int, message: str) -> ConversionResult:
+        """
+        Converts a message, capturing any error as a `ConversionError`.
+
+        :param index: The index of the message.
+        :param message: The raw message to convert.
+        :return: The result of the conversion.
+        """
+        try:
+            return ConversionResult(index, response=self.convert(message))
+        except Exception as error:
+            return ConversionResult(index, error=_to_conversion_error(error))
+
+    def _convert_batch(
+        self, settings: tuple, batch: list
+    ) -> Iterator[ConversionResult]:
+        """
+        Converts a batch of messages with the converter's batch API, reading the
+        streamed results one at a time.
+
+        :param settings: The input type and root template of the messages.
+        :param batch: A list of `(index, message)` tuples, with the messages
+          prepared for conversion.
+        :return: An iterator of the results of the conversions.
+        """
+        input_type, root_template = settings
+        data = {
+            "input_data": [message for _, message in batch],
+            "input_type": input_type,
+            "root_template": root_template,
+        }
+        try:
+            response = self._post(self.__batch_url, data, stream=True)
+        except Exception as error:
+            conversion_error = _to_conversion_error(error)
+            for index, _ in batch:
+                yield ConversionResult(index, error=conversion_error)
+            return
+
+        with response:
+            if response.status_code != 200:
+                conversion_error = ConversionError(response)
+                for index, _ in batch:
+                    yield ConversionResult(index, error=conversion_error)
+                return
+
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                result = json.loads(line)
+                index = batch[result["index"]][0]
+                conversion = result["response"]
+                if conversion.get("Status") == "OK":
+                    yield ConversionResult(index, bundle=conversion["FhirResource"])
+                else:
+                    yield ConversionResult(
+                        index,
+                        error=ConversionError(
+                            message=conversion.get("stderr")
+                            or "The converter could not convert the message."
+                        ),
+                    )
+
+    def _post(self, url: str, data: dict, **kwargs) -> requests.Response:
+        """
+        Makes a POST request to the converter, retrying once with a new access
+        token if the cached one has expired.
+
+        :param url: The URL to make the request to.
+        :param data: The body of the request.
+        :param kwargs: Any other keyword arguments to make the request with.
+        :return: A requests.Response object
+        """
+        headers = dict(self.__headers)
+        if self.__cred_manager:
+            access_token = self.__cred_manager.get_access_token()
+            headers["Authorization"] = f"Bearer {access_token}"
+        response = self.__session.post(url=url, headers=headers, json=data, **kwargs)
+
+        # Retry with a new token in case the cached one has expired
+        if response.status_code == 401 and self.__cred_manager:
+            response.close()
+            access_token = self.__cred_manager.get_access_token(force_refresh=True)
+            headers["Authorization"] = f"Bearer {access_token}"
+            response = self.__session.post(
+                url=url, headers=headers, json=data, **kwargs
+            )
+
+        return response
+
+
+def _to_conversion_error(error: Exception) -> "ConversionError":
+    """
+    Wraps an error raised while converting a message in a `ConversionError`, if it
+    isn't one already.
+
+    :param error: The error raised.
+    :return: The error as a `ConversionError`.
+    """
+    if isinstance(error, ConversionError):
+        return error
+    conversion_error = ConversionError(message=str(error))
+    conversion_error.__cause__ = error
+    return conversion_error
+
+
+def _get_conversion_request_data(message: str, use_default_ccda=False) -> dict:
+    """
+    Builds the body of a request to convert a message with the FHIR converter,
+    standardizing datetimes in HL7v2 messages.
+
+    :param message: The raw message to convert.
+    :param use_default_ccda: Whether to default to the
+      base "CCD" root template if a resource's LOINC code doesn't
+      map to a specific supported template. Default: `False`
+    :raises ConversionError: If conversion settings cannot be derived.
+    :return: The body of the request.
+    """
+    conversion_settings = _get_fhir_conversion_settings(message, use_default_ccda)
+    if conversion_settings.get("input_type") == "hl7v2":
+        message = standardize_hl7_datetimes(message)
+
+    return {
+        "input_data": message,
+        "input_type": conversion_settings.get("input_type"),
+        "root_template": conversion_settings.get("root_template"),
+    }
+
+
 def _get_fhir_conversion_settings(message: str, use_default_ccda=False) -> dict:
     """
     Determines which settings to use with the FHIR server to facilitate message
@@ -121,69 +442,116 @@ def _get_fhir_conversion_settings(message: str, use_default_ccda=False) -> dict:
     """
     # Some streams (e.g. ELR, VXU) are HL7v2 encoded
     if message[:3] == "MSH":
-        parsed_msg = hl7.parse(message)
-        extracted_code = str(parsed_msg.segment("MSH")[9])
-
-        # HL7 MSH segment 9 has three components: message code, trigger
-        # event, and message structure. We can extract based on number of
-        # present separators and recombine to create a robust formatted code
-        extracted_code_tokenized = extracted_code.split(parsed_msg.separators[3])
-        formatted_code = ""
-        if (len(extracted_code_tokenized) >= 3) and (extracted_code_tokenized[2] != ""):
-            formatted_code = extracted_code_tokenized[2]
-        elif len(extracted_code_tokenized) == 2:
-            formatted_code = (
-                f"{extracted_code_tokenized[0]}_{extracted_code_tokenized[1]}"
-            )
-
-        if formatted_code == "":
-            raise ConversionError(message="Could not determine HL7 message structure")
-
         return {
-            "root_template": formatted_code,
+            "root_template": _get_hl7_root_template(message),
             "input_type": "hl7v2",
         }
 
     # Others conform to C-CDA standards (e.g. ECR)
-    else:
-        try:
-            root = et.fromstring(message)
+    ccda_code = _get_ccda_code(message)
+    try:
+        root_template = CCDA_CODES_TO_CONVERSION_RESOURCE[ccda_code]
+        return {
+            "root_template": root_template,
+            "input_type": "ccda",
+        }
+    except KeyError:
+        if use_default_ccda:
+            return {
+                "root_template": "CCD",
+                "input_type": "ccda",
+            }
+        else:
+            raise KeyError("Resource code does not match any provided input template")
 
-            # The Clinical Document tag and codeSystem together denote
-            # accepted LOINC codes for convertible resources
-            if root.tag.strip() == "{urn:hl7-org:v3}ClinicalDocument":
-                for child in root:
+
+def _get_hl7_root_template(message: str) -> str:
+    """
+    Determines the FHIR converter root template for an HL7v2 message from the
+    message type in MSH-9, reading only the message's MSH segment rather than
+    parsing the whole message.
+
+    :param message: The HL7v2 message, starting with its MSH segment.
+    :raises ConversionError: If the message structure cannot be determined.
+    :return: The name of the root template.
+    """
+    msh_segment = message.split("\r", 1)[0].split("\n", 1)[0]
+
+    # MSH-1 is the field separator itself and MSH-2 holds the encoding
+    # characters, the first of which is the component separator
+    field_separator = msh_segment[3:4]
+    fields = msh_segment[4:].split(field_separator) if field_separator else []
+    if len(fields) < 8 or fields[0] == "":
+        raise ConversionError(message="Could not determine HL7 message structure")
+    extracted_code = fields[7]
+    component_separator = fields[0][0]
+
+    # HL7 MSH segment 9 has three components: message code, trigger
+    # event, and message structure. We can extract based on number of
+    # present separators and recombine to create a robust formatted code
+    extracted_code_tokenized = extracted_code.split(component_separator)
+    formatted_code = ""
+    if (len(extracted_code_tokenized) >= 3) and (extracted_code_tokenized[2] != ""):
+        formatted_code = extracted_code_tokenized[2]
+    elif len(extracted_code_tokenized) == 2:
+        formatted_code = f"{extracted_code_tokenized[0]}_{extracted_code_tokenized[1]}"
+
+    if formatted_code == "":
+        raise ConversionError(message="Could not determine HL7 message structure")
+
+    return formatted_code
+
+
+def _get_ccda_code(message: str) -> Union[str, None]:
+    """
+    Extracts the LOINC code of a CCDA document from its `ClinicalDocument/code`
+    element. The document is parsed incrementally, `CCDA_SNIFF_CHUNK_SIZE`
+    characters at a time, and parsing stops as soon as the code is found in the
+    document's header, so large documents such as eCRs are never parsed in full.
+
+    :param message: The CCDA document.
+    :raises ConversionError: If the message is not a CCDA document.
+    :return: The LOINC code of the document, or `None` if it has none.
+    """
+    parser = et.XMLPullParser(("start", "end"))
+    depth = 0
+    try:
+        for chunk_start in range(0, len(message), CCDA_SNIFF_CHUNK_SIZE):
+            parser.feed(message[chunk_start : chunk_start + CCDA_SNIFF_CHUNK_SIZE])
+            for event, element in parser.read_events():
+                if event == "end":
+                    depth -= 1
+                    continue
+
+                depth += 1
+                if (
+                    depth == 1
+                    and element.tag.strip() != "{urn:hl7-org:v3}ClinicalDocument"
+                ):
+                    raise ConversionError(
+                        message="Input message is not a CCDA ClinicalDocument."
+                    )
+
+                # The Clinical Document tag and codeSystem together denote
+                # accepted LOINC codes for convertible resources
+                if depth == 2:
                     if (
-                        child.tag.strip() == "{urn:hl7-org:v3}code"
-                        and child.get("codeSystem") == "2.16.840.1.113883.6.1"
+                        element.tag.strip() == "{urn:hl7-org:v3}code"
+                        and element.get("codeSystem") == "2.16.840.1.113883.6.1"
                     ):
-                        break
-                ccda_code = child.attrib.get("code")
-
-                try:
-                    root_template = CCDA_CODES_TO_CONVERSION_RESOURCE[ccda_code]
-                    return {
-                        "root_template": root_template,
-                        "input_type": "ccda",
-                    }
-                except KeyError:
-                    if use_default_ccda:
-                        return {
-                            "root_template": "CCD",
-                            "input_type": "ccda",
-                        }
-                    else:
-                        raise KeyError(
-                            "Resource code does not match any provided input template"
-                        )
-
-        except et.ParseError as ex:
-            raise ConversionError(
-                message=(
-                    "Input message has unrecognized data type, "
-                    + "should be HL7v2 or XML."
-                )
-            ) from ex
+                        return element.get("code")
+                    # The header, including the document's code, precedes its
+                    # body
+                    if element.tag.strip() == "{urn:hl7-org:v3}component":
+                        return None
+        parser.close()
+
+    except et.ParseError as ex:
+        raise ConversionError(
+            message="Input message has unrecognized data type, should be HL7v2 or XML."
+        ) from ex
+
+    return None
 
 
 class ConversionError(Exception):
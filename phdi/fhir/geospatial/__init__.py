@@ -1,9 +1,12 @@
 from phdi.fhir.geospatial.core import BaseFhirGeocodeClient
 from phdi.fhir.geospatial.smarty import SmartyFhirGeocodeClient
 from phdi.fhir.geospatial.census import CensusFhirGeocodeClient
+from phdi.fhir.geospatial.executor import FhirGeocodeExecutor, TokenBucket
 
 __all__ = (
     "BaseFhirGeocodeClient",
     "SmartyFhirGeocodeClient",
     "CensusFhirGeocodeClient",
+    "FhirGeocodeExecutor",
+    "TokenBucket",
 )
@@ -1,5 +1,7 @@
 import copy
 
+from phdi.geospatial.boundaries import BoundaryIndex, EnrichedGeocodeClient
+from phdi.geospatial.cache import CachedGeocodeClient, GeocodeCache
 from phdi.geospatial.census import CensusGeocodeClient
 from phdi.fhir.geospatial.core import BaseFhirGeocodeClient
 
@@ -7,11 +9,18 @@ from phdi.fhir.geospatial.core import BaseFhirGeocodeClient
 class CensusFhirGeocodeClient(BaseFhirGeocodeClient):
     """
     Implementation of a geocoding client designed to handle FHIR-
-    formatted data using the Census API.
+    formatted data using the Census API. If a `GeocodeCache` is given,
+    addresses are only looked up if their results aren't cached. If a
+    `BoundaryIndex` is given, the census tracts of addresses the Census API
+    doesn't return one for are found in it instead.
     """
 
-    def __init__(self):
+    def __init__(self, cache: GeocodeCache = None, boundaries: BoundaryIndex = None):
         self.__client = CensusGeocodeClient()
+        if boundaries is not None:
+            self.__client = EnrichedGeocodeClient(self.__client, boundaries)
+        if cache is not None:
+            self.__client = CachedGeocodeClient(self.__client, cache)
 
     def geocode_resource(self, resource: dict, overwrite=True) -> dict:
         """
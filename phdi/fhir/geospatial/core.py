@@ -10,6 +10,15 @@ class BaseFhirGeocodeClient(ABC):
     the underlying vendor-specific client property.
     """
 
+    @property
+    def batch_size(self) -> int:
+        """
+        The number of entries the client geocodes together in one request when
+        geocoding a bundle. Clients that look up each address on its own geocode
+        one entry at a time.
+        """
+        return 1
+
     @abstractmethod
     def geocode_resource(self, resource: dict, overwrite=True) -> dict:
         """
@@ -0,0 +1,331 @@
+import copy
+import random
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple
+from smartystreets_python_sdk import exceptions as smarty_exceptions
+
+import requests
+
+from phdi.fhir.geospatial.core import BaseFhirGeocodeClient
+
+
+# Errors raised by geocoding clients that are worth retrying, since they're likely
+# to be transient.
+RETRYABLE_GEOCODE_ERRORS = (
+    requests.ConnectionError,
+    requests.Timeout,
+    ConnectionError,
+    TimeoutError,
+    smarty_exceptions.TooManyRequestsError,
+    smarty_exceptions.InternalServerError,
+    smarty_exceptions.BadGatewayError,
+    smarty_exceptions.ServiceUnavailableError,
+    smarty_exceptions.GatewayTimeoutError,
+    smarty_exceptions.RequestTimeoutError,
+)
+
+
+class TokenBucket:
+    """
+    A token bucket rate limiter, shared between threads. Tokens are added to the
+    bucket at a steady `rate` per second, up to a `capacity`, and each operation
+    takes as many tokens as it makes requests of the rate-limited service, waiting
+    for them if there aren't enough. Bursts of up to `capacity` requests are
+    allowed, while the average rate never exceeds `rate`.
+    """
+
+    @property
+    def rate(self) -> float:
+        return self.__rate
+
+    @property
+    def capacity(self) -> float:
+        return self.__capacity
+
+    def __init__(self, rate: float, capacity: float = None):
+        """
+        Creates a new TokenBucket object, starting full.
+
+        :param rate: The number of tokens added to the bucket per second.
+        :param capacity: The maximum number of tokens the bucket holds. If not
+          provided, the bucket holds one second's worth of tokens, or one token if
+          that's more. Default: `None`
+        :raises ValueError: If `rate` or `capacity` is not positive.
+        """
+        if rate is None or rate <= 0:
+            raise ValueError("rate must be positive")
+        if capacity is None:
+            capacity = max(rate, 1)
+        if capacity <= 0:
+            raise ValueError("capacity must be positive")
+
+        self.__rate = rate
+        self.__capacity = capacity
+        self.__tokens = capacity
+        self.__updated_at = time.monotonic()
+        self.__lock = threading.Lock()
+
+    def acquire(self, tokens: float = 1) -> None:
+        """
+        Takes tokens from the bucket, waiting until there are enough. Requests for
+        more tokens than the bucket holds are paid in installments of up to a full
+        bucket, so they still wait for every token they take, and the average rate
+        never exceeds `rate`.
+
+        :param tokens: The number of tokens to take. Default: `1`
+        """
+        while tokens > 0:
+            installment = min(tokens, self.__capacity)
+            self._take(installment)
+            tokens -= installment
+
+    def _take(self, tokens: float) -> None:
+        """
+        Takes tokens from the bucket, waiting until there are enough.
+
+        :param tokens: The number of tokens to take, at most the bucket's
+          capacity.
+        """
+        while True:
+            with self.__lock:
+                now = time.monotonic()
+                self.__tokens = min(
+                    self.__capacity,
+                    self.__tokens + (now - self.__updated_at) * self.__rate,
+                )
+                self.__updated_at = now
+                if self.__tokens >= tokens:
+                    self.__tokens -= tokens
+                    return
+                wait = (tokens - self.__tokens) / self.__rate
+            time.sleep(wait)
+
+
+class FhirGeocodeExecutor:
+    """
+    Geocodes FHIR bundles concurrently with a `BaseFhirGeocodeClient`. The entries
+    with addresses in each bundle are split into chunks of the client's batch size,
+    which are geocoded in parallel with the client's `geocode_bundle`, so clients
+    that geocode bundles in batches still do, and clients that look up addresses
+    one at a time look up several at once. Lookups can be limited to a vendor's
+    quota by a shared `TokenBucket`, taking one token per address, and entries
+    that fail with a transient error are retried, one at a time, with jittered
+    exponential backoff. Geocoded resources always keep their original order in
+    their bundle.
+
+    The executor counts the addresses it has geocoded, and the chunks waiting to
+    be geocoded, so its throughput and queue depth can be monitored while it runs.
+    """
+
+    @property
+    def client(self) -> BaseFhirGeocodeClient:
+        return self.__client
+
+    @property
+    def max_workers(self) -> int:
+        return self.__max_workers
+
+    @property
+    def rate_limiter(self) -> TokenBucket:
+        return self.__rate_limiter
+
+    @property
+    def lookups_completed(self) -> int:
+        """
+        The number of addresses geocoded so far.
+        """
+        return self.__lookups_completed
+
+    @property
+    def queue_depth(self) -> int:
+        """
+        The number of chunks waiting to be geocoded.
+        """
+        return self.__queue_depth
+
+    @property
+    def in_flight(self) -> int:
+        """
+        The number of chunks being geocoded.
+        """
+        return self.__in_flight
+
+    @property
+    def throughput(self) -> float:
+        """
+        The number of addresses geocoded per second since the executor started
+        geocoding.
+        """
+        if self.__started_at is None:
+            return 0.0
+        elapsed = time.monotonic() - self.__started_at
+        return self.__lookups_completed / elapsed if elapsed > 0 else 0.0
+
+    def __init__(
+        self,
+        client: BaseFhirGeocodeClient,
+        max_workers: int = 4,
+        rate_limiter: TokenBucket = None,
+        chunk_size: int = None,
+        retry_count: int = 3,
+        retry_backoff: float = 0.5,
+    ):
+        """
+        Creates a new FhirGeocodeExecutor object.
+
+        :param client: The client to geocode with.
+        :param max_workers: The maximum number of chunks geocoded at once.
+          Default: `4`
+        :param rate_limiter: A rate limiter to take a token from per address
+          geocoded. It may be shared between executors, to keep their combined
+          lookups within a quota. If not provided, lookups aren't rate limited.
+          Default: `None`
+        :param chunk_size: The maximum number of entries geocoded together. If not
+          provided, the client's `batch_size` is used. Default: `None`
+        :param retry_count: The number of times to retry entries that fail with a
+          transient error. Default: `3`
+        :param retry_backoff: The maximum number of seconds to wait before the
+          first retry, which doubles with each retry; the actual wait is chosen at
+          random up to this maximum. Default: `0.5`
+        :raises ValueError: If `max_workers` or `chunk_size` is not a positive
+          integer.
+        """
+        if max_workers is None or max_workers < 1:
+            raise ValueError("max_workers must be a positive integer")
+        if chunk_size is None:
+            chunk_size = client.batch_size
+        if chunk_size < 1:
+            raise ValueError("chunk_size must be a positive integer")
+
+        self.__client = client
+        self.__max_workers = max_workers
+        self.__rate_limiter = rate_limiter
+        self.__chunk_size = chunk_size
+        self.__retry_count = retry_count
+        self.__retry_backoff = retry_backoff
+
+        self.__lock = threading.Lock()
+        self.__lookups_completed = 0
+        self.__queue_depth = 0
+        self.__in_flight = 0
+        self.__started_at = None
+
+    def geocode_bundle(self, bundle: dict, overwrite=True) -> dict:
+        """
+        Geocodes all supported resources in a FHIR bundle concurrently.
+
+        :param bundle: A bundle of FHIR resources.
+        :param overwrite: If true, `bundle` is modified in-place;
+          if false, a copy of `bundle` modified and returned.  Default: `True`
+        :raises Exception: The error a chunk failed with, once its retries are
+          exhausted.
+        :return: The FHIR bundle with geocoded address(es).
+        """
+        return self.geocode_bundles([bundle], overwrite=overwrite)[0]
+
+    def geocode_bundles(self, bundles: List[dict], overwrite=True) -> List[dict]:
+        """
+        Geocodes all supported resources in the given FHIR bundles concurrently.
+
+        :param bundles: A list of bundles of FHIR resources.
+        :param overwrite: If true, `bundles` are modified in-place;
+          if false, copies of `bundles` are modified and returned.  Default: `True`
+        :raises Exception: The error a chunk failed with, once its retries are
+          exhausted.
+        :return: The FHIR bundles with geocoded address(es).
+        """
+        if not overwrite:
+            bundles = copy.deepcopy(bundles)
+
+        chunks = []
+        for bundle in bundles:
+            entries = [
+                entry
+                for entry in bundle.get("entry", [])
+                if entry.get("resource", {}).get("address")
+            ]
+            for start in range(0, len(entries), self.__chunk_size):
+                chunks.append((bundle, entries[start : start + self.__chunk_size]))
+
+        with self.__lock:
+            if self.__started_at is None:
+                self.__started_at = time.monotonic()
+            self.__queue_depth += len(chunks)
+
+        with ThreadPoolExecutor(max_workers=self.__max_workers) as executor:
+            futures = [executor.submit(self._geocode_chunk, chunk) for chunk in chunks]
+            try:
+                for future in futures:
+                    future.result()
+            except BaseException:
+                cancelled = sum(future.cancel() for future in futures)
+                with self.__lock:
+                    self.__queue_depth -= cancelled
+                raise
+
+        return bundles
+
+    def _geocode_chunk(self, chunk: Tuple[dict, List[dict]]) -> None:
+        """
+        Geocodes a chunk of a bundle's entries, retrying those that fail with a
+        transient error.
+
+        :param chunk: A tuple of the bundle and the entries to geocode.
+        """
+        bundle, entries = chunk
+        with self.__lock:
+            self.__queue_depth -= 1
+            self.__in_flight += 1
+
+        try:
+            # A chunk geocoded together fails together, so its entries are retried
+            # one at a time, and those that succeed aren't looked up again
+            pending = [entries]
+            attempt = 0
+            while pending:
+                failed = []
+                for batch in pending:
+                    try:
+                        self._geocode_entries(bundle, batch)
+                    except RETRYABLE_GEOCODE_ERRORS:
+                        if attempt == self.__retry_count:
+                            raise
+                        failed.extend([entry] for entry in batch)
+                if failed:
+                    time.sleep(random.uniform(0, self.__retry_backoff * 2**attempt))
+                    attempt += 1
+                pending = failed
+        finally:
+            with self.__lock:
+                self.__in_flight -= 1
+
+    def _geocode_entries(self, bundle: dict, entries: List[dict]) -> None:
+        """
+        Geocodes a bundle's entries together, taking a token from the rate limiter
+        per address, and writes the geocoded resources back to the entries.
+
+        :param bundle: The bundle the entries belong to.
+        :param entries: The entries to geocode.
+        """
+        lookups = sum(len(entry["resource"]["address"]) for entry in entries)
+        if self.__rate_limiter is not None:
+            self.__rate_limiter.acquire(lookups)
+
+        chunk_bundle = {
+            "resourceType": "Bundle",
+            "type": bundle.get("type", "batch"),
+            "entry": entries,
+        }
+        geocoded = self.__client.geocode_bundle(chunk_bundle, overwrite=False)
+
+        # Resources are updated in place, so they keep their places in the bundle
+        # and any references held to them
+        for entry, geocoded_entry in zip(entries, geocoded["entry"]):
+            entry["resource"].clear()
+            entry["resource"].update(geocoded_entry["resource"])
+
+        with self.__lock:
+            self.__lookups_completed += lookups
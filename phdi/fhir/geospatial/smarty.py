@@ -1,6 +1,10 @@
 import copy
-from smartystreets_python_sdk import us_street
+from smartystreets_python_sdk import Batch, us_street
+from typing import List, Union
 
+from phdi.geospatial.boundaries import BoundaryIndex, EnrichedGeocodeClient
+from phdi.geospatial.cache import CachedGeocodeClient, GeocodeCache
+from phdi.geospatial.core import GeocodeResult
 from phdi.geospatial.smarty import SmartyGeocodeClient
 from phdi.fhir.geospatial.core import BaseFhirGeocodeClient
 from phdi.fhir.utils import get_one_line_address
@@ -11,11 +15,24 @@ class SmartyFhirGeocodeClient(BaseFhirGeocodeClient):
     Implementation of a geocoding client designed to handle FHIR-
     formatted data using the SmartyStreets API.
     Requires an authorization ID as well as an authentication token
-    in order to build a street lookup client.
+    in order to build a street lookup client. If a `GeocodeCache` is
+    given, addresses are only looked up if their results aren't cached.
+    If a `BoundaryIndex` is given, the census tracts of geocoded addresses
+    are found in it and stored in the addresses.
     """
 
-    def __init__(self, auth_id, auth_token):
+    def __init__(
+        self,
+        auth_id,
+        auth_token,
+        cache: GeocodeCache = None,
+        boundaries: BoundaryIndex = None,
+    ):
         self.__client = SmartyGeocodeClient(auth_id, auth_token)
+        if boundaries is not None:
+            self.__client = EnrichedGeocodeClient(self.__client, boundaries)
+        if cache is not None:
+            self.__client = CachedGeocodeClient(self.__client, cache)
 
     @property
     def geocode_client(self) -> us_street.Client:
@@ -28,6 +45,14 @@ class SmartyFhirGeocodeClient(BaseFhirGeocodeClient):
         """
         return self.__client
 
+    @property
+    def batch_size(self) -> int:
+        """
+        The number of entries geocoded together in one request, which is the most
+        lookups Smarty allows in a batch.
+        """
+        return Batch.MAX_BATCH_SIZE
+
     def geocode_resource(self, resource: dict, overwrite=True) -> dict:
         """
         Performs geocoding on one or more addresses in a given FHIR
@@ -59,15 +84,30 @@ class SmartyFhirGeocodeClient(BaseFhirGeocodeClient):
         for address in patient.get("address", []):
             address_str = get_one_line_address(address)
             standardized_address = self.__client.geocode_from_str(address_str)
+            self._update_address(address, standardized_address)
+
+    def _update_address(
+        self, address: dict, standardized_address: Union[GeocodeResult, None]
+    ) -> None:
+        """
+        Updates a FHIR address with its geocoded, standardized information.
 
-            # Update fields with new, standardized information
-            if standardized_address:
-                address["line"] = standardized_address.line
-                address["city"] = standardized_address.city
-                address["state"] = standardized_address.state
-                address["postalCode"] = standardized_address.postal_code
-                self._store_lat_long_extension(
-                    address, standardized_address.lat, standardized_address.lng
+        :param address: A FHIR address.
+        :param standardized_address: The geocoded address, or `None` if it
+          couldn't be geocoded.
+        """
+        # Update fields with new, standardized information
+        if standardized_address:
+            address["line"] = list(standardized_address.line)
+            address["city"] = standardized_address.city
+            address["state"] = standardized_address.state
+            address["postalCode"] = standardized_address.postal_code
+            self._store_lat_long_extension(
+                address, standardized_address.lat, standardized_address.lng
+            )
+            if standardized_address.census_tract:
+                self._store_census_tract_extension(
+                    address, standardized_address.census_tract
                 )
 
     def geocode_bundle(self, bundle: dict, overwrite=True) -> dict:
@@ -83,10 +123,34 @@ class SmartyFhirGeocodeClient(BaseFhirGeocodeClient):
           if false, a copy of `bundle` modified and returned.  Default: `True`
         :return: The FHIR bundle with geocoded address(es).
         """
-        if not overwrite:
-            bundle = copy.deepcopy(bundle)
-
-        for entry in bundle.get("entry", []):
-            _ = self.geocode_resource(entry.get("resource", {}), overwrite=True)
+        return self.geocode_bundles([bundle], overwrite=overwrite)[0]
 
-        return bundle
+    def geocode_bundles(self, bundles: List[dict], overwrite=True) -> List[dict]:
+        """
+        Geocodes on all resources in the given FHIR bundles whose resource type
+        is among those supported by the PHDI SDK (see `geocode_bundle`). Every
+        address across the bundles is geocoded together, with duplicate addresses
+        looked up only once and the rest sent to Smarty in batches of up to 100.
+
+        :param bundles: A list of bundles of FHIR resources.
+        :param overwrite: If true, `bundles` are modified in-place;
+          if false, copies of `bundles` are modified and returned.  Default: `True`
+        :return: The FHIR bundles with geocoded address(es).
+        """
+        if not overwrite:
+            bundles = copy.deepcopy(bundles)
+
+        addresses = [
+            address
+            for bundle in bundles
+            for entry in bundle.get("entry", [])
+            if entry.get("resource", {}).get("resourceType", "") == "Patient"
+            for address in entry["resource"].get("address", [])
+        ]
+        standardized_addresses = self.__client.geocode_many(
+            [get_one_line_address(address) for address in addresses]
+        )
+        for address, standardized_address in zip(addresses, standardized_addresses):
+            self._update_address(address, standardized_address)
+
+        return bundles
@@ -1,9 +1,11 @@
+from phdi.fhir.tabulation.references import ReferenceStore
 from phdi.fhir.tabulation.tables import (
     drop_invalid,
     extract_data_from_fhir_search,
     extract_data_from_fhir_search_incremental,
     extract_data_from_schema,
     tabulate_data,
+    tabulate_deferred_data,
 )
 
 __all__ = [
@@ -12,4 +14,6 @@ __all__ = [
     "extract_data_from_fhir_search_incremental",
     "extract_data_from_schema",
     "tabulate_data",
+    "tabulate_deferred_data",
+    "ReferenceStore",
 ]
@@ -0,0 +1,272 @@
+import json
+import os
+import sqlite3 as sql
+import tempfile
+
+from typing import Iterator, List, Tuple, Union
+
+
+# The number of resources a `ReferenceStore` holds in memory before they are all
+# spilled to its database on disk.
+DEFAULT_MAX_RESOURCES_IN_MEMORY = 10000
+
+
+class ReferenceStore:
+    """
+    A key-value store for the FHIR resources needed to resolve references between
+    the anchor resources of a table and the resources they reference, or are
+    referenced by, across every page of a FHIR search. Resources are held in memory
+    until `max_resources_in_memory` of them have accumulated, at which point they
+    are all spilled to a SQLite database on disk, so the memory used stays bounded
+    however many pages of results are stored. Storing a resource is idempotent, so
+    a page of results may safely be stored more than once.
+    """
+
+    @property
+    def path(self) -> str:
+        return self.__path
+
+    @property
+    def max_resources_in_memory(self) -> int:
+        return self.__max_resources_in_memory
+
+    @property
+    def resources_in_memory(self) -> int:
+        return self.__resources_in_memory
+
+    def __init__(
+        self,
+        path: str = None,
+        max_resources_in_memory: int = DEFAULT_MAX_RESOURCES_IN_MEMORY,
+    ):
+        """
+        Creates a new ReferenceStore object.
+
+        :param path: The path of the SQLite database that resources are spilled to.
+          If the database already exists, the resources previously spilled to it
+          are kept. If not provided, a temporary file is used, which is deleted
+          when the store is closed. Default: `None`
+        :param max_resources_in_memory: The number of resources to hold in memory
+          before spilling them to disk. Default: `DEFAULT_MAX_RESOURCES_IN_MEMORY`
+        :raises ValueError: If `max_resources_in_memory` is not a positive integer.
+        """
+        if max_resources_in_memory is None or max_resources_in_memory < 1:
+            raise ValueError("max_resources_in_memory must be a positive integer")
+
+        self.__temporary = path is None
+        if self.__temporary:
+            file_descriptor, path = tempfile.mkstemp(suffix=".db")
+            os.close(file_descriptor)
+
+        self.__path = path
+        self.__max_resources_in_memory = max_resources_in_memory
+        self.__resources = {}
+        self.__reverse_references = {}
+        self.__deferred_anchors = {}
+        self.__resources_in_memory = 0
+        self.__spilled = os.path.isfile(path) and os.path.getsize(path) > 0
+
+        self.__connection = sql.connect(path)
+        with self.__connection:
+            self.__connection.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS resources (
+                    resource_type TEXT NOT NULL,
+                    resource_id TEXT NOT NULL,
+                    search_mode TEXT,
+                    resource TEXT NOT NULL,
+                    PRIMARY KEY (resource_type, resource_id)
+                );
+                CREATE TABLE IF NOT EXISTS reverse_references (
+                    resource_type TEXT NOT NULL,
+                    anchor_id TEXT NOT NULL,
+                    resource_key TEXT NOT NULL,
+                    resource TEXT NOT NULL,
+                    PRIMARY KEY (resource_type, anchor_id, resource_key)
+                );
+                CREATE TABLE IF NOT EXISTS deferred_anchors (
+                    resource_type TEXT NOT NULL,
+                    resource_id TEXT NOT NULL,
+                    PRIMARY KEY (resource_type, resource_id)
+                );
+                """
+            )
+
+    def put_resource(
+        self, resource_type: str, resource_id: str, resource: dict, search_mode: str
+    ) -> None:
+        """
+        Stores a resource that can be looked up by its type and ID, replacing any
+        resource previously stored with the same type and ID.
+
+        :param resource_type: The type of the resource.
+        :param resource_id: The ID of the resource.
+        :param resource: The resource.
+        :param search_mode: The search mode of the resource's bundle entry.
+        """
+        key = (resource_type, resource_id)
+        if key not in self.__resources:
+            self.__resources_in_memory += 1
+        self.__resources[key] = (resource, search_mode)
+        self._spill_if_full()
+
+    def get_resource(
+        self, resource_type: str, resource_id: str
+    ) -> Union[Tuple[dict, str], None]:
+        """
+        Looks up a resource stored with `put_resource`.
+
+        :param resource_type: The type of the resource.
+        :param resource_id: The ID of the resource.
+        :return: A tuple holding the resource and the search mode of its bundle
+          entry, or `None` if no such resource has been stored.
+        """
+        key = (resource_type, resource_id)
+        if key in self.__resources:
+            return self.__resources[key]
+        if not self.__spilled:
+            return None
+
+        result = self.__connection.execute(
+            "SELECT resource, search_mode FROM resources "
+            "WHERE resource_type = ? AND resource_id = ?;",
+            key,
+        ).fetchone()
+        if result is None:
+            return None
+        return (json.loads(result[0]), result[1])
+
+    def add_reverse_reference(
+        self, resource_type: str, anchor_id: str, resource: dict
+    ) -> None:
+        """
+        Stores a resource that references an anchor resource, so it can be looked
+        up by its type and the ID of the anchor it references.
+
+        :param resource_type: The type of the referencing resource.
+        :param anchor_id: The ID of the referenced anchor resource.
+        :param resource: The referencing resource.
+        """
+        references = self.__reverse_references.setdefault(
+            (resource_type, anchor_id), {}
+        )
+        resource_key = _get_resource_key(resource)
+        if resource_key not in references:
+            self.__resources_in_memory += 1
+        references[resource_key] = resource
+        self._spill_if_full()
+
+    def get_reverse_references(self, resource_type: str, anchor_id: str) -> List[dict]:
+        """
+        Looks up the resources of a type that reference an anchor resource.
+
+        :param resource_type: The type of the referencing resources.
+        :param anchor_id: The ID of the referenced anchor resource.
+        :return: A list of the referencing resources, in the order they were first
+          stored.
+        """
+        key = (resource_type, anchor_id)
+        references = {}
+        if self.__spilled:
+            for resource_key, resource in self.__connection.execute(
+                "SELECT resource_key, resource FROM reverse_references "
+                "WHERE resource_type = ? AND anchor_id = ? ORDER BY rowid;",
+                key,
+            ):
+                references[resource_key] = json.loads(resource)
+        references.update(self.__reverse_references.get(key, {}))
+        return list(references.values())
+
+    def defer_anchor(self, resource_type: str, resource_id: str) -> None:
+        """
+        Records that an anchor resource stored with `put_resource` should generate
+        a row once every page of results has been stored.
+
+        :param resource_type: The type of the anchor resource.
+        :param resource_id: The ID of the anchor resource.
+        """
+        key = (resource_type, resource_id)
+        if key not in self.__deferred_anchors:
+            self.__resources_in_memory += 1
+            self.__deferred_anchors[key] = None
+        self._spill_if_full()
+
+    def deferred_anchors(self) -> Iterator[Tuple[str, str]]:
+        """
+        Iterates over the anchor resources recorded with `defer_anchor`, spilling
+        every resource held in memory to disk first.
+
+        :return: An iterator of `(resource_type, resource_id)` tuples, in the order
+          the anchors were first deferred.
+        """
+        self.flush()
+        yield from self.__connection.execute(
+            "SELECT resource_type, resource_id FROM deferred_anchors ORDER BY rowid;"
+        )
+
+    def flush(self) -> None:
+        """
+        Spills every resource held in memory to disk.
+        """
+        with self.__connection:
+            self.__connection.executemany(
+                "INSERT OR REPLACE INTO resources VALUES (?, ?, ?, ?);",
+                [
+                    (resource_type, resource_id, search_mode, json.dumps(resource))
+                    for (resource_type, resource_id), (
+                        resource,
+                        search_mode,
+                    ) in self.__resources.items()
+                ],
+            )
+            self.__connection.executemany(
+                "INSERT OR REPLACE INTO reverse_references VALUES (?, ?, ?, ?);",
+                [
+                    (resource_type, anchor_id, resource_key, json.dumps(resource))
+                    for (resource_type, anchor_id), references in (
+                        self.__reverse_references.items()
+                    )
+                    for resource_key, resource in references.items()
+                ],
+            )
+            self.__connection.executemany(
+                "INSERT OR IGNORE INTO deferred_anchors VALUES (?, ?);",
+                list(self.__deferred_anchors),
+            )
+
+        self.__resources = {}
+        self.__reverse_references = {}
+        self.__deferred_anchors = {}
+        self.__resources_in_memory = 0
+        self.__spilled = True
+
+    def close(self) -> None:
+        """
+        Closes the store's database, deleting it if it is a temporary file.
+        Resources held in memory are not spilled to disk first, so `flush` should
+        be called beforehand if the database is to be re-opened.
+        """
+        self.__connection.close()
+        if self.__temporary:
+            os.remove(self.__path)
+
+    def _spill_if_full(self) -> None:
+        """
+        Spills every resource held in memory to disk if the store holds
+        `max_resources_in_memory` resources in memory.
+        """
+        if self.__resources_in_memory >= self.__max_resources_in_memory:
+            self.flush()
+
+
+def _get_resource_key(resource: dict) -> str:
+    """
+    Gets a key identifying a resource among the resources referencing the same
+    anchor, using the resource's ID if it has one, and its content otherwise.
+
+    :param resource: The resource.
+    :return: The key of the resource.
+    """
+    if resource.get("id"):
+        return resource["id"]
+    return json.dumps(resource, sort_keys=True)
@@ -1,17 +1,171 @@
 import fhirpathpy
+import hashlib
 import json
+import os
 import random
 import warnings
 import requests
 from functools import cache
-from typing import Any, Callable, Dict, Literal, List, Union, Tuple
-from urllib.parse import parse_qs, urlencode
+from typing import Any, Callable, Dict, FrozenSet, Iterator, Literal, List, Union, Tuple
+from urllib.parse import parse_qs, parse_qsl, urlencode
 import urllib.parse
 import pathlib
+from dataclasses import dataclass
 
 from phdi.cloud.core import BaseCredentialManager
-from phdi.fhir.transport import http_request_with_reauth
-from phdi.tabulation.tables import load_schema, write_data
+from phdi.fhir.tabulation.references import ReferenceStore
+from phdi.fhir.transport import (
+    http_request_with_reauth,
+    stream_from_fhir_export_response,
+)
+from phdi.tabulation.tables import (
+    DEFAULT_ROW_GROUP_SIZE,
+    CsvTableWriter,
+    ParquetTableWriter,
+    SqlTableWriter,
+    _get_column_types,
+    _open_table_writer,
+    _resume_table_writer,
+    load_schema,
+    write_data,
+)
+
+
+@dataclass(frozen=True)
+class _ColumnPlan:
+    """
+    The compiled form of a single column of a schema table, holding everything
+    needed to extract and validate the column's value for one row.
+    """
+
+    name: str
+    fhir_path: str
+    selection_criteria: str
+    params: dict
+    invalid_values: FrozenSet
+
+
+@dataclass(frozen=True)
+class _TablePlan:
+    """
+    The compiled form of a schema table, holding its anchor resource type and
+    its columns in a consistent order.
+    """
+
+    table_name: str
+    anchor_type: str
+    columns: Tuple[_ColumnPlan, ...]
+
+    @property
+    def headers(self) -> List[str]:
+        return [column.name for column in self.columns]
+
+
+@dataclass(frozen=True)
+class _ScanPlan:
+    """
+    A FHIR search whose results are shared by one or more schema tables. Tables
+    anchored on the same resource type with the same search criteria are scanned
+    together, using the union of their `_include` and `_revinclude` parameters.
+    """
+
+    search_url: str
+    table_names: Tuple[str, ...]
+
+
+@dataclass
+class _TableOutput:
+    """
+    The output of one table while its scan is being written, holding the
+    parameters passed to `write_data` for the table, the table's writer, and the
+    store used to resolve its references across pages, if it needs one.
+    """
+
+    table_name: str
+    write_params: dict
+    writer: Union[CsvTableWriter, ParquetTableWriter, SqlTableWriter, None] = None
+    reference_store: Union[ReferenceStore, None] = None
+
+    def write(self, tabulated_data: List[list]) -> None:
+        """
+        Writes tabulated data to the table, reusing the same writer for every
+        call.
+
+        :param tabulated_data: The output of `tabulate_data` for the table.
+        """
+        output_type = self.write_params["output_type"]
+        self.writer = write_data(
+            tabulated_data=tabulated_data,
+            pq_writer=self.writer if output_type == "parquet" else None,
+            sql_writer=self.writer if output_type == "sql" else None,
+            csv_writer=self.writer if output_type == "csv" else None,
+            **self.write_params,
+        )
+
+
+class _ReferenceStoreView:
+    """
+    Exposes the resources of a `ReferenceStore` through the same lookups as the
+    entry of one table in the output of `_build_reference_dicts`, so references
+    can be dereferenced against the store in the same way.
+    """
+
+    def __init__(self, reference_store: ReferenceStore, resource_directions: dict):
+        self.__reference_store = reference_store
+        self.__resource_directions = resource_directions
+
+    def __contains__(self, resource_type: str) -> bool:
+        return (
+            resource_type == self.__resource_directions["anchor"]
+            or resource_type in self.__resource_directions["forward"]
+            or resource_type in self.__resource_directions["reverse"]
+        )
+
+    def __getitem__(self, resource_type: str) -> "_ReferenceStoreTypeView":
+        return _ReferenceStoreTypeView(
+            self.__reference_store,
+            resource_type,
+            resource_type in self.__resource_directions["reverse"],
+        )
+
+
+class _ReferenceStoreTypeView:
+    """
+    Exposes the resources of one type in a `ReferenceStore`, keyed by their own
+    ID for forward references, or by the ID of the anchor they reference for
+    reverse references.
+    """
+
+    def __init__(
+        self, reference_store: ReferenceStore, resource_type: str, reverse: bool
+    ):
+        self.__reference_store = reference_store
+        self.__resource_type = resource_type
+        self.__reverse = reverse
+
+    def __contains__(self, resource_id: str) -> bool:
+        if self.__reverse:
+            return bool(
+                self.__reference_store.get_reverse_references(
+                    self.__resource_type, resource_id
+                )
+            )
+        return (
+            self.__reference_store.get_resource(self.__resource_type, resource_id)
+            is not None
+        )
+
+    def __getitem__(self, resource_id: str) -> Union[Tuple[dict, str], List[dict]]:
+        if self.__reverse:
+            return self.__reference_store.get_reverse_references(
+                self.__resource_type, resource_id
+            )
+        resource = self.__reference_store.get_resource(
+            self.__resource_type, resource_id
+        )
+        if resource is None:
+            raise KeyError(resource_id)
+        return resource
 
 
 def drop_invalid(data: List[list], schema: Dict, table_name: str) -> List[list]:
@@ -32,31 +186,23 @@ def drop_invalid(data: List[list], schema: Dict, table_name: str) -> List[list]:
         The first list in the data value is a list of headers serving as the
         columns, and all subsequent lists are rows in the table.
     """
-    invalid_values_by_column_index = {}
-
-    # Identify columns to drop invalid values for each table in schema
-    columns = schema["tables"][table_name]["columns"]
-    # Identify indices in List of Lists to check for invalid values
-    invalid_values_by_column_index[table_name] = {
-        i: columns[col].get("invalid_values")
-        for i, col in enumerate(columns)
-        if columns[col].get("invalid_values", [])
-    }
-
-    # Check if resource contains invalid values to be dropped
-    rows_to_remove = []
-    if len(invalid_values_by_column_index) > 0:
-        for i in range(len(data)):
-            for index, invalid_values in invalid_values_by_column_index[
-                table_name
-            ].items():
-                if data[i][index] in invalid_values:
-                    rows_to_remove.append(i)
-                    break
-
-    # Remove rows with invalid values
-    for idx, i in enumerate(rows_to_remove):
-        del data[i - idx]
+    plan = _compile_table_plan(schema, table_name)
+    invalid_values_by_column_index = [
+        (index, column.invalid_values)
+        for index, column in enumerate(plan.columns)
+        if column.invalid_values
+    ]
+
+    # Rebuild the data without the rows containing invalid values, in place so
+    # that callers holding a reference to `data` see the result
+    data[:] = [
+        row
+        for row in data
+        if not any(
+            _is_invalid_value(row[index], invalid_values)
+            for index, invalid_values in invalid_values_by_column_index
+        )
+    ]
 
     return data
 
@@ -155,6 +301,8 @@ def extract_data_from_schema(
     """
     Performs a full FHIR search for each table in the specified `schema`,
     and returns a dictionary mapping the table name to corresponding search results.
+    Tables anchored on the same resource type with the same search criteria are
+    searched for together, once.
     :param schema: A declarative, user-defined specification, for one or more tables,
         that defines the metadata, properties, and columns of those tables as they
         relate to FHIR resources.
@@ -166,16 +314,24 @@ def extract_data_from_schema(
 
     search_urls = _generate_search_urls(schema=schema)
 
+    # Tables sharing a scan share the same search results
     results = {}
-    for table_name, search_url in search_urls.items():
-        results[table_name] = extract_data_from_fhir_search(
-            search_url=f"{fhir_url}/{search_url}", cred_manager=cred_manager
+    for scan in _generate_scan_plans(search_urls):
+        scan_results = extract_data_from_fhir_search(
+            search_url=f"{fhir_url}/{scan.search_url}", cred_manager=cred_manager
         )
+        for table_name in scan.table_names:
+            results[table_name] = scan_results
 
     return results
 
 
-def tabulate_data(data: List[dict], schema: dict, table_name: str) -> List[list]:
+def tabulate_data(
+    data: List[dict],
+    schema: dict,
+    table_name: str,
+    reference_store: ReferenceStore = None,
+) -> List[list]:
     """
     Transforms a list of FHIR bundle resource entries into a tabular
     format (given by a list of lists) using a user-defined schema.
@@ -190,15 +346,25 @@ def tabulate_data(data: List[dict], schema: dict, table_name: str) -> List[list]
     the aggregated resources are parsed for value extraction using
     the schema's columns, and the results are stored in a list of
     lists for that table. The first entry in this list are the headers
-    of the data, taken from the schema. This functions performs the
-    above procedure on one table from the schema, specified by a
-    table name.
+    of the data, taken from the schema. Rows containing any of a
+    column's `invalid_values` are dropped while they are being built.
+    This functions performs the above procedure on one table from the
+    schema, specified by a table name.
+
+    Without a `reference_store`, references are only resolved between the
+    resources in `data`. When tabulating the pages of a FHIR search one at a
+    time, a `ReferenceStore` can be passed instead to resolve references across
+    every page: the resources of each page are added to the store, and the rows
+    of a table with referenced columns are deferred until every page has been
+    stored, after which they are tabulated by `tabulate_deferred_data`.
     :param data: A list of FHIR bundle resource entries to tabulate.
     :param schema: A declarative, user-defined specification, for one or more tables,
         that defines the metadata, properties, and columns of those tables as they
         relate to FHIR resources.
     :param table_name: A string specifying the name of a table defined
       in the given schema.
+    :param reference_store: A store in which to collect the resources needed to
+      resolve references across pages of search results. Default: `None`
     :raises KeyError: If the given `table_name` does not occur in the
       provided schema.
     :return: A list of lists denoting the tabulated form of the data.
@@ -206,25 +372,25 @@ def tabulate_data(data: List[dict], schema: dict, table_name: str) -> List[list]
       and all subsequent lists are rows in the table.
     """
 
-    if table_name not in schema.get("tables", {}):
-        raise KeyError(f"Provided table name {table_name} not found in schema")
-
-    # First pass: build mapping of references for easy lookup
+    plan = _compile_table_plan(schema, table_name)
     ref_directions = _get_reference_directions(schema)
-    ref_dicts = _build_reference_dicts(data, ref_directions)
 
-    # Get the columns from the schema so we always iterate through
-    # them in a consistent order
-    table_params = schema["tables"][table_name]
-    column_items = table_params["columns"].items()
-    headers = [column_name for column_name, _ in column_items]
-    tabulated_data = [headers]
-    anchor_type = schema["tables"][table_name]["resource_type"]
+    tabulated_data = [plan.headers]
+
+    # Rows whose references may be resolved by resources on later pages are
+    # deferred until every page has been stored
+    if reference_store is not None and _has_reference_columns(schema, table_name):
+        _store_references(reference_store, data, ref_directions[table_name])
+        return tabulated_data
+
+    # First pass: build mapping of references for easy lookup, for this
+    # table only
+    ref_dicts = _build_reference_dicts(data, {table_name: ref_directions[table_name]})
 
     # Second pass over just the anchor data, since that
     # defines the table's rows
     for anchor_resource, is_result_because in (
-        ref_dicts.get(table_name, {}).get(anchor_type, {}).values()
+        ref_dicts.get(table_name, {}).get(plan.anchor_type, {}).values()
     ):
         # Resources that aren't matches to the original criteria
         # don't generate rows because they were included via a
@@ -232,56 +398,133 @@ def tabulate_data(data: List[dict], schema: dict, table_name: str) -> List[list]
         if is_result_because != "match":
             continue
 
-        row = []
+        row = _build_row(anchor_resource, plan, ref_dicts)
+        if row is not None:
+            tabulated_data.append(row)
 
-        for _, column_params in column_items:
-            path_to_use = column_params["fhir_path"]
-            resource_to_use = anchor_resource
+    return tabulated_data
 
-            # Determine if we need to make a lookup in our
-            # first-pass reference mapping
-            if "reference_location" in column_params:
-                resource_to_use = _dereference_included_resource(
-                    resource_to_use,
-                    path_to_use,
-                    anchor_resource,
-                    column_params,
-                    ref_dicts,
-                    table_name,
-                )
-                if resource_to_use is None:
-                    row.append(None)
-                    continue
-
-            # Forward pointers are many-to-one anchor:target (i.e. many patients
-            # could point to the same general practitioner), so we only need a
-            # single value for them
-            if isinstance(resource_to_use, dict):
-                row.append(
-                    _extract_value_with_resource_path(
-                        resource_to_use,
-                        path_to_use,
-                        column_params["selection_criteria"],
-                    )
-                )
 
-            # Reverse pointers are one-to-many (one patient could have multiple
-            # observations pointing to them), so they need to be stored in a list
-            else:
-                values = [
-                    _extract_value_with_resource_path(
-                        r, path_to_use, column_params["selection_criteria"]
-                    )
-                    for r in resource_to_use
-                ]
-                row.append(values)
+def tabulate_deferred_data(
+    schema: dict,
+    table_name: str,
+    reference_store: ReferenceStore,
+    batch_size: int = 1000,
+) -> Iterator[List[list]]:
+    """
+    Tabulates the rows of a table that were deferred by `tabulate_data`, once every
+    page of search results has been added to the `reference_store`, resolving the
+    references of each row against the resources of all pages. Rows are produced
+    in batches, so that the whole table never needs to be held in memory.
 
-        tabulated_data.append(row)
+    :param schema: A declarative, user-defined specification, for one or more tables,
+        that defines the metadata, properties, and columns of those tables as they
+        relate to FHIR resources.
+    :param table_name: A string specifying the name of a table defined
+      in the given schema.
+    :param reference_store: The store passed to `tabulate_data` for every page of
+      search results.
+    :param batch_size: The maximum number of rows in each batch. Default: `1000`
+    :raises KeyError: If the given `table_name` does not occur in the
+      provided schema.
+    :return: An iterator of lists of lists, in the same form as the output of
+      `tabulate_data`, each holding the headers and a batch of rows.
+    """
+    plan = _compile_table_plan(schema, table_name)
+    ref_dicts = {
+        table_name: _ReferenceStoreView(
+            reference_store, _get_reference_directions(schema)[table_name]
+        )
+    }
 
-    # Drop invalid values specified in the schema
-    tabulated_data = drop_invalid(tabulated_data, schema, table_name)
+    tabulated_data = [plan.headers]
+    for anchor_type, anchor_id in reference_store.deferred_anchors():
+        anchor_resource, _ = reference_store.get_resource(anchor_type, anchor_id)
+        row = _build_row(anchor_resource, plan, ref_dicts)
+        if row is not None:
+            tabulated_data.append(row)
 
-    return tabulated_data
+        if len(tabulated_data) > batch_size:
+            yield tabulated_data
+            tabulated_data = [plan.headers]
+
+    if len(tabulated_data) > 1:
+        yield tabulated_data
+
+
+def _build_row(
+    anchor_resource: dict, plan: _TablePlan, ref_dicts: dict
+) -> Union[list, None]:
+    """
+    Builds the row of a table generated by an anchor resource.
+
+    :param anchor_resource: The anchor resource generating the row.
+    :param plan: The compiled table.
+    :param ref_dicts: The output of the `_build_reference_dicts` function.
+    :return: The row, or `None` if it contains a value the schema marks as invalid.
+    """
+    row = []
+    for column in plan.columns:
+        value = _extract_column_value(
+            anchor_resource, column, ref_dicts, plan.table_name
+        )
+
+        # Rows containing a value the schema marks as invalid are dropped
+        # as soon as the value is found, so they are never built in full
+        if column.invalid_values and _is_invalid_value(value, column.invalid_values):
+            return None
+        row.append(value)
+
+    return row
+
+
+def _extract_column_value(
+    anchor_resource: dict, column: _ColumnPlan, ref_dicts: dict, table_name: str
+) -> Any:
+    """
+    Extracts the value of a single column for the row generated by an anchor
+    resource, dereferencing the resource(s) the column's value comes from if
+    the column has a `reference_location`.
+
+    :param anchor_resource: The anchor resource generating the row.
+    :param column: The compiled column to extract a value for.
+    :param ref_dicts: The output of the `_build_reference_dicts` function.
+    :param table_name: The name of the table the row belongs to.
+    :return: The extracted value, a list of values for reverse references,
+      or `None` if no value was found.
+    """
+    resource_to_use = anchor_resource
+
+    # Determine if we need to make a lookup in our
+    # first-pass reference mapping
+    if "reference_location" in column.params:
+        resource_to_use = _dereference_included_resource(
+            resource_to_use,
+            column.fhir_path,
+            anchor_resource,
+            column.params,
+            ref_dicts,
+            table_name,
+        )
+        if resource_to_use is None:
+            return None
+
+    # Forward pointers are many-to-one anchor:target (i.e. many patients
+    # could point to the same general practitioner), so we only need a
+    # single value for them
+    if isinstance(resource_to_use, dict):
+        return _extract_value_with_resource_path(
+            resource_to_use, column.fhir_path, column.selection_criteria
+        )
+
+    # Reverse pointers are one-to-many (one patient could have multiple
+    # observations pointing to them), so they need to be stored in a list
+    return [
+        _extract_value_with_resource_path(
+            r, column.fhir_path, column.selection_criteria
+        )
+        for r in resource_to_use
+    ]
 
 
 def _apply_selection_criteria(
@@ -397,6 +640,103 @@ def _build_reference_dicts(data: List[dict], directions_by_table: dict) -> dict:
     return reference_dicts
 
 
+def _has_reference_columns(schema: dict, table_name: str) -> bool:
+    """
+    Checks whether any column of a table takes its value from a referenced
+    resource.
+
+    :param schema: A declarative, user-defined specification, for one or more tables,
+        that defines the metadata, properties, and columns of those tables as they
+        relate to FHIR resources.
+    :param table_name: The name of the table in the schema.
+    :return: `True` if the table has a column with a `reference_location`, and
+      `False` otherwise.
+    """
+    columns = schema.get("tables", {}).get(table_name, {}).get("columns", {})
+    return any(
+        "reference_location" in column_params for column_params in columns.values()
+    )
+
+
+def _store_references(
+    reference_store: ReferenceStore, data: List[dict], resource_directions: dict
+) -> None:
+    """
+    Adds the anchor resources of a table, and the resources they reference or
+    are referenced by, from a list of FHIR bundle resource entries to a
+    `ReferenceStore`, deferring the rows of anchors that match the search.
+
+    :param reference_store: The store to add resources to.
+    :param data: A list of FHIR bundle resource entries to tabulate.
+    :param resource_directions: The entry for the table in the output of the
+      `_get_reference_directions` function.
+    """
+    for entry in data:
+        resource = entry.get("resource", {})
+        resource_type = resource.get("resourceType", "")
+        resource_id = resource.get("id", "")
+        search_mode = entry.get("search", {}).get("mode", "")
+
+        if (
+            resource_type == resource_directions["anchor"]
+            or resource_type in resource_directions["forward"]
+        ):
+            reference_store.put_resource(
+                resource_type, resource_id, resource, search_mode
+            )
+            if resource_type == resource_directions["anchor"] and search_mode == (
+                "match"
+            ):
+                reference_store.defer_anchor(resource_type, resource_id)
+
+        if resource_type in resource_directions["reverse"]:
+            ref_path = (
+                resource_directions["reverse"][resource_type].replace(":", ".")
+                + ".reference"
+            )
+            referenced_anchor = _extract_value_with_resource_path(resource, ref_path)
+            if referenced_anchor is not None:
+                reference_store.add_reverse_reference(
+                    resource_type, referenced_anchor.split("/")[-1], resource
+                )
+
+
+def _compile_table_plan(schema: dict, table_name: str) -> _TablePlan:
+    """
+    Compiles a table of a schema into a `_TablePlan`, converting each column's
+    `invalid_values` into a frozenset so rows can be checked for invalid values
+    with constant-time lookups while they are being built.
+
+    :param schema: A declarative, user-defined specification, for one or more tables,
+        that defines the metadata, properties, and columns of those tables as they
+        relate to FHIR resources.
+    :param table_name: A string specifying the name of a table defined
+      in the given schema.
+    :raises KeyError: If the given `table_name` does not occur in the
+      provided schema.
+    :return: The compiled table.
+    """
+    if table_name not in schema.get("tables", {}):
+        raise KeyError(f"Provided table name {table_name} not found in schema")
+
+    table_params = schema["tables"][table_name]
+    columns = tuple(
+        _ColumnPlan(
+            name=column_name,
+            fhir_path=column_params["fhir_path"],
+            selection_criteria=column_params.get("selection_criteria", "first"),
+            params=column_params,
+            invalid_values=frozenset(column_params.get("invalid_values", [])),
+        )
+        for column_name, column_params in table_params["columns"].items()
+    )
+    return _TablePlan(
+        table_name=table_name,
+        anchor_type=table_params["resource_type"],
+        columns=columns,
+    )
+
+
 def _dereference_included_resource(
     resource_to_use: dict,
     path_to_use: str,
@@ -607,6 +947,61 @@ def _generate_search_urls(schema: dict) -> dict:
     return url_dict
 
 
+def _generate_scan_plans(search_urls: Dict[str, str]) -> List[_ScanPlan]:
+    """
+    Groups the search URLs of a schema's tables into the scans needed to extract
+    every table. Tables whose search URLs differ only in their `_include` and
+    `_revinclude` parameters are grouped into a single scan, searching with the
+    union of those parameters, since including more resources doesn't change
+    which resources match the search.
+
+    :param search_urls: The output of the `_generate_search_urls` function.
+    :return: A list of scans, in the order their first table appears in the
+      schema.
+    """
+    include_params = ("_include", "_revinclude")
+    scans = {}
+    for table_name, search_url in search_urls.items():
+        search_url_prefix, _, search_query_string = search_url.partition("?")
+        query_params = parse_qsl(search_query_string, keep_blank_values=True)
+        criteria = (
+            search_url_prefix,
+            tuple(sorted(p for p in query_params if p[0] not in include_params)),
+        )
+
+        if criteria not in scans:
+            scans[criteria] = (search_url, query_params, [table_name])
+            continue
+
+        scan_url, scan_params, table_names = scans[criteria]
+        new_params = [
+            param
+            for param in query_params
+            if param[0] in include_params and param not in scan_params
+        ]
+        if new_params:
+            scan_params = scan_params + new_params
+            scan_url = "?".join((search_url_prefix, urlencode(scan_params)))
+        scans[criteria] = (scan_url, scan_params, table_names + [table_name])
+
+    return [
+        _ScanPlan(search_url=scan_url, table_names=tuple(table_names))
+        for scan_url, _, table_names in scans.values()
+    ]
+
+
+def _is_invalid_value(value: Any, invalid_values: FrozenSet) -> bool:
+    """
+    Checks whether a tabulated value is one of a column's invalid values. Lists of
+    values, produced by reverse references, are never invalid.
+
+    :param value: The tabulated value to check.
+    :param invalid_values: The column's invalid values.
+    :return: True if the value is invalid; false otherwise.
+    """
+    return not isinstance(value, list) and value in invalid_values
+
+
 @cache
 def _get_fhirpathpy_parser(fhirpath_expression: str) -> Callable:
     """
@@ -673,49 +1068,431 @@ def generate_tables(
     output_params: dict,
     fhir_url: str,
     cred_manager: BaseCredentialManager = None,
+    checkpoint_path: pathlib.Path = None,
+    checkpoint_interval: int = 1,
 ) -> None:
     """
     Queries a FHIR server for information, and generates and stores the tables in the
-    desired location, according to the supplied schema.
+    desired location, according to the supplied schema. Tables anchored on the same
+    resource type with the same search criteria are extracted with a single FHIR
+    search, whose pages are each fetched once and written to all of those tables.
+
+    If a `checkpoint_path` is provided, the progress of each table (the next page
+    of search results to fetch, and the state of the table's writer) is saved to
+    that file as the tables are written. Calling this function again with the same
+    checkpoint file resumes an interrupted run, skipping completed tables and
+    continuing the others from their last checkpoint without duplicating rows.
+    Parquet tables written with checkpointing are stored as a directory of part
+    files named after the table's `filename`.
 
     :param schema_path: A path to the location of a schema config file.
     :param output_params: A dictionary of dictionaries containing the parameters for
         writing each table specified in the schema. For each table in the schema, the
         nested dictionary must contain a directory, filename, and output_type at
-        minimum. See `write_data` function for full writing specifications.
+        minimum. Parquet tables may also set a `row_group_size`, and CSV tables a
+        `compression`. See `write_data` function for full writing specifications.
     :param fhir_url: A URL to a FHIR server.
     :param cred_manager: The credential manager used to authenticate to the FHIR server.
+    :param checkpoint_path: The path of a JSON file in which to save the progress of
+        the run, and from which to resume it. Default: `None`
+    :param checkpoint_interval: The number of pages of search results to write
+        between checkpoints. Default: `1`
+    :raises ValueError: If `checkpoint_interval` is not a positive integer, or if
+        the checkpoint doesn't match the tables of the schema.
     """
-
     # Load schema
     schema = load_schema(schema_path)
 
-    # Load search_urls to query FHIR server
-    search_urls = _generate_search_urls(schema=schema)
+    _write_tables(
+        schema,
+        fhir_url,
+        _get_table_write_params(schema, output_params),
+        cred_manager,
+        checkpoint_path,
+        checkpoint_interval,
+    )
 
-    for table_name, search_url in search_urls.items():
-        pq_writer = None
-        next = search_url
-        while next is not None:
-            # Return set of incremental results and next URL to query
-            incremental_results, next = extract_data_from_fhir_search_incremental(
-                search_url=urllib.parse.urljoin(fhir_url, next),
-                cred_manager=cred_manager,
+
+def generate_tables_from_export(
+    schema_path: pathlib.Path,
+    output_params: dict,
+    export_response: dict,
+    cred_manager: BaseCredentialManager = None,
+    max_workers: int = 4,
+    batch_size: int = 1000,
+) -> None:
+    """
+    Generates and stores the tables of a schema from the ndjson files of a
+    completed FHIR bulk data $export operation, such as the output of
+    `export_from_fhir_server`, rather than by searching a FHIR server. The export
+    files holding the resource types used by the schema are downloaded
+    concurrently and streamed into the tables in batches of resources, so neither
+    the files nor the tables are ever held in memory in full. References between
+    resources are resolved across every export file.
+
+    Every exported resource of a table's anchor type generates a row, so the
+    resources included in the tables are determined by the parameters of the
+    export (e.g., `since` and `resource_type`), rather than by the search
+    criteria of the schema.
+
+    :param schema_path: A path to the location of a schema config file.
+    :param output_params: A dictionary of dictionaries containing the parameters for
+        writing each table specified in the schema. See `generate_tables` for the
+        parameters of each table.
+    :param export_response: A dictionary holding the final response of a completed
+        export operation, as specified here:
+        https://hl7.org/fhir/uv/bulkdata/export/index.html#response---complete-status
+    :param cred_manager: The credential manager used to authenticate to the server
+        hosting the export files, if the export response requires an access
+        token. Default: `None`
+    :param max_workers: The maximum number of export files to download at once.
+        Default: `4`
+    :param batch_size: The number of resources tabulated into the tables at a time.
+        Default: `1000`
+    :raises ValueError: If `batch_size` is not a positive integer.
+    """
+    if batch_size is None or batch_size < 1:
+        raise ValueError("batch_size must be a positive integer")
+
+    schema = load_schema(schema_path)
+    table_write_params = _get_table_write_params(schema, output_params)
+    ref_directions = _get_reference_directions(schema)
+
+    outputs = [
+        _TableOutput(table_name, table_write_params[table_name])
+        for table_name in schema.get("tables", {})
+    ]
+    resource_types = set()
+    for output in outputs:
+        resource_directions = ref_directions[output.table_name]
+        resource_types.add(resource_directions["anchor"])
+        resource_types.update(resource_directions["forward"])
+        resource_types.update(resource_directions["reverse"])
+
+        # Export files are not grouped by the anchors their resources reference,
+        # so references are resolved once every file has been downloaded
+        if _has_reference_columns(schema, output.table_name):
+            output.reference_store = ReferenceStore()
+
+    try:
+        entries = []
+        for _, resource in stream_from_fhir_export_response(
+            export_response,
+            cred_manager=cred_manager,
+            resource_types=resource_types,
+            max_workers=max_workers,
+        ):
+            # Exported resources are not the result of a search, so every
+            # resource is treated as a match
+            entries.append({"resource": resource, "search": {"mode": "match"}})
+            if len(entries) == batch_size:
+                for output in outputs:
+                    output.write(
+                        tabulate_data(
+                            entries, schema, output.table_name, output.reference_store
+                        )
+                    )
+                entries = []
+
+        # The final batch is always written, so every table is created even if
+        # the export holds no resources for it
+        for output in outputs:
+            output.write(
+                tabulate_data(
+                    entries, schema, output.table_name, output.reference_store
+                )
             )
-            # Tabulate data for set of incremental results
-            tabulated_incremental_data = tabulate_data(
-                incremental_results, schema, table_name
+
+        for output in outputs:
+            if output.reference_store is not None:
+                for tabulated_deferred_data in tabulate_deferred_data(
+                    schema, output.table_name, output.reference_store
+                ):
+                    output.write(tabulated_deferred_data)
+    finally:
+        for output in outputs:
+            if output.reference_store is not None:
+                output.reference_store.close()
+            if output.writer is not None:
+                output.writer.close()
+
+
+def _get_table_write_params(schema: dict, output_params: dict) -> Dict[str, dict]:
+    """
+    Gets the keyword arguments passed to `write_data` to write each table of a
+    schema from the output parameters passed to `generate_tables`.
+
+    :param schema: A declarative, user-defined specification, for one or more tables,
+        that defines the metadata, properties, and columns of those tables as they
+        relate to FHIR resources.
+    :param output_params: A dictionary of dictionaries containing the parameters for
+        writing each table specified in the schema.
+    :return: A dict holding the keyword arguments for each table, keyed by table
+      name.
+    """
+    table_write_params = {}
+    for table_name, table_params in output_params.items():
+        table_write_params[table_name] = {
+            "directory": table_params.get("directory"),
+            "filename": table_params.get("filename"),
+            "output_type": table_params.get("output_type"),
+            "db_file": table_params.get("db_file", None),
+            "db_tablename": table_params.get("db_tablename", None),
+            "column_types": _get_column_types(schema, table_name),
+            "row_group_size": table_params.get(
+                "row_group_size", DEFAULT_ROW_GROUP_SIZE
+            ),
+            "compression": table_params.get("compression"),
+        }
+    return table_write_params
+
+
+def _write_tables(
+    schema: dict,
+    fhir_url: str,
+    table_write_params: Dict[str, dict],
+    cred_manager: BaseCredentialManager = None,
+    checkpoint_path: pathlib.Path = None,
+    checkpoint_interval: int = 1,
+) -> None:
+    """
+    Extracts, tabulates and writes every table of a schema. Tables that can share
+    a FHIR search are extracted in a single scan: each page of search results is
+    fetched once, and tabulated into every table of the scan in the same pass.
+    See `generate_tables` for a description of checkpointing.
+
+    :param schema: A declarative, user-defined specification, for one or more tables,
+        that defines the metadata, properties, and columns of those tables as they
+        relate to FHIR resources.
+    :param fhir_url: A URL to a FHIR server.
+    :param table_write_params: A dict holding, for each table in the schema, the
+        keyword arguments passed to `write_data` to write the table.
+    :param cred_manager: The credential manager used to authenticate to the FHIR server.
+    :param checkpoint_path: The path of a JSON file in which to save the progress of
+        the run, and from which to resume it. Default: `None`
+    :param checkpoint_interval: The number of pages of search results to write
+        between checkpoints. Default: `1`
+    :raises ValueError: If `checkpoint_interval` is not a positive integer, or if
+        the checkpoint doesn't match the scans of the schema.
+    """
+    if checkpoint_interval is None or checkpoint_interval < 1:
+        raise ValueError("checkpoint_interval must be a positive integer")
+
+    checkpoint = None
+    if checkpoint_path is not None:
+        checkpoint = _load_checkpoint(checkpoint_path)
+
+    for scan in _generate_scan_plans(_generate_search_urls(schema=schema)):
+        outputs = [
+            _TableOutput(table_name, table_write_params[table_name])
+            for table_name in scan.table_names
+        ]
+        try:
+            next = scan.search_url
+            resuming = False
+            if checkpoint is not None:
+                next, resuming = _start_checkpointed_scan(
+                    checkpoint, checkpoint_path, scan, outputs, schema
+                )
+
+            # Already completed by a previous run
+            if next is None:
+                continue
+
+            # References between resources on different pages are resolved through
+            # a store that spills to disk, kept next to the checkpoint if there is one
+            for output in outputs:
+                if _has_reference_columns(schema, output.table_name):
+                    output.reference_store = _open_reference_store(
+                        checkpoint_path, output.table_name, resuming
+                    )
+
+            pages_written = 0
+            while next is not None:
+                # Return set of incremental results and next URL to query
+                incremental_results, next = extract_data_from_fhir_search_incremental(
+                    search_url=urllib.parse.urljoin(fhir_url, next),
+                    cred_manager=cred_manager,
+                )
+
+                # Tabulate set of incremental results into every table of the scan,
+                # and write them, reusing the same writer for every page of a table
+                for output in outputs:
+                    output.write(
+                        tabulate_data(
+                            incremental_results,
+                            schema,
+                            output.table_name,
+                            output.reference_store,
+                        )
+                    )
+
+                pages_written += 1
+                if (
+                    checkpoint is not None
+                    and next is not None
+                    and pages_written % checkpoint_interval == 0
+                ):
+                    _save_scan_checkpoint(checkpoint, checkpoint_path, outputs, next)
+
+            # Once every page has been stored, write the rows whose references
+            # needed resolving
+            for output in outputs:
+                if output.reference_store is not None:
+                    for tabulated_deferred_data in tabulate_deferred_data(
+                        schema, output.table_name, output.reference_store
+                    ):
+                        output.write(tabulated_deferred_data)
+        finally:
+            for output in outputs:
+                if output.reference_store is not None:
+                    output.reference_store.close()
+                if output.writer is not None:
+                    output.writer.close()
+
+        if checkpoint is not None:
+            _save_scan_checkpoint(checkpoint, checkpoint_path, outputs, None)
+            for output in outputs:
+                if output.reference_store is not None:
+                    os.remove(output.reference_store.path)
+
+
+def _load_checkpoint(checkpoint_path: pathlib.Path) -> dict:
+    """
+    Loads the checkpoint of a tabulation run, or creates an empty checkpoint if the
+    file doesn't exist yet.
+
+    :param checkpoint_path: The path of the checkpoint file.
+    :return: A dict holding the progress of each table, keyed by table name, under
+      `"tables"`.
+    """
+    if not os.path.isfile(checkpoint_path):
+        return {"tables": {}}
+    with open(checkpoint_path, "r") as file:
+        return json.load(file)
+
+
+def _open_reference_store(
+    checkpoint_path: Union[pathlib.Path, None], table_name: str, resume: bool
+) -> ReferenceStore:
+    """
+    Opens the store used to resolve a table's references across pages of search
+    results. For checkpointed runs the store is kept next to the checkpoint file,
+    so that its resources are available when the run is resumed.
+
+    :param checkpoint_path: The path of the checkpoint file, or `None` if the run
+      is not checkpointed.
+    :param table_name: The name of the table.
+    :param resume: Whether the table is being resumed from a checkpoint. If not, any
+      store left behind by a previous run is deleted.
+    :return: The reference store.
+    """
+    if checkpoint_path is None:
+        return ReferenceStore()
+
+    table_hash = hashlib.sha1(table_name.encode("utf-8")).hexdigest()[:12]
+    path = f"{checkpoint_path}.{table_hash}.references"
+    if not resume and os.path.isfile(path):
+        os.remove(path)
+    return ReferenceStore(path)
+
+
+def _save_checkpoint(checkpoint_path: pathlib.Path, checkpoint: dict) -> None:
+    """
+    Saves the checkpoint of a tabulation run. The checkpoint is written to a
+    temporary file that then replaces the previous checkpoint, so that an
+    interruption never leaves a partially-written checkpoint behind.
+
+    :param checkpoint_path: The path of the checkpoint file.
+    :param checkpoint: The checkpoint to save.
+    """
+    temporary_path = f"{checkpoint_path}.tmp"
+    with open(temporary_path, "w") as file:
+        json.dump(checkpoint, file)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temporary_path, checkpoint_path)
+
+
+def _save_scan_checkpoint(
+    checkpoint: dict,
+    checkpoint_path: pathlib.Path,
+    outputs: List[_TableOutput],
+    next: Union[str, None],
+) -> None:
+    """
+    Records the progress of every table of a scan in the checkpoint of a
+    tabulation run, and saves the checkpoint. The tables' reference stores are
+    flushed to disk first.
+
+    :param checkpoint: The checkpoint of the run.
+    :param checkpoint_path: The path of the checkpoint file.
+    :param outputs: The outputs of the tables of the scan.
+    :param next: The URL of the next page of search results to write to the
+      tables, or `None` if the scan is complete and its writers have been closed.
+    """
+    for output in outputs:
+        if output.reference_store is not None and next is not None:
+            output.reference_store.flush()
+
+        checkpoint["tables"][output.table_name] = {
+            "next": next,
+            "rows_written": output.writer.rows_written,
+            "writer": output.writer.checkpoint() if next is not None else None,
+        }
+    _save_checkpoint(checkpoint_path, checkpoint)
+
+
+def _start_checkpointed_scan(
+    checkpoint: dict,
+    checkpoint_path: pathlib.Path,
+    scan: _ScanPlan,
+    outputs: List[_TableOutput],
+    schema: dict,
+) -> Tuple[Union[str, None], bool]:
+    """
+    Opens the writers of the tables of a scan, and gets the URL of the next page
+    of search results to write to them. A scan with progress recorded in the
+    checkpoint is resumed from there, and is skipped if it is already complete.
+    Otherwise, new writers are opened and their initial state checkpointed, so
+    that rows written before the scan's first checkpoint can be discarded if the
+    run is interrupted.
+
+    :param checkpoint: The checkpoint of the run.
+    :param checkpoint_path: The path of the checkpoint file.
+    :param scan: The scan.
+    :param outputs: The outputs of the tables of the scan.
+    :param schema: The schema of the tables.
+    :raises ValueError: If the tables of the scan don't share the same progress
+      in the checkpoint.
+    :return: A tuple holding the next URL to query, which is `None` if the scan
+      is already complete, and whether the scan is being resumed.
+    """
+    table_checkpoints = [
+        checkpoint["tables"].get(output.table_name) for output in outputs
+    ]
+    if all(table_checkpoint is None for table_checkpoint in table_checkpoints):
+        for output in outputs:
+            output.writer = _open_table_writer(
+                headers=_compile_table_plan(schema, output.table_name).headers,
+                partitioned=True,
+                **output.write_params,
             )
+        _save_scan_checkpoint(checkpoint, checkpoint_path, outputs, scan.search_url)
+        return scan.search_url, False
+
+    if any(table_checkpoint is None for table_checkpoint in table_checkpoints) or (
+        len({table_checkpoint["next"] for table_checkpoint in table_checkpoints}) > 1
+    ):
+        raise ValueError(
+            "The checkpoint does not match the tables of the schema: tables "
+            f"{', '.join(scan.table_names)} must be resumed together."
+        )
 
-            # Write set of tabulated incremental data
-            pq_writer = write_data(
-                tabulated_data=tabulated_incremental_data,
-                directory=output_params[table_name].get("directory"),
-                filename=output_params[table_name].get("filename"),
-                output_type=output_params[table_name].get("output_type"),
-                db_file=output_params[table_name].get("db_file", None),
-                db_tablename=output_params[table_name].get("db_tablename", None),
-                pq_writer=pq_writer,
+    next = table_checkpoints[0]["next"]
+    if next is not None:
+        for output, table_checkpoint in zip(outputs, table_checkpoints):
+            output.writer = _resume_table_writer(
+                output.write_params["output_type"], table_checkpoint["writer"]
             )
-        if pq_writer is not None:
-            pq_writer.close()  # pragma: no cover
+    return next, True
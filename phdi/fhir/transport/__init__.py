@@ -1,14 +1,26 @@
 from phdi.fhir.transport.http import (
+    BundleEntryResult,
+    bulk_upload_to_fhir_server,
     http_request_with_reauth,
     fhir_server_get,
     upload_bundle_to_fhir_server,
 )
 
-from phdi.fhir.transport.export import export_from_fhir_server
+from phdi.fhir.transport.export import (
+    ExportJob,
+    ExportJobManager,
+    export_from_fhir_server,
+    stream_from_fhir_export_response,
+)
 
 __all__ = [
+    "BundleEntryResult",
+    "bulk_upload_to_fhir_server",
     "http_request_with_reauth",
     "fhir_server_get",
     "upload_bundle_to_fhir_server",
+    "ExportJob",
+    "ExportJobManager",
     "export_from_fhir_server",
+    "stream_from_fhir_export_response",
 ]
@@ -1,9 +1,300 @@
+import json
 import polling
+import queue
 import requests
+import threading
+import time
 
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
 from phdi.fhir.transport.http import http_request_with_reauth
 from phdi.cloud.core import BaseCredentialManager
-from typing import Union
+from typing import Callable, Iterable, Iterator, List, Tuple, Union
+
+
+# The number of resources parsed from an export file that are handed over to
+# the consumer of `stream_from_fhir_export_response` at a time.
+EXPORT_BATCH_SIZE = 500
+
+# The number of batches of resources waiting to be consumed before the
+# downloads of export files are paused.
+MAX_PENDING_EXPORT_BATCHES = 16
+
+
+class ExportJob:
+    """
+    The state of a single FHIR $export operation, from the moment the server
+    accepts it until its export files are ready.
+    """
+
+    @property
+    def poll_url(self) -> str:
+        return self.__poll_url
+
+    @property
+    def status(self) -> str:
+        return self.__status
+
+    @property
+    def progress(self) -> Union[str, None]:
+        return self.__progress
+
+    @property
+    def poll_count(self) -> int:
+        return self.__poll_count
+
+    @property
+    def response(self) -> Union[requests.Response, None]:
+        return self.__response
+
+    @property
+    def result(self) -> Union[dict, None]:
+        return self.__result
+
+    def __init__(self, poll_url: str):
+        """
+        Creates a new ExportJob object.
+
+        :param poll_url: The URL the FHIR server provided to poll for the status of
+          the export (the `Content-Location` of the kick-off response).
+        """
+        self.__poll_url = poll_url
+        self.__status = "in-progress"
+        self.__progress = None
+        self.__poll_count = 0
+        self.__response = None
+        self.__result = None
+
+    def _update(self, response: requests.Response) -> None:
+        """
+        Records the response of a poll of the export's status.
+
+        :param response: The response of the poll.
+        """
+        self.__poll_count += 1
+        self.__response = response
+        if response.status_code == 202:
+            progress = response.headers.get("X-Progress")
+            if isinstance(progress, str):
+                self.__progress = progress
+        elif response.status_code == 200:
+            self.__status = "complete"
+            self.__result = response.json()
+
+
+class ExportJobManager:
+    """
+    Starts FHIR $export operations and polls them until their export files are
+    ready. Polling starts quickly and backs off exponentially while an export is in
+    progress, so small exports complete in seconds while large ones aren't polled
+    more often than needed. A `Retry-After` header sent by the server takes
+    precedence over the backoff. Access tokens come from the credential manager's
+    shared cache, and several exports can be run concurrently.
+    """
+
+    @property
+    def fhir_url(self) -> str:
+        return self.__fhir_url
+
+    @property
+    def initial_poll_step(self) -> float:
+        return self.__initial_poll_step
+
+    @property
+    def max_poll_step(self) -> float:
+        return self.__max_poll_step
+
+    @property
+    def backoff_factor(self) -> float:
+        return self.__backoff_factor
+
+    @property
+    def poll_timeout(self) -> float:
+        return self.__poll_timeout
+
+    def __init__(
+        self,
+        cred_manager: BaseCredentialManager,
+        fhir_url: str,
+        initial_poll_step: float = 1,
+        max_poll_step: float = 30,
+        backoff_factor: float = 2,
+        poll_timeout: float = 300,
+        progress_callback: Callable[[ExportJob], None] = None,
+    ):
+        """
+        Creates a new ExportJobManager object.
+
+        :param cred_manager: The credential manager used to authenticate to the FHIR
+          server.
+        :param fhir_url: The FHIR server base URL.
+        :param initial_poll_step: The number of seconds to wait before polling an
+          export for the first time. Default: `1`
+        :param max_poll_step: The maximum number of seconds to wait between poll
+          requests, unless the server asks for a longer wait with a `Retry-After`
+          header. Default: `30`
+        :param backoff_factor: The factor by which the wait between poll requests
+          grows each time an export is found to still be in progress. Default: `2`
+        :param poll_timeout: The maximum number of seconds to wait for the export
+          files of an export to be generated. Default: `300`
+        :param progress_callback: A function called with the `ExportJob` after every
+          poll of its status, e.g. to report its `progress`. Default: `None`
+        :raises ValueError: If `initial_poll_step` is greater than `max_poll_step`,
+          or `backoff_factor` is less than 1.
+        """
+        if initial_poll_step > max_poll_step:
+            raise ValueError("initial_poll_step must not be greater than max_poll_step")
+        if backoff_factor < 1:
+            raise ValueError("backoff_factor must be at least 1")
+
+        self.__cred_manager = cred_manager
+        self.__fhir_url = fhir_url
+        self.__initial_poll_step = initial_poll_step
+        self.__max_poll_step = max_poll_step
+        self.__backoff_factor = backoff_factor
+        self.__poll_timeout = poll_timeout
+        self.__progress_callback = progress_callback
+
+    def start_export(
+        self,
+        export_scope: str = "",
+        since: str = "",
+        resource_type: str = "",
+        container: str = "",
+    ) -> ExportJob:
+        """
+        Initiates a FHIR $export operation, without waiting for it to complete.
+
+        :param export_scope: Either `Patient` or `Group/[id]` as specified in the
+          FHIR spec
+          (https://hl7.org/fhir/uv/bulkdata/export/index.html#bulk-data-kick-off-request).
+        :param since: A FHIR instant (https://build.fhir.org/datatypes.html#instant)
+          instructing the export to include only resources created or modified after
+          the specified instant.
+        :param resource_type: A comma-delimited list of FHIR resource types to
+          include in exported files.
+        :param container: The name of the storage container used to store exported
+          files.
+        :raises requests.HTTPError: If the FHIR server doesn't accept the export.
+        :return: The started export.
+        """
+        # TODO consider putting implementation-specific parameters (e.g. container)
+        # in a flexible dictionary rather than listing as explicit parameters.
+        export_url = _compose_export_url(
+            fhir_url=self.__fhir_url,
+            export_scope=export_scope,
+            since=since,
+            resource_type=resource_type,
+            container=container,
+        )
+        response = self._request(
+            export_url,
+            {"Accept": "application/fhir+json", "Prefer": "respond-async"},
+        )
+        if response.status_code != 202:
+            raise requests.HTTPError(response=response)
+
+        return ExportJob(response.headers.get("Content-Location"))
+
+    def poll(self, job: ExportJob) -> Union[float, None]:
+        """
+        Polls the status of an export once, updating the `job`.
+
+        :param job: The export to poll.
+        :raises requests.HTTPError: If an unexpected status code is returned.
+        :return: The number of seconds the server asked to wait before polling
+          again with a `Retry-After` header, or `None` if it didn't.
+        """
+        response = self._request(job.poll_url, {"Accept": "application/fhir+ndjson"})
+        if response.status_code not in (200, 202):
+            raise requests.HTTPError(response=response)
+
+        job._update(response)
+        if self.__progress_callback is not None:
+            self.__progress_callback(job)
+
+        if response.status_code == 202:
+            return _parse_retry_after(response.headers.get("Retry-After"))
+
+    def wait(self, job: ExportJob) -> dict:
+        """
+        Polls an export until its export files are ready.
+
+        :param job: The export to wait for.
+        :raises polling.TimeoutException: If the FHIR server continually returns a
+          202 status indicating in progress until the timeout is reached.
+        :raises requests.HTTPError: If an unexpected status code is returned.
+        :return: The JSON-formatted HTTP response of the completed export operation
+          as a dictionary.
+        """
+        deadline = time.monotonic() + self.__poll_timeout
+        poll_step = self.__initial_poll_step
+        while True:
+            retry_after = self.poll(job)
+            if job.status == "complete":
+                return job.result
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise polling.TimeoutException(values=None, last=job.response)
+
+            if retry_after is not None:
+                delay = retry_after
+            else:
+                delay = poll_step
+                poll_step = min(poll_step * self.__backoff_factor, self.__max_poll_step)
+            time.sleep(min(delay, remaining))
+
+    def run_exports(self, exports: List[dict], max_workers: int = 4) -> List[dict]:
+        """
+        Runs several FHIR $export operations concurrently, waiting for all of them
+        to complete.
+
+        :param exports: A list of dictionaries, each holding the keyword arguments
+          passed to `start_export` for one export.
+        :param max_workers: The maximum number of exports to run at once.
+          Default: `4`
+        :raises polling.TimeoutException: If any export times out.
+        :raises requests.HTTPError: If any export fails.
+        :return: The results of the exports, in the same order as `exports`.
+        """
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [
+                executor.submit(self._run_export, export_params)
+                for export_params in exports
+            ]
+            return [future.result() for future in futures]
+
+    def _run_export(self, export_params: dict) -> dict:
+        """
+        Starts an export and waits for it to complete.
+
+        :param export_params: The keyword arguments passed to `start_export`.
+        :return: The result of the export.
+        """
+        return self.wait(self.start_export(**export_params))
+
+    def _request(self, url: str, headers: dict) -> requests.Response:
+        """
+        Makes an authenticated GET request to the FHIR server. The credential
+        manager caches and refreshes the access token, so it's asked for the token
+        for every request. If the server rejects the token, a new one is
+        requested.
+
+        :param url: The URL to request.
+        :param headers: The headers of the request, other than Authorization.
+        :return: The response of the FHIR server.
+        """
+        access_token = self.__cred_manager.get_access_token()
+        return http_request_with_reauth(
+            cred_manager=self.__cred_manager,
+            url=url,
+            retry_count=3,
+            request_type="GET",
+            allowed_methods=["GET"],
+            headers={"Authorization": f"Bearer {access_token}", **headers},
+        )
 
 
 def export_from_fhir_server(
@@ -18,7 +309,10 @@ def export_from_fhir_server(
 ) -> dict:
     """
     Initiates a FHIR $export operation, polls until it completes, and returns the
-    successful result.
+    successful result. Polling starts after one second and backs off exponentially
+    up to `poll_step` seconds between polls, unless the server asks for a different
+    wait with a `Retry-After` header. See `ExportJobManager` to run several exports
+    concurrently or track their progress.
 
     :param cred_manager: The credential manager used to authenticate to the FHIR server.
     :param fhir_url: The FHIR server base URL.
@@ -30,57 +324,32 @@ def export_from_fhir_server(
     :param resource_type: A comma-delimited list of FHIR resource types to include
       in exported files.
     :param container: The name of the storage container used to store exported files.
-    :param poll_step: The number of seconds to wait between poll requests, waiting
-      for export files to be generated.
+    :param poll_step: The maximum number of seconds to wait between poll requests,
+      waiting for export files to be generated.
     :param poll_timeout: The maximum number of seconds to wait for export files to
       be generated.
     :raises polling.TimeoutException: If the FHIR server continually returns a 202
       status indicating in progress until the timeout is reached.
+    :raises requests.HTTPError: If the FHIR server doesn't accept the export, or an
+      unexpected status code is returned while polling.
     :return: The JSON-formatted HTTP response of a completed export operation
       as a dictionary.
     """
-    # TODO consider putting implementation-specific parameters (e.g. container) in a
-    # flexible dictionary rather than listing as explicit parameters.
-
-    # Combine template variables into export endpoint
-    access_token = cred_manager.get_access_token()
-    export_url = _compose_export_url(
-        fhir_url=fhir_url,
-        export_scope=export_scope,
-        since=since,
-        resource_type=resource_type,
-        container=container,
+    manager = ExportJobManager(
+        cred_manager,
+        fhir_url,
+        initial_poll_step=min(1, poll_step),
+        max_poll_step=poll_step,
+        poll_timeout=poll_timeout,
     )
-
-    # Open connection to the export operation and kickoff process
-    response = http_request_with_reauth(
-        cred_manager=cred_manager,
-        url=export_url,
-        retry_count=3,
-        request_type="GET",
-        allowed_methods=["GET"],
-        headers={
-            "Authorization": f"Bearer {access_token}",
-            "Accept": "application/fhir+json",
-            "Prefer": "respond-async",
-        },
-    )
-
-    # TODO handle export failure conditions and timeouts.
-    if response.status_code == 202:
-        # Repeatedly poll the endpoint the FHIR server creates for us
-        # until either the connection times out (as we configured) or
-        # we have the response in hand
-        poll_response = export_from_fhir_server_poll(
-            poll_url=response.headers.get("Content-Location"),
-            cred_manager=cred_manager,
-            poll_step=poll_step,
-            poll_timeout=poll_timeout,
+    return manager.wait(
+        manager.start_export(
+            export_scope=export_scope,
+            since=since,
+            resource_type=resource_type,
+            container=container,
         )
-
-        # We successfully completed the full export
-        if poll_response.status_code == 200:
-            return poll_response.json()
+    )
 
 
 def export_from_fhir_server_poll(
@@ -91,11 +360,14 @@ def export_from_fhir_server_poll(
 ) -> requests.Response:
     """
     Polls an endpoint to retrieve an export file after an export run has been initiated.
+    Polling starts after one second and backs off exponentially up to `poll_step`
+    seconds between polls, unless the server asks for a different wait with a
+    `Retry-After` header.
 
     :param poll_url: The URL to poll for export information.
     :param cred_manager: The service used to get an access token used to make a request.
-    :param poll_step: The number of seconds to wait between poll requests, waiting
-      for export files to be generated.
+    :param poll_step: The maximum number of seconds to wait between poll requests,
+      waiting for export files to be generated.
     :param poll_timeout: The maximum number of seconds to wait for export files to
       be generated.
     :raises polling.TimeoutException: If the FHIR server continually returns a 202
@@ -103,15 +375,178 @@ def export_from_fhir_server_poll(
     :raises requests.HTTPError: If an unexpected status code is returned.
     :return: A response from polled endpoint.
     """
-    response = polling.poll(
-        target=_export_from_fhir_server_poll_call,
-        args=[poll_url, cred_manager],
-        step=poll_step,
-        timeout=poll_timeout,
-    )
+    job = ExportJob(poll_url)
+    ExportJobManager(
+        cred_manager,
+        None,
+        initial_poll_step=min(1, poll_step),
+        max_poll_step=poll_step,
+        poll_timeout=poll_timeout,
+    ).wait(job)
 
     # If no error conditions, return response
-    return response
+    return job.response
+
+
+def stream_from_fhir_export_response(
+    export_response: dict,
+    cred_manager: BaseCredentialManager = None,
+    resource_types: Iterable[str] = None,
+    max_workers: int = 4,
+    timeout: float = 60,
+) -> Iterator[Tuple[str, dict]]:
+    """
+    Accepts the export response content as specified here:
+    https://hl7.org/fhir/uv/bulkdata/export/index.html#response---complete-status
+    and downloads the ndjson files in its "output" array, yielding their
+    resources one at a time. Files are downloaded concurrently and parsed line by
+    line as they are streamed, so no file is ever held in memory in full. The
+    downloads are paused whenever too many parsed resources are waiting to be
+    consumed, so memory use stays bounded however quickly they are downloaded.
+
+    :param export_response: A dictionary holding the final export response.
+    :param cred_manager: The credential manager used to authenticate to the server
+      hosting the export files, if the export response requires an access token.
+      Default: `None`
+    :param resource_types: The resource types whose export files should be
+      downloaded. If not provided, every export file is downloaded. Default: `None`
+    :param max_workers: The maximum number of export files to download at once.
+      Default: `4`
+    :param timeout: The number of seconds to wait for the server to send data
+      before giving up on a download. Default: `60`
+    :raises ValueError: If `max_workers` is not a positive integer, or if the
+      export response requires an access token and no `cred_manager` is provided.
+    :raises requests.HTTPError: If an export file can't be downloaded.
+    :return: An iterator of tuples, each holding a FHIR resource type (e.g.,
+      Patient) and a resource of that type.
+    """
+    # TODO: Handle error array that could be contained in the response content.
+    if max_workers is None or max_workers < 1:
+        raise ValueError("max_workers must be a positive integer")
+
+    requires_access_token = export_response.get("requiresAccessToken", False)
+    if requires_access_token and cred_manager is None:
+        raise ValueError(
+            "The export response requires an access token, but no cred_manager "
+            "was provided."
+        )
+
+    export_entries = [
+        export_entry
+        for export_entry in export_response.get("output", [])
+        if resource_types is None or export_entry.get("type") in resource_types
+    ]
+    if not export_entries:
+        return
+
+    # Each download hands batches of resources over through a bounded queue,
+    # followed by `None` once its file is complete (or the error that ended it)
+    batches = queue.Queue(maxsize=MAX_PENDING_EXPORT_BATCHES)
+    cancelled = threading.Event()
+
+    def download(export_entry: dict) -> None:
+        try:
+            batch = []
+            for resource in _stream_export_file(
+                export_entry.get("url"), cred_manager, requires_access_token, timeout
+            ):
+                batch.append(resource)
+                if len(batch) == EXPORT_BATCH_SIZE:
+                    if not _put_unless_cancelled(
+                        batches, (export_entry.get("type"), batch), cancelled
+                    ):
+                        return
+                    batch = []
+            if batch:
+                _put_unless_cancelled(
+                    batches, (export_entry.get("type"), batch), cancelled
+                )
+            _put_unless_cancelled(batches, None, cancelled)
+        except Exception as error:
+            _put_unless_cancelled(batches, error, cancelled)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for export_entry in export_entries:
+            executor.submit(download, export_entry)
+
+        try:
+            downloads_remaining = len(export_entries)
+            while downloads_remaining > 0:
+                item = batches.get()
+                if item is None:
+                    downloads_remaining -= 1
+                elif isinstance(item, Exception):
+                    raise item
+                else:
+                    resource_type, batch = item
+                    for resource in batch:
+                        yield resource_type, resource
+        finally:
+            # Stop any downloads still running if the consumer stopped early
+            # or a download failed
+            cancelled.set()
+
+
+def _stream_export_file(
+    url: str,
+    cred_manager: Union[BaseCredentialManager, None],
+    requires_access_token: bool,
+    timeout: float,
+) -> Iterator[dict]:
+    """
+    Downloads an ndjson export file, parsing each line into a resource as the file
+    is streamed. If the server rejects the access token, a new one is requested
+    from the `cred_manager` and the download is retried once.
+
+    :param url: The URL of the export file.
+    :param cred_manager: The credential manager used to authenticate to the server
+      hosting the file.
+    :param requires_access_token: Whether an access token must be sent with the
+      request.
+    :param timeout: The number of seconds to wait for the server to send data.
+    :raises requests.HTTPError: If the file can't be downloaded.
+    :return: An iterator of the resources in the file.
+    """
+    headers = {"Accept": "application/fhir+ndjson"}
+    if requires_access_token:
+        headers["Authorization"] = f"Bearer {cred_manager.get_access_token()}"
+
+    response = requests.get(url, headers=headers, stream=True, timeout=timeout)
+    if response.status_code == 401 and requires_access_token:
+        response.close()
+        access_token = cred_manager.get_access_token(force_refresh=True)
+        headers["Authorization"] = f"Bearer {access_token}"
+        response = requests.get(url, headers=headers, stream=True, timeout=timeout)
+
+    with response:
+        response.raise_for_status()
+        for line in response.iter_lines():
+            if line.strip():
+                yield json.loads(line)
+
+
+def _put_unless_cancelled(
+    items: queue.Queue,
+    item: Union[Tuple[str, List[dict]], Exception, None],
+    cancelled: threading.Event,
+) -> bool:
+    """
+    Puts an item on a bounded queue, waiting for space to become available unless
+    the consumer of the queue has stopped.
+
+    :param items: The queue.
+    :param item: The item to put on the queue.
+    :param cancelled: An event set once the consumer of the queue has stopped.
+    :return: `True` if the item was put on the queue, and `False` if the consumer
+      stopped first.
+    """
+    while not cancelled.is_set():
+        try:
+            items.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
 
 
 def _compose_export_url(
@@ -160,38 +595,25 @@ def _compose_export_url(
     return export_url
 
 
-def _export_from_fhir_server_poll_call(
-    poll_url: str, cred_manager: BaseCredentialManager
-) -> Union[requests.Response, None]:
+def _parse_retry_after(retry_after: Union[str, None]) -> Union[float, None]:
     """
-    Called by `export_from_fhir_server_poll` to see if the export files are ready
-    based on received status code. If an export is still in progress, then returns
-    `None` so polling continues. If the response is 200, then the export files are
-    ready, and returns the HTTP response. Any other status either indicates an error
-    or unexpected condition, and an error is raised.
+    Parses the value of a `Retry-After` header, which is either a number of seconds
+    or an HTTP date (https://httpwg.org/specs/rfc9110.html#field.retry-after).
 
-    :param poll_url: The endpoint the FHIR server gave us to query for if
-      our files are ready.
-    :param cred_manager: The credential manager used to authenticate to the FHIR server.
-    :return: An HTTP response (if 200) or None (if still in progress).
-    """
-    access_token = cred_manager.get_access_token()
-    response = http_request_with_reauth(
-        cred_manager=cred_manager,
-        url=poll_url,
-        retry_count=3,
-        request_type="GET",
-        allowed_methods=["GET"],
-        headers={
-            "Authorization": f"Bearer {access_token}",
-            "Accept": "application/fhir+ndjson",
-        },
-    )
-    if response.status_code == 202:
-        # In progress - return None to keep polling
-        return
-    elif response.status_code == 200:
-        # Complete
-        return response
-    else:
-        raise requests.HTTPError(response=response)
+    :param retry_after: The value of the header.
+    :return: The number of seconds to wait, or `None` if the value is missing or
+      can't be parsed.
+    """
+    if not isinstance(retry_after, str):
+        return None
+    try:
+        return max(float(retry_after), 0)
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(retry_after)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max((retry_at - datetime.now(timezone.utc)).total_seconds(), 0)
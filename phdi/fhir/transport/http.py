@@ -1,11 +1,42 @@
+import json
 import logging
-from typing import List, Literal
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Iterable, List, Literal, Optional, Tuple
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3 import Retry
 
 from phdi.cloud.core import BaseCredentialManager
 from phdi.transport import http_request_with_retry
 
 
+# The HTTP status codes of bundle entries that are worth submitting again,
+# because they indicate a transient failure rather than a problem with the entry.
+RETRYABLE_ENTRY_STATUSES = frozenset([408, 409, 429, 500, 502, 503, 504])
+
+
+@dataclass
+class BundleEntryResult:
+    """
+    The outcome of uploading one resource or bundle entry with
+    `bulk_upload_to_fhir_server`. If the entry's bundle couldn't be posted at all,
+    e.g. because the connection failed, `error` holds the exception raised and
+    `status` is empty.
+    """
+
+    index: int
+    status: str
+    attempts: int
+    response: dict = field(default_factory=dict)
+    error: Optional[Exception] = None
+
+    @property
+    def succeeded(self) -> bool:
+        return self.status.startswith("2")
+
+
 def http_request_with_reauth(
     cred_manager: BaseCredentialManager,
     url: str,
@@ -48,7 +79,7 @@ def http_request_with_reauth(
     # Retry with new token in case it expired since creation (or from cache)
     if response.status_code == 401:
         if headers.get("Authorization", "").startswith("Bearer "):
-            new_access_token = cred_manager.get_access_token()
+            new_access_token = cred_manager.get_access_token(force_refresh=True)
             headers["Authorization"] = f"Bearer {new_access_token}"
 
         response = http_request_with_retry(
@@ -119,6 +150,92 @@ def upload_bundle_to_fhir_server(
     return response
 
 
+def bulk_upload_to_fhir_server(
+    resources: Iterable[dict],
+    cred_manager: BaseCredentialManager,
+    fhir_url: str,
+    max_entries_per_bundle: int = 500,
+    max_bundle_bytes: int = 4 * 1024 * 1024,
+    max_workers: int = 4,
+    retry_count: int = 3,
+    retry_backoff: float = 1,
+) -> List[BundleEntryResult]:
+    """
+    Uploads any number of FHIR resources to the FHIR server. The resources are
+    packed into batch bundles holding at most `max_entries_per_bundle` entries and
+    `max_bundle_bytes` bytes of JSON, and up to `max_workers` bundles are posted at
+    once over a shared pool of connections. Entries that fail with a transient
+    status (see `RETRYABLE_ENTRY_STATUSES`) are resubmitted on their own, without
+    the entries of their bundle that succeeded, up to `retry_count` times.
+
+    :param resources: An iterable of FHIR resources or bundle entries. Resources, and
+      entries without a `request` element, are created with a PUT to
+      `[type]/[id]` if they have an ID, and with a POST to `[type]` otherwise.
+    :param cred_manager: The credential manager used to authenticate to the FHIR server.
+    :param fhir_url: The url of the FHIR server to upload to.
+    :param max_entries_per_bundle: The maximum number of entries in each bundle.
+      Default: `500`
+    :param max_bundle_bytes: The maximum size of each bundle's entries, in bytes of
+      JSON. An entry larger than this on its own is posted in a bundle by itself.
+      Default: `4194304` (4 MiB)
+    :param max_workers: The maximum number of bundles to post at once. Default: `4`
+    :param retry_count: The number of times failed entries are resubmitted, and
+      failed requests retried. Default: `3`
+    :param retry_backoff: The number of seconds to wait before resubmitting failed
+      entries the first time, doubling with every further attempt. Default: `1`
+    :raises ValueError: If `max_entries_per_bundle`, `max_bundle_bytes` or
+      `max_workers` is not a positive integer.
+    :return: The result of uploading each resource, in the order the resources were
+      given. A bundle that can't be posted at all (e.g., because its connection
+      failed) doesn't stop the upload; its entries' results hold the error.
+    """
+    for name, value in [
+        ("max_entries_per_bundle", max_entries_per_bundle),
+        ("max_bundle_bytes", max_bundle_bytes),
+        ("max_workers", max_workers),
+    ]:
+        if value is None or value < 1:
+            raise ValueError(f"{name} must be a positive integer")
+
+    # Failed bundles are resubmitted by `_upload_bundle_entries`, so connections
+    # only retry requests that never reached the server
+    retry_strategy = Retry(total=retry_count, read=0, allowed_methods=["POST"])
+    adapter = HTTPAdapter(
+        pool_connections=1, pool_maxsize=max_workers, max_retries=retry_strategy
+    )
+    results = []
+    with requests.Session() as session:
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            # Only a few bundles are packed ahead of the uploads, so the resources
+            # never need to be held in memory all at once
+            pending = set()
+            for bundle_entries in _pack_bundle_entries(
+                resources, max_entries_per_bundle, max_bundle_bytes
+            ):
+                if len(pending) >= 2 * max_workers:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        results.extend(future.result())
+                pending.add(
+                    executor.submit(
+                        _upload_bundle_entries,
+                        session,
+                        bundle_entries,
+                        cred_manager,
+                        fhir_url,
+                        retry_count,
+                        retry_backoff,
+                    )
+                )
+            for future in pending:
+                results.extend(future.result())
+
+    return sorted(results, key=lambda result: result.index)
+
+
 def fhir_server_get(url: str, cred_manager: BaseCredentialManager) -> requests.Response:
     """
     Submits a GET request to a FHIR server given a url and access token for
@@ -187,3 +304,168 @@ def _log_fhir_server_error(status_code: int, batch_entry_index: int = None) -> N
             f"FHIR SERVER ERROR {batch_decorator}- Status code {status_code}"
         )
         logging.error(error_message)
+
+
+def _pack_bundle_entries(
+    resources: Iterable[dict], max_entries: int, max_bytes: int
+) -> Iterable[List[Tuple[int, dict]]]:
+    """
+    Packs resources into the entries of batch bundles, keeping each bundle under
+    the given number of entries and bytes of JSON.
+
+    :param resources: An iterable of FHIR resources or bundle entries.
+    :param max_entries: The maximum number of entries in each bundle.
+    :param max_bytes: The maximum size of each bundle's entries, in bytes of JSON.
+    :return: An iterator of lists, each holding the entries of one bundle along with
+      the index of the resource each entry came from.
+    """
+    bundle_entries = []
+    bundle_bytes = 0
+    for index, resource in enumerate(resources):
+        entry = resource if "resource" in resource else {"resource": resource}
+        if "request" not in entry:
+            resource_type = entry["resource"].get("resourceType")
+            resource_id = entry["resource"].get("id")
+            entry = {
+                **entry,
+                "request": (
+                    {"method": "PUT", "url": f"{resource_type}/{resource_id}"}
+                    if resource_id
+                    else {"method": "POST", "url": resource_type}
+                ),
+            }
+
+        entry_bytes = len(json.dumps(entry).encode("utf-8"))
+        if bundle_entries and (
+            len(bundle_entries) == max_entries or bundle_bytes + entry_bytes > max_bytes
+        ):
+            yield bundle_entries
+            bundle_entries = []
+            bundle_bytes = 0
+        bundle_entries.append((index, entry))
+        bundle_bytes += entry_bytes
+
+    if bundle_entries:
+        yield bundle_entries
+
+
+def _upload_bundle_entries(
+    session: requests.Session,
+    bundle_entries: List[Tuple[int, dict]],
+    cred_manager: BaseCredentialManager,
+    fhir_url: str,
+    retry_count: int,
+    retry_backoff: float,
+) -> List[BundleEntryResult]:
+    """
+    Posts the entries of one batch bundle to the FHIR server, resubmitting the
+    entries that fail with a transient status until they succeed or run out of
+    attempts.
+
+    :param session: The session whose connections are used to post the bundle.
+    :param bundle_entries: The entries of the bundle, along with the index of the
+      resource each entry came from.
+    :param cred_manager: The credential manager used to authenticate to the FHIR server.
+    :param fhir_url: The url of the FHIR server to upload to.
+    :param retry_count: The number of times failed entries are resubmitted.
+    :param retry_backoff: The number of seconds to wait before resubmitting failed
+      entries the first time, doubling with every further attempt.
+    :return: The result of uploading each entry, including those of entries whose
+      bundle couldn't be posted.
+    """
+    results = []
+    attempt = 0
+    while bundle_entries:
+        attempt += 1
+        try:
+            response = _post_bundle(
+                session,
+                {
+                    "resourceType": "Bundle",
+                    "type": "batch",
+                    "entry": [entry for _, entry in bundle_entries],
+                },
+                cred_manager,
+                fhir_url,
+            )
+
+            if response.status_code == 200:
+                response_entries = response.json().get("entry", [])
+                entry_responses = [
+                    response_entries[position].get("response", {})
+                    if position < len(response_entries)
+                    else {}
+                    for position in range(len(bundle_entries))
+                ]
+            else:
+                # The whole bundle failed, so every entry shares the bundle's status
+                entry_responses = [
+                    {"status": str(response.status_code)} for _ in bundle_entries
+                ]
+        except Exception as error:
+            # The bundle couldn't be posted, even after its connection's retries,
+            # so its remaining entries fail without the other bundles' uploads
+            # being abandoned
+            logging.error(
+                f"FHIR SERVER ERROR - Failed to post a bundle of "
+                f"{len(bundle_entries)} entries: {error!r}"
+            )
+            results.extend(
+                BundleEntryResult(index, "", attempt, error=error)
+                for index, _ in bundle_entries
+            )
+            break
+
+        retry_entries = []
+        for (index, entry), entry_response in zip(bundle_entries, entry_responses):
+            status = entry_response.get("status", "")
+            result = BundleEntryResult(index, status, attempt, entry_response)
+            if (
+                not result.succeeded
+                and attempt <= retry_count
+                and status[0:3].isdigit()
+                and int(status[0:3]) in RETRYABLE_ENTRY_STATUSES
+            ):
+                retry_entries.append((index, entry))
+                continue
+
+            if not result.succeeded and status[0:3].isdigit():
+                _log_fhir_server_error(
+                    status_code=int(status[0:3]), batch_entry_index=index
+                )
+            results.append(result)
+
+        bundle_entries = retry_entries
+        if bundle_entries:
+            time.sleep(retry_backoff * 2 ** (attempt - 1))
+
+    return results
+
+
+def _post_bundle(
+    session: requests.Session,
+    bundle: dict,
+    cred_manager: BaseCredentialManager,
+    fhir_url: str,
+) -> requests.Response:
+    """
+    Posts a bundle to the FHIR server, requesting a new access token and posting
+    it again if the server rejects the current one.
+
+    :param session: The session used to post the bundle.
+    :param bundle: The bundle to post.
+    :param cred_manager: The credential manager used to authenticate to the FHIR server.
+    :param fhir_url: The url of the FHIR server to upload to.
+    :return: The response from the FHIR server.
+    """
+    headers = {
+        "Authorization": f"Bearer {cred_manager.get_access_token()}",
+        "Accept": "application/fhir+json",
+        "Content-Type": "application/fhir+json",
+    }
+    response = session.post(url=fhir_url, headers=headers, json=bundle)
+    if response.status_code == 401:
+        access_token = cred_manager.get_access_token(force_refresh=True)
+        headers["Authorization"] = f"Bearer {access_token}"
+        response = session.post(url=fhir_url, headers=headers, json=bundle)
+    return response
@@ -1,10 +1,18 @@
 from phdi.geospatial.core import GeocodeResult, BaseGeocodeClient
 from phdi.geospatial.smarty import SmartyGeocodeClient
 from phdi.geospatial.census import CensusGeocodeClient
+from phdi.geospatial.cache import CachedGeocodeClient, GeocodeCache
+from phdi.geospatial.local import LocalGeocodeClient
+from phdi.geospatial.boundaries import BoundaryIndex, EnrichedGeocodeClient
 
 __all__ = (
     "GeocodeResult",
     "BaseGeocodeClient",
     "SmartyGeocodeClient",
     "CensusGeocodeClient",
+    "CachedGeocodeClient",
+    "GeocodeCache",
+    "LocalGeocodeClient",
+    "BoundaryIndex",
+    "EnrichedGeocodeClient",
 )
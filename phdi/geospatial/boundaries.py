@@ -0,0 +1,493 @@
+import dataclasses
+import json
+import math
+import pathlib
+import struct
+
+from typing import Iterable, Iterator, List, Sequence, Tuple, Union
+
+import numpy as np
+
+from phdi.geospatial.census import _format_census_tract
+from phdi.geospatial.core import BaseGeocodeClient, GeocodeResult
+
+
+# The maximum number of point-edge pairs tested against each other at once when
+# locating a batch of points, which bounds the memory used by a lookup.
+MAX_POINT_EDGE_PAIRS = 1 << 20
+
+# The average number of grid cells per boundary in a `BoundaryIndex` by default.
+DEFAULT_CELLS_PER_BOUNDARY = 4
+
+
+class BoundaryIndex:
+    """
+    A spatial index of census geography boundaries, such as census tracts, block
+    groups or blocks, that locates the boundary containing a point without any
+    network calls. Boundaries are loaded from GeoJSON files or shapefiles, such
+    as the Census Bureau's TIGER/Line or cartographic boundary files, and must
+    use longitude and latitude coordinates, not a projection.
+
+    Each boundary is registered in the cells of a uniform grid that its bounding
+    box overlaps, so only the few boundaries in a point's cell are tested for
+    containment. Points are tested in batches with NumPy, against every edge of
+    a candidate boundary at once.
+
+    Boundaries are identified by their GEOID, from which the county FIPS code,
+    census tract and (for block groups and blocks) block of the geography
+    containing a point are derived.
+    """
+
+    @property
+    def geoids(self) -> List[str]:
+        return self.__geoids
+
+    def __init__(
+        self,
+        boundaries: Iterable[Tuple[str, Sequence[Sequence[Sequence[float]]]]],
+        cell_size: float = None,
+    ):
+        """
+        Creates a new BoundaryIndex object.
+
+        :param boundaries: The boundaries to index, each given as a tuple of its
+          GEOID and its rings, where each ring is a sequence of (longitude,
+          latitude) coordinates. Rings are combined with the even-odd rule, so
+          the rings of holes and of multiple polygons may be given together.
+        :param cell_size: The width and height of the grid's cells, in degrees.
+          If not provided, it's chosen so there are about
+          `DEFAULT_CELLS_PER_BOUNDARY` cells per boundary. Default: `None`
+        :raises ValueError: If no boundaries are given, or `cell_size` is not
+          positive.
+        """
+        self.__geoids = []
+        self.__edges = []
+        bboxes = []
+        for geoid, rings in boundaries:
+            edges = _get_edges(rings)
+            if edges is None:
+                continue
+            self.__geoids.append(geoid)
+            self.__edges.append(edges)
+            xs, ys = edges[:2]
+            bboxes.append((xs.min(), ys.min(), xs.max(), ys.max()))
+
+        if not self.__geoids:
+            raise ValueError("At least one boundary must be given")
+        if cell_size is not None and cell_size <= 0:
+            raise ValueError("cell_size must be positive")
+
+        self.__bboxes = np.array(bboxes)
+        self.__min_x, self.__min_y = self.__bboxes[:, :2].min(axis=0)
+        max_x, max_y = self.__bboxes[:, 2:].max(axis=0)
+        if cell_size is None:
+            area = max(max_x - self.__min_x, 1e-9) * max(max_y - self.__min_y, 1e-9)
+            cell_size = math.sqrt(
+                area / (DEFAULT_CELLS_PER_BOUNDARY * len(self.__geoids))
+            )
+        self.__cell_size = cell_size
+        self.__columns = int((max_x - self.__min_x) // cell_size) + 1
+        self.__rows = int((max_y - self.__min_y) // cell_size) + 1
+
+        # The grid is packed into two arrays: the indexes of the boundaries in
+        # each cell, ordered by cell, and where each cell's boundaries start
+        cells = []
+        cell_boundaries = []
+        for index, (min_x, min_y, max_x, max_y) in enumerate(bboxes):
+            first_column, first_row = self._get_cell(min_x, min_y)
+            last_column, last_row = self._get_cell(max_x, max_y)
+            for row in range(first_row, last_row + 1):
+                for column in range(first_column, last_column + 1):
+                    cells.append(row * self.__columns + column)
+                    cell_boundaries.append(index)
+        cells = np.array(cells, dtype=np.int64)
+        order = np.argsort(cells, kind="stable")
+        self.__cell_boundaries = np.array(cell_boundaries, dtype=np.int64)[order]
+        self.__cell_starts = np.searchsorted(
+            cells[order], np.arange(self.__rows * self.__columns + 1)
+        )
+
+    @classmethod
+    def from_geojson(cls, path: str, geoid_property: str = "GEOID", **kwargs):
+        """
+        Creates a BoundaryIndex of the Polygon and MultiPolygon features of a
+        GeoJSON FeatureCollection.
+
+        :param path: The path of the GeoJSON file.
+        :param geoid_property: The name of the property holding each feature's
+          GEOID. Default: `"GEOID"`
+        :param kwargs: Other arguments to create the BoundaryIndex with.
+        :return: The BoundaryIndex.
+        """
+        with open(path) as fp:
+            features = json.load(fp).get("features", [])
+
+        boundaries = []
+        for feature in features:
+            geometry = feature.get("geometry") or {}
+            if geometry.get("type") == "Polygon":
+                rings = geometry["coordinates"]
+            elif geometry.get("type") == "MultiPolygon":
+                rings = [
+                    ring for polygon in geometry["coordinates"] for ring in polygon
+                ]
+            else:
+                continue
+            geoid = (feature.get("properties") or {}).get(geoid_property)
+            boundaries.append((str(geoid), rings))
+
+        return cls(boundaries, **kwargs)
+
+    @classmethod
+    def from_shapefile(cls, path: str, geoid_field: str = "GEOID", **kwargs):
+        """
+        Creates a BoundaryIndex of the polygons of a shapefile, such as a
+        TIGER/Line file. The shapefile's `.dbf` file must be alongside its `.shp`
+        file.
+
+        :param path: The path of the shapefile's `.shp` file.
+        :param geoid_field: The name of the attribute holding each polygon's
+          GEOID. Default: `"GEOID"`
+        :param kwargs: Other arguments to create the BoundaryIndex with.
+        :return: The BoundaryIndex.
+        """
+        path = pathlib.Path(path)
+        records = _read_dbf(path.with_suffix(".dbf"))
+        boundaries = [
+            (record.get(geoid_field), rings)
+            for record, rings in zip(records, _read_shp_polygons(path))
+            if rings
+        ]
+        return cls(boundaries, **kwargs)
+
+    def locate(self, lat: float, lng: float) -> Union[str, None]:
+        """
+        Finds the boundary containing a point.
+
+        :param lat: The latitude of the point.
+        :param lng: The longitude of the point.
+        :return: The GEOID of the boundary containing the point, or None if no
+          boundary contains it.
+        """
+        return self.locate_many([lat], [lng])[0]
+
+    def locate_many(
+        self, lats: Sequence[float], lngs: Sequence[float]
+    ) -> List[Union[str, None]]:
+        """
+        Finds the boundaries containing a batch of points. Each point is paired
+        with the boundaries in its grid cell, and each boundary is then tested
+        against all of the points paired with it together.
+
+        :param lats: The latitudes of the points.
+        :param lngs: The longitudes of the points, in the same order.
+        :return: A list holding the GEOID of the boundary containing each point,
+          or None if no boundary contains it, in the order of the points.
+        """
+        lats = np.asarray(lats, dtype=float)
+        lngs = np.asarray(lngs, dtype=float)
+        located = np.full(len(lats), -1, dtype=np.int64)
+
+        with np.errstate(invalid="ignore"):
+            columns = np.floor((lngs - self.__min_x) / self.__cell_size)
+            rows = np.floor((lats - self.__min_y) / self.__cell_size)
+        points = np.flatnonzero(
+            (columns >= 0)
+            & (columns < self.__columns)
+            & (rows >= 0)
+            & (rows < self.__rows)
+        )
+        cells = (rows[points] * self.__columns + columns[points]).astype(np.int64)
+
+        # Pair each point with each boundary in its cell whose bounding box
+        # contains it
+        starts = self.__cell_starts[cells]
+        counts = self.__cell_starts[cells + 1] - starts
+        offsets = np.arange(counts.sum()) - np.repeat(
+            np.cumsum(counts) - counts, counts
+        )
+        pair_points = np.repeat(points, counts)
+        pair_boundaries = self.__cell_boundaries[np.repeat(starts, counts) + offsets]
+        bboxes = self.__bboxes[pair_boundaries]
+        in_bbox = (
+            (lngs[pair_points] >= bboxes[:, 0])
+            & (lats[pair_points] >= bboxes[:, 1])
+            & (lngs[pair_points] <= bboxes[:, 2])
+            & (lats[pair_points] <= bboxes[:, 3])
+        )
+        pair_points = pair_points[in_bbox]
+        pair_boundaries = pair_boundaries[in_bbox]
+
+        # Test each boundary against all of its points at once
+        order = np.argsort(pair_boundaries, kind="stable")
+        pair_points = pair_points[order]
+        pair_boundaries = pair_boundaries[order]
+        group_starts = np.flatnonzero(
+            np.r_[len(pair_boundaries) > 0, pair_boundaries[1:] != pair_boundaries[:-1]]
+        )
+        group_ends = np.r_[group_starts[1:], len(pair_boundaries)]
+        for start, end in zip(group_starts, group_ends):
+            index = pair_boundaries[start]
+            group = pair_points[start:end]
+            inside = _contains(self.__edges[index], lngs[group], lats[group])
+            located[group[inside]] = index
+
+        return [self.__geoids[index] if index >= 0 else None for index in located]
+
+    def enrich(self, result: Union[GeocodeResult, None]) -> Union[GeocodeResult, None]:
+        """
+        Fills in the census geography of a geocoding result from the boundary
+        containing its coordinates. See `enrich_many` for details.
+
+        :param result: The geocoding result, or None.
+        :return: A copy of the result with its census geography filled in, or the
+          result itself if no boundary contains it.
+        """
+        return self.enrich_many([result])[0]
+
+    def enrich_many(
+        self, results: Iterable[Union[GeocodeResult, None]]
+    ) -> List[Union[GeocodeResult, None]]:
+        """
+        Fills in the census geography of a batch of geocoding results from the
+        boundaries containing their coordinates, which are located together.
+        The `geoid`, `census_tract`, `census_block` and `county_fips` fields of
+        each result are filled in if they're empty, with the block being the
+        block group's digit when the boundaries are block groups. Results are
+        copied rather than modified, so results held elsewhere (e.g., in a
+        cache) aren't changed.
+
+        :param results: The geocoding results, any of which may be None.
+        :return: A list of the results with their census geography filled in,
+          in the order of the results.
+        """
+        results = list(results)
+        located = [
+            index
+            for index, result in enumerate(results)
+            if result is not None and result.lat is not None and result.lng is not None
+        ]
+        geoids = self.locate_many(
+            [results[index].lat for index in located],
+            [results[index].lng for index in located],
+        )
+
+        for index, geoid in zip(located, geoids):
+            if geoid is None:
+                continue
+            result = results[index]
+            results[index] = dataclasses.replace(
+                result,
+                geoid=result.geoid or geoid,
+                census_tract=result.census_tract
+                or (_format_census_tract(geoid[5:11]) if len(geoid) >= 11 else None),
+                census_block=result.census_block or geoid[11:] or None,
+                county_fips=result.county_fips or geoid[:5],
+            )
+
+        return results
+
+    def _get_cell(self, lng: float, lat: float) -> Tuple[int, int]:
+        """
+        Gets the grid cell containing a point.
+
+        :param lng: The longitude of the point.
+        :param lat: The latitude of the point.
+        :return: A tuple of the cell's column and row.
+        """
+        return (
+            min(int((lng - self.__min_x) // self.__cell_size), self.__columns - 1),
+            min(int((lat - self.__min_y) // self.__cell_size), self.__rows - 1),
+        )
+
+
+class EnrichedGeocodeClient(BaseGeocodeClient):
+    """
+    A geocoding client that wraps another `BaseGeocodeClient`, filling in the
+    census geography of its results from a `BoundaryIndex`, e.g. so results from
+    a vendor that doesn't return census tracts have them.
+    """
+
+    @property
+    def client(self) -> BaseGeocodeClient:
+        return self.__client
+
+    @property
+    def boundaries(self) -> BoundaryIndex:
+        return self.__boundaries
+
+    def __init__(self, client: BaseGeocodeClient, boundaries: BoundaryIndex):
+        """
+        Creates a new EnrichedGeocodeClient object.
+
+        :param client: The geocoding client to wrap.
+        :param boundaries: The boundaries to locate results in.
+        """
+        self.__client = client
+        self.__boundaries = boundaries
+
+    def geocode_from_str(self, address: str) -> Union[GeocodeResult, None]:
+        """
+        Geocodes the provided address, which is formatted as a string, and fills
+        in its census geography. See the wrapped client's `geocode_from_str` for
+        details.
+
+        :param address: The address to geocode, given as a string.
+        :return: A geocoded address (if valid result) or None (if no valid result).
+        """
+        return self.__boundaries.enrich(self.__client.geocode_from_str(address))
+
+    def geocode_from_dict(self, address: dict) -> Union[GeocodeResult, None]:
+        """
+        Geocodes the provided address, which is formatted as a dictionary, and
+        fills in its census geography. See the wrapped client's
+        `geocode_from_dict` for details.
+
+        :param address: A dictionary of address fields.
+        :return: A geocoded address (if valid result) or None (if no valid result).
+        """
+        return self.__boundaries.enrich(self.__client.geocode_from_dict(address))
+
+    def geocode_many(
+        self, addresses: Iterable[Union[str, dict]]
+    ) -> List[Union[GeocodeResult, None]]:
+        """
+        Geocodes any number of addresses with the wrapped client's `geocode_many`,
+        and fills in the census geography of the results together.
+
+        :param addresses: The addresses to geocode.
+        :return: A list holding a geocoded address (if valid result) or None (if no
+          valid result) for each address, in the order of the addresses.
+        """
+        return self.__boundaries.enrich_many(self.__client.geocode_many(addresses))
+
+
+def _get_edges(
+    rings: Sequence[Sequence[Sequence[float]]],
+) -> Union[Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray], None]:
+    """
+    Gets the edges of a boundary's rings, as arrays of the coordinates of their
+    start and end points.
+
+    :param rings: The boundary's rings, each a sequence of (longitude, latitude)
+      coordinates, which may or may not repeat the first point at the end.
+    :return: A tuple of the edges' start longitudes, start latitudes, end
+      longitudes and end latitudes, or None if the rings have no edges.
+    """
+    starts = []
+    ends = []
+    for ring in rings:
+        points = np.asarray(ring, dtype=float)[:, :2]
+        if len(points) < 3:
+            continue
+        starts.append(points)
+        ends.append(np.roll(points, -1, axis=0))
+    if not starts:
+        return None
+
+    starts = np.concatenate(starts)
+    ends = np.concatenate(ends)
+    return starts[:, 0], starts[:, 1], ends[:, 0], ends[:, 1]
+
+
+def _contains(
+    edges: Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray],
+    lngs: np.ndarray,
+    lats: np.ndarray,
+) -> np.ndarray:
+    """
+    Tests which points a boundary contains, by casting a ray east from each
+    point and counting the edges it crosses; points whose rays cross an odd
+    number of edges are inside. Points are tested against every edge at once,
+    in chunks of up to `MAX_POINT_EDGE_PAIRS` point-edge pairs.
+
+    :param edges: The boundary's edges, as returned by `_get_edges`.
+    :param lngs: The longitudes of the points.
+    :param lats: The latitudes of the points.
+    :return: An array of whether the boundary contains each point.
+    """
+    x1, y1, x2, y2 = edges
+    chunk_size = max(1, MAX_POINT_EDGE_PAIRS // len(x1))
+    inside = np.empty(len(lngs), dtype=bool)
+    for start in range(0, len(lngs), chunk_size):
+        px = lngs[start : start + chunk_size, None]
+        py = lats[start : start + chunk_size, None]
+        crosses = (y1 > py) != (y2 > py)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            crossing_x = x1 + (py - y1) * (x2 - x1) / (y2 - y1)
+        inside[start : start + chunk_size] = (
+            np.count_nonzero(crosses & (px < crossing_x), axis=1) % 2 == 1
+        )
+    return inside
+
+
+# The shapefile shape types holding polygons, with and without Z and M values.
+_SHP_POLYGON_TYPES = (5, 15, 25)
+
+
+def _read_shp_polygons(path: pathlib.Path) -> Iterator[List[np.ndarray]]:
+    """
+    Reads the polygons of a shapefile's `.shp` file, following the ESRI
+    Shapefile Technical Description.
+
+    :param path: The path of the `.shp` file.
+    :return: An iterator of the rings of each record's polygon, in record order,
+      with an empty list for records that aren't polygons.
+    """
+    with open(path, "rb") as fp:
+        fp.seek(100)
+        while True:
+            header = fp.read(8)
+            if len(header) < 8:
+                return
+            _, content_length = struct.unpack(">2i", header)
+            content = fp.read(content_length * 2)
+            (shape_type,) = struct.unpack("<i", content[:4])
+            if shape_type not in _SHP_POLYGON_TYPES:
+                yield []
+                continue
+
+            part_count, point_count = struct.unpack("<2i", content[36:44])
+            parts = struct.unpack(f"<{part_count}i", content[44 : 44 + 4 * part_count])
+            offset = 44 + 4 * part_count
+            points = np.frombuffer(
+                content, dtype="<f8", count=2 * point_count, offset=offset
+            ).reshape(-1, 2)
+            yield [
+                points[start:end]
+                for start, end in zip(parts, list(parts[1:]) + [point_count])
+            ]
+
+
+def _read_dbf(path: pathlib.Path) -> Iterator[dict]:
+    """
+    Reads the attributes of the records of a shapefile's dBASE `.dbf` file, as
+    strings.
+
+    :param path: The path of the `.dbf` file.
+    :return: An iterator of the attributes of each record, in record order.
+    """
+    with open(path, "rb") as fp:
+        header = fp.read(32)
+        record_count, header_length, record_length = struct.unpack("<IHH", header[4:12])
+        descriptors = fp.read(header_length - 32)
+        fields = []
+        for start in range(0, len(descriptors) - 1, 32):
+            descriptor = descriptors[start : start + 32]
+            if descriptor[0] == 0x0D:
+                break
+            name = descriptor[:11].split(b"\x00")[0].decode("latin-1")
+            fields.append((name, descriptor[16]))
+
+        for _ in range(record_count):
+            record = fp.read(record_length)
+            values = {}
+            offset = 1
+            for name, length in fields:
+                values[name] = (
+                    record[offset : offset + length]
+                    .decode("utf-8", errors="replace")
+                    .strip()
+                )
+                offset += length
+            yield values
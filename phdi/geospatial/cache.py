@@ -0,0 +1,378 @@
+import json
+import re
+import sqlite3 as sql
+import threading
+import time
+
+from collections import OrderedDict
+from dataclasses import astuple
+from typing import Iterable, List, Union
+
+from phdi.geospatial.core import BaseGeocodeClient, GeocodeResult
+
+
+# The number of geocoding results a `GeocodeCache` holds in memory by default.
+DEFAULT_GEOCODE_CACHE_SIZE = 10000
+
+# Marks a cache miss, as opposed to a cached `None` (i.e., negative) result.
+_MISSING = object()
+
+
+class GeocodeCache:
+    """
+    A cache of geocoding results, keyed by normalized address. The most recently
+    used results are held in an in-memory LRU cache of up to `max_size` results,
+    and, if a `path` is given, every result is also written to a SQLite database
+    on disk, so results persist between runs and can be shared between processes.
+    Addresses that could not be geocoded are cached too, so they aren't looked up
+    again. Results expire `ttl` seconds after they were cached, if a `ttl` is
+    given. A cache may be shared between threads.
+    """
+
+    # Returned by `get` when no result is cached for an address
+    MISSING = _MISSING
+
+    @property
+    def max_size(self) -> int:
+        return self.__max_size
+
+    @property
+    def path(self) -> Union[str, None]:
+        return self.__path
+
+    @property
+    def ttl(self) -> Union[float, None]:
+        return self.__ttl
+
+    def __init__(
+        self,
+        max_size: int = DEFAULT_GEOCODE_CACHE_SIZE,
+        path: str = None,
+        ttl: float = None,
+    ):
+        """
+        Creates a new GeocodeCache object.
+
+        :param max_size: The maximum number of results held in memory.
+          Default: `DEFAULT_GEOCODE_CACHE_SIZE`
+        :param path: The path of a SQLite database to persist results to. If the
+          database already exists, the results previously cached in it are used.
+          If not provided, results are only held in memory. Default: `None`
+        :param ttl: The number of seconds a result is cached for. If not
+          provided, results never expire. Default: `None`
+        :raises ValueError: If `max_size` is not a positive integer, or `ttl` is
+          not positive.
+        """
+        if max_size is None or max_size < 1:
+            raise ValueError("max_size must be a positive integer")
+        if ttl is not None and ttl <= 0:
+            raise ValueError("ttl must be positive")
+
+        self.__max_size = max_size
+        self.__path = path
+        self.__ttl = ttl
+        self.__results = OrderedDict()
+        self.__lock = threading.Lock()
+
+        self.__connection = None
+        if path is not None:
+            self.__connection = sql.connect(path, check_same_thread=False)
+            with self.__connection:
+                self.__connection.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS geocode_results (
+                        key TEXT PRIMARY KEY,
+                        result TEXT NOT NULL,
+                        expires_at REAL
+                    );
+                    """
+                )
+
+    def get(self, key: str) -> Union[GeocodeResult, None, object]:
+        """
+        Looks up the cached result for a normalized address.
+
+        :param key: The normalized address, as returned by `normalize_address`.
+        :return: The cached result, which is `None` if the address could not be
+          geocoded, or `GeocodeCache.MISSING` if no unexpired result is cached.
+        """
+        now = time.time()
+        with self.__lock:
+            if key in self.__results:
+                result, expires_at = self.__results[key]
+                if expires_at is None or expires_at > now:
+                    self.__results.move_to_end(key)
+                    return result
+                del self.__results[key]
+
+            if self.__connection is None:
+                return _MISSING
+
+            row = self.__connection.execute(
+                "SELECT result, expires_at FROM geocode_results WHERE key = ?;",
+                (key,),
+            ).fetchone()
+            if row is None or (row[1] is not None and row[1] <= now):
+                return _MISSING
+
+            result = _deserialize_result(row[0])
+            self._remember(key, result, row[1])
+            return result
+
+    def put(self, key: str, result: Union[GeocodeResult, None]) -> None:
+        """
+        Caches the result for a normalized address.
+
+        :param key: The normalized address, as returned by `normalize_address`.
+        :param result: The result of geocoding the address, which is `None` if it
+          could not be geocoded.
+        """
+        expires_at = None if self.__ttl is None else time.time() + self.__ttl
+        with self.__lock:
+            self._remember(key, result, expires_at)
+            if self.__connection is not None:
+                with self.__connection:
+                    self.__connection.execute(
+                        "INSERT OR REPLACE INTO geocode_results VALUES (?, ?, ?);",
+                        (key, _serialize_result(result), expires_at),
+                    )
+
+    def clear(self) -> None:
+        """
+        Removes every result from the cache, including those persisted to disk.
+        """
+        with self.__lock:
+            self.__results.clear()
+            if self.__connection is not None:
+                with self.__connection:
+                    self.__connection.execute("DELETE FROM geocode_results;")
+
+    def close(self) -> None:
+        """
+        Closes the cache's database, if it has one.
+        """
+        if self.__connection is not None:
+            self.__connection.close()
+
+    def _remember(
+        self, key: str, result: Union[GeocodeResult, None], expires_at: float
+    ) -> None:
+        """
+        Holds a result in memory, evicting the least recently used result if the
+        cache is full. Must be called with the cache's lock held.
+
+        :param key: The normalized address.
+        :param result: The result of geocoding the address.
+        :param expires_at: The time the result expires at, or `None` if it never
+          expires.
+        """
+        self.__results[key] = (result, expires_at)
+        self.__results.move_to_end(key)
+        if len(self.__results) > self.__max_size:
+            self.__results.popitem(last=False)
+
+
+class CachedGeocodeClient(BaseGeocodeClient):
+    """
+    A geocoding client that wraps another `BaseGeocodeClient`, only calling it to
+    geocode addresses whose results aren't already in a `GeocodeCache`. Results
+    are cached under the name of the wrapped client's class as well as the
+    address, so a cache may be shared between clients of different vendors.
+    """
+
+    @property
+    def client(self) -> BaseGeocodeClient:
+        return self.__client
+
+    @property
+    def cache(self) -> GeocodeCache:
+        return self.__cache
+
+    def __init__(self, client: BaseGeocodeClient, cache: GeocodeCache = None):
+        """
+        Creates a new CachedGeocodeClient object.
+
+        :param client: The geocoding client to wrap.
+        :param cache: The cache to store results in. If not provided, a new
+          in-memory cache is used. Default: `None`
+        """
+        self.__client = client
+        self.__cache = cache if cache is not None else GeocodeCache()
+
+    def geocode_from_str(self, address: str) -> Union[GeocodeResult, None]:
+        """
+        Geocodes the provided address, which is formatted as a string, using the
+        cached result if there is one. See the wrapped client's
+        `geocode_from_str` for details.
+
+        :param address: The address to geocode, given as a string.
+        :return: A geocoded address (if valid result) or None (if no valid result).
+        """
+        return self._geocode(address, self.__client.geocode_from_str)
+
+    def geocode_from_dict(self, address: dict) -> Union[GeocodeResult, None]:
+        """
+        Geocodes the provided address, which is formatted as a dictionary, using
+        the cached result if there is one. See the wrapped client's
+        `geocode_from_dict` for details.
+
+        :param address: A dictionary of address fields.
+        :return: A geocoded address (if valid result) or None (if no valid result).
+        """
+        return self._geocode(address, self.__client.geocode_from_dict)
+
+    def geocode_many(
+        self, addresses: Iterable[Union[str, dict]]
+    ) -> List[Union[GeocodeResult, None]]:
+        """
+        Geocodes any number of addresses, using the cached results of those that
+        have them. The remaining distinct addresses are geocoded together with the
+        wrapped client's `geocode_many`, so a client that geocodes in batches
+        still does.
+
+        :param addresses: The addresses to geocode.
+        :return: A list holding a geocoded address (if valid result) or None (if no
+          valid result) for each address, in the order of the addresses.
+        """
+        keys = []
+        results = {}
+        uncached_addresses = {}
+        for address in addresses:
+            key = self._get_key(address)
+            keys.append(key)
+            if key in results or key in uncached_addresses:
+                continue
+            result = self.__cache.get(key)
+            if result is GeocodeCache.MISSING:
+                uncached_addresses[key] = address
+            else:
+                results[key] = result
+
+        if uncached_addresses:
+            geocoded = self.__client.geocode_many(list(uncached_addresses.values()))
+            for key, result in zip(uncached_addresses, geocoded):
+                self.__cache.put(key, result)
+                results[key] = result
+
+        return [results[key] for key in keys]
+
+    def _geocode(
+        self, address: Union[str, dict], geocode
+    ) -> Union[GeocodeResult, None]:
+        """
+        Looks up the cached result for an address, geocoding and caching it if
+        there is none. Errors raised while geocoding aren't cached.
+
+        :param address: The address to geocode.
+        :param geocode: The wrapped client's method to geocode the address with.
+        :return: A geocoded address (if valid result) or None (if no valid result).
+        """
+        key = self._get_key(address)
+        result = self.__cache.get(key)
+        if result is GeocodeCache.MISSING:
+            result = geocode(address)
+            self.__cache.put(key, result)
+        return result
+
+    def _get_key(self, address: Union[str, dict]) -> str:
+        """
+        Gets the key an address's result is cached under.
+
+        :param address: The address.
+        :return: The cache key.
+        """
+        return f"{type(self.__client).__name__}:{normalize_address(address)}"
+
+
+# The canonical fields of an address dictionary that identify the address, in
+# the order they appear in its normalized form.
+_ADDRESS_FIELDS = (
+    "street",
+    "street2",
+    "apartment",
+    "city",
+    "state",
+    "postal_code",
+    "urbanization",
+    "development",
+)
+
+
+def normalize_address(address: Union[str, dict]) -> str:
+    """
+    Normalizes an address, so that trivially different ways of writing the same
+    address (e.g., differing in case, whitespace or punctuation) map to the same
+    cache key. Addresses given as strings and as dictionaries are normalized
+    differently, as vendors may geocode them differently.
+
+    :param address: The address, given as a string or dictionary.
+    :return: The normalized address.
+    """
+    if isinstance(address, str):
+        return f"str:{_normalize_text(address)}"
+    fields = _get_address_fields(address)
+    return "dict:" + "|".join(
+        _normalize_text(str(fields[field])) for field in _ADDRESS_FIELDS
+    )
+
+
+def _get_address_fields(address: dict) -> dict:
+    """
+    Gets the fields identifying an address given as a dictionary, which may be
+    FHIR-formatted, under their canonical names in `_ADDRESS_FIELDS`. The street
+    is taken from `street`, or else the joined `line`s of a FHIR address, and the
+    postal code from `zip`, `postal_code` or `postalCode`.
+
+    :param address: The address, given as a dictionary.
+    :return: A dictionary holding every field in `_ADDRESS_FIELDS`, which is an
+      empty string if the address doesn't have it.
+    """
+    fields = {field: address.get(field) or "" for field in _ADDRESS_FIELDS}
+    fields["street"] = address.get("street") or " ".join(address.get("line") or [])
+    fields["postal_code"] = (
+        address.get("zip")
+        or address.get("postal_code")
+        or address.get("postalCode")
+        or ""
+    )
+    return fields
+
+
+def _normalize_text(text: str) -> str:
+    """
+    Normalizes the text of an address, upper-casing it, dropping punctuation and
+    collapsing whitespace.
+
+    :param text: The text to normalize.
+    :return: The normalized text.
+    """
+    return " ".join(re.sub(r"[^\w\s#-]", " ", text.upper()).split())
+
+
+def _serialize_result(result: Union[GeocodeResult, None]) -> str:
+    """
+    Serializes a geocoding result compactly, as a JSON array of its field values
+    in order, without trailing empty optional fields.
+
+    :param result: The geocoding result, or `None`.
+    :return: The serialized result.
+    """
+    if result is None:
+        return "null"
+    values = list(astuple(result))
+    while values and values[-1] is None:
+        values.pop()
+    return json.dumps(values, separators=(",", ":"))
+
+
+def _deserialize_result(serialized: str) -> Union[GeocodeResult, None]:
+    """
+    Deserializes a geocoding result serialized with `_serialize_result`.
+
+    :param serialized: The serialized result.
+    :return: The geocoding result, or `None`.
+    """
+    values = json.loads(serialized)
+    if values is None:
+        return None
+    return GeocodeResult(*values)
@@ -1,8 +1,19 @@
-from typing import Union, Literal
+import csv
+import io
+from typing import Dict, Iterable, List, Union, Literal
 
+from phdi.geospatial.cache import _get_address_fields
 from phdi.geospatial.core import BaseGeocodeClient, GeocodeResult
 from phdi.transport import http_request_with_retry
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3 import Retry
+
+
+# The Census geocoder's batch endpoint, and the maximum number of addresses it
+# accepts in one request.
+CENSUS_BATCH_URL = "https://geocoding.geo.census.gov/geocoder/geographies/addressbatch"
+CENSUS_MAX_BATCH_SIZE = 10000
 
 
 class CensusGeocodeClient(BaseGeocodeClient):
@@ -10,8 +21,26 @@ class CensusGeocodeClient(BaseGeocodeClient):
     Implementation of a geocoding client using the Census API.
     """
 
-    def __init__(self):
+    def __init__(
+        self, batch_url: str = CENSUS_BATCH_URL, batch_size: int = CENSUS_MAX_BATCH_SIZE
+    ):
+        """
+        Creates a new CensusGeocodeClient object.
+
+        :param batch_url: The URL of the Census geocoder's batch endpoint, used by
+          `geocode_many`. Default: `CENSUS_BATCH_URL`
+        :param batch_size: The maximum number of addresses sent in one request to
+          the batch endpoint. Default: `CENSUS_MAX_BATCH_SIZE`
+        :raises ValueError: If `batch_size` is not between 1 and
+          `CENSUS_MAX_BATCH_SIZE`.
+        """
+        if batch_size is None or not 1 <= batch_size <= CENSUS_MAX_BATCH_SIZE:
+            raise ValueError(
+                f"batch_size must be between 1 and {CENSUS_MAX_BATCH_SIZE}"
+            )
         self.__client = ()
+        self.__batch_url = batch_url
+        self.__batch_size = batch_size
 
     def geocode_from_str(self, address: str) -> Union[GeocodeResult, None]:
         """
@@ -74,6 +103,183 @@ class CensusGeocodeClient(BaseGeocodeClient):
 
         return self._parse_census_result(response)
 
+    def geocode_many(
+        self, addresses: Iterable[Union[str, dict]]
+    ) -> List[Union[GeocodeResult, None]]:
+        """
+        Geocodes any number of addresses with the Census geocoder's batch
+        endpoint, which geocodes up to 10,000 addresses in one request. Addresses
+        may be given as dictionaries (see `geocode_from_dict`), including
+        FHIR-formatted addresses, or as strings. The batch endpoint needs the
+        fields of an address separately, so addresses given as strings, as well as
+        those the batch endpoint could not match, are geocoded one at a time
+        instead.
+
+        The batch endpoint doesn't return county names, so results it matched have
+        no `county_name`.
+
+        :param addresses: The addresses to geocode.
+        :raises ValueError: If an address does not include street number and name.
+        :raises requests.HTTPError: If the batch endpoint returns an unexpected
+          status code.
+        :return: A list holding a geocoded address (if valid result) or None (if no
+          valid result) for each address, in the order of the addresses.
+        """
+        addresses = [
+            address if isinstance(address, str) else self._to_address_dict(address)
+            for address in addresses
+        ]
+        for address in addresses:
+            street = address if isinstance(address, str) else address["street"]
+            if street == "":
+                raise ValueError(
+                    "Address must include street number and name at a minimum"
+                )
+
+        results = [None] * len(addresses)
+        unmatched = [
+            index for index, address in enumerate(addresses) if isinstance(address, str)
+        ]
+        batch = [
+            index
+            for index, address in enumerate(addresses)
+            if not isinstance(address, str)
+        ]
+
+        for start in range(0, len(batch), self.__batch_size):
+            indexes = batch[start : start + self.__batch_size]
+            matched = self._call_census_batch_api(
+                [addresses[index] for index in indexes]
+            )
+            for row_id, index in enumerate(indexes):
+                if row_id in matched:
+                    results[index] = matched[row_id]
+                else:
+                    unmatched.append(index)
+
+        # Fall back to geocoding the remaining addresses one at a time
+        for index in sorted(unmatched):
+            address = addresses[index]
+            if isinstance(address, str):
+                results[index] = self.geocode_from_str(address)
+            else:
+                results[index] = self.geocode_from_dict(address)
+
+        return results
+
+    @staticmethod
+    def _to_address_dict(address: dict) -> dict:
+        """
+        Gets the fields of an address given as a dictionary, which may be
+        FHIR-formatted, that the Census geocoder uses.
+
+        :param address: The address, given as a dictionary.
+        :return: A dictionary holding the `street`, `city`, `state` and `zip` of
+          the address.
+        """
+        fields = _get_address_fields(address)
+        return {
+            "street": fields["street"],
+            "city": fields["city"],
+            "state": fields["state"],
+            "zip": fields["postal_code"],
+        }
+
+    def _call_census_batch_api(self, addresses: List[dict]) -> Dict[int, GeocodeResult]:
+        """
+        Geocodes a batch of addresses with the Census geocoder's batch endpoint,
+        posting them as a CSV file and parsing the CSV file of results as it's
+        streamed back.
+
+        :param addresses: A list of addresses, as returned by `_to_address_dict`.
+        :raises requests.HTTPError: If an unexpected status code is returned.
+        :return: A dictionary of the results of the matched addresses, keyed by
+          the index of the address in `addresses`.
+        """
+        address_file = io.StringIO()
+        writer = csv.writer(address_file)
+        for row_id, address in enumerate(addresses):
+            writer.writerow(
+                [
+                    row_id,
+                    address["street"],
+                    address["city"],
+                    address["state"],
+                    address["zip"],
+                ]
+            )
+
+        retry_strategy = Retry(
+            total=5,
+            status_forcelist=[429, 500, 502, 503, 504],
+            allowed_methods=["POST"],
+        )
+        with requests.Session() as session:
+            session.mount("http://", HTTPAdapter(max_retries=retry_strategy))
+            session.mount("https://", HTTPAdapter(max_retries=retry_strategy))
+            response = session.post(
+                self.__batch_url,
+                files={
+                    "addressFile": (
+                        "addresses.csv",
+                        address_file.getvalue(),
+                        "text/csv",
+                    )
+                },
+                data={
+                    "benchmark": "Public_AR_Census2020",
+                    "vintage": "Census2020_Census2020",
+                },
+                stream=True,
+            )
+
+            with response:
+                if response.status_code != 200:
+                    raise requests.HTTPError(response=response)
+
+                response.encoding = response.encoding or "utf-8"
+                results = {}
+                for row in csv.reader(response.iter_lines(decode_unicode=True)):
+                    result = self._parse_census_batch_row(row)
+                    if result is not None:
+                        results[int(row[0])] = result
+                return results
+
+    @staticmethod
+    def _parse_census_batch_row(row: List[str]) -> Union[GeocodeResult, None]:
+        """
+        Parses a row of the results of the Census geocoder's batch endpoint into
+        our standardized GeocodeResult class. Rows have the columns: ID, input
+        address, match indicator, match type, matched address, coordinates, TIGER
+        line ID, side, state FIPS code, county FIPS code, tract and block.
+
+        :param row: The columns of the row.
+        :return: A parsed and standardized address enriched with lat, lon, census
+          tract, and more. Returns None if the address wasn't matched.
+        """
+        if len(row) < 12 or row[2] != "Match":
+            return None
+
+        matched_address = [part.strip() for part in row[4].rsplit(",", 3)]
+        if len(matched_address) != 4:
+            return None
+        street, city, state, postal_code = matched_address
+        lng, lat = row[5].split(",")
+        state_fips, county_fips, tract, block = row[8:12]
+
+        return GeocodeResult(
+            line=[street],
+            city=city,
+            state=state,
+            postal_code=postal_code,
+            county_fips=state_fips + county_fips,
+            lat=float(lat),
+            lng=float(lng),
+            geoid=state_fips + county_fips + tract + block,
+            census_tract=_format_census_tract(tract),
+            census_block=block,
+        )
+
     @staticmethod
     def _format_address(
         address: Union[str, dict], searchtype: Literal["onelineaddress", "address"]
@@ -217,3 +423,20 @@ class CensusGeocodeClient(BaseGeocodeClient):
                 census_tract=tractComponents.get("BASENAME", ""),
                 census_block=blockComponents.get("BASENAME", ""),
             )
+
+
+def _format_census_tract(tract: str) -> str:
+    """
+    Formats a six-digit census tract code as the tract's name, as returned by the
+    Census geocoder's single address endpoints, e.g. "005900" as "59" and "215101"
+    as "2151.01".
+
+    :param tract: The six-digit census tract code.
+    :return: The name of the census tract.
+    """
+    if len(tract) != 6 or not tract.isdigit():
+        return tract
+    name = str(int(tract[:4]))
+    if tract[4:] != "00":
+        name += f".{tract[4:]}"
+    return name
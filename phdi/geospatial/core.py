@@ -1,4 +1,4 @@
-from typing import List, Optional, Union
+from typing import Iterable, List, Optional, Union
 from dataclasses import dataclass
 from abc import ABC, abstractmethod
 
@@ -72,3 +72,23 @@ class BaseGeocodeClient(ABC):
         :return: A geocoded address (if valid result) or None (if no valid result).
         """
         pass  # pragma: no cover
+
+    def geocode_many(
+        self, addresses: Iterable[Union[str, dict]]
+    ) -> List[Union[GeocodeResult, None]]:
+        """
+        Geocodes any number of addresses, each formatted as either a string or a
+        dictionary (see `geocode_from_str` and `geocode_from_dict`). By default,
+        each address is geocoded in turn; implementing classes may override this
+        to geocode addresses in batches with their vendor's API.
+
+        :param addresses: The addresses to geocode.
+        :return: A list holding a geocoded address (if valid result) or None (if no
+          valid result) for each address, in the order of the addresses.
+        """
+        return [
+            self.geocode_from_str(address)
+            if isinstance(address, str)
+            else self.geocode_from_dict(address)
+            for address in addresses
+        ]
@@ -0,0 +1,337 @@
+import csv
+import re
+import sqlite3 as sql
+import threading
+
+from typing import Dict, Iterable, Union
+
+from phdi.geospatial.core import BaseGeocodeClient, GeocodeResult
+
+
+# The fields of an address point, in the order they're stored in an index.
+ADDRESS_POINT_FIELDS = (
+    "number",
+    "street",
+    "city",
+    "state",
+    "postal_code",
+    "lat",
+    "lng",
+    "county_fips",
+    "county_name",
+    "census_tract",
+    "census_block",
+    "geoid",
+)
+
+# Standard USPS abbreviations for common street suffixes, directions and
+# secondary unit designators, so that e.g. "123 North Main Street" and
+# "123 N Main St" are normalized the same way.
+STREET_ABBREVIATIONS = {
+    "ALLEY": "ALY",
+    "AVENUE": "AVE",
+    "BOULEVARD": "BLVD",
+    "CIRCLE": "CIR",
+    "COURT": "CT",
+    "DRIVE": "DR",
+    "EXPRESSWAY": "EXPY",
+    "HIGHWAY": "HWY",
+    "LANE": "LN",
+    "PARKWAY": "PKWY",
+    "PLACE": "PL",
+    "ROAD": "RD",
+    "SQUARE": "SQ",
+    "STREET": "ST",
+    "TERRACE": "TER",
+    "TRAIL": "TRL",
+    "NORTH": "N",
+    "SOUTH": "S",
+    "EAST": "E",
+    "WEST": "W",
+    "NORTHEAST": "NE",
+    "NORTHWEST": "NW",
+    "SOUTHEAST": "SE",
+    "SOUTHWEST": "SW",
+    "APARTMENT": "APT",
+    "SUITE": "STE",
+}
+
+
+class LocalGeocodeClient(BaseGeocodeClient):
+    """
+    Implementation of a geocoding client that geocodes addresses offline, using a
+    local index of address points, such as an extract of a state or county
+    address point file. The index is a SQLite database keyed by postal code, house
+    number and normalized street, built once with `build_index`, so each lookup is
+    a single indexed query.
+
+    Addresses are matched to address points at the building level, ignoring any
+    apartment or unit. Addresses without a match are passed on to a `fallback`
+    client, if one is given, so the local index can serve as a first tier in
+    front of a remote geocoding service.
+    """
+
+    @property
+    def path(self) -> str:
+        return self.__path
+
+    @property
+    def fallback(self) -> Union[BaseGeocodeClient, None]:
+        return self.__fallback
+
+    def __init__(self, path: str, fallback: BaseGeocodeClient = None):
+        """
+        Creates a new LocalGeocodeClient object.
+
+        :param path: The path of an index built with `build_index`.
+        :param fallback: A client to geocode addresses that aren't in the index.
+          If not provided, addresses that aren't in the index aren't geocoded.
+          Default: `None`
+        """
+        self.__path = path
+        self.__fallback = fallback
+        self.__connection = sql.connect(
+            f"file:{path}?mode=ro", uri=True, check_same_thread=False
+        )
+        self.__lock = threading.Lock()
+
+    def geocode_from_str(self, address: str) -> Union[GeocodeResult, None]:
+        """
+        Geocodes the provided address, which is formatted as a string. The string
+        must end with the address's postal code, as in
+        "123 Main St Springfield, IL 62701".
+
+        :param address: The address to geocode, given as a string.
+        :raises ValueError: If address does not include street number and name.
+        :return: A geocoded address (if valid result) or None (if no valid result).
+        """
+        if address == "":
+            raise ValueError("Address must include street number and name at a minimum")
+
+        result = None
+        match = re.search(r"(\d{5})(?:-\d{4})?\s*$", address)
+        if match is not None:
+            result = self._lookup(
+                _normalize_street(address[: match.start()]), postal_code=match[1]
+            )
+
+        if result is None and self.__fallback is not None:
+            return self.__fallback.geocode_from_str(address)
+        return result
+
+    def geocode_from_dict(self, address: dict) -> Union[GeocodeResult, None]:
+        """
+        Geocodes the provided address, which is formatted as a dictionary.
+
+        The given dictionary should conform to standard nomenclature around address
+        fields, including:
+
+        * `street`: the number and street address
+        * `city`: city to geocode
+        * `state`: state to geocode
+        * `postal_code`: the postal code to use
+
+        Either `postal_code`, or `city` and `state`, must be given for an address
+        to be found in the index.
+
+        :param address: A dictionary with fields outlined above.
+        :raises ValueError: If address does not include street number and name.
+        :return: A geocoded address (if valid result) or None (if no valid result).
+        """
+        if address.get("street", "") == "":
+            raise ValueError("Address must include street number and name at a minimum")
+
+        postal_code = address.get("postal_code") or address.get("zip") or ""
+        result = self._lookup(
+            _normalize_street(address["street"]),
+            postal_code=postal_code[:5],
+            city=_normalize_street(address.get("city", "")),
+            state=_normalize_street(address.get("state", "")),
+        )
+
+        if result is None and self.__fallback is not None:
+            return self.__fallback.geocode_from_dict(address)
+        return result
+
+    def close(self) -> None:
+        """
+        Closes the index.
+        """
+        self.__connection.close()
+
+    def _lookup(
+        self, street: str, postal_code: str = "", city: str = "", state: str = ""
+    ) -> Union[GeocodeResult, None]:
+        """
+        Looks up the address point of a normalized address, matching the longest
+        indexed street the address starts with among the address points with the
+        same house number in the same postal code, or city and state.
+
+        :param street: The normalized address, starting with its house number and
+          street, which may be followed by a unit, city and state.
+        :param postal_code: The five-digit postal code of the address.
+        :param city: The normalized city of the address.
+        :param state: The normalized state of the address.
+        :return: The geocoded address (if found) or None (if not found).
+        """
+        number = street.split(" ", 1)[0]
+        if not number:
+            return None
+
+        columns = ", ".join(ADDRESS_POINT_FIELDS)
+        with self.__lock:
+            if postal_code:
+                rows = self.__connection.execute(
+                    f"SELECT {columns} FROM address_points "
+                    "WHERE postal_code = ? AND number = ?;",
+                    (postal_code, number),
+                ).fetchall()
+            elif city and state:
+                rows = self.__connection.execute(
+                    f"SELECT {columns} FROM address_points "
+                    "WHERE state = ? AND city = ? AND number = ?;",
+                    (state, city, number),
+                ).fetchall()
+            else:
+                return None
+
+        best = None
+        for row in rows:
+            indexed_street = f"{row[0]} {row[1]}"
+            if (
+                street == indexed_street or street.startswith(indexed_street + " ")
+            ) and (best is None or len(row[1]) > len(best[1])):
+                best = row
+        if best is None:
+            return None
+
+        point = dict(zip(ADDRESS_POINT_FIELDS, best))
+        return GeocodeResult(
+            line=[f"{point['number']} {point['street']}"],
+            city=point["city"],
+            state=point["state"],
+            postal_code=point["postal_code"],
+            county_fips=point["county_fips"],
+            lat=point["lat"],
+            lng=point["lng"],
+            county_name=point["county_name"],
+            census_tract=point["census_tract"],
+            census_block=point["census_block"],
+            geoid=point["geoid"],
+        )
+
+    @staticmethod
+    def build_index(
+        address_points: Union[str, Iterable[dict]],
+        path: str,
+        columns: Dict[str, str] = None,
+    ) -> int:
+        """
+        Builds an index of address points for a `LocalGeocodeClient`, adding to
+        the index at `path` if it already exists.
+
+        Address points are read from a CSV file, or given as dictionaries, with
+        the fields in `ADDRESS_POINT_FIELDS`. `lat`, `lng`, `street` and either
+        `postal_code`, or `city` and `state`, are required for each point. If
+        `number` is missing, the house number is taken from the start of
+        `street`.
+
+        :param address_points: The path of a CSV file of address points, or an
+          iterable of address points given as dictionaries.
+        :param path: The path of the index.
+        :param columns: A dictionary mapping the fields in `ADDRESS_POINT_FIELDS`
+          to the names of the columns or keys holding them, for those that differ.
+          Default: `None`
+        :return: The number of address points indexed.
+        """
+        columns = {
+            field: (columns or {}).get(field, field) for field in ADDRESS_POINT_FIELDS
+        }
+        csv_file = None
+        if isinstance(address_points, str):
+            csv_file = open(address_points, newline="")
+            address_points = csv.DictReader(csv_file)
+
+        connection = sql.connect(path)
+        try:
+            with connection:
+                connection.executescript(
+                    """
+                    CREATE TABLE IF NOT EXISTS address_points (
+                        number TEXT NOT NULL,
+                        street TEXT NOT NULL,
+                        city TEXT,
+                        state TEXT,
+                        postal_code TEXT,
+                        lat REAL NOT NULL,
+                        lng REAL NOT NULL,
+                        county_fips TEXT,
+                        county_name TEXT,
+                        census_tract TEXT,
+                        census_block TEXT,
+                        geoid TEXT,
+                        PRIMARY KEY (postal_code, number, street, city, state)
+                    ) WITHOUT ROWID;
+                    CREATE INDEX IF NOT EXISTS address_points_by_city
+                        ON address_points (state, city, number);
+                    """
+                )
+                count = 0
+                for point in address_points:
+                    row = _get_address_point_row(point, columns)
+                    if row is None:
+                        continue
+                    connection.execute(
+                        "INSERT OR REPLACE INTO address_points VALUES "
+                        "(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?);",
+                        row,
+                    )
+                    count += 1
+            connection.execute("ANALYZE;")
+        finally:
+            connection.close()
+            if csv_file is not None:
+                csv_file.close()
+
+        return count
+
+
+def _get_address_point_row(point: dict, columns: Dict[str, str]) -> Union[tuple, None]:
+    """
+    Gets the row of an index for an address point, normalizing its street, city
+    and state.
+
+    :param point: The address point.
+    :param columns: A dictionary mapping the fields in `ADDRESS_POINT_FIELDS` to
+      the keys of `point` holding them.
+    :return: The row, or None if the address point is missing required fields.
+    """
+    values = {field: point.get(column) for field, column in columns.items()}
+    street = _normalize_street(str(values["street"] or ""))
+    number = str(values["number"] or "").strip().upper()
+    if not number:
+        number, _, street = street.partition(" ")
+    if not number or not street or any(values[f] in (None, "") for f in ("lat", "lng")):
+        return None
+
+    values["number"] = number
+    values["street"] = street
+    values["city"] = _normalize_street(str(values["city"] or ""))
+    values["state"] = _normalize_street(str(values["state"] or ""))
+    values["postal_code"] = str(values["postal_code"] or "")[:5]
+    values["lat"] = float(values["lat"])
+    values["lng"] = float(values["lng"])
+    return tuple(values[field] for field in ADDRESS_POINT_FIELDS)
+
+
+def _normalize_street(text: str) -> str:
+    """
+    Normalizes part of an address, upper-casing it, dropping punctuation,
+    collapsing whitespace and abbreviating common street suffixes, directions and
+    unit designators.
+
+    :param text: The text to normalize.
+    :return: The normalized text.
+    """
+    words = re.sub(r"[^\w\s-]", " ", text.upper()).split()
+    return " ".join(STREET_ABBREVIATIONS.get(word, word) for word in words)
@@ -1,8 +1,9 @@
-from typing import List, Union
-from smartystreets_python_sdk import StaticCredentials, ClientBuilder
+from typing import Iterable, List, Union
+from smartystreets_python_sdk import Batch, StaticCredentials, ClientBuilder
 from smartystreets_python_sdk import us_street
 from smartystreets_python_sdk.us_street.lookup import Lookup
 
+from phdi.geospatial.cache import normalize_address
 from phdi.geospatial.core import BaseGeocodeClient, GeocodeResult
 
 
@@ -47,13 +48,7 @@ class SmartyGeocodeClient(BaseGeocodeClient):
         :raises ValueError: When the address does not include street number and name.
         :return: A geocoded address (if valid result) or None (if no valid result).
         """
-
-        # The smarty Lookup class will parse a BadRequestError but retry
-        # 5 times if the lookup address is blank, so catch that here
-        if address == "":
-            raise ValueError("Address must include street number and name at a minimum")
-
-        lookup = Lookup(street=address)
+        lookup = self._get_lookup(address)
         self.__client.send_lookup(lookup)
         return self._parse_smarty_result(lookup)
 
@@ -81,6 +76,67 @@ class SmartyGeocodeClient(BaseGeocodeClient):
         :raises Exception: When the address street is an empty string.
         :return: A geocoded address (if valid result) or None (if no valid result).
         """
+        lookup = self._get_lookup(address)
+        self.__client.send_lookup(lookup)
+        return self._parse_smarty_result(lookup)
+
+    def geocode_many(
+        self, addresses: Iterable[Union[str, dict]]
+    ) -> List[Union[GeocodeResult, None]]:
+        """
+        Geocodes any number of addresses, each formatted as either a string or a
+        dictionary (see `geocode_from_str` and `geocode_from_dict`). Duplicate
+        addresses are only looked up once, and the rest are sent to Smarty in
+        batches of up to 100 lookups, so only one request is made for every 100
+        distinct addresses.
+
+        :param addresses: The addresses to geocode.
+        :raises ValueError: When an address does not include street number and
+          name.
+        :return: A list holding a geocoded address (if valid result) or None (if no
+          valid result) for each address, in the order of the addresses.
+        """
+        keys = []
+        lookups = {}
+        for address in addresses:
+            key = normalize_address(address)
+            keys.append(key)
+            if key not in lookups:
+                lookups[key] = self._get_lookup(address)
+
+        batch = Batch()
+        for lookup in lookups.values():
+            if batch.is_full():
+                self.__client.send_batch(batch)
+                batch = Batch()
+            batch.add(lookup)
+        if len(batch) > 0:
+            self.__client.send_batch(batch)
+
+        results = {
+            key: self._parse_smarty_result(lookup) for key, lookup in lookups.items()
+        }
+        return [results[key] for key in keys]
+
+    @staticmethod
+    def _get_lookup(address: Union[str, dict]) -> Lookup:
+        """
+        Configures a Smarty lookup for an address, formatted as either a string or
+        a dictionary.
+
+        :param address: The address to geocode.
+        :raises ValueError: When the address does not include street number and
+          name.
+        :return: The lookup.
+        """
+        if isinstance(address, str):
+            # The smarty Lookup class will parse a BadRequestError but retry
+            # 5 times if the lookup address is blank, so catch that here
+            if address == "":
+                raise ValueError(
+                    "Address must include street number and name at a minimum"
+                )
+            return Lookup(street=address)
 
         # Smarty geocode requests must include a street level
         # field in the payload, otherwise generates BadRequestError
@@ -98,9 +154,7 @@ class SmartyGeocodeClient(BaseGeocodeClient):
         lookup.zipcode = address.get("postal_code", "")
         lookup.urbanization = address.get("urbanization", "")
         lookup.match = "strict"
-
-        self.__client.send_lookup(lookup)
-        return self._parse_smarty_result(lookup)
+        return lookup
 
     @staticmethod
     def _parse_smarty_result(lookup) -> Union[GeocodeResult, None]:
@@ -1,3 +1,17 @@
-from phdi.tabulation.tables import load_schema, validate_schema, write_data
+from phdi.tabulation.tables import (
+    load_schema,
+    validate_schema,
+    write_data,
+    CsvTableWriter,
+    ParquetTableWriter,
+    SqlTableWriter,
+)
 
-__all__ = ("load_schema", "validate_schema", write_data)
+__all__ = (
+    "load_schema",
+    "validate_schema",
+    "write_data",
+    "CsvTableWriter",
+    "ParquetTableWriter",
+    "SqlTableWriter",
+)
@@ -1,4 +1,6 @@
 import csv
+import gzip
+import io
 import os
 import pathlib
 import json
@@ -7,11 +9,709 @@ import pyarrow.parquet as pq
 import sqlite3 as sql
 import yaml
 
-from typing import Literal, List, Union
+from typing import Any, Dict, Literal, List, Tuple, Union
 from jsonschema import validate
 import importlib.resources
 
 
+# The maximum number of rows buffered by a `ParquetTableWriter` before they are
+# flushed to disk as a single row group.
+DEFAULT_ROW_GROUP_SIZE = 100000
+
+# The size, in bytes, of the write buffer used by a `CsvTableWriter`.
+DEFAULT_CSV_BUFFER_SIZE = 1024 * 1024
+
+# The number of rows inserted by a `SqlTableWriter` in a single transaction.
+DEFAULT_SQL_BATCH_SIZE = 10000
+
+# Arrow types used for columns that declare a `data_type` in the schema.
+SCHEMA_DATA_TYPES_TO_ARROW = {
+    "string": pa.string(),
+    "number": pa.float64(),
+    "boolean": pa.bool_(),
+}
+
+# The arrow types an inferred column's type may be widened to, from narrowest to
+# widest, when a later page holds values that its inferred type can't store.
+ARROW_TYPE_WIDENINGS = {
+    pa.bool_(): [pa.string()],
+    pa.int64(): [pa.float64(), pa.string()],
+    pa.float64(): [pa.string()],
+}
+
+# SQLite column types used to store each of the arrow types a column can resolve to.
+ARROW_TYPES_TO_SQL = {
+    pa.string(): "TEXT",
+    pa.float64(): "REAL",
+    pa.int64(): "INTEGER",
+    pa.bool_(): "INTEGER",
+}
+
+
+class ParquetTableWriter:
+    """
+    Incrementally writes tabulated data to a parquet file. Rows are accumulated
+    into one typed buffer per column as pages of data arrive, and are flushed to
+    a single underlying `pyarrow.parquet.ParquetWriter` as record batches each time
+    `row_group_size` rows have been buffered, so every flush becomes one row group
+    in the output file. Column types are taken from the schema's `data_type`
+    declarations where present, and are otherwise inferred from the first page
+    of data containing rows. An inferred type is widened (from integer to double
+    to string) if a later page holds values it can't store, as long as no rows
+    have been flushed under it yet; values are never converted lossily.
+
+    A partitioned writer instead treats `path` as a directory, and writes a new
+    `part-NNNNN.parquet` file each time it is checkpointed. Since a parquet file
+    cannot be appended to once it has been closed, this is what allows an
+    interrupted write to be resumed.
+    """
+
+    @property
+    def path(self) -> str:
+        return self.__path
+
+    @property
+    def headers(self) -> List[str]:
+        return self.__headers
+
+    @property
+    def row_group_size(self) -> int:
+        return self.__row_group_size
+
+    @property
+    def partitioned(self) -> bool:
+        return self.__partitioned
+
+    @property
+    def files(self) -> List[str]:
+        return self.__files
+
+    @property
+    def arrow_schema(self) -> Union[pa.Schema, None]:
+        return self.__arrow_schema
+
+    @property
+    def rows_written(self) -> int:
+        return self.__rows_written
+
+    def __init__(
+        self,
+        path: str,
+        headers: List[str],
+        column_types: Dict[str, str] = None,
+        row_group_size: int = DEFAULT_ROW_GROUP_SIZE,
+        partitioned: bool = False,
+    ):
+        """
+        Creates a new ParquetTableWriter object. The parquet file itself is not
+        created until the first row group is flushed, or the writer is closed.
+
+        :param path: The path of the parquet file to write, or of the directory
+          to write part files to if `partitioned` is set.
+        :param headers: The names of the table's columns, in order.
+        :param column_types: A mapping of column name to the schema `data_type`
+          ("string", "number" or "boolean") of that column. Columns without a
+          declared type have their type inferred. Default: `None`
+        :param row_group_size: The number of rows to buffer before flushing
+          them to the file as a row group. Default: `DEFAULT_ROW_GROUP_SIZE`
+        :param partitioned: Whether to write the table as a directory of part
+          files, which is required to checkpoint the writer. Default: `False`
+        :raises ValueError: If `row_group_size` is not a positive integer.
+        """
+        if row_group_size is None or row_group_size < 1:
+            raise ValueError("row_group_size must be a positive integer")
+
+        self.__path = path
+        self.__headers = list(headers)
+        self.__column_types = column_types or {}
+        self.__row_group_size = row_group_size
+        self.__partitioned = partitioned
+        self.__files = []
+        self.__buffers = [[] for _ in self.__headers]
+        self.__buffered_rows = 0
+        self.__rows_written = 0
+        self.__arrow_schema = None
+        self.__writer = None
+        self.__writer_path = None
+
+        if partitioned:
+            os.makedirs(path, exist_ok=True)
+
+    @classmethod
+    def from_checkpoint(cls, state: dict) -> "ParquetTableWriter":
+        """
+        Re-creates a partitioned ParquetTableWriter from the state returned by
+        `checkpoint`, deleting any part files written after the checkpoint was
+        taken.
+
+        :param state: The state returned by `checkpoint`.
+        :return: A writer that continues the table from the checkpoint.
+        """
+        writer = cls(
+            state["path"],
+            state["headers"],
+            column_types=state["column_types"],
+            row_group_size=state["row_group_size"],
+            partitioned=True,
+        )
+        writer.__files = list(state["files"])
+        writer.__rows_written = state["rows_written"]
+        if state["arrow_types"] is not None:
+            writer.__arrow_schema = pa.schema(
+                zip(
+                    writer.__headers,
+                    [pa.type_for_alias(alias) for alias in state["arrow_types"]],
+                )
+            )
+
+        for file_name in os.listdir(writer.__path):
+            if file_name.startswith("part-") and file_name not in writer.__files:
+                os.remove(os.path.join(writer.__path, file_name))
+        return writer
+
+    def write(self, rows: List[list]) -> None:
+        """
+        Appends rows of tabulated data to the column buffers, flushing a row group
+        to the parquet file each time `row_group_size` rows have accumulated.
+
+        :param rows: The rows of the table to write, excluding the headers.
+        :raises ValueError: If a column holds a value that can't be stored in the
+          column's type without losing information, and the type is declared in
+          the schema or rows have already been flushed under it.
+        """
+        if len(rows) == 0:
+            return
+
+        if self.__arrow_schema is None:
+            self.__arrow_schema = self._build_arrow_schema(rows)
+
+        # Every column is converted before any is buffered, so a page that can't
+        # be written leaves the buffers as they were
+        columns = []
+        arrow_types = list(self.__arrow_schema.types)
+        for index, column_name in enumerate(self.__headers):
+            arrow_type, values = _coerce_arrow_column(
+                [row[index] for row in rows],
+                arrow_types[index],
+                column_name,
+                declared=column_name in self.__column_types,
+            )
+            if arrow_type != arrow_types[index]:
+                if self.__writer is not None or self.__rows_written > 0:
+                    raise ValueError(
+                        f"Column {column_name!r} has already been written as "
+                        f"{arrow_types[index]}, but holds values that need "
+                        f"{arrow_type}; declare its data_type in the schema"
+                    )
+                arrow_types[index] = arrow_type
+            columns.append(values)
+
+        if arrow_types != self.__arrow_schema.types:
+            for index, arrow_type in enumerate(arrow_types):
+                if arrow_type != self.__arrow_schema.types[index]:
+                    self.__buffers[index] = [
+                        _coerce_arrow_value(value, arrow_type)
+                        for value in self.__buffers[index]
+                    ]
+            self.__arrow_schema = pa.schema(zip(self.__headers, arrow_types))
+
+        for buffer, values in zip(self.__buffers, columns):
+            buffer.extend(values)
+        self.__buffered_rows += len(rows)
+
+        while self.__buffered_rows >= self.__row_group_size:
+            self._flush(self.__row_group_size)
+
+    def checkpoint(self) -> dict:
+        """
+        Flushes any buffered rows and closes the current part file, so that every
+        row written so far is stored in a complete parquet file. Rows written
+        afterwards go to a new part file.
+
+        :raises ValueError: If the writer is not partitioned.
+        :return: The state of the writer, which may be passed to `from_checkpoint`
+          to resume writing the table.
+        """
+        if not self.__partitioned:
+            raise ValueError("Only a partitioned ParquetTableWriter can checkpoint")
+
+        if self.__buffered_rows > 0:
+            self._flush(self.__buffered_rows)
+        self._close_file()
+        return {
+            "path": self.__path,
+            "headers": self.__headers,
+            "column_types": self.__column_types,
+            "row_group_size": self.__row_group_size,
+            "arrow_types": None
+            if self.__arrow_schema is None
+            else [str(arrow_type) for arrow_type in self.__arrow_schema.types],
+            "files": list(self.__files),
+            "rows_written": self.__rows_written,
+        }
+
+    def close(self) -> None:
+        """
+        Flushes any buffered rows and closes the parquet file. If no rows were
+        ever written, an empty parquet file with the table's columns is created.
+        """
+        if self.__arrow_schema is None:
+            self.__arrow_schema = self._build_arrow_schema([])
+        if self.__buffered_rows > 0 or (
+            self.__writer is None and len(self.__files) == 0
+        ):
+            self._flush(self.__buffered_rows)
+        self._close_file()
+
+    def _build_arrow_schema(self, rows: List[list]) -> pa.Schema:
+        """
+        Builds the arrow schema of the parquet file from the resolved type of
+        each column.
+
+        :param rows: The rows of the table used to infer undeclared column types.
+        :return: The arrow schema of the parquet file.
+        """
+        arrow_types = _resolve_arrow_types(self.__headers, self.__column_types, rows)
+        return pa.schema(zip(self.__headers, arrow_types))
+
+    def _flush(self, row_count: int) -> None:
+        """
+        Writes the first `row_count` buffered rows to the parquet file as a single
+        row group, opening the file first if necessary.
+
+        :param row_count: The number of buffered rows to write.
+        """
+        if self.__writer is None:
+            self.__writer_path = (
+                os.path.join(self.__path, f"part-{len(self.__files):05d}.parquet")
+                if self.__partitioned
+                else self.__path
+            )
+            self.__writer = pq.ParquetWriter(self.__writer_path, self.__arrow_schema)
+
+        arrays = [
+            pa.array(buffer[:row_count], type=arrow_type)
+            for buffer, arrow_type in zip(self.__buffers, self.__arrow_schema.types)
+        ]
+        table = pa.Table.from_arrays(arrays, schema=self.__arrow_schema)
+        self.__writer.write_table(table, row_group_size=self.__row_group_size)
+
+        for buffer in self.__buffers:
+            del buffer[:row_count]
+        self.__buffered_rows -= row_count
+        self.__rows_written += row_count
+
+    def _close_file(self) -> None:
+        """
+        Closes the parquet file currently being written, if there is one, and
+        records it as a complete part file of a partitioned table.
+        """
+        if self.__writer is None:
+            return
+        self.__writer.close()
+        if self.__partitioned:
+            self.__files.append(os.path.basename(self.__writer_path))
+        self.__writer = None
+
+
+class CsvTableWriter:
+    """
+    Incrementally writes tabulated data to a CSV file. The file is opened once,
+    in append mode with a large write buffer, and kept open until the writer is
+    closed. Headers are written once, when the file is first created, and the
+    output may optionally be compressed with gzip or zstd.
+    """
+
+    @property
+    def path(self) -> str:
+        return self.__path
+
+    @property
+    def headers(self) -> List[str]:
+        return self.__headers
+
+    @property
+    def compression(self) -> Union[str, None]:
+        return self.__compression
+
+    @property
+    def rows_written(self) -> int:
+        return self.__rows_written
+
+    def __init__(
+        self,
+        path: str,
+        headers: List[str],
+        compression: Literal["gzip", "zstd"] = None,
+        buffer_size: int = DEFAULT_CSV_BUFFER_SIZE,
+    ):
+        """
+        Creates a new CsvTableWriter object and opens the CSV file for appending,
+        creating it (and writing the headers) if it doesn't already exist.
+
+        :param path: The path of the CSV file to write.
+        :param headers: The names of the table's columns, in order.
+        :param compression: The compression to apply to the file, either "gzip"
+          or "zstd". Writing zstd requires the `zstandard` package. Default: `None`
+        :param buffer_size: The size, in bytes, of the file's write buffer.
+          Default: `DEFAULT_CSV_BUFFER_SIZE`
+        :raises ValueError: If an unsupported compression is requested.
+        """
+        if compression not in (None, "gzip", "zstd"):
+            raise ValueError(f"Unsupported compression provided: {compression}")
+
+        self.__path = path
+        self.__headers = list(headers)
+        self.__compression = compression
+        self.__rows_written = 0
+
+        write_headers = not (os.path.isfile(path) and os.path.getsize(path) > 0)
+        self.__raw_file = open(path, "ab", buffering=buffer_size)
+        self.__file = _wrap_csv_stream(self.__raw_file, compression)
+        self.__writer = csv.writer(self.__file, dialect="excel")
+        if write_headers:
+            self.__writer.writerow(self.__headers)
+
+    @classmethod
+    def from_checkpoint(cls, state: dict) -> "CsvTableWriter":
+        """
+        Re-creates a CsvTableWriter from the state returned by `checkpoint`,
+        truncating the file to discard anything written after the checkpoint was
+        taken.
+
+        :param state: The state returned by `checkpoint`.
+        :return: A writer that continues the table from the checkpoint.
+        """
+        path = state["path"]
+        if os.path.isfile(path) and os.path.getsize(path) > state["offset"]:
+            os.truncate(path, state["offset"])
+
+        writer = cls(path, state["headers"], compression=state["compression"])
+        writer.__rows_written = state["rows_written"]
+        return writer
+
+    def write(self, rows: List[list]) -> None:
+        """
+        Appends rows of tabulated data to the CSV file. Lists (from reverse
+        references or `selection_criteria: all`) and dicts are serialized into
+        strings.
+
+        :param rows: The rows of the table to write, excluding the headers.
+        """
+        self.__writer.writerows(
+            [
+                [
+                    _convert_list_to_string(value)
+                    if isinstance(value, list)
+                    else str(value)
+                    if isinstance(value, dict)
+                    else value
+                    for value in row
+                ]
+                for row in rows
+            ]
+        )
+        self.__rows_written += len(rows)
+
+    def checkpoint(self) -> dict:
+        """
+        Flushes all buffered output to disk, so that every row written so far
+        is stored in the file. For compressed files, the current gzip member or
+        zstd frame is also ended, so that the file can be truncated back to this
+        point and appended to again.
+
+        :return: The state of the writer, which may be passed to `from_checkpoint`
+          to resume writing the table.
+        """
+        if self.__compression == "gzip":
+            # Closing the gzip stream writes the member's trailer, but not the file
+            self.__file.detach().close()
+        elif self.__compression == "zstd":
+            import zstandard
+
+            self.__file.flush()
+            self.__file.buffer.flush(zstandard.FLUSH_FRAME)
+        else:
+            self.__file.flush()
+
+        self.__raw_file.flush()
+        os.fsync(self.__raw_file.fileno())
+        offset = self.__raw_file.tell()
+
+        if self.__compression == "gzip":
+            self.__file = _wrap_csv_stream(self.__raw_file, self.__compression)
+            self.__writer = csv.writer(self.__file, dialect="excel")
+
+        return {
+            "path": self.__path,
+            "headers": self.__headers,
+            "compression": self.__compression,
+            "offset": offset,
+            "rows_written": self.__rows_written,
+        }
+
+    def close(self) -> None:
+        """
+        Flushes any buffered output and closes the CSV file.
+        """
+        self.__file.close()
+        # A gzip stream does not close the file it writes to
+        self.__raw_file.close()
+
+
+class SqlTableWriter:
+    """
+    Incrementally writes tabulated data to a table in a SQLite database. A single
+    connection is held open for the whole extraction, with the database in WAL
+    journal mode, and rows are inserted in batched transactions. Column types are
+    taken from the schema's `data_type` declarations where present, and are
+    otherwise inferred from the first page of data containing rows. An inferred
+    type is widened (from integer to real to text) if a later page holds values
+    it can't store, by rebuilding the table with the wider column; values are
+    never converted lossily.
+    """
+
+    @property
+    def db_path(self) -> str:
+        return self.__db_path
+
+    @property
+    def table_name(self) -> str:
+        return self.__table_name
+
+    @property
+    def headers(self) -> List[str]:
+        return self.__headers
+
+    @property
+    def column_types(self) -> Union[List[pa.DataType], None]:
+        return self.__column_arrow_types
+
+    @property
+    def rows_written(self) -> int:
+        return self.__rows_written
+
+    def __init__(
+        self,
+        db_path: str,
+        table_name: str,
+        headers: List[str],
+        column_types: Dict[str, str] = None,
+        batch_size: int = DEFAULT_SQL_BATCH_SIZE,
+    ):
+        """
+        Creates a new SqlTableWriter object and opens a connection to the database,
+        creating the database file if it doesn't exist. The table itself is created,
+        if it doesn't already exist, when the first rows are written.
+
+        :param db_path: The path of the SQLite database file.
+        :param table_name: The name of the table to create or write data to.
+        :param headers: The names of the table's columns, in order.
+        :param column_types: A mapping of column name to the schema `data_type`
+          ("string", "number" or "boolean") of that column. Columns without a
+          declared type have their type inferred. Default: `None`
+        :param batch_size: The maximum number of rows to insert in a single
+          transaction. Default: `DEFAULT_SQL_BATCH_SIZE`
+        :raises ValueError: If `batch_size` is not a positive integer.
+        """
+        if batch_size is None or batch_size < 1:
+            raise ValueError("batch_size must be a positive integer")
+
+        self.__db_path = db_path
+        self.__table_name = table_name
+        self.__headers = list(headers)
+        self.__column_types = column_types or {}
+        self.__batch_size = batch_size
+        self.__column_arrow_types = None
+        self.__rows_written = 0
+
+        self.__connection = sql.connect(db_path)
+        self.__connection.execute("PRAGMA journal_mode=WAL;")
+        self.__connection.execute("PRAGMA synchronous=NORMAL;")
+
+        quoted_headers = ", ".join(_quote_sql_identifier(h) for h in self.__headers)
+        placeholders = ", ".join("?" * len(self.__headers))
+        self.__insert_statement = (
+            f"INSERT INTO {_quote_sql_identifier(table_name)} ({quoted_headers}) "
+            f"VALUES ({placeholders});"
+        )
+
+    @classmethod
+    def from_checkpoint(cls, state: dict) -> "SqlTableWriter":
+        """
+        Re-creates a SqlTableWriter from the state returned by `checkpoint`,
+        deleting any rows inserted into the table after the checkpoint was taken.
+
+        :param state: The state returned by `checkpoint`.
+        :return: A writer that continues the table from the checkpoint.
+        """
+        writer = cls(
+            state["db_path"],
+            state["table_name"],
+            state["headers"],
+            column_types=state["column_types"],
+            batch_size=state["batch_size"],
+        )
+        writer.__rows_written = state["rows_written"]
+        if state["arrow_types"] is not None:
+            writer.__column_arrow_types = [
+                pa.type_for_alias(alias) for alias in state["arrow_types"]
+            ]
+
+        if writer._table_exists():
+            with writer.__connection:
+                writer.__connection.execute(
+                    f"DELETE FROM {_quote_sql_identifier(writer.__table_name)} "
+                    "WHERE rowid > ?;",
+                    (state["last_rowid"],),
+                )
+        return writer
+
+    def write(self, rows: List[list]) -> None:
+        """
+        Inserts rows of tabulated data into the table, committing a transaction
+        for every `batch_size` rows.
+
+        :param rows: The rows of the table to write, excluding the headers.
+        :raises ValueError: If a column declared in the schema holds a value that
+          can't be stored in the column's type without losing information.
+        """
+        if len(rows) == 0:
+            return
+
+        if self.__column_arrow_types is None:
+            self._create_table(rows)
+
+        # Every column is converted before any row is inserted, so a page that
+        # can't be written leaves the table as it was
+        columns = []
+        arrow_types = []
+        for index, column_name in enumerate(self.__headers):
+            arrow_type, values = _coerce_arrow_column(
+                [row[index] for row in rows],
+                self.__column_arrow_types[index],
+                column_name,
+                declared=column_name in self.__column_types,
+            )
+            arrow_types.append(arrow_type)
+            columns.append(values)
+        if arrow_types != self.__column_arrow_types:
+            self._widen_table(arrow_types)
+
+        coerced_rows = list(zip(*columns))
+        for start in range(0, len(coerced_rows), self.__batch_size):
+            batch = coerced_rows[start : start + self.__batch_size]
+            with self.__connection:
+                self.__connection.executemany(self.__insert_statement, batch)
+            self.__rows_written += len(batch)
+
+    def checkpoint(self) -> dict:
+        """
+        Records the last row of the table written so far. Every batch of rows is
+        committed as it is written, so no data needs to be flushed.
+
+        :return: The state of the writer, which may be passed to `from_checkpoint`
+          to resume writing the table.
+        """
+        last_rowid = 0
+        if self._table_exists():
+            last_rowid = self.__connection.execute(
+                f"SELECT MAX(rowid) FROM {_quote_sql_identifier(self.__table_name)};"
+            ).fetchone()[0]
+
+        return {
+            "db_path": self.__db_path,
+            "table_name": self.__table_name,
+            "headers": self.__headers,
+            "column_types": self.__column_types,
+            "batch_size": self.__batch_size,
+            "arrow_types": None
+            if self.__column_arrow_types is None
+            else [str(arrow_type) for arrow_type in self.__column_arrow_types],
+            "last_rowid": last_rowid or 0,
+            "rows_written": self.__rows_written,
+        }
+
+    def close(self) -> None:
+        """
+        Closes the database connection, creating the table first if no rows
+        were ever written.
+        """
+        if self.__column_arrow_types is None:
+            self._create_table([])
+        self.__connection.close()
+
+    def _create_table(self, rows: List[list]) -> None:
+        """
+        Resolves the type of each column and creates the table if it doesn't
+        already exist in the database.
+
+        :param rows: The rows of the table used to infer undeclared column types.
+        """
+        self.__column_arrow_types = _resolve_arrow_types(
+            self.__headers, self.__column_types, rows
+        )
+        column_definitions = ", ".join(
+            f"{_quote_sql_identifier(header)} {ARROW_TYPES_TO_SQL[arrow_type]}"
+            for header, arrow_type in zip(self.__headers, self.__column_arrow_types)
+        )
+        with self.__connection:
+            self.__connection.execute(
+                "CREATE TABLE IF NOT EXISTS "
+                f"{_quote_sql_identifier(self.__table_name)} ({column_definitions});"
+            )
+
+    def _widen_table(self, arrow_types: List[pa.DataType]) -> None:
+        """
+        Widens the types of the table's columns, rebuilding the table in a single
+        transaction, since SQLite can't change the type of a column in place.
+        Rows keep their rowids, so checkpoints taken earlier remain valid.
+
+        :param arrow_types: The widened arrow type of each column.
+        """
+        table_name = _quote_sql_identifier(self.__table_name)
+        widened_table_name = _quote_sql_identifier(f"{self.__table_name}__widened")
+        column_definitions = ", ".join(
+            f"{_quote_sql_identifier(header)} {ARROW_TYPES_TO_SQL[arrow_type]}"
+            for header, arrow_type in zip(self.__headers, arrow_types)
+        )
+        quoted_headers = ", ".join(_quote_sql_identifier(h) for h in self.__headers)
+        converted_columns = ", ".join(
+            _convert_sql_column(_quote_sql_identifier(header), old_type, new_type)
+            for header, old_type, new_type in zip(
+                self.__headers, self.__column_arrow_types, arrow_types
+            )
+        )
+
+        with self.__connection:
+            self.__connection.execute("BEGIN;")
+            self.__connection.execute(f"DROP TABLE IF EXISTS {widened_table_name};")
+            self.__connection.execute(
+                f"CREATE TABLE {widened_table_name} ({column_definitions});"
+            )
+            self.__connection.execute(
+                f"INSERT INTO {widened_table_name} (rowid, {quoted_headers}) "
+                f"SELECT rowid, {converted_columns} FROM {table_name};"
+            )
+            self.__connection.execute(f"DROP TABLE {table_name};")
+            self.__connection.execute(
+                f"ALTER TABLE {widened_table_name} RENAME TO {table_name};"
+            )
+        self.__column_arrow_types = arrow_types
+
+    def _table_exists(self) -> bool:
+        """
+        Checks whether the table exists in the database.
+
+        :return: `True` if the table exists, and `False` otherwise.
+        """
+        cursor = self.__connection.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?;",
+            (self.__table_name,),
+        )
+        return cursor.fetchone() is not None
+
+
 def load_schema(path: pathlib.Path) -> dict:
     """
     Given the path to a local YAML or JSON file containing a schema,
@@ -71,8 +771,13 @@ def write_data(
     filename: str = None,
     db_file: str = None,
     db_tablename: str = None,
-    pq_writer: pq.ParquetWriter = None,
-) -> Union[None, pq.ParquetWriter]:
+    pq_writer: ParquetTableWriter = None,
+    column_types: Dict[str, str] = None,
+    row_group_size: int = DEFAULT_ROW_GROUP_SIZE,
+    sql_writer: SqlTableWriter = None,
+    csv_writer: CsvTableWriter = None,
+    compression: Literal["gzip", "zstd"] = None,
+) -> Union[CsvTableWriter, ParquetTableWriter, SqlTableWriter]:
     """
     Writes a set of tabulated data to a particular output format on disk
     (one of CSV, Parquet, or SQL). For CSV and Parquet writing, a filename
@@ -97,72 +802,321 @@ def write_data(
       SQL. Default: `None`.
     :param db_tablename: The name of the table in the database to create
       or write data to. Omit if `output_type` is not SQL. Default: `None`.
-    :param pq_writer: A pre-existing `ParquetWriter` object that can be
-      used to append data to a parquet format. Used in cases where
-      incremental writing to a parquet destination is desired. Omit if
+    :param pq_writer: A `ParquetTableWriter` returned by a previous call to
+      this function, used to append data to the same parquet file. Used in
+      cases where incremental writing to a parquet destination is desired;
+      the caller must close the writer once all data has been written. Omit if
       `output_type` is not Parquet. Default: `None`.
+    :param column_types: A mapping of column name to the `data_type` declared
+      for that column in the schema, used to type parquet and SQL columns. Only
+      used when creating a new writer. Default: `None`.
+    :param row_group_size: The number of rows buffered by a new parquet writer
+      before they are written to the file as a row group. Only used when
+      creating a new parquet writer. Default: `DEFAULT_ROW_GROUP_SIZE`.
+    :param sql_writer: A `SqlTableWriter` returned by a previous call to this
+      function, used to keep appending data to the same database table over a
+      single connection; the caller must close the writer once all data has
+      been written. Omit if `output_type` is not SQL. Default: `None`.
+    :param csv_writer: A `CsvTableWriter` returned by a previous call to this
+      function, used to keep appending data to the same open CSV file; the
+      caller must close the writer once all data has been written. Omit if
+      `output_type` is not CSV. Default: `None`.
+    :param compression: The compression, either "gzip" or "zstd", applied to a
+      new CSV file. Only used when creating a new CSV writer. Default: `None`.
+    :return: The `CsvTableWriter`, `ParquetTableWriter` or `SqlTableWriter` used
+      to write the data.
+    """
+    writer = {"parquet": pq_writer, "csv": csv_writer, "sql": sql_writer}.get(
+        output_type
+    )
+    if writer is None:
+        writer = _open_table_writer(
+            output_type,
+            directory,
+            headers=tabulated_data[0],
+            filename=filename,
+            db_file=db_file,
+            db_tablename=db_tablename,
+            column_types=column_types,
+            row_group_size=row_group_size,
+            compression=compression,
+        )
+    if writer is not None:
+        writer.write(tabulated_data[1:])
+    return writer
+
+
+def _open_table_writer(
+    output_type: Literal["csv", "parquet", "sql"],
+    directory: str,
+    headers: List[str],
+    filename: str = None,
+    db_file: str = None,
+    db_tablename: str = None,
+    column_types: Dict[str, str] = None,
+    row_group_size: int = DEFAULT_ROW_GROUP_SIZE,
+    compression: Literal["gzip", "zstd"] = None,
+    partitioned: bool = False,
+) -> Union[CsvTableWriter, ParquetTableWriter, SqlTableWriter, None]:
     """
-    # some elements may themselves contain lists, if selection_criteria = all is used
-    for i in range(1, len(tabulated_data)):
-        table_list = tabulated_data[i]
-        for row, elt in enumerate(table_list):
-            if isinstance(elt, list):
-                tabulated_data[i][row] = _convert_list_to_string(elt)
-            if isinstance(elt, dict):
-                tabulated_data[i][row] = str(elt)
+    Creates a new writer for a table of the given output type. See `write_data`
+    for a description of the remaining parameters.
+
+    :param output_type: The format the data should be written to.
+    :param directory: The directory in which to write the output data.
+    :param headers: The names of the table's columns, in order.
+    :param partitioned: Whether a parquet table should be written as a directory
+      of part files, so that its writer can be checkpointed. Default: `False`.
+    :return: The new writer, or `None` if `output_type` is not supported.
+    """
+    if output_type == "parquet":
+        return ParquetTableWriter(
+            os.path.join(directory, filename),
+            headers=headers,
+            column_types=column_types,
+            row_group_size=row_group_size,
+            partitioned=partitioned,
+        )
 
     if output_type == "csv":
-        write_headers = (
-            False if os.path.isfile(os.path.join(directory, filename)) else True
+        return CsvTableWriter(
+            os.path.join(directory, filename),
+            headers=headers,
+            compression=compression,
         )
-        with open(os.path.join(directory, filename), "a", newline="") as fp:
-            writer = csv.writer(fp, dialect="excel")
-            if write_headers:
-                writer.writerow(tabulated_data[0])
-            writer.writerows(tabulated_data[1:])
 
-    if output_type == "parquet":
-        table = pa.Table.from_arrays(tabulated_data[1:], names=tabulated_data[0])
-        if pq_writer is None:
-            pq_writer = pq.ParquetWriter(
-                os.path.join(directory, filename), table.schema
-            )
-        pq_writer.write_table(table=table)
-        return pq_writer
-
-    # @TODO:
-    # 1. support username and passwords for database access
-    # 2. figure out a more intelligent way to serialize data that's being
-    # written to the SQL DB; there's the possibility that we need to write
-    # list data to the table if an anchor has multiple reverse references,
-    # but SQL can't write native python lists, so we need to either
-    # stringify them, json.dumps serialize them, or binarize them
+    # @TODO: support username and passwords for database access
     if output_type == "sql":
-        # We need a file-space cursor to operate on a connected table
-        conn = sql.connect(os.path.join(directory, db_file))
-        cursor = conn.cursor()
-
-        # Create requested table if it's not already in the database
-        headers = tuple(tabulated_data[0])
-        cursor.execute(f"CREATE TABLE IF NOT EXISTS {db_tablename} {headers};")
-
-        # Format the programmatic values correctly by number of cols
-        # Need this ugly construction so that the binding placeholder qmarks
-        # don't have quotes around them individually when parsed by the SQL
-        # engine
-        hdr_placeholder = "({})".format(", ".join("?" * len(tabulated_data[0])))
-        tuple_data = [tuple([str(x) for x in row]) for row in tabulated_data[1:]]
-        # Have to do a format string this way to avoid an empty f-string error
-        print(tuple_data)
-        cursor.executemany(
-            "INSERT INTO {} {} VALUES {};".format(
-                db_tablename, headers, hdr_placeholder
-            ),
-            tuple_data,
+        return SqlTableWriter(
+            os.path.join(directory, db_file),
+            db_tablename,
+            headers=headers,
+            column_types=column_types,
         )
 
-        conn.commit()
-        conn.close()
+
+def _resume_table_writer(
+    output_type: Literal["csv", "parquet", "sql"], state: dict
+) -> Union[CsvTableWriter, ParquetTableWriter, SqlTableWriter]:
+    """
+    Re-creates a writer of the given output type from the state returned by its
+    `checkpoint` method.
+
+    :param output_type: The format the data is being written to.
+    :param state: The state returned by the writer's `checkpoint` method.
+    :raises ValueError: If `output_type` is not supported.
+    :return: A writer that continues the table from the checkpoint.
+    """
+    writer_classes = {
+        "parquet": ParquetTableWriter,
+        "csv": CsvTableWriter,
+        "sql": SqlTableWriter,
+    }
+    if output_type not in writer_classes:
+        raise ValueError(f"Unsupported output type provided: {output_type}")
+    return writer_classes[output_type].from_checkpoint(state)
+
+
+def _get_column_types(schema: dict, table_name: str) -> Dict[str, str]:
+    """
+    Gets the `data_type` declared in the schema for each column of a table that
+    declares one.
+
+    :param schema: A declarative, user-defined specification, for one or more tables,
+        that defines the metadata, properties, and columns of those tables as they
+        relate to FHIR resources.
+    :param table_name: The name of the table in the schema.
+    :return: A dict mapping column names to their declared data types.
+    """
+    columns = schema.get("tables", {}).get(table_name, {}).get("columns", {})
+    return {
+        column_name: column_params["data_type"]
+        for column_name, column_params in columns.items()
+        if "data_type" in column_params
+    }
+
+
+def _coerce_arrow_column(
+    values: List[Any], arrow_type: pa.DataType, column_name: str, declared: bool
+) -> Tuple[pa.DataType, List[Any]]:
+    """
+    Converts a column of tabulated values into a form that can be stored in an
+    arrow array of the column's type. If the column's type was inferred, and some
+    values can't be stored in it without losing information, the type is widened
+    to the narrowest type in `ARROW_TYPE_WIDENINGS` that can store every value.
+
+    :param values: The tabulated values of the column.
+    :param arrow_type: The arrow type of the column.
+    :param column_name: The name of the column.
+    :param declared: Whether the column's type was declared in the schema, in
+      which case strings are parsed into numbers and booleans, and the type
+      can't be widened.
+    :raises ValueError: If a value can't be stored in the column's type without
+      losing information, and the type can't be widened.
+    :return: A tuple holding the column's type, widened if necessary, and the
+      converted values.
+    """
+    candidate_types = [arrow_type]
+    if not declared:
+        candidate_types += ARROW_TYPE_WIDENINGS.get(arrow_type, [])
+
+    for candidate_type in candidate_types:
+        try:
+            return candidate_type, [
+                _coerce_arrow_value(value, candidate_type, parse_strings=declared)
+                for value in values
+            ]
+        except ValueError as error:
+            if candidate_type == candidate_types[-1]:
+                raise ValueError(f"Column {column_name!r}: {error}") from None
+
+
+def _coerce_arrow_value(
+    value: Any, arrow_type: pa.DataType, parse_strings: bool = False
+) -> Any:
+    """
+    Converts a single tabulated value into a form that can be stored in an arrow
+    array of the given type. Lists (from reverse references or
+    `selection_criteria: all`) and dicts are serialized into strings. Values are
+    never converted lossily, e.g. by truncating a float stored in an integer
+    column.
+
+    :param value: The tabulated value to convert.
+    :param arrow_type: The arrow type of the column holding the value.
+    :param parse_strings: Whether strings holding numbers, or "true" or "false",
+      may be parsed into numeric or boolean columns. Default: `False`
+    :raises ValueError: If the value can't be stored in the arrow type without
+      losing information.
+    :return: The converted value, or `None` if `value` is `None`.
+    """
+    if value is None:
+        return None
+    if isinstance(value, list):
+        value = _convert_list_to_string(value)
+    elif isinstance(value, dict):
+        value = str(value)
+
+    if pa.types.is_string(arrow_type):
+        return value if isinstance(value, str) else str(value)
+    if pa.types.is_boolean(arrow_type):
+        if isinstance(value, bool):
+            return value
+        if parse_strings and isinstance(value, str):
+            if value.lower() in ("true", "false"):
+                return value.lower() == "true"
+    elif pa.types.is_integer(arrow_type):
+        if isinstance(value, int) and not isinstance(value, bool):
+            return value
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    elif parse_strings and isinstance(value, str):
+        try:
+            return float(value)
+        except ValueError:
+            pass
+
+    raise ValueError(f"{value!r} can't be stored as {arrow_type}")
+
+
+def _infer_arrow_type(values) -> pa.DataType:
+    """
+    Infers the arrow type of a column from its values. Columns holding only
+    booleans or only integers are typed accordingly, other numeric columns are
+    stored as doubles, and everything else (including columns with no non-null
+    values) is stored as strings.
+
+    :param values: An iterable of tabulated values from a single column.
+    :return: The inferred arrow type.
+    """
+    python_types = {type(value) for value in values if value is not None}
+    if python_types == {bool}:
+        return pa.bool_()
+    if python_types == {int}:
+        return pa.int64()
+    if python_types and python_types <= {int, float}:
+        return pa.float64()
+    return pa.string()
+
+
+def _wrap_csv_stream(
+    raw_file: io.BufferedWriter, compression: Union[str, None]
+) -> io.TextIOWrapper:
+    """
+    Wraps a binary file opened for appending in a text stream for writing CSV,
+    optionally through a gzip or zstd compressor. Appending to an existing
+    compressed file adds a new gzip member or zstd frame, which decompressors
+    read as one continuous stream.
+
+    :param raw_file: The binary file to write to.
+    :param compression: The compression to apply, either "gzip", "zstd" or `None`.
+    :raises ValueError: If an unsupported compression is requested.
+    :return: A text stream that writes to the file.
+    """
+    if compression is None:
+        stream = raw_file
+    elif compression == "gzip":
+        stream = gzip.GzipFile(fileobj=raw_file, mode="ab")
+    elif compression == "zstd":
+        import zstandard
+
+        stream = zstandard.ZstdCompressor().stream_writer(raw_file)
+    else:
+        raise ValueError(f"Unsupported compression provided: {compression}")
+
+    return io.TextIOWrapper(stream, encoding="utf-8", newline="")
+
+
+def _convert_sql_column(
+    column: str, arrow_type: pa.DataType, widened_type: pa.DataType
+) -> str:
+    """
+    Builds the SQL expression converting a column's stored values to a widened
+    type, matching how `_coerce_arrow_value` converts values of the narrower
+    type.
+
+    :param column: The quoted name of the column.
+    :param arrow_type: The arrow type the column's values are stored as.
+    :param widened_type: The arrow type to convert the values to.
+    :return: The SQL expression.
+    """
+    if widened_type == arrow_type:
+        return column
+    if pa.types.is_boolean(arrow_type):
+        return f"CASE {column} WHEN 1 THEN 'True' WHEN 0 THEN 'False' END"
+    return f"CAST({column} AS {ARROW_TYPES_TO_SQL[widened_type]})"
+
+
+def _quote_sql_identifier(identifier: str) -> str:
+    """
+    Quotes a table or column name for use in a SQL statement.
+
+    :param identifier: The table or column name to quote.
+    :return: The quoted identifier.
+    """
+    return '"' + identifier.replace('"', '""') + '"'
+
+
+def _resolve_arrow_types(
+    headers: List[str], column_types: Dict[str, str], rows: List[list]
+) -> List[pa.DataType]:
+    """
+    Determines the arrow type of each column of a table, using the declared schema
+    type of the column if there is one, and inferring it from the values in `rows`
+    otherwise.
+
+    :param headers: The names of the table's columns, in order.
+    :param column_types: A mapping of column name to declared schema `data_type`.
+    :param rows: The rows of the table used to infer undeclared column types.
+    :return: A list holding the arrow type of each column.
+    """
+    arrow_types = []
+    for index, column_name in enumerate(headers):
+        data_type = column_types.get(column_name)
+        if data_type in SCHEMA_DATA_TYPES_TO_ARROW:
+            arrow_types.append(SCHEMA_DATA_TYPES_TO_ARROW[data_type])
+        else:
+            arrow_types.append(_infer_arrow_type(row[index] for row in rows))
+    return arrow_types
 
 
 def _convert_list_to_string(val: list) -> str:
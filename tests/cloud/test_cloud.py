@@ -2,15 +2,103 @@ import json
 import pathlib
 import pytest
 import io
+import threading
 
 from azure.storage.blob import ContainerClient
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
 from unittest import mock
+
+import phdi.cloud.core
+import phdi.cloud.gcp
 from phdi.cloud.azure import (
     AzureCredentialManager,
     AzureCloudContainerConnection,
 )
+from phdi.cloud.core import BaseCredentialManager, ListingPage
 from phdi.cloud.gcp import GcpCloudStorageConnection, GcpCredentialManager
+from phdi.cloud.local import LocalCloudStorageConnection, LocalCredentialManager
+from phdi.cloud.memory import MemoryCloudStorageConnection
+
+
+class _TestCredentialManager(BaseCredentialManager):
+    """
+    A credential manager handing out numbered tokens that each expire
+    `token_lifetime` seconds after the (patched) current time.
+    """
+
+    def __init__(self, token_lifetime, request_started=None, release_request=None):
+        super().__init__(token_refresh_margin=60)
+        self.token_lifetime = token_lifetime
+        self.request_count = 0
+        self.request_started = request_started
+        self.release_request = release_request
+
+    def get_credential_object(self):
+        return None
+
+    def _request_access_token(self):
+        if self.request_started is not None:
+            self.request_started.set()
+            self.release_request.wait(timeout=5)
+        self.request_count += 1
+        expires_on = (
+            None
+            if self.token_lifetime is None
+            else phdi.cloud.core.time.time() + self.token_lifetime
+        )
+        return f"token-{self.request_count}", expires_on
+
+
+class _TestStorageConnection(phdi.cloud.core.BaseCloudStorageConnection):
+    """
+    A storage connection only implementing the abstract methods, holding objects
+    in a dictionary.
+    """
+
+    def __init__(self):
+        self.objects = {}
+
+    def download_object(self, container_name, filename, encoding="utf-8"):
+        return self.objects[(container_name, filename)]
+
+    def upload_object(self, message, container_name, filename):
+        self.objects[(container_name, filename)] = message
+
+    def list_containers(self):
+        return sorted({container_name for container_name, _ in self.objects})
+
+    def list_objects(self, container_name, prefix=""):
+        return sorted(name for c, name in self.objects if c == container_name)
+
+
+class _TestPager:
+    """
+    Mimics the paged listings of the Azure and GCP SDKs, whose continuation token
+    is updated as each page is listed.
+    """
+
+    def __init__(self, pages, continuation_tokens):
+        self.page_list = pages
+        self.continuation_tokens = continuation_tokens
+        self.continuation_token = self.next_page_token = None
+
+    def __iter__(self):
+        for page, continuation_token in zip(self.page_list, self.continuation_tokens):
+            self.continuation_token = self.next_page_token = continuation_token
+            yield iter(page)
+
+    @property
+    def pages(self):
+        return iter(self)
+
+
+def _named_mocks(*names):
+    items = []
+    for name in names:
+        item = mock.Mock()
+        item.name = name
+        items.append(item)
+    return items
 
 
 @mock.patch("phdi.cloud.azure.DefaultAzureCredential")
@@ -162,6 +250,61 @@ def test_azure_need_new_token_without_token():
     assert cred_manager._need_new_token()
 
 
+@mock.patch("phdi.cloud.core.time")
+def test_credential_manager_token_cache(patched_time):
+    patched_time.time.return_value = 1000
+    cred_manager = _TestCredentialManager(token_lifetime=600)
+
+    assert cred_manager.get_access_token() == "token-1"
+    patched_time.time.return_value = 1500
+    assert cred_manager.get_access_token() == "token-1"
+    assert cred_manager.request_count == 1
+
+    # Within the refresh margin, the cached token is returned while a new one is
+    # requested in the background; the next caller waits for it to arrive
+    patched_time.time.return_value = 1560
+    assert cred_manager.get_access_token() == "token-1"
+    assert cred_manager.get_access_token() == "token-2"
+    assert cred_manager.request_count == 2
+
+    # Expired tokens and forced refreshes are requested synchronously
+    patched_time.time.return_value = 3000
+    assert cred_manager.get_access_token() == "token-3"
+    assert cred_manager.get_access_token(force_refresh=True) == "token-4"
+
+
+@mock.patch("phdi.cloud.core.time")
+def test_credential_manager_single_flight_refresh(patched_time):
+    patched_time.time.return_value = 1000
+    request_started = threading.Event()
+    release_request = threading.Event()
+    cred_manager = _TestCredentialManager(600, request_started, release_request)
+
+    tokens = []
+    callers = [
+        threading.Thread(target=lambda: tokens.append(cred_manager.get_access_token()))
+        for _ in range(8)
+    ]
+    callers[0].start()
+    assert request_started.wait(timeout=5)
+    for caller in callers[1:]:
+        caller.start()
+    release_request.set()
+    for caller in callers:
+        caller.join(timeout=5)
+
+    # Every caller shares the token requested by the first one
+    assert tokens == ["token-1"] * 8
+    assert cred_manager.request_count == 1
+
+
+def test_credential_manager_unknown_expiry():
+    cred_manager = _TestCredentialManager(token_lifetime=None)
+
+    assert cred_manager.get_access_token() == "token-1"
+    assert cred_manager.get_access_token() == "token-2"
+
+
 @mock.patch("phdi.cloud.gcp.google.auth.transport.requests.Request")
 @mock.patch("phdi.cloud.gcp.google.auth.default")
 def test_gcp_credential_manager(mock_gcp_creds, mock_gcp_requests):
@@ -219,6 +362,49 @@ def test_gcp_credential_manager_handle_expired_token(mock_gcp_creds, mock_gcp_re
     assert mock_gcp_requests.called
 
 
+@mock.patch("phdi.cloud.gcp.google.auth.default")
+def test_gcp_credential_manager_caches_token(mock_gcp_creds):
+    credentials = mock.Mock()
+    credentials.token = "some-token"
+    credentials.expired = False
+    credentials.valid = True
+    credentials.expiry = datetime.utcnow() + timedelta(hours=1)
+    mock_gcp_creds.return_value = credentials, "some-project"
+
+    credential_manager = GcpCredentialManager()
+
+    assert credential_manager.get_access_token() == "some-token"
+    credentials.valid = False
+    assert credential_manager.get_access_token() == "some-token"
+
+    # Only the first token is requested from GCP, until the cached one expires
+    credentials.refresh.assert_called_once()
+
+
+@mock.patch("phdi.cloud.gcp.google.auth.transport.requests.Request")
+@mock.patch("phdi.cloud.gcp.google.auth.default")
+def test_gcp_credential_manager_force_refresh(mock_gcp_creds, mock_gcp_requests):
+    credentials = mock.Mock()
+    credentials.valid = True
+    credentials.expiry = datetime.utcnow() + timedelta(hours=1)
+    tokens = iter(["some-token", "new-token"])
+
+    def refresh(request):
+        credentials.token = next(tokens)
+
+    credentials.refresh.side_effect = refresh
+    mock_gcp_creds.return_value = credentials, "some-project"
+
+    credential_manager = GcpCredentialManager()
+    assert credential_manager.get_access_token() == "some-token"
+
+    # A token rejected by a server is replaced, even though the credentials
+    # still consider it valid
+    assert credential_manager.get_access_token(force_refresh=True) == "new-token"
+    assert credential_manager.get_access_token() == "new-token"
+    assert credentials.refresh.call_count == 2
+
+
 @mock.patch("phdi.cloud.gcp.google.auth.default")
 def test_gcp_credential_manager_handle_expired_credentials(
     mock_gcp_creds,
@@ -374,13 +560,11 @@ def test_azure_download_object_cp1252(mock_get_client):
 @mock.patch("phdi.cloud.azure.BlobServiceClient")
 def test_azure_list_containers(mock_service_client):
     mock_service_client_instance = mock_service_client.return_value
-    item1 = mock.Mock()
-    item1.name = "container1"
-    item2 = mock.Mock()
-    item2.name = "container2"
-    mock_container_list = [item1, item2]
-
-    mock_service_client_instance.list_containers.return_value = mock_container_list
+    mock_pages = _TestPager(
+        [_named_mocks("container1"), _named_mocks("container2")], ["token-1", ""]
+    )
+    mock_container_list = mock_service_client_instance.list_containers.return_value
+    mock_container_list.by_page.return_value = mock_pages
 
     mock_cred_manager = mock.Mock()
 
@@ -392,27 +576,41 @@ def test_azure_list_containers(mock_service_client):
 
     container_list = phdi_container_client.list_containers()
 
+    # Containers aren't listed until they're consumed
+    mock_service_client_instance.list_containers.assert_not_called()
+    container_list = list(container_list)
+
     mock_service_client.assert_called_with(
         account_url=object_storage_account,
         credential=mock_cred_manager.get_credential_object(),
+        transport=mock.ANY,
     )
 
-    mock_service_client_instance.list_containers.assert_called_with()
+    mock_service_client_instance.list_containers.assert_called_with(
+        results_per_page=None
+    )
+    mock_container_list.by_page.assert_called_with(continuation_token=None)
 
     assert container_list == ["container1", "container2"]
 
+    mock_container_list.by_page.return_value = _TestPager(
+        [_named_mocks("container2")], [""]
+    )
+    assert list(
+        phdi_container_client.list_container_pages(
+            page_size=1, continuation_token="token-1"
+        )
+    ) == [ListingPage(["container2"], None)]
+    mock_service_client_instance.list_containers.assert_called_with(results_per_page=1)
+    mock_container_list.by_page.assert_called_with(continuation_token="token-1")
+
 
 @mock.patch.object(AzureCloudContainerConnection, "_get_container_client")
 def test_azure_list_objects(mock_get_client):
-    item1 = mock.Mock()
-    item1.name = "blob1"
-    item2 = mock.Mock()
-    item2.name = "blob2"
-    mock_object_list = [item1, item2]
-
     mock_client = mock_get_client.return_value
-
-    mock_client.list_blobs.return_value = mock_object_list
+    mock_client.list_blobs.return_value.by_page.return_value = _TestPager(
+        [_named_mocks("blob1", "blob2"), _named_mocks("blob3")], ["token-1", None]
+    )
 
     object_storage_account = "some-resource-location"
     object_container = "some-container-name"
@@ -424,13 +622,131 @@ def test_azure_list_objects(mock_get_client):
         object_storage_account, mock_cred_manager
     )
 
-    blob_list = phdi_container_client.list_objects(object_container, object_prefix)
+    blob_pages = phdi_container_client.list_object_pages(
+        object_container, object_prefix, page_size=2
+    )
+    assert next(blob_pages) == ListingPage(["blob1", "blob2"], "token-1")
 
     mock_get_client.assert_called_with(f"{object_storage_account}/{object_container}")
 
-    mock_client.list_blobs.assert_called_with(name_starts_with=object_prefix)
+    mock_client.list_blobs.assert_called_with(
+        name_starts_with=object_prefix, results_per_page=2
+    )
+    mock_client.list_blobs.return_value.by_page.assert_called_with(
+        continuation_token=None
+    )
+
+    assert list(blob_pages) == [ListingPage(["blob3"], None)]
+
+    mock_client.list_blobs.return_value.by_page.return_value = _TestPager(
+        [_named_mocks("blob1", "blob2")], [None]
+    )
+    blob_list = phdi_container_client.list_objects(object_container, object_prefix)
+    assert list(blob_list) == ["blob1", "blob2"]
+    mock_client.list_blobs.assert_called_with(
+        name_starts_with=object_prefix, results_per_page=None
+    )
+
+
+@mock.patch("phdi.cloud.azure.BlobServiceClient")
+@mock.patch.object(ContainerClient, "from_container_url")
+def test_azure_client_reuse(mock_get_client, mock_service_client):
+    mock_cred_manager = mock.Mock()
+    phdi_container_client = AzureCloudContainerConnection(
+        "some-resource-location", mock_cred_manager
+    )
+
+    for _ in range(3):
+        phdi_container_client.upload_object("hello", "container-1", "some-file")
+        list(phdi_container_client.list_containers())
+    phdi_container_client.upload_object("hello", "container-2", "some-file")
+
+    # Clients are created once per container, and share a credential object and
+    # transport
+    assert mock_get_client.call_count == 2
+    mock_service_client.assert_called_once()
+    mock_cred_manager.get_credential_object.assert_called_once()
+    transports = {
+        call.kwargs["transport"]
+        for call in mock_get_client.call_args_list + mock_service_client.call_args_list
+    }
+    assert len(transports) == 1
+
+
+def test_upload_objects():
+    connection = _TestStorageConnection()
+    connection.upload_objects(
+        (
+            (f"message {index}", "some-container", f"file-{index}")
+            for index in range(50)
+        ),
+        max_concurrency=4,
+    )
+    assert len(connection.objects) == 50
+    assert connection.objects[("some-container", "file-7")] == "message 7"
+
+    def failing_upload(message, container_name, filename):
+        raise ConnectionError
+
+    connection.upload_object = failing_upload
+    with pytest.raises(ConnectionError):
+        connection.upload_objects([("message", "some-container", "some-file")])
+
+
+def test_default_listing_pages():
+    connection = _TestStorageConnection()
+    for index in range(5):
+        connection.upload_object("", "some-container", f"file-{index}")
+
+    pages = list(connection.list_object_pages("some-container", page_size=2))
+    assert pages == [
+        ListingPage(["file-0", "file-1"], "file-1"),
+        ListingPage(["file-2", "file-3"], "file-3"),
+        ListingPage(["file-4"], None),
+    ]
+
+    # Listings resume after the page a continuation token came from
+    assert list(
+        connection.list_object_pages(
+            "some-container", page_size=3, continuation_token="file-1"
+        )
+    ) == [ListingPage(["file-2", "file-3", "file-4"], None)]
+    assert list(connection.list_container_pages()) == [
+        ListingPage(["some-container"], None)
+    ]
+
+
+def test_list_objects_parallel():
+    connection = MemoryCloudStorageConnection()
+    names = [f"{prefix}/file-{index:02}" for prefix in "abcdef" for index in range(25)]
+    for name in names:
+        connection.upload_object("", "some-container", name)
+    connection.upload_object("", "some-container", "z/not-listed")
+
+    listed = list(
+        connection.list_objects_parallel(
+            "some-container", (f"{prefix}/" for prefix in "abcdef"), page_size=10
+        )
+    )
+    assert sorted(listed) == names
+    # Names under each prefix keep their order
+    assert [name for name in listed if name.startswith("c/")] == names[50:75]
+
+    # Listing can stop early
+    listed = connection.list_objects_parallel(
+        "some-container", ["a/", "b/"], page_size=1, max_concurrency=1
+    )
+    assert next(listed) == "a/file-00"
+    listed.close()
 
-    assert blob_list == ["blob1", "blob2"]
+    def failing_pages(container_name, prefix, page_size=None):
+        if prefix == "b/":
+            raise ConnectionError
+        return iter([ListingPage([f"{prefix}file"], None)])
+
+    connection.list_object_pages = failing_pages
+    with pytest.raises(ConnectionError):
+        list(connection.list_objects_parallel("some-container", ["a/", "b/", "c/"]))
 
 
 def test_gcp_storage_connect_init():
@@ -507,37 +823,294 @@ def test_gcp_download_object(mock_get_client):
 
 @mock.patch.object(GcpCloudStorageConnection, "_get_storage_client")
 def test_gcp_list_objects(mock_get_client):
-    item1 = mock.Mock()
-    item1.name = "blob1"
-    item2 = mock.Mock()
-    item2.name = "blob2"
-    mock_object_list = [item1, item2]
-
     mock_storage_client = mock.Mock()
     mock_get_client.return_value = mock_storage_client
-    mock_storage_client.list_blobs.return_value = mock_object_list
+    mock_storage_client.list_blobs.return_value = _TestPager(
+        [_named_mocks("blob1"), _named_mocks("blob2")], ["token-1", None]
+    )
 
     object_bucket = "some-container"
     phdi_storage_client = GcpCloudStorageConnection()
     blob_list = phdi_storage_client.list_objects(object_bucket)
 
-    mock_storage_client.list_blobs.assert_called_with(object_bucket, prefix="")
-    assert blob_list == ["blob1", "blob2"]
+    # Objects aren't listed until they're consumed
+    mock_storage_client.list_blobs.assert_not_called()
+    assert list(blob_list) == ["blob1", "blob2"]
+    mock_storage_client.list_blobs.assert_called_with(
+        object_bucket, prefix="", page_size=None, page_token=None
+    )
+
+    mock_storage_client.list_blobs.return_value = _TestPager(
+        [_named_mocks("blob2")], [None]
+    )
+    assert list(
+        phdi_storage_client.list_object_pages(
+            object_bucket, "blob", page_size=1, continuation_token="token-1"
+        )
+    ) == [ListingPage(["blob2"], None)]
+    mock_storage_client.list_blobs.assert_called_with(
+        object_bucket, prefix="blob", page_size=1, page_token="token-1"
+    )
 
 
 @mock.patch.object(GcpCloudStorageConnection, "_get_storage_client")
 def test_gcp_list_containers(mock_get_client):
-    item1 = "blob1"
-    item2 = "blob2"
-    mock_bucket_list = [item1, item2]
-
     mock_storage_client = mock.Mock()
     mock_get_client.return_value = mock_storage_client
-    mock_storage_client.list_buckets.return_value = mock_bucket_list
+    mock_storage_client.list_buckets.return_value = _TestPager(
+        [_named_mocks("bucket1", "bucket2")], [None]
+    )
 
     phdi_storage_client = GcpCloudStorageConnection()
     bucket_list = phdi_storage_client.list_containers()
 
-    mock_storage_client.list_buckets.assert_called_with()
+    # Bucket names are listed, rather than buckets
+    assert list(bucket_list) == ["bucket1", "bucket2"]
+
+    mock_storage_client.list_buckets.assert_called_with(page_size=None, page_token=None)
+
+
+def test_default_object_streams():
+    connection = _TestStorageConnection()
+    connection.upload_object_stream(
+        ["{}\n", b'{"a": "\xc3\xa9"}\n'], "some-container", "some.ndjson"
+    )
+    assert connection.objects[("some-container", "some.ndjson")] == '{}\n{"a": "é"}\n'
+
+    chunks = list(
+        connection.download_object_stream("some-container", "some.ndjson", chunk_size=4)
+    )
+    assert chunks == [b"{}\n{", b'"a":', b' "\xc3\xa9', b'"}\n']
+    assert list(
+        connection.download_object_lines("some-container", "some.ndjson", chunk_size=4)
+    ) == ["{}\n", '{"a": "é"}\n']
+
+
+def test_rechunk():
+    assert list(phdi.cloud.core._rechunk([b"abc", b"", b"defgh", b"i"], 4)) == [
+        b"abcd",
+        b"efgh",
+        b"i",
+    ]
+    assert list(phdi.cloud.core._rechunk([], 4)) == []
+
+
+@mock.patch.object(AzureCloudContainerConnection, "_get_container_client")
+def test_azure_download_object_stream(mock_get_client):
+    content = b"MSH|1\rPID|1\nMSH|2\rPID|2\n"
+    mock_blob_client = mock.Mock()
+    mock_blob_client.get_blob_properties.return_value = mock.Mock(
+        size=len(content), etag="some-etag"
+    )
+    mock_blob_client.download_blob.side_effect = lambda offset, length, **kwargs: (
+        mock.Mock(readall=lambda: content[offset : offset + length])
+    )
+    mock_get_client.return_value.get_blob_client.return_value = mock_blob_client
+
+    phdi_container_client = AzureCloudContainerConnection(
+        "some-resource-location", mock.Mock()
+    )
+    chunks = list(
+        phdi_container_client.download_object_stream(
+            "some-container", "some-batch.hl7", chunk_size=10, max_concurrency=2
+        )
+    )
+    assert chunks == [content[0:10], content[10:20], content[20:]]
+    assert mock_blob_client.download_blob.call_args.kwargs["etag"] == "some-etag"
+
+    lines = phdi_container_client.download_object_lines(
+        "some-container", "some-batch.hl7", chunk_size=10
+    )
+    assert list(lines) == ["MSH|1\rPID|1\n", "MSH|2\rPID|2\n"]
+
+
+@mock.patch.object(AzureCloudContainerConnection, "_get_container_client")
+def test_azure_upload_object_stream(mock_get_client):
+    mock_blob_client = mock.Mock()
+    mock_get_client.return_value.get_blob_client.return_value = mock_blob_client
+    phdi_container_client = AzureCloudContainerConnection(
+        "some-resource-location", mock.Mock()
+    )
+
+    # Content that fits in one block is uploaded in one request
+    phdi_container_client.upload_object_stream(
+        ["hello ", b"world"], "some-container", "some-file"
+    )
+    mock_blob_client.upload_blob.assert_called_once_with(b"hello world", overwrite=True)
+    mock_blob_client.stage_block.assert_not_called()
+
+    phdi_container_client.upload_object_stream(
+        ["hello ", b"world"], "some-container", "some-file", chunk_size=4
+    )
+    staged = {
+        call.args[0]: call.args[1]
+        for call in mock_blob_client.stage_block.call_args_list
+    }
+    committed = mock_blob_client.commit_block_list.call_args.args[0]
+    assert [staged[block.id] for block in committed] == [b"hell", b"o wo", b"rld"]
 
-    assert bucket_list == ["blob1", "blob2"]
+
+@mock.patch.object(GcpCloudStorageConnection, "_get_storage_client")
+def test_gcp_download_object_stream(mock_get_client):
+    content = b'{"a": 1}\n{"b": 2}\n'
+    mock_blob = mock.Mock(size=len(content), generation=7)
+    mock_blob.download_as_bytes.side_effect = lambda start, end, **kwargs: content[
+        start : end + 1
+    ]
+    mock_get_client.return_value.bucket.return_value.blob.return_value = mock_blob
+
+    phdi_container_client = GcpCloudStorageConnection()
+    lines = phdi_container_client.download_object_lines(
+        "some-bucket", "some.ndjson", chunk_size=4
+    )
+    assert list(lines) == ['{"a": 1}\n', '{"b": 2}\n']
+    mock_blob.reload.assert_called_once()
+    mock_blob.download_as_bytes.assert_called_with(
+        start=16, end=17, if_generation_match=7
+    )
+
+
+@mock.patch.object(GcpCloudStorageConnection, "_get_storage_client")
+def test_gcp_upload_object_stream(mock_get_client, monkeypatch):
+    monkeypatch.setattr(phdi.cloud.gcp, "GCP_MAX_COMPOSE_SOURCES", 2)
+    blobs = {}
+    mock_bucket = mock.Mock()
+    mock_bucket.blob.side_effect = lambda name: blobs.setdefault(
+        name, mock.Mock(name=name)
+    )
+    mock_get_client.return_value.bucket.return_value = mock_bucket
+
+    phdi_container_client = GcpCloudStorageConnection()
+    phdi_container_client.upload_object_stream(
+        (line for line in ["ab", "cd", "ef"]),
+        "some-bucket",
+        "some-file",
+        chunk_size=2,
+    )
+
+    parts = [
+        blob
+        for name, blob in blobs.items()
+        if name != "some-file" and "composed" not in name
+    ]
+    assert [part.upload_from_string.call_args.kwargs["data"] for part in parts] == [
+        b"ab",
+        b"cd",
+        b"ef",
+    ]
+    # Three parts are composed in two levels, and every temporary blob is deleted
+    blobs["some-file"].compose.assert_called_once()
+    assert len(blobs["some-file"].compose.call_args.args[0]) == 2
+    deleted = mock_bucket.delete_blobs.call_args.args[0]
+    assert set(deleted) == set(blobs.values()) - {blobs["some-file"]}
+
+
+def test_local_storage_connection(tmp_path):
+    connection = LocalCloudStorageConnection(str(tmp_path))
+    assert list(connection.list_containers()) == []
+
+    connection.upload_object({"hello": "world"}, "some-container", "a/b.json")
+    connection.upload_object_stream(
+        (line for line in ["{}\n", b"{}\n"]), "some-container", "c.ndjson"
+    )
+    assert list(connection.list_containers()) == ["some-container"]
+    assert list(connection.list_objects("some-container")) == ["a/b.json", "c.ndjson"]
+    assert list(connection.list_objects("some-container", prefix="a/")) == ["a/b.json"]
+
+    assert json.loads(connection.download_object("some-container", "a/b.json")) == {
+        "hello": "world"
+    }
+    assert list(
+        connection.download_object_stream("some-container", "c.ndjson", chunk_size=2)
+    ) == [b"{}", b"\n{", b"}\n"]
+    assert list(connection.download_object_lines("some-container", "c.ndjson")) == [
+        "{}\n",
+        "{}\n",
+    ]
+
+    # Failed writes leave any previous object in place
+    def failing_chunks():
+        yield "partial"
+        raise RuntimeError
+
+    with pytest.raises(RuntimeError):
+        connection.upload_object_stream(failing_chunks(), "some-container", "c.ndjson")
+    assert connection.download_object("some-container", "c.ndjson") == "{}\n{}\n"
+    assert list(connection.list_objects("some-container")) == ["a/b.json", "c.ndjson"]
+
+    with pytest.raises(ValueError):
+        connection.download_object("some-container", "../outside")
+
+
+def test_local_storage_connection_reads(tmp_path):
+    connection = LocalCloudStorageConnection(str(tmp_path))
+    connection.upload_object("MSH|1\rPID|1\nMSH|2\rPID|é", "some-container", "a.hl7")
+    connection.upload_object("", "some-container", "empty.txt")
+    for name in ["a/b/c.json", "a/bc.json", "a/d/e.json", "ab.json"]:
+        connection.upload_object({}, "some-container", name)
+
+    assert list(connection.download_object_lines("some-container", "a.hl7")) == [
+        "MSH|1\rPID|1\n",
+        "MSH|2\rPID|é",
+    ]
+    assert connection.download_object("some-container", "empty.txt") == ""
+    assert list(connection.download_object_lines("some-container", "empty.txt")) == []
+    assert list(connection.download_object_stream("some-container", "empty.txt")) == []
+
+    assert list(connection.list_objects("some-container", prefix="a/b")) == [
+        "a/b/c.json",
+        "a/bc.json",
+    ]
+    assert list(connection.list_objects("some-container", prefix="a/d/")) == [
+        "a/d/e.json"
+    ]
+    assert list(connection.list_objects("some-container", prefix="x/")) == []
+
+    # Objects are listed in the order of their full names
+    connection.upload_object({}, "some-container", "a-b.json")
+    assert list(connection.list_objects("some-container", prefix="a")) == [
+        "a-b.json",
+        "a.hl7",
+        "a/b/c.json",
+        "a/bc.json",
+        "a/d/e.json",
+        "ab.json",
+    ]
+    assert list(connection.list_objects("other-container")) == []
+
+    with pytest.raises(FileNotFoundError):
+        connection.download_object("some-container", "missing.json")
+
+
+def test_memory_storage_connection():
+    connection = MemoryCloudStorageConnection()
+    assert list(connection.list_containers()) == []
+
+    connection.upload_object({"hello": "world"}, "some-container", "a/b.json")
+    connection.upload_object_stream(
+        (line for line in ["{}\n", b"{}\n"]), "some-container", "c.ndjson"
+    )
+    connection.upload_object("hello", "other-container", "d.txt")
+    assert list(connection.list_containers()) == ["other-container", "some-container"]
+    assert list(connection.list_objects("some-container")) == ["a/b.json", "c.ndjson"]
+    assert list(connection.list_objects("some-container", prefix="a/")) == ["a/b.json"]
+
+    assert json.loads(connection.download_object("some-container", "a/b.json")) == {
+        "hello": "world"
+    }
+    assert list(
+        connection.download_object_stream("some-container", "c.ndjson", chunk_size=2)
+    ) == [b"{}", b"\n{", b"}\n"]
+    assert list(connection.download_object_lines("some-container", "c.ndjson")) == [
+        "{}\n",
+        "{}\n",
+    ]
+
+    with pytest.raises(FileNotFoundError):
+        connection.download_object("some-container", "d.txt")
+
+
+def test_local_credential_manager():
+    cred_manager = LocalCredentialManager("some-token")
+    assert cred_manager.get_access_token() == "some-token"
+    assert cred_manager.get_credential_object() is None
@@ -0,0 +1,234 @@
+from unittest import mock
+import threading
+import time
+
+import pytest
+import requests
+
+from phdi.fhir.geospatial.core import BaseFhirGeocodeClient
+from phdi.fhir.geospatial.executor import FhirGeocodeExecutor, TokenBucket
+
+
+class _TestFhirGeocodeClient(BaseFhirGeocodeClient):
+    """
+    Geocodes addresses by upper-casing their lines, recording the bundles it was
+    asked to geocode and the lines it looked up in each. It fails `flaky_failures`
+    times for each resource with a "FLAKY" address, along with the rest of its
+    bundle.
+    """
+
+    def __init__(self, batch_size=1, flaky_failures=1):
+        self.bundles = []
+        self.lookups = []
+        self.running = 0
+        self.max_running = 0
+        self.failures = {}
+        self.flaky_failures = flaky_failures
+        self.lock = threading.Lock()
+        self.__batch_size = batch_size
+
+    @property
+    def batch_size(self) -> int:
+        return self.__batch_size
+
+    def geocode_resource(self, resource: dict, overwrite=True) -> dict:
+        for address in resource.get("address", []):
+            address["line"] = [line.upper() for line in address["line"]]
+        return resource
+
+    def geocode_bundle(self, bundle: dict, overwrite=True) -> dict:
+        assert not overwrite
+        with self.lock:
+            self.bundles.append(bundle)
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        time.sleep(0.02)
+        with self.lock:
+            self.running -= 1
+
+        lines = [
+            line
+            for entry in bundle["entry"]
+            for address in entry["resource"]["address"]
+            for line in address["line"]
+        ]
+        with self.lock:
+            self.lookups.append(lines)
+        for entry in bundle["entry"]:
+            if "FLAKY" in entry["resource"]["address"][0]["line"]:
+                with self.lock:
+                    failures = self.failures.get(id(entry["resource"]), 0)
+                    self.failures[id(entry["resource"])] = failures + 1
+                if failures < self.flaky_failures:
+                    raise requests.ConnectionError()
+        if "BROKEN" in lines:
+            raise ValueError("Address must include street number and name")
+
+        return {
+            "entry": [
+                {"resource": self.geocode_resource(dict(entry["resource"]))}
+                for entry in bundle["entry"]
+            ]
+        }
+
+
+def _patient_bundle(lines):
+    return {
+        "resourceType": "Bundle",
+        "entry": [
+            {
+                "resource": {
+                    "resourceType": "Patient",
+                    "id": str(index),
+                    "address": [{"line": [line]}],
+                }
+            }
+            for index, line in enumerate(lines)
+        ]
+        + [{"resource": {"resourceType": "Observation"}}],
+    }
+
+
+@mock.patch("phdi.fhir.geospatial.executor.random")
+def test_geocode_bundles(patched_random):
+    patched_random.uniform.return_value = 0
+    client = _TestFhirGeocodeClient()
+    executor = FhirGeocodeExecutor(client, max_workers=3, chunk_size=2)
+
+    bundles = [
+        _patient_bundle([f"{number} fake st" for number in range(7)]),
+        _patient_bundle(["1 fake st", "FLAKY"]),
+    ]
+    patients = [entry["resource"] for entry in bundles[0]["entry"]]
+    returned_bundles = executor.geocode_bundles(bundles)
+
+    assert returned_bundles is bundles
+    assert [
+        entry["resource"]["address"][0]["line"] for entry in bundles[0]["entry"][:-1]
+    ] == [[f"{number} FAKE ST"] for number in range(7)]
+    assert bundles[0]["entry"][-1] == {"resource": {"resourceType": "Observation"}}
+
+    # Resources are updated in place and keep their order
+    assert [entry["resource"] for entry in bundles[0]["entry"]] == patients
+    assert all(
+        entry["resource"] is patient
+        for entry, patient in zip(bundles[0]["entry"], patients)
+    )
+
+    # Entries with addresses are geocoded in chunks, in parallel, and the entries
+    # in the flaky chunk are retried one at a time
+    assert len(client.bundles) == 7
+    assert client.max_running == 3
+    assert executor.lookups_completed == 9
+    assert executor.queue_depth == 0
+    assert executor.in_flight == 0
+    assert executor.throughput > 0
+
+
+def test_geocode_bundles_default_concurrency():
+    client = _TestFhirGeocodeClient()
+    executor = FhirGeocodeExecutor(client)
+    bundle = _patient_bundle([f"{number} fake st" for number in range(8)])
+
+    # Clients that don't geocode in batches have their entries geocoded one at a
+    # time, several at once
+    executor.geocode_bundle(bundle)
+    assert len(client.bundles) == 8
+    assert client.max_running > 1
+    assert executor.lookups_completed == 8
+
+    # Clients that do are sent whole batches
+    client = _TestFhirGeocodeClient(batch_size=100)
+    FhirGeocodeExecutor(client).geocode_bundle(bundle)
+    assert len(client.bundles) == 1
+
+
+@mock.patch("phdi.fhir.geospatial.executor.random")
+def test_geocode_bundles_retries_failed_entries(patched_random):
+    patched_random.uniform.return_value = 0
+    client = _TestFhirGeocodeClient(batch_size=100, flaky_failures=2)
+    rate_limiter = mock.Mock()
+    executor = FhirGeocodeExecutor(client, rate_limiter=rate_limiter)
+    bundle = _patient_bundle(["1 fake st", "FLAKY", "2 fake st"])
+
+    executor.geocode_bundle(bundle)
+    assert [
+        entry["resource"]["address"][0]["line"] for entry in bundle["entry"][:-1]
+    ] == [["1 FAKE ST"], ["FLAKY"], ["2 FAKE ST"]]
+
+    # The failed batch is retried one entry at a time, and entries that succeed
+    # aren't looked up or paid for again
+    assert client.lookups == [
+        ["1 fake st", "FLAKY", "2 fake st"],
+        ["1 fake st"],
+        ["FLAKY"],
+        ["2 fake st"],
+        ["FLAKY"],
+    ]
+    assert rate_limiter.acquire.call_args_list == [
+        mock.call(3),
+        mock.call(1),
+        mock.call(1),
+        mock.call(1),
+        mock.call(1),
+    ]
+    assert executor.lookups_completed == 3
+
+
+def test_geocode_bundle_errors():
+    client = _TestFhirGeocodeClient()
+    executor = FhirGeocodeExecutor(client, chunk_size=1)
+    bundle = _patient_bundle(["1 fake st", "BROKEN"])
+
+    # Errors that aren't transient aren't retried
+    with pytest.raises(ValueError):
+        executor.geocode_bundle(bundle, overwrite=False)
+    assert len(client.bundles) == 2
+    assert bundle["entry"][0]["resource"]["address"][0]["line"] == ["1 fake st"]
+
+    with pytest.raises(ValueError):
+        FhirGeocodeExecutor(client, max_workers=0)
+
+
+@mock.patch("phdi.fhir.geospatial.executor.time")
+def test_token_bucket(patched_time):
+    now = [0.0]
+    patched_time.monotonic.side_effect = lambda: now[0]
+
+    def sleep(seconds):
+        now[0] += seconds
+
+    patched_time.sleep.side_effect = sleep
+
+    bucket = TokenBucket(rate=10, capacity=20)
+
+    # A full bucket allows a burst, after which tokens are added at the rate
+    bucket.acquire(20)
+    assert now[0] == 0
+    bucket.acquire(5)
+    assert now[0] == pytest.approx(0.5)
+
+    # Requests for more tokens than the bucket holds are paid in installments
+    bucket.acquire(100)
+    assert now[0] == pytest.approx(10.5)
+
+    with pytest.raises(ValueError):
+        TokenBucket(rate=0)
+
+
+def test_geocode_bundles_rate_limited():
+    client = _TestFhirGeocodeClient()
+    rate_limiter = TokenBucket(rate=1000, capacity=100)
+    executor = FhirGeocodeExecutor(
+        client, max_workers=4, rate_limiter=rate_limiter, chunk_size=250
+    )
+    bundle = _patient_bundle([f"{number} fake st" for number in range(1000)])
+
+    # Chunks larger than the bucket still pay for every address they geocode,
+    # so lookups beyond the initial burst are limited to the rate
+    started_at = time.monotonic()
+    executor.geocode_bundle(bundle)
+    elapsed = time.monotonic() - started_at
+    assert executor.lookups_completed == 1000
+    assert executor.lookups_completed <= rate_limiter.capacity + elapsed * 1000
+    assert elapsed >= 0.85
@@ -107,9 +107,74 @@ def test_geocode_bundle():
         }
     )
 
-    smarty_client.geocode_client.geocode_from_str = mock.Mock()
-    smarty_client.geocode_client.geocode_from_str.return_value = geocoded_response
+    smarty_client.geocode_client.geocode_many = mock.Mock()
+    smarty_client.geocode_client.geocode_many.side_effect = lambda addresses: [
+        geocoded_response
+    ] * len(addresses)
     returned_bundle = smarty_client.geocode_bundle(bundle, overwrite=False)
     assert standardized_bundle == returned_bundle
     assert bundle != standardized_bundle
-    smarty_client.geocode_client.geocode_from_str.assert_called()
+    smarty_client.geocode_client.geocode_many.assert_called_once()
+
+
+def test_geocode_bundles():
+    auth_id = mock.Mock()
+    auth_token = mock.Mock()
+    smarty_client = SmartyFhirGeocodeClient(auth_id, auth_token)
+
+    def geocode_many(addresses):
+        return [
+            None
+            if "Nowhere" in address
+            else GeocodeResult(
+                line=[address.split(" ,")[0].upper()],
+                city="New York",
+                state="NY",
+                lat=45.123,
+                lng=-70.234,
+                county_fips="36061",
+                postal_code="10001",
+            )
+            for address in addresses
+        ]
+
+    smarty_client.geocode_client.geocode_many = mock.Mock(side_effect=geocode_many)
+
+    bundles = [
+        {
+            "entry": [
+                {
+                    "resource": {
+                        "resourceType": "Patient",
+                        "address": [{"line": [f"{number} Fake St"]}],
+                    }
+                }
+                for number in range(3)
+            ]
+            + [{"resource": {"resourceType": "Observation"}}]
+        },
+        {
+            "entry": [
+                {
+                    "resource": {
+                        "resourceType": "Patient",
+                        "address": [
+                            {"line": ["1 Fake St"]},
+                            {"line": ["1 Nowhere Rd"]},
+                        ],
+                    }
+                }
+            ]
+        },
+    ]
+    returned_bundles = smarty_client.geocode_bundles(bundles)
+
+    # Every address across the bundles is geocoded with one call
+    smarty_client.geocode_client.geocode_many.assert_called_once()
+    assert len(smarty_client.geocode_client.geocode_many.call_args[0][0]) == 5
+    assert returned_bundles is bundles
+    assert bundles[0]["entry"][2]["resource"]["address"][0]["line"] == ["2 FAKE ST"]
+    assert bundles[1]["entry"][0]["resource"]["address"][0]["line"] == ["1 FAKE ST"]
+    assert bundles[1]["entry"][0]["resource"]["address"][1] == {
+        "line": ["1 Nowhere Rd"]
+    }
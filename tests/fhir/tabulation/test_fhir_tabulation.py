@@ -4,9 +4,12 @@ import os
 import os.path
 import pytest
 import urllib.parse
+import requests
 import yaml
 import csv
+import threading
 
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from unittest import mock
 from requests.models import Response
 
@@ -15,6 +18,7 @@ from phdi.fhir.tabulation.tables import (
     drop_invalid,
     tabulate_data,
     generate_tables,
+    generate_tables_from_export,
     _get_reference_directions,
     _build_reference_dicts,
     _generate_search_url,
@@ -24,7 +28,14 @@ from phdi.fhir.tabulation.tables import (
     extract_data_from_fhir_search,
     extract_data_from_schema,
     _merge_include_query_params_for_location,
+    _compile_table_plan,
+    _is_invalid_value,
+    tabulate_deferred_data,
+    _generate_scan_plans,
+    _ScanPlan,
 )
+from phdi.fhir.tabulation.references import ReferenceStore
+from phdi.tabulation.tables import write_data
 
 
 def test_apply_selection_criteria():
@@ -544,6 +555,180 @@ def test_drop_invalid():
     assert tabulated_data["table 2A"][1][0] == dropped_user_value[1][0]
 
 
+def test_tabulate_data_drops_invalid_rows():
+    schema = yaml.safe_load(
+        open(
+            pathlib.Path(__file__).parent.parent.parent
+            / "assets"
+            / "tabulation_schema.yaml"
+        )
+    )
+    extracted_data = json.load(
+        open(
+            pathlib.Path(__file__).parent.parent.parent
+            / "assets"
+            / "FHIR_server_extracted_data.json"
+        )
+    )
+
+    schema["tables"]["Physical Exams"]["columns"]["Last Name"]["invalid_values"] = [
+        "Shepard",
+        None,
+    ]
+    # Lists of reverse-referenced values are never treated as invalid
+    schema["tables"]["Physical Exams"]["columns"]["Exam ID"]["invalid_values"] = [
+        "obs1"
+    ]
+    tabulated_exam_data = tabulate_data(
+        extracted_data["entry"], schema, "Physical Exams"
+    )
+    assert tabulated_exam_data == [
+        ["Last Name", "City", "Exam ID", "General Practitioner"],
+        ["Price929", "Waltham", ["obs1"], "i-am-not-a-robot"],
+    ]
+
+
+def test_tabulate_data_with_reference_store():
+    schema = yaml.safe_load(
+        open(
+            pathlib.Path(__file__).parent.parent.parent
+            / "assets"
+            / "tabulation_schema.yaml"
+        )
+    )
+    entries = json.load(
+        open(
+            pathlib.Path(__file__).parent.parent.parent
+            / "assets"
+            / "FHIR_server_extracted_data.json"
+        )
+    )["entry"]
+
+    # The observations and practitioners referenced by each patient arrive on a
+    # later page than the patients themselves
+    pages = [
+        [e for e in entries if e["resource"]["resourceType"] == "Patient"],
+        [e for e in entries if e["resource"]["resourceType"] != "Patient"],
+    ]
+    reference_store = ReferenceStore(max_resources_in_memory=2)
+    for page in pages:
+        # Rows of tables with referenced columns are deferred
+        assert tabulate_data(page, schema, "Physical Exams", reference_store) == [
+            ["Last Name", "City", "Exam ID", "General Practitioner"]
+        ]
+    deferred_batches = list(
+        tabulate_deferred_data(schema, "Physical Exams", reference_store, 2)
+    )
+    reference_store.close()
+
+    expected = tabulate_data(entries, schema, "Physical Exams")
+    assert [len(batch) for batch in deferred_batches] == [3, 2]
+    assert deferred_batches[0] + deferred_batches[1][1:] == expected
+
+    # Rows of tables without referenced columns are tabulated straight away
+    reference_store = ReferenceStore()
+    assert tabulate_data(pages[0], schema, "Patients", reference_store) == (
+        tabulate_data(pages[0], schema, "Patients")
+    )
+    assert list(tabulate_deferred_data(schema, "Patients", reference_store)) == []
+    reference_store.close()
+
+
+def test_compile_table_plan():
+    schema = yaml.safe_load(
+        open(
+            pathlib.Path(__file__).parent.parent.parent
+            / "assets"
+            / "tabulation_schema.yaml"
+        )
+    )
+
+    plan = _compile_table_plan(schema, "Patients")
+    assert plan.table_name == "Patients"
+    assert plan.anchor_type == "Patient"
+    assert plan.headers == [
+        "Patient ID",
+        "First Name",
+        "Last Name",
+        "Phone Number",
+        "Building Number",
+    ]
+    assert plan.columns[0].fhir_path == "Patient.id"
+    assert plan.columns[0].selection_criteria == "first"
+    assert plan.columns[1].invalid_values == frozenset([None, "", "Unknown"])
+    assert plan.columns[2].invalid_values == frozenset()
+
+    with pytest.raises(KeyError):
+        _compile_table_plan(schema, "invalid name")
+
+
+def test_generate_scan_plans():
+    search_urls = {
+        "Patients": "Patient?_count=1000",
+        "Exams": "Patient?_revinclude=Observation%3Asubject&_count=1000",
+        "Practitioners": "Patient?_include=Patient%3Ageneral-practitioner&_count=1000",
+        "Recent Patients": "Patient?_count=1000&_since=2020-01-01",
+        "Observations": "Observation?_count=1000",
+    }
+    assert _generate_scan_plans(search_urls) == [
+        _ScanPlan(
+            search_url="Patient?_count=1000&_revinclude=Observation%3Asubject"
+            "&_include=Patient%3Ageneral-practitioner",
+            table_names=("Patients", "Exams", "Practitioners"),
+        ),
+        _ScanPlan(
+            search_url="Patient?_count=1000&_since=2020-01-01",
+            table_names=("Recent Patients",),
+        ),
+        _ScanPlan(search_url="Observation?_count=1000", table_names=("Observations",)),
+    ]
+
+
+@mock.patch("phdi.fhir.tabulation.tables.extract_data_from_fhir_search_incremental")
+def test_generate_tables_single_scan(patch_search_incremental, tmp_path):
+    schema_path = (
+        pathlib.Path(__file__).parent.parent.parent / "assets" / "valid_schema.json"
+    )
+    output_params = {
+        table_name: {
+            "directory": str(tmp_path),
+            "output_type": "csv",
+            "filename": f"{table_name}.csv",
+        }
+        for table_name in ["table 1A", "table 2A"]
+    }
+    entries = json.load(
+        open(
+            pathlib.Path(__file__).parent.parent.parent
+            / "assets"
+            / "FHIR_server_extracted_data.json"
+        )
+    )["entry"]
+    patch_search_incremental.side_effect = [(entries, "page-2"), (entries, None)]
+
+    generate_tables(schema_path, output_params, "https://some_fhir_server_url")
+
+    # Both tables are anchored on patients with the same search criteria, so each
+    # page is only fetched once
+    assert patch_search_incremental.call_count == 2
+    schema = json.load(open(schema_path))
+    for table_name in ["table 1A", "table 2A"]:
+        with open(tmp_path / f"{table_name}.csv", "r") as csv_file:
+            rows = [row for row in csv.reader(csv_file, dialect="excel")]
+        assert rows[0] == list(schema["tables"][table_name]["columns"])
+    # "table 2A" resolves references across pages, so the patient repeated on the
+    # second page only generates one row
+    assert len(rows) == 2
+
+
+def test_is_invalid_value():
+    invalid_values = frozenset([None, "", "Unknown"])
+    assert _is_invalid_value(None, invalid_values)
+    assert _is_invalid_value("Unknown", invalid_values)
+    assert not _is_invalid_value("John", invalid_values)
+    assert not _is_invalid_value(["Unknown"], invalid_values)
+
+
 @mock.patch("phdi.fhir.tabulation.tables.http_request_with_reauth")
 def test_extract_data_from_fhir_search_incremental(patch_query):
     fhir_server_responses = json.load(
@@ -870,3 +1055,227 @@ def test_generate_tables(patch_search_incremental):
     # Remove file after testing is complete
     if os.path.isfile(physical_exams_path):  # pragma: no cover
         os.remove(physical_exams_path)
+
+
+@mock.patch("phdi.fhir.tabulation.tables.extract_data_from_fhir_search_incremental")
+def test_generate_tables_resumes_from_checkpoint(patch_search_incremental, tmp_path):
+    schema_path = (
+        pathlib.Path(__file__).parent.parent.parent
+        / "assets"
+        / "tabulation_schema.yaml"
+    )
+    output_params = {
+        "Patients": {
+            "directory": str(tmp_path),
+            "output_type": "csv",
+            "filename": "patients.csv",
+        },
+        "Physical Exams": {
+            "directory": str(tmp_path),
+            "output_type": "parquet",
+            "filename": "physical_exam.parquet",
+        },
+    }
+    checkpoint_path = tmp_path / "checkpoint.json"
+    entries = json.load(
+        open(
+            pathlib.Path(__file__).parent.parent.parent
+            / "assets"
+            / "FHIR_server_extracted_data.json"
+        )
+    )["entry"]
+
+    # The run is interrupted while fetching the fourth page of patients, after the
+    # third page was written but before it was checkpointed
+    patch_search_incremental.side_effect = [
+        (entries, "page-2"),
+        (entries, "page-3"),
+        (entries, "page-4"),
+        requests.exceptions.ConnectionError(),
+    ]
+    with pytest.raises(requests.exceptions.ConnectionError):
+        generate_tables(
+            schema_path,
+            output_params,
+            "https://some_fhir_server_url",
+            checkpoint_path=checkpoint_path,
+            checkpoint_interval=2,
+        )
+    checkpoint = json.load(open(checkpoint_path))
+    assert checkpoint["tables"]["Patients"]["next"] == "page-3"
+    assert checkpoint["tables"]["Patients"]["rows_written"] == 6
+    assert "Physical Exams" not in checkpoint["tables"]
+
+    patch_search_incremental.reset_mock()
+    patch_search_incremental.side_effect = [(entries, None), (entries, None)]
+    generate_tables(
+        schema_path,
+        output_params,
+        "https://some_fhir_server_url",
+        checkpoint_path=checkpoint_path,
+        checkpoint_interval=2,
+    )
+    assert (
+        patch_search_incremental.call_args_list[0].kwargs["search_url"]
+        == "https://some_fhir_server_url/page-3"
+    )
+    checkpoint = json.load(open(checkpoint_path))
+    assert checkpoint["tables"]["Patients"] == {
+        "next": None,
+        "rows_written": 9,
+        "writer": None,
+    }
+    assert checkpoint["tables"]["Physical Exams"]["next"] is None
+
+    # Each page of patients is written exactly once
+    with open(tmp_path / "patients.csv", "r") as csv_file:
+        rows = [row for row in csv.reader(csv_file, dialect="excel")]
+    with open(
+        pathlib.Path(__file__).parent.parent.parent
+        / "assets"
+        / "tabulated_patients.csv"
+    ) as csv_file:
+        expected_rows = [row for row in csv.reader(csv_file, dialect="excel")]
+    assert rows == expected_rows[:1] + expected_rows[1:] * 3
+    assert os.listdir(tmp_path / "physical_exam.parquet") == ["part-00000.parquet"]
+
+    # Running again with a complete checkpoint doesn't fetch or write anything
+    patch_search_incremental.reset_mock()
+    generate_tables(
+        schema_path,
+        output_params,
+        "https://some_fhir_server_url",
+        checkpoint_path=checkpoint_path,
+    )
+    patch_search_incremental.assert_not_called()
+
+    with pytest.raises(ValueError):
+        generate_tables(
+            schema_path, output_params, "https://some_fhir_server_url", None, None, 0
+        )
+
+
+@mock.patch("phdi.fhir.tabulation.tables.extract_data_from_fhir_search_incremental")
+def test_generate_tables_closes_outputs_on_error(patch_search_incremental, tmp_path):
+    schema_path = (
+        pathlib.Path(__file__).parent.parent.parent
+        / "assets"
+        / "tabulation_schema.yaml"
+    )
+    output_params = {
+        "Patients": {
+            "directory": str(tmp_path),
+            "output_type": "csv",
+            "filename": "patients.csv",
+        },
+        "Physical Exams": {
+            "directory": str(tmp_path),
+            "output_type": "csv",
+            "filename": "physical_exams.csv",
+        },
+    }
+    entries = json.load(
+        open(
+            pathlib.Path(__file__).parent.parent.parent
+            / "assets"
+            / "FHIR_server_extracted_data.json"
+        )
+    )["entry"]
+
+    # The tables written before the error are closed, so the rows of every page
+    # fetched are in their files
+    patch_search_incremental.side_effect = [
+        (entries, "page-2"),
+        requests.exceptions.ConnectionError(),
+    ]
+    with pytest.raises(requests.exceptions.ConnectionError):
+        generate_tables(schema_path, output_params, "https://some_fhir_server_url")
+
+    with open(tmp_path / "patients.csv", "r") as csv_file:
+        rows = [row for row in csv.reader(csv_file, dialect="excel")]
+    with open(
+        pathlib.Path(__file__).parent.parent.parent
+        / "assets"
+        / "tabulated_patients.csv"
+    ) as csv_file:
+        expected_rows = [row for row in csv.reader(csv_file, dialect="excel")]
+    assert rows == expected_rows
+
+
+def test_generate_tables_from_export(tmp_path):
+    schema_path = (
+        pathlib.Path(__file__).parent.parent.parent / "assets" / "valid_schema.json"
+    )
+    entries = json.load(
+        open(
+            pathlib.Path(__file__).parent.parent.parent
+            / "assets"
+            / "FHIR_server_extracted_data.json"
+        )
+    )["entry"]
+    files = {}
+    for entry in entries:
+        resource = entry["resource"]
+        files.setdefault(f"/{resource['resourceType']}.ndjson", []).append(
+            json.dumps(resource)
+        )
+
+    class ExportFileHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            content = "\n".join(files[self.path]).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), ExportFileHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    export_response = {
+        "output": [
+            {
+                "type": path[1:].split(".")[0],
+                "url": f"http://127.0.0.1:{server.server_address[1]}{path}",
+            }
+            for path in files
+        ]
+    }
+
+    output_params = {
+        table_name: {
+            "directory": str(tmp_path / "export"),
+            "output_type": "csv",
+            "filename": f"{table_name}.csv",
+        }
+        for table_name in ["table 1A", "table 2A"]
+    }
+    os.mkdir(tmp_path / "export")
+    os.mkdir(tmp_path / "search")
+    try:
+        generate_tables_from_export(
+            schema_path, output_params, export_response, batch_size=2
+        )
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    # Resources of every type are split across batches, but the tables hold the
+    # same rows as if the resources were tabulated at once
+    schema = json.load(open(schema_path))
+    for table_name in ["table 1A", "table 2A"]:
+        write_data(
+            tabulate_data(entries, schema, table_name),
+            str(tmp_path / "search"),
+            "csv",
+            filename=f"{table_name}.csv",
+        ).close()
+        with open(tmp_path / "export" / f"{table_name}.csv") as export_file, open(
+            tmp_path / "search" / f"{table_name}.csv"
+        ) as search_file:
+            export_lines = export_file.readlines()
+            search_lines = search_file.readlines()
+        assert export_lines[0] == search_lines[0]
+        assert sorted(export_lines[1:]) == sorted(search_lines[1:])
+        assert len(export_lines) > 1
@@ -0,0 +1,59 @@
+import os
+import pytest
+
+from phdi.fhir.tabulation.references import ReferenceStore
+
+
+def test_reference_store_spills_to_disk():
+    reference_store = ReferenceStore(max_resources_in_memory=3)
+    patient = {"resourceType": "Patient", "id": "p1"}
+    observations = [
+        {"resourceType": "Observation", "id": f"obs{i}", "subject": "Patient/p1"}
+        for i in range(3)
+    ]
+
+    reference_store.put_resource("Patient", "p1", patient, "match")
+    reference_store.defer_anchor("Patient", "p1")
+    reference_store.add_reverse_reference("Observation", "p1", observations[0])
+    assert reference_store.resources_in_memory == 0
+
+    # Storing the same resources again is idempotent, whether they're held in
+    # memory or have been spilled to disk
+    reference_store.add_reverse_reference("Observation", "p1", observations[0])
+    reference_store.add_reverse_reference("Observation", "p1", observations[1])
+    reference_store.add_reverse_reference("Observation", "p1", observations[2])
+    reference_store.defer_anchor("Patient", "p1")
+    assert reference_store.resources_in_memory == 1
+
+    assert reference_store.get_resource("Patient", "p1") == (patient, "match")
+    assert reference_store.get_resource("Patient", "p2") is None
+    assert reference_store.get_reverse_references("Observation", "p1") == observations
+    assert reference_store.get_reverse_references("Observation", "p2") == []
+    assert list(reference_store.deferred_anchors()) == [("Patient", "p1")]
+
+    path = reference_store.path
+    reference_store.close()
+    assert not os.path.isfile(path)
+
+    with pytest.raises(ValueError):
+        ReferenceStore(max_resources_in_memory=0)
+
+
+def test_reference_store_reopen(tmp_path):
+    path = str(tmp_path / "references.db")
+    patient = {"resourceType": "Patient", "id": "p1"}
+    observation = {"resourceType": "Observation", "subject": "Patient/p1"}
+
+    reference_store = ReferenceStore(path)
+    reference_store.put_resource("Patient", "p1", patient, "match")
+    reference_store.add_reverse_reference("Observation", "p1", observation)
+    assert reference_store.resources_in_memory == 2
+    reference_store.flush()
+    reference_store.close()
+
+    # A store with a path keeps its spilled resources when it is closed
+    reference_store = ReferenceStore(path)
+    assert reference_store.get_resource("Patient", "p1") == (patient, "match")
+    assert reference_store.get_reverse_references("Observation", "p1") == [observation]
+    reference_store.close()
+    assert os.path.isfile(path)
@@ -1,7 +1,7 @@
 import pathlib
 import pytest
 
-from phdi.fhir.conversion import convert_to_fhir
+from phdi.fhir.conversion import FhirConverterClient, convert_to_fhir
 from phdi.fhir.conversion.convert import ConversionError, _get_fhir_conversion_settings
 from phdi.harmonization import standardize_hl7_datetimes
 from unittest import mock
@@ -59,6 +59,29 @@ def test_get_fhir_conversion_settings():
     }
 
 
+def test_get_fhir_conversion_settings_sniffing():
+    # Only the MSH segment of an HL7 message is read
+    settings = _get_fhir_conversion_settings(
+        "MSH|^~\\&|||||||VXU^V04^VXU_V04|1|P|2.5.1\rPID|NOT VALID HL7"
+    )
+    assert settings == {"root_template": "VXU_V04", "input_type": "hl7v2"}
+
+    with pytest.raises(ConversionError, match="HL7 message structure"):
+        _get_fhir_conversion_settings("MSH|^~\\&|ADT1\rPID|1")
+
+    # Only the header of a CCDA document is parsed, so the rest of the document
+    # is never read
+    with open(
+        pathlib.Path(__file__).parent.parent / "assets" / "ccda_sample.xml"
+    ) as fp:
+        message = fp.read()
+    settings = _get_fhir_conversion_settings(message + "<unclosed>")
+    assert settings == {"root_template": "ProcedureNote", "input_type": "ccda"}
+
+    with pytest.raises(ConversionError, match="not a CCDA ClinicalDocument"):
+        _get_fhir_conversion_settings("<Bundle><code code='34133-9'/></Bundle>")
+
+
 @mock.patch("requests.Session")
 def test_convert_to_fhir_success_cred_manager(mock_requests_session):
     mock_requests_session_instance = mock_requests_session.return_value
@@ -228,3 +251,142 @@ def test_conversion_error():
 
     with pytest.raises(ConversionError, match="^some other message$"):
         raise ConversionError(mock_response, message="some other message")
+
+
+@mock.patch("requests.Session")
+def test_fhir_converter_client_convert(mock_requests_session):
+    mock_requests_session_instance = mock_requests_session.return_value
+    mock_requests_session_instance.post.side_effect = [
+        mock.Mock(status_code=401),
+        mock.Mock(status_code=200, json=lambda: {"resourceType": "Bundle"}),
+        mock.Mock(status_code=400),
+    ]
+    mock_cred_manager = mock.Mock()
+    mock_cred_manager.get_access_token.side_effect = [
+        "some-token",
+        "new-token",
+        "new-token",
+    ]
+
+    with open(pathlib.Path(__file__).parent.parent / "assets" / "sample_hl7.hl7") as fp:
+        message = fp.read()
+
+    with FhirConverterClient(
+        "some-converter-url", mock_cred_manager, headers={"X-Header": "value"}
+    ) as client:
+        response = client.convert(message)
+        assert response.json() == {"resourceType": "Bundle"}
+        mock_requests_session_instance.post.assert_called_with(
+            url="some-converter-url",
+            headers={"X-Header": "value", "Authorization": "Bearer new-token"},
+            json={
+                "input_data": standardize_hl7_datetimes(message),
+                "input_type": "hl7v2",
+                "root_template": "ORU_R01",
+            },
+        )
+
+        with pytest.raises(ConversionError):
+            client.convert(message)
+
+    # A single session is used for every conversion
+    assert mock_requests_session.call_count == 1
+    mock_requests_session_instance.close.assert_called_once()
+
+
+@mock.patch("requests.Session")
+def test_fhir_converter_client_convert_many(mock_requests_session):
+    mock_requests_session_instance = mock_requests_session.return_value
+
+    def post(url, headers, json):
+        if "FAIL" in json["input_data"]:
+            return mock.Mock(status_code=500)
+        return mock.Mock(status_code=200, json=lambda: {"resourceType": "Bundle"})
+
+    mock_requests_session_instance.post.side_effect = post
+
+    with open(pathlib.Path(__file__).parent.parent / "assets" / "sample_hl7.hl7") as fp:
+        message = fp.read()
+    messages = [message] * 10
+    messages[3] = "BAD Message Data"
+    messages[7] = message.replace("PID|", "PID|FAIL", 1)
+
+    client = FhirConverterClient("some-converter-url")
+    results = sorted(
+        client.convert_many(iter(messages), concurrency=3),
+        key=lambda result: result.index,
+    )
+    client.close()
+
+    assert [result.index for result in results] == list(range(10))
+    assert [result.error is None for result in results] == [
+        index not in (3, 7) for index in range(10)
+    ]
+    assert "unrecognized data type" in str(results[3].error)
+    assert results[7].error.http_response.status_code == 500
+    assert results[0].response.json() == {"resourceType": "Bundle"}
+
+    with pytest.raises(ValueError):
+        list(client.convert_many(messages, concurrency=0))
+
+
+@mock.patch("requests.Session")
+def test_fhir_converter_client_convert_batch(mock_requests_session):
+    mock_requests_session_instance = mock_requests_session.return_value
+    requests_made = []
+
+    def post(url, headers, json, stream):
+        requests_made.append(json)
+        if json["root_template"] == "ADT_A01":
+            return mock.MagicMock(status_code=500)
+        lines = [
+            b'{"index": %d, "response": {"Status": "OK", "FhirResource": {"id": "%d"}}}'
+            % (index, index)
+            for index in range(len(json["input_data"]))
+        ]
+        # The converter fails to convert the second message of the first batch
+        if len(requests_made) == 1:
+            lines[1] = b'{"index": 1, "response": {"returncode": 1, "stderr": "err"}}'
+        response = mock.MagicMock(status_code=200)
+        response.iter_lines.return_value = lines
+        response.__enter__.return_value = response
+        return response
+
+    mock_requests_session_instance.post.side_effect = post
+
+    with open(pathlib.Path(__file__).parent.parent / "assets" / "sample_hl7.hl7") as fp:
+        message = fp.read()
+    adt_message = message.replace("ORU^R01", "ADT^A01", 1)
+    messages = [message] * 5
+    messages[2] = "BAD Message Data"
+    messages[3] = adt_message
+
+    client = FhirConverterClient("some-converter-url/convert-to-fhir")
+    assert client.batch_url == "some-converter-url/convert-to-fhir-batch"
+    results = sorted(
+        client.convert_batch(iter(messages), batch_size=2),
+        key=lambda result: result.index,
+    )
+    client.close()
+
+    # Messages are batched by their conversion settings
+    assert [
+        (request["root_template"], len(request["input_data"]))
+        for request in requests_made
+    ] == [("ORU_R01", 2), ("ADT_A01", 1), ("ORU_R01", 1)]
+    mock_requests_session_instance.post.assert_called_with(
+        url="some-converter-url/convert-to-fhir-batch",
+        headers={},
+        json=requests_made[-1],
+        stream=True,
+    )
+
+    assert [result.index for result in results] == list(range(5))
+    assert results[0].bundle == {"id": "0"}
+    assert results[4].bundle == {"id": "0"}
+    assert str(results[1].error) == "err"
+    assert "unrecognized data type" in str(results[2].error)
+    assert results[3].error.http_response.status_code == 500
+
+    with pytest.raises(ValueError):
+        list(client.convert_batch(messages, batch_size=0))
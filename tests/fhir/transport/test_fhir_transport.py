@@ -1,13 +1,23 @@
+import json
 import polling
 import pytest
 import re
 import requests
-
-from phdi.fhir.transport import http_request_with_reauth, export_from_fhir_server
-from phdi.fhir.transport.export import _compose_export_url
+import threading
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from phdi.fhir.transport import (
+    ExportJobManager,
+    http_request_with_reauth,
+    export_from_fhir_server,
+    stream_from_fhir_export_response,
+)
+from phdi.fhir.transport.export import _compose_export_url, _parse_retry_after
 from unittest import mock
 
 from phdi.fhir.transport.http import (
+    _pack_bundle_entries,
+    bulk_upload_to_fhir_server,
     fhir_server_get,
     upload_bundle_to_fhir_server,
     _log_fhir_server_error,
@@ -239,6 +249,139 @@ def test_log_fhir_server_error(patch_log_error):
     )
 
 
+def test_pack_bundle_entries():
+    resources = [
+        {"resourceType": "Patient", "id": "patient-1"},
+        {"resourceType": "Patient"},
+        {
+            "resource": {"resourceType": "Observation", "id": "obs-1"},
+            "request": {"method": "POST", "url": "Observation"},
+        },
+        {"resource": {"resourceType": "Observation", "id": "x" * 100}},
+        {"resourceType": "Patient", "id": "patient-2"},
+    ]
+
+    bundles = list(_pack_bundle_entries(resources, max_entries=2, max_bytes=250))
+
+    assert [[index for index, _ in bundle] for bundle in bundles] == [
+        [0, 1],
+        [2],
+        [3],
+        [4],
+    ]
+    assert bundles[0][0][1] == {
+        "resource": resources[0],
+        "request": {"method": "PUT", "url": "Patient/patient-1"},
+    }
+    assert bundles[0][1][1]["request"] == {"method": "POST", "url": "Patient"}
+    assert bundles[1][0][1] == resources[2]
+
+
+@mock.patch("phdi.fhir.transport.http.time")
+@mock.patch("requests.Session")
+def test_bulk_upload_to_fhir_server(mock_requests_session, patched_time):
+    mock_session = mock_requests_session.return_value.__enter__.return_value
+    resources = [{"resourceType": "Patient", "id": f"patient-{i}"} for i in range(5)]
+
+    # "patient-1" fails transiently once, "patient-3" fails permanently, and the
+    # first post of the bundle holding "patient-4" fails as a whole
+    posted_bundles = []
+    failures = {"patient-1": ["503"], "patient-3": ["400"] * 4}
+    bundle_failures = ["500"]
+
+    def post(url, headers, json):
+        posted_bundles.append([entry["resource"]["id"] for entry in json["entry"]])
+        if "patient-4" in posted_bundles[-1] and bundle_failures:
+            return mock.Mock(status_code=int(bundle_failures.pop()))
+
+        response_entries = []
+        for entry in json["entry"]:
+            resource_failures = failures.get(entry["resource"]["id"], [])
+            status = resource_failures.pop() if resource_failures else "201 Created"
+            response_entries.append({"response": {"status": status}})
+        return mock.Mock(
+            status_code=200,
+            json=lambda: {"resourceType": "Bundle", "entry": response_entries},
+        )
+
+    mock_session.post.side_effect = post
+    mock_cred_manager = mock.Mock()
+    mock_cred_manager.get_access_token.return_value = "some-token"
+
+    results = bulk_upload_to_fhir_server(
+        resources,
+        mock_cred_manager,
+        "https://some-fhir-url",
+        max_entries_per_bundle=2,
+        max_workers=1,
+    )
+
+    # Only the entries that failed transiently are resubmitted
+    assert posted_bundles == [
+        ["patient-0", "patient-1"],
+        ["patient-1"],
+        ["patient-2", "patient-3"],
+        ["patient-4"],
+        ["patient-4"],
+    ]
+    assert [(r.index, r.status, r.attempts) for r in results] == [
+        (0, "201 Created", 1),
+        (1, "201 Created", 2),
+        (2, "201 Created", 1),
+        (3, "400", 1),
+        (4, "201 Created", 2),
+    ]
+    assert [r.succeeded for r in results] == [True, True, True, False, True]
+    assert mock_session.post.call_args.kwargs["json"]["type"] == "batch"
+
+    with pytest.raises(ValueError):
+        bulk_upload_to_fhir_server(
+            resources, mock_cred_manager, "https://some-fhir-url", max_workers=0
+        )
+
+
+@mock.patch("requests.Session")
+def test_bulk_upload_to_fhir_server_connection_error(mock_requests_session):
+    mock_session = mock_requests_session.return_value.__enter__.return_value
+    resources = [{"resourceType": "Patient", "id": f"patient-{i}"} for i in range(6)]
+
+    def post(url, headers, json):
+        if json["entry"][0]["resource"]["id"] == "patient-2":
+            raise requests.ConnectionError("connection reset")
+        return mock.Mock(
+            status_code=200,
+            json=lambda: {
+                "entry": [
+                    {"response": {"status": "201 Created"}} for _ in json["entry"]
+                ]
+            },
+        )
+
+    mock_session.post.side_effect = post
+    mock_cred_manager = mock.Mock()
+    mock_cred_manager.get_access_token.return_value = "some-token"
+
+    # The bundle that can't be posted fails on its own, and the others still
+    # succeed
+    results = bulk_upload_to_fhir_server(
+        resources,
+        mock_cred_manager,
+        "https://some-fhir-url",
+        max_entries_per_bundle=2,
+        max_workers=2,
+    )
+    assert [(r.index, r.status, r.succeeded) for r in results] == [
+        (0, "201 Created", True),
+        (1, "201 Created", True),
+        (2, "", False),
+        (3, "", False),
+        (4, "201 Created", True),
+        (5, "201 Created", True),
+    ]
+    assert isinstance(results[2].error, requests.ConnectionError)
+    assert results[0].error is None
+
+
 @mock.patch("requests.Session")
 def test_export_from_fhir_server(mock_requests_session):
     mock_requests_session_instance = mock_requests_session.return_value
@@ -443,6 +586,139 @@ def test_export_from_fhir_server_error(mock_requests_session):
     assert mock_requests_session_instance.get.call_count == 2
 
 
+@mock.patch("phdi.fhir.transport.export.time")
+@mock.patch("requests.Session")
+def test_export_job_manager_backoff(mock_requests_session, patched_time):
+    mock_requests_session_instance = mock_requests_session.return_value
+    patched_time.monotonic.return_value = 0
+
+    mock_cred_manager = mock.Mock()
+    mock_cred_manager.get_access_token.return_value = "some-token"
+
+    mock_export_response = mock.Mock(
+        status_code=202, headers={"Content-Location": "https://export-download-url"}
+    )
+    mock_in_progress_responses = [
+        mock.Mock(status_code=202, headers={"X-Progress": f"{i * 25}%"})
+        for i in range(4)
+    ]
+    mock_in_progress_responses[2].headers["Retry-After"] = "10"
+    mock_complete_response = mock.Mock(status_code=200, headers={})
+    mock_complete_response.json.return_value = {"output": []}
+    mock_requests_session_instance.get.side_effect = [
+        mock_export_response,
+        *mock_in_progress_responses,
+        mock_complete_response,
+    ]
+
+    progress = []
+    manager = ExportJobManager(
+        mock_cred_manager,
+        "https://fhir-url",
+        initial_poll_step=1,
+        max_poll_step=3,
+        progress_callback=lambda job: progress.append(job.progress),
+    )
+    job = manager.start_export(export_scope="Patient")
+    assert manager.wait(job) == {"output": []}
+
+    # The wait doubles while the export is in progress, up to `max_poll_step`,
+    # except when the server sends a Retry-After header
+    assert patched_time.sleep.call_args_list == [
+        mock.call(1),
+        mock.call(2),
+        mock.call(10),
+        mock.call(3),
+    ]
+    assert progress == ["0%", "25%", "50%", "75%", "75%"]
+    assert job.status == "complete"
+    assert job.poll_count == 5
+
+    # The credential manager, which caches the access token, is asked for it for
+    # every request
+    assert mock_cred_manager.get_access_token.call_count == 6
+
+
+@mock.patch("phdi.fhir.transport.export.time")
+@mock.patch("requests.Session")
+def test_export_job_manager_run_exports(mock_requests_session, patched_time):
+    mock_requests_session_instance = mock_requests_session.return_value
+    patched_time.monotonic.return_value = 0
+
+    # Mimics a credential manager's cached token, which is replaced when a new
+    # one is forced
+    tokens = ["some-token"]
+
+    def get_access_token(force_refresh=False):
+        if force_refresh:
+            tokens.append("new-token")
+        return tokens[-1]
+
+    mock_cred_manager = mock.Mock()
+    mock_cred_manager.get_access_token.side_effect = get_access_token
+
+    polls = {}
+
+    def get(url, headers):
+        # The first request is rejected, as if the original token had expired
+        if headers["Authorization"] == "Bearer some-token" and not polls:
+            polls["rejected"] = True
+            return mock.Mock(status_code=401, headers={})
+        if "$export" in url:
+            export_type = url.split("_type=")[1]
+            return mock.Mock(
+                status_code=202,
+                headers={"Content-Location": f"https://poll/{export_type}"},
+            )
+        polls[url] = polls.get(url, 0) + 1
+        if polls[url] < 3:
+            return mock.Mock(status_code=202, headers={})
+        response = mock.Mock(status_code=200, headers={})
+        response.json.return_value = {"output": [{"type": url.split("/")[-1]}]}
+        return response
+
+    mock_requests_session_instance.get.side_effect = get
+
+    manager = ExportJobManager(mock_cred_manager, "https://fhir-url")
+    results = manager.run_exports(
+        [{"resource_type": "Patient"}, {"resource_type": "Observation"}]
+    )
+
+    assert results == [
+        {"output": [{"type": "Patient"}]},
+        {"output": [{"type": "Observation"}]},
+    ]
+    # The new token obtained after the rejection is used for later requests
+    mock_cred_manager.get_access_token.assert_any_call(force_refresh=True)
+    assert tokens == ["some-token", "new-token"]
+    last_headers = mock_requests_session_instance.get.call_args.kwargs["headers"]
+    assert last_headers["Authorization"] == "Bearer new-token"
+
+
+@mock.patch("requests.Session")
+def test_export_job_manager_kickoff_failure(mock_requests_session):
+    mock_requests_session.return_value.get.return_value = mock.Mock(
+        status_code=400, headers={}
+    )
+    mock_cred_manager = mock.Mock()
+    mock_cred_manager.get_access_token.return_value = "some-token"
+
+    with pytest.raises(requests.HTTPError):
+        ExportJobManager(mock_cred_manager, "https://fhir-url").start_export()
+
+    with pytest.raises(ValueError):
+        ExportJobManager(mock_cred_manager, "https://fhir-url", initial_poll_step=60)
+
+
+def test_parse_retry_after():
+    assert _parse_retry_after("120") == 120
+    assert _parse_retry_after("-5") == 0
+    assert _parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0
+    assert 0 < _parse_retry_after("Fri, 01 Jan 9999 00:00:00 GMT")
+    assert _parse_retry_after("not a date") is None
+    assert _parse_retry_after(None) is None
+
+
 def test_compose_export_url():
     fhir_url = "https://fhir-url"
     assert _compose_export_url(fhir_url) == f"{fhir_url}/$export"
@@ -480,3 +756,107 @@ def test_compose_export_url():
 
     with pytest.raises(ValueError):
         _compose_export_url(fhir_url, "InvalidExportScope")
+
+
+@pytest.fixture
+def export_server():
+    """
+    Serves ndjson export files from a local HTTP server, recording the
+    Authorization header of each request. Files are added to the `files` dict of
+    the yielded server, keyed by path.
+    """
+
+    class ExportFileHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            server.authorizations.append(self.headers.get("Authorization"))
+            if self.path not in server.files:
+                self.send_response(404)
+                self.end_headers()
+                return
+            content = server.files[self.path].encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/fhir+ndjson")
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), ExportFileHandler)
+    server.files = {}
+    server.authorizations = []
+    server.url = f"http://127.0.0.1:{server.server_address[1]}"
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_stream_from_fhir_export_response(export_server):
+    patients = [{"resourceType": "Patient", "id": f"patient-{i}"} for i in range(1200)]
+    observations = [
+        {"resourceType": "Observation", "id": f"observation-{i}"} for i in range(3)
+    ]
+    export_server.files["/Patient.ndjson"] = (
+        "\n".join(json.dumps(patient) for patient in patients) + "\n"
+    )
+    export_server.files["/Observation.ndjson"] = "\n".join(
+        json.dumps(observation) for observation in observations
+    )
+    export_server.files["/Encounter.ndjson"] = json.dumps(
+        {"resourceType": "Encounter", "id": "encounter"}
+    )
+    export_response = {
+        "requiresAccessToken": False,
+        "output": [
+            {"type": "Patient", "url": f"{export_server.url}/Patient.ndjson"},
+            {"type": "Observation", "url": f"{export_server.url}/Observation.ndjson"},
+            {"type": "Encounter", "url": f"{export_server.url}/Encounter.ndjson"},
+        ],
+    }
+
+    resources = list(
+        stream_from_fhir_export_response(
+            export_response, resource_types=["Patient", "Observation"], max_workers=2
+        )
+    )
+
+    # Files are downloaded concurrently, so only the order within a file is kept
+    assert [r for t, r in resources if t == "Patient"] == patients
+    assert [r for t, r in resources if t == "Observation"] == observations
+    assert len(resources) == 1203
+    assert export_server.authorizations == [None, None]
+
+
+def test_stream_from_fhir_export_response_access_token(export_server):
+    export_server.files["/Patient.ndjson"] = json.dumps(
+        {"resourceType": "Patient", "id": "some-id"}
+    )
+    export_response = {
+        "requiresAccessToken": True,
+        "output": [{"type": "Patient", "url": f"{export_server.url}/Patient.ndjson"}],
+    }
+    mock_cred_manager = mock.Mock()
+    mock_cred_manager.get_access_token.return_value = "some-token"
+
+    assert list(
+        stream_from_fhir_export_response(export_response, mock_cred_manager)
+    ) == [("Patient", {"resourceType": "Patient", "id": "some-id"})]
+    assert export_server.authorizations == ["Bearer some-token"]
+
+    with pytest.raises(ValueError):
+        list(stream_from_fhir_export_response(export_response))
+
+
+def test_stream_from_fhir_export_response_failure(export_server):
+    export_response = {
+        "output": [{"type": "Patient", "url": f"{export_server.url}/missing.ndjson"}],
+    }
+
+    with pytest.raises(requests.HTTPError):
+        list(stream_from_fhir_export_response(export_response))
+
+    with pytest.raises(ValueError):
+        list(stream_from_fhir_export_response(export_response, max_workers=0))
@@ -0,0 +1,194 @@
+from unittest import mock
+import json
+import struct
+import pytest
+
+from phdi.geospatial.boundaries import BoundaryIndex, EnrichedGeocodeClient
+from phdi.geospatial.core import BaseGeocodeClient, GeocodeResult
+from phdi.fhir.geospatial.smarty import SmartyFhirGeocodeClient
+
+
+# Two adjacent block groups, the first of which has a hole, and a tract made up
+# of two separate squares
+boundaries = [
+    (
+        "360610003001",
+        [
+            [(0, 0), (2, 0), (2, 2), (0, 2), (0, 0)],
+            [(0.5, 0.5), (1.5, 0.5), (1.5, 1.5), (0.5, 1.5), (0.5, 0.5)],
+        ],
+    ),
+    ("360610003002", [[(2, 0), (4, 0), (4, 2), (2, 2)]]),
+    (
+        "36061215101",
+        [[(10, 10), (11, 10), (11, 11), (10, 11)], [(12, 12), (13, 12), (13, 13)]],
+    ),
+]
+
+geocoded_response = GeocodeResult(
+    line=["123 FAKE ST"],
+    city="New York",
+    state="NY",
+    postal_code="10001",
+    county_fips="36061",
+    lat=1.8,
+    lng=0.2,
+    county_name="New York",
+)
+
+
+def test_locate():
+    index = BoundaryIndex(boundaries)
+
+    assert index.locate(lat=1.8, lng=0.2) == "360610003001"
+    assert index.locate(lat=1.0, lng=3.9) == "360610003002"
+    # Points in holes and outside every boundary aren't located
+    assert index.locate(lat=1.0, lng=1.0) is None
+    assert index.locate(lat=5.0, lng=5.0) is None
+    assert index.locate(lat=-50.0, lng=100.0) is None
+    assert index.locate(lat=10.5, lng=10.5) == "36061215101"
+    assert index.locate(lat=12.2, lng=12.5) == "36061215101"
+
+    with pytest.raises(ValueError):
+        BoundaryIndex([])
+
+
+def test_locate_many():
+    index = BoundaryIndex(boundaries, cell_size=0.25)
+    lats = [1.8, 1.0, 1.0, 10.5, float("nan"), 0.1, 1.9]
+    lngs = [0.2, 3.9, 1.0, 10.5, 1.0, 0.1, 3.5]
+
+    assert index.locate_many(lats, lngs) == [
+        "360610003001",
+        "360610003002",
+        None,
+        "36061215101",
+        None,
+        "360610003001",
+        "360610003002",
+    ]
+    assert index.locate_many(lats, lngs) == [
+        index.locate(lat, lng) for lat, lng in zip(lats, lngs)
+    ]
+
+
+def test_enrich_many():
+    index = BoundaryIndex(boundaries)
+    census_response = GeocodeResult(
+        line=["456 FAKE ST"],
+        city="New York",
+        state="NY",
+        postal_code="10001",
+        county_fips="36061",
+        lat=10.5,
+        lng=10.5,
+        census_tract="59",
+    )
+
+    results = index.enrich_many([geocoded_response, None, census_response])
+    assert results[0].geoid == "360610003001"
+    assert results[0].census_tract == "3"
+    assert results[0].census_block == "1"
+    assert results[0].county_fips == "36061"
+    assert results[1] is None
+    # Fields that are already filled in are kept
+    assert results[2].census_tract == "59"
+    assert results[2].geoid == "36061215101"
+    assert results[2].census_block is None
+
+    # Results aren't modified in place
+    assert geocoded_response.census_tract is None
+
+
+def test_from_geojson(tmp_path):
+    path = tmp_path / "tracts.geojson"
+    path.write_text(
+        json.dumps(
+            {
+                "type": "FeatureCollection",
+                "features": [
+                    {
+                        "type": "Feature",
+                        "properties": {"GEOID20": "36061000300"},
+                        "geometry": {
+                            "type": "MultiPolygon",
+                            "coordinates": [[[[0, 0], [2, 0], [2, 2], [0, 2]]]],
+                        },
+                    },
+                    {
+                        "type": "Feature",
+                        "properties": {"GEOID20": "36061000400"},
+                        "geometry": {"type": "Point", "coordinates": [5, 5]},
+                    },
+                ],
+            }
+        )
+    )
+    index = BoundaryIndex.from_geojson(str(path), geoid_property="GEOID20")
+    assert index.geoids == ["36061000300"]
+    assert index.locate(lat=1, lng=1) == "36061000300"
+
+
+def test_from_shapefile(tmp_path):
+    # A minimal shapefile holding one polygon record and one null record
+    ring = [(0.0, 0.0), (0.0, 2.0), (2.0, 2.0), (2.0, 0.0), (0.0, 0.0)]
+    polygon = (
+        struct.pack("<i4d2i", 5, 0, 0, 2, 2, 1, len(ring))
+        + struct.pack("<i", 0)
+        + b"".join(struct.pack("<2d", *point) for point in ring)
+    )
+    null = struct.pack("<i", 0)
+    records = b"".join(
+        struct.pack(">2i", number, len(content) // 2) + content
+        for number, content in enumerate([polygon, null], start=1)
+    )
+    (tmp_path / "tracts.shp").write_bytes(b"\x00" * 100 + records)
+
+    field = b"GEOID".ljust(11, b"\x00") + b"C" + b"\x00" * 4 + bytes([11, 0])
+    dbf = (
+        struct.pack("<4BIHH", 3, 123, 1, 1, 2, 65, 12)
+        + b"\x00" * 20
+        + field.ljust(32, b"\x00")
+        + b"\x0d"
+        + b" 36061000300"
+        + b" 36061000400"
+    )
+    (tmp_path / "tracts.dbf").write_bytes(dbf)
+
+    index = BoundaryIndex.from_shapefile(str(tmp_path / "tracts.shp"))
+    assert index.geoids == ["36061000300"]
+    assert index.locate(lat=1, lng=1) == "36061000300"
+
+
+def test_enriched_geocode_client():
+    client = mock.Mock(spec=BaseGeocodeClient)
+    client.geocode_from_str.return_value = geocoded_response
+    client.geocode_from_dict.return_value = None
+    client.geocode_many.return_value = [None, geocoded_response]
+    enriched_client = EnrichedGeocodeClient(client, BoundaryIndex(boundaries))
+
+    assert enriched_client.geocode_from_str("123 Fake St").census_tract == "3"
+    assert enriched_client.geocode_from_dict({"street": "123 Fake St"}) is None
+    results = enriched_client.geocode_many(["1 Nowhere Rd", "123 Fake St"])
+    assert results[0] is None
+    assert results[1].geoid == "360610003001"
+
+
+@mock.patch("phdi.fhir.geospatial.smarty.SmartyGeocodeClient")
+def test_fhir_geocode_client_with_boundaries(patched_smarty_client):
+    patched_smarty_client.return_value.geocode_from_str.return_value = geocoded_response
+    client = SmartyFhirGeocodeClient(
+        mock.Mock(), mock.Mock(), boundaries=BoundaryIndex(boundaries)
+    )
+    patient = {
+        "resourceType": "Patient",
+        "address": [{"line": ["123 Fake St"], "city": "New York", "state": "NY"}],
+    }
+    client.geocode_resource(patient)
+
+    assert patient["address"][0]["_line"][0]["extension"] == [
+        {
+            "url": "http://hl7.org/fhir/StructureDefinition/iso21090-ADXP-censusTract",
+            "valueString": "3",
+        }
+    ]
@@ -1,7 +1,12 @@
 from phdi.geospatial.core import GeocodeResult
-from phdi.geospatial.census import CensusGeocodeClient
+from phdi.geospatial.census import CensusGeocodeClient, _format_census_tract
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import csv
+import io
 import json
 import pathlib
+import threading
 from unittest import mock
 from unittest.mock import patch
 import pytest
@@ -191,3 +196,125 @@ def test_geocode_from_dict():
         "zip": "00000",
     }
     assert census_client.geocode_from_dict(malformed_input_dict) is None
+
+
+@pytest.fixture
+def census_batch_server():
+    """
+    Serves a stub of the Census geocoder's batch endpoint from a local HTTP
+    server, matching every address except those on "Nowhere Rd". The CSV files
+    posted to the server are recorded in its `address_files` list.
+    """
+
+    class CensusBatchHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers["Content-Length"]))
+            form = BytesParser().parsebytes(
+                f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode() + body
+            )
+            parts = {
+                part.get_param("name", header="Content-Disposition"): part.get_payload(
+                    decode=True
+                ).decode()
+                for part in form.get_payload()
+            }
+            assert parts["benchmark"] == "Public_AR_Census2020"
+            server.address_files.append(parts["addressFile"])
+
+            results = io.StringIO()
+            writer = csv.writer(results, quoting=csv.QUOTE_ALL)
+            for row_id, street, city, state, zip in csv.reader(
+                io.StringIO(parts["addressFile"])
+            ):
+                input_address = f"{street}, {city}, {state}, {zip}"
+                if "Nowhere" in street:
+                    writer.writerow([row_id, input_address, "No_Match"])
+                    continue
+                writer.writerow(
+                    [
+                        row_id,
+                        input_address,
+                        "Match",
+                        "Exact",
+                        f"{street.upper()}, {city.upper()}, {state}, 10003",
+                        "-73.9954428687588,40.72962831414409",
+                        "59653655",
+                        "L",
+                        "36",
+                        "061",
+                        "005900",
+                        "2000",
+                    ]
+                )
+
+            content = results.getvalue().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/csv")
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), CensusBatchHandler)
+    server.address_files = []
+    server.url = f"http://127.0.0.1:{server.server_address[1]}/addressbatch"
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_geocode_many(census_batch_server):
+    census_client = CensusGeocodeClient(batch_url=census_batch_server.url, batch_size=2)
+    census_client.geocode_from_str = mock.Mock(return_value=None)
+    census_client.geocode_from_dict = mock.Mock(return_value=None)
+
+    addresses = [
+        {"street": "239 Greene St", "city": "New York", "state": "NY"},
+        {"line": ["1 Nowhere Rd"], "city": "New York", "state": "NY"},
+        "239 Greene St New York NY",
+        {
+            "line": ["239 Greene St", "Apt 4L"],
+            "city": "New York",
+            "state": "NY",
+            "postalCode": "10003",
+        },
+    ]
+    results = census_client.geocode_many(addresses)
+
+    # Dictionaries, including FHIR addresses, are posted in batches
+    assert len(census_batch_server.address_files) == 2
+    assert list(csv.reader(io.StringIO(census_batch_server.address_files[1]))) == [
+        ["0", "239 Greene St Apt 4L", "New York", "NY", "10003"]
+    ]
+    assert results[0] == GeocodeResult(
+        line=["239 GREENE ST"],
+        city="NEW YORK",
+        state="NY",
+        postal_code="10003",
+        county_fips="36061",
+        lat=40.72962831414409,
+        lng=-73.9954428687588,
+        geoid="360610059002000",
+        census_tract="59",
+        census_block="2000",
+    )
+    assert results[3].line == ["239 GREENE ST APT 4L"]
+
+    # Strings and unmatched addresses fall back to single lookups
+    assert results[1] is None and results[2] is None
+    census_client.geocode_from_str.assert_called_once_with(addresses[2])
+    census_client.geocode_from_dict.assert_called_once_with(
+        {"street": "1 Nowhere Rd", "city": "New York", "state": "NY", "zip": ""}
+    )
+
+    with pytest.raises(ValueError):
+        census_client.geocode_many([{"city": "New York"}])
+
+
+def test_format_census_tract():
+    assert _format_census_tract("005900") == "59"
+    assert _format_census_tract("215101") == "2151.01"
@@ -0,0 +1,188 @@
+from unittest import mock
+import pytest
+
+from phdi.geospatial.cache import (
+    CachedGeocodeClient,
+    GeocodeCache,
+    _deserialize_result,
+    _serialize_result,
+    normalize_address,
+)
+from phdi.geospatial.core import BaseGeocodeClient, GeocodeResult
+from phdi.fhir.geospatial.census import CensusFhirGeocodeClient
+
+
+geocoded_response = GeocodeResult(
+    line=["123 FAKE ST"],
+    city="New York",
+    state="NY",
+    postal_code="10001",
+    county_fips="36061",
+    lat=45.123,
+    lng=-70.234,
+    county_name="New York",
+)
+
+
+def test_normalize_address():
+    assert normalize_address("123 Fake St., New York,  NY") == normalize_address(
+        "123 FAKE ST NEW YORK NY"
+    )
+    assert normalize_address({"street": "123 fake st", "city": "New York"}) == (
+        normalize_address({"city": "NEW YORK", "street": "123 Fake St."})
+    )
+    assert normalize_address("123 Fake St") != normalize_address(
+        {"street": "123 Fake St"}
+    )
+
+
+def test_normalize_fhir_address():
+    # FHIR addresses are keyed by their lines and postal code too
+    assert normalize_address({"line": ["1 A St"], "postalCode": "10001"}) != (
+        normalize_address({"line": ["2 B St"], "postalCode": "10001"})
+    )
+    assert normalize_address({"line": ["1 A St"], "postalCode": "10001"}) != (
+        normalize_address({"line": ["1 A St"], "postalCode": "10002"})
+    )
+    assert normalize_address(
+        {"line": ["1 A St", "Apt 2"], "postalCode": "10001"}
+    ) == normalize_address({"street": "1 a st apt 2", "zip": "10001"})
+
+
+def test_serialize_result():
+    serialized = _serialize_result(geocoded_response)
+    assert serialized == (
+        '[["123 FAKE ST"],"New York","NY","10001","36061",45.123,-70.234,'
+        + 'null,null,"New York"]'
+    )
+    assert _deserialize_result(serialized) == geocoded_response
+    assert _deserialize_result(_serialize_result(None)) is None
+
+
+def test_geocode_cache_lru():
+    cache = GeocodeCache(max_size=2)
+    cache.put("a", geocoded_response)
+    cache.put("b", None)
+    assert cache.get("a") == geocoded_response
+    cache.put("c", geocoded_response)
+
+    # "b" was the least recently used result, and negative results are cached
+    assert cache.get("b") is GeocodeCache.MISSING
+    assert cache.get("a") == geocoded_response
+    cache.put("b", None)
+    assert cache.get("b") is None
+
+    with pytest.raises(ValueError):
+        GeocodeCache(max_size=0)
+
+
+@mock.patch("phdi.geospatial.cache.time")
+def test_geocode_cache_persistent(patched_time, tmp_path):
+    patched_time.time.return_value = 1000
+    path = str(tmp_path / "geocode_cache.db")
+    cache = GeocodeCache(max_size=1, path=path, ttl=60)
+    cache.put("a", geocoded_response)
+    cache.put("b", None)
+
+    # Results evicted from memory are read back from disk
+    assert cache.get("a") == geocoded_response
+    cache.close()
+
+    cache = GeocodeCache(path=path, ttl=60)
+    assert cache.get("a") == geocoded_response
+    assert cache.get("b") is None
+
+    # Results expire after the TTL
+    patched_time.time.return_value = 1060
+    assert cache.get("a") is GeocodeCache.MISSING
+    assert cache.get("b") is GeocodeCache.MISSING
+    cache.close()
+
+
+def test_cached_geocode_client():
+    client = mock.Mock(spec=BaseGeocodeClient)
+    client.geocode_from_str.side_effect = [geocoded_response, None]
+    client.geocode_from_dict.side_effect = [ValueError, geocoded_response]
+    cached_client = CachedGeocodeClient(client)
+
+    assert cached_client.geocode_from_str("123 Fake St") == geocoded_response
+    assert cached_client.geocode_from_str("123 FAKE ST.") == geocoded_response
+    assert cached_client.geocode_from_str("456 Nowhere Rd") is None
+    assert cached_client.geocode_from_str("456 nowhere rd") is None
+    assert client.geocode_from_str.call_count == 2
+
+    # Errors aren't cached
+    with pytest.raises(ValueError):
+        cached_client.geocode_from_dict({"street": "123 Fake St"})
+    assert cached_client.geocode_from_dict({"street": "123 Fake St"}) == (
+        geocoded_response
+    )
+    assert cached_client.geocode_from_dict({"street": "123 Fake St"}) == (
+        geocoded_response
+    )
+    assert client.geocode_from_dict.call_count == 2
+
+
+def test_cached_geocode_client_geocode_many():
+    client = mock.Mock(spec=BaseGeocodeClient)
+    client.geocode_many.side_effect = lambda addresses: [
+        None if "Nowhere" in address else geocoded_response for address in addresses
+    ]
+    cached_client = CachedGeocodeClient(client)
+
+    results = cached_client.geocode_many(["123 Fake St", "1 Nowhere Rd", "123 FAKE ST"])
+    assert results == [geocoded_response, None, geocoded_response]
+    client.geocode_many.assert_called_once_with(["123 Fake St", "1 Nowhere Rd"])
+
+    # Only the uncached addresses are geocoded
+    results = cached_client.geocode_many(["456 Fake St", "1 nowhere rd"])
+    assert results == [geocoded_response, None]
+    client.geocode_many.assert_called_with(["456 Fake St"])
+
+
+def test_cached_geocode_client_fhir_addresses():
+    client = mock.Mock(spec=BaseGeocodeClient)
+    client.geocode_many.side_effect = lambda addresses: [
+        GeocodeResult(
+            line=address["line"],
+            city="New York",
+            state="NY",
+            postal_code=address["postalCode"],
+            county_fips="36061",
+            lat=45.123,
+            lng=-70.234,
+        )
+        for address in addresses
+    ]
+    cached_client = CachedGeocodeClient(client)
+
+    addresses = [
+        {"line": ["1 A St"], "postalCode": "10001"},
+        {"line": ["2 B St"], "postalCode": "10001"},
+        {"line": ["1 A St"], "postalCode": "10002"},
+    ]
+    results = cached_client.geocode_many(addresses)
+    assert [(result.line, result.postal_code) for result in results] == [
+        (["1 A St"], "10001"),
+        (["2 B St"], "10001"),
+        (["1 A St"], "10002"),
+    ]
+    client.geocode_many.assert_called_once_with(addresses)
+
+
+@mock.patch("phdi.fhir.geospatial.census.CensusGeocodeClient")
+def test_fhir_geocode_client_with_cache(patched_census_client):
+    patched_census_client.return_value.geocode_from_dict.return_value = (
+        geocoded_response
+    )
+    client = CensusFhirGeocodeClient(cache=GeocodeCache())
+
+    for _ in range(3):
+        patient = {
+            "resourceType": "Patient",
+            "address": [{"line": ["123 Fake St"], "city": "New York", "state": "NY"}],
+        }
+        client.geocode_resource(patient)
+        assert patient["address"][0]["postalCode"] == "10001"
+
+    patched_census_client.return_value.geocode_from_dict.assert_called_once()
@@ -0,0 +1,149 @@
+from unittest import mock
+import pytest
+
+from phdi.geospatial.core import BaseGeocodeClient, GeocodeResult
+from phdi.geospatial.local import LocalGeocodeClient, _normalize_street
+
+
+address_points = [
+    {
+        "number": "123",
+        "street": "Fake Street",
+        "city": "New York",
+        "state": "NY",
+        "postal_code": "10001",
+        "lat": "45.123",
+        "lng": "-70.234",
+        "county_fips": "36061",
+        "county_name": "New York",
+        "census_tract": "3",
+        "census_block": "1002",
+        "geoid": "360610003001002",
+    },
+    {
+        "street": "123 Fake Street North",
+        "city": "New York",
+        "state": "NY",
+        "postal_code": "10001",
+        "lat": "45.125",
+        "lng": "-70.236",
+    },
+    {"street": "1 Nowhere Rd", "city": "New York", "state": "NY", "lat": ""},
+]
+
+geocoded_response = GeocodeResult(
+    line=["123 FAKE ST"],
+    city="NEW YORK",
+    state="NY",
+    postal_code="10001",
+    county_fips="36061",
+    lat=45.123,
+    lng=-70.234,
+    county_name="New York",
+    census_tract="3",
+    census_block="1002",
+    geoid="360610003001002",
+)
+
+
+@pytest.fixture
+def index_path(tmp_path):
+    path = str(tmp_path / "address_points.db")
+    assert LocalGeocodeClient.build_index(address_points, path) == 2
+    return path
+
+
+def test_normalize_street():
+    assert _normalize_street("123 North Main Street, Apartment #4") == (
+        "123 N MAIN ST APT 4"
+    )
+
+
+def test_build_index_from_csv(tmp_path):
+    csv_path = tmp_path / "address_points.csv"
+    csv_path.write_text(
+        "ADDRESS,ZIP,LAT,LON,TRACT\n"
+        + "123 Fake St,10001,45.123,-70.234,3\n"
+        + "456 Fake St,10001,45.124,-70.235,3\n"
+    )
+    path = str(tmp_path / "address_points.db")
+    count = LocalGeocodeClient.build_index(
+        str(csv_path),
+        path,
+        columns={
+            "street": "ADDRESS",
+            "postal_code": "ZIP",
+            "lat": "LAT",
+            "lng": "LON",
+            "census_tract": "TRACT",
+        },
+    )
+    assert count == 2
+
+    client = LocalGeocodeClient(path)
+    result = client.geocode_from_str("456 Fake St, 10001")
+    assert (result.lat, result.lng, result.census_tract) == (45.124, -70.235, "3")
+    client.close()
+
+
+def test_geocode_from_str(index_path):
+    client = LocalGeocodeClient(index_path)
+
+    assert (
+        client.geocode_from_str("123 Fake St. Apt 4L New York, NY 10001-0001")
+        == geocoded_response
+    )
+    # The longest matching street is used
+    assert client.geocode_from_str("123 Fake Street N, New York, NY 10001").lat == (
+        45.125
+    )
+    assert client.geocode_from_str("123 Fake St, New York, NY 10002") is None
+    assert client.geocode_from_str("123 Fake St, New York, NY") is None
+    assert client.geocode_from_str("1234 Fake St, New York, NY 10001") is None
+
+    with pytest.raises(ValueError):
+        client.geocode_from_str("")
+    client.close()
+
+
+def test_geocode_from_dict(index_path):
+    client = LocalGeocodeClient(index_path)
+
+    assert (
+        client.geocode_from_dict(
+            {"street": "123 FAKE STREET", "apartment": "4L", "postal_code": "10001"}
+        )
+        == geocoded_response
+    )
+    assert (
+        client.geocode_from_dict(
+            {"street": "123 Fake St", "city": "new york", "state": "ny"}
+        )
+        == geocoded_response
+    )
+    assert client.geocode_from_dict({"street": "123 Fake St", "state": "NY"}) is None
+
+    with pytest.raises(ValueError):
+        client.geocode_from_dict({"city": "New York"})
+    client.close()
+
+
+def test_geocode_with_fallback(index_path):
+    fallback = mock.Mock(spec=BaseGeocodeClient)
+    fallback.geocode_from_str.return_value = geocoded_response
+    fallback.geocode_from_dict.return_value = None
+    client = LocalGeocodeClient(index_path, fallback=fallback)
+
+    # Addresses in the index are geocoded locally
+    assert client.geocode_from_str("123 Fake St, New York, NY 10001") == (
+        geocoded_response
+    )
+    fallback.geocode_from_str.assert_not_called()
+
+    assert client.geocode_from_str("456 Fake St, New York, NY 10001") == (
+        geocoded_response
+    )
+    fallback.geocode_from_str.assert_called_once_with("456 Fake St, New York, NY 10001")
+    assert client.geocode_from_dict({"street": "456 Fake St"}) is None
+    fallback.geocode_from_dict.assert_called_once_with({"street": "456 Fake St"})
+    client.close()
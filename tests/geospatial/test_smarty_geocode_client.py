@@ -172,3 +172,49 @@ def test_blank_geocode_inputs():
         geocoded_response = smarty_client.geocode_from_dict({})
     assert "Address must include street number and name at a minimum" in str(e.value)
     assert geocoded_response is None
+
+
+def test_geocode_many():
+    auth_id = mock.Mock()
+    auth_token = mock.Mock()
+    smarty_client = SmartyGeocodeClient(auth_id, auth_token)
+
+    def fill_in_results(batch):
+        assert len(batch) <= 100
+        for lookup in batch:
+            if "NOWHERE" in lookup.street.upper():
+                lookup.result = []
+                continue
+            candidate = Candidate({})
+            candidate.delivery_line_1 = lookup.street.upper()
+            candidate.metadata = Metadata(
+                {"latitude": 45.123, "longitude": -70.234, "county_fips": "36061"}
+            )
+            candidate.components = Components(
+                {
+                    "zipcode": "10001",
+                    "city_name": "New York",
+                    "state_abbreviation": "NY",
+                }
+            )
+            lookup.result = [candidate]
+
+    smarty_client.client.send_batch = mock.Mock(side_effect=fill_in_results)
+    smarty_client.client.send_lookup = mock.Mock()
+
+    addresses = [f"{number} Fake St" for number in range(150)]
+    addresses += ["0 fake st.", "1 Nowhere Rd", {"street": "2 Fake St"}]
+    results = smarty_client.geocode_many(addresses)
+
+    # 151 distinct addresses are looked up in two batches
+    assert smarty_client.client.send_batch.call_count == 2
+    smarty_client.client.send_lookup.assert_not_called()
+    assert len(results) == 153
+    assert results[0].line == ["0 FAKE ST"]
+    assert results[149].line == ["149 FAKE ST"]
+    assert results[150] == results[0]
+    assert results[151] is None
+    assert results[152].line == ["2 FAKE ST"]
+
+    with pytest.raises(ValueError):
+        smarty_client.geocode_many(["1 Fake St", ""])
@@ -1,11 +1,13 @@
 import csv
+import gzip
 import os
 import jsonschema
 import yaml
 import json
 import pathlib
 import sqlite3 as sql
-from unittest import mock
+import pyarrow as pa
+import pyarrow.parquet as pq
 import pytest
 import copy
 
@@ -13,10 +15,14 @@ from phdi.tabulation import (
     load_schema,
     validate_schema,
     write_data,
+    CsvTableWriter,
+    ParquetTableWriter,
+    SqlTableWriter,
 )
 from phdi.fhir.tabulation import tabulate_data
 from phdi.tabulation.tables import (
     _convert_list_to_string,
+    _get_column_types,
 )
 
 
@@ -73,36 +79,125 @@ def test_write_data_csv():
 
     # Batch 1 tests writing and creating brand new file
     # Only one row actually written in first batch
-    write_data(batch_1, file_location, file_format, filename=output_file_name)
+    csv_writer = write_data(
+        batch_1, file_location, file_format, filename=output_file_name
+    )
+    assert isinstance(csv_writer, CsvTableWriter)
+    csv_writer.close()
     with open(file_location + output_file_name, "r") as csv_file:
         reader = csv.reader(csv_file, dialect="excel")
-        line = 0
-        for row in reader:
-            for i in range(len(row)):
-                assert row[i] == str(batch_1[line][i])
-            line += 1
-        assert line == 2
+        assert [row for row in reader] == [
+            ["Last Name", "City", "Exam ID", "General Practitioner"],
+            ["Price929", "Waltham", "obs1", "i-am-not-a-robot"],
+        ]
 
     # Batch 2 tests appending to existing csv
     # Two more rows written here, make sure no duplicate header row
-    write_data(batch_2, file_location, file_format, filename=output_file_name)
+    csv_writer = write_data(
+        [batch_2[0], batch_2[1]], file_location, file_format, output_file_name
+    )
+    # Later pages reuse the same open file
+    returned_writer = write_data(
+        [batch_2[0], batch_2[2]],
+        file_location,
+        file_format,
+        output_file_name,
+        csv_writer=csv_writer,
+    )
+    assert returned_writer is csv_writer
+    csv_writer.close()
+    assert csv_writer.rows_written == 2
     with open(file_location + output_file_name, "r") as csv_file:
         reader = csv.reader(csv_file, dialect="excel")
-        line = 0
-        for row in reader:
-            for i in range(len(row)):
-                if row[i] == "":
-                    assert table_to_use[line][i] is None
-                    continue
-                assert row[i] == str(table_to_use[line][i])
-            line += 1
-        assert line == 4
+        assert [row for row in reader] == [
+            ["Last Name", "City", "Exam ID", "General Practitioner"],
+            ["Price929", "Waltham", "obs1", "i-am-not-a-robot"],
+            ["Shepard", "Zakera Ward", "", "no-srsly-i-am-hoomun"],
+            ["", "Faketon", "obs2,obs3", ""],
+        ]
+    os.remove(file_location + output_file_name)
+
+
+def test_csv_table_writer_compression():
+    file_location = "./"
+    output_file_name = "compressed.csv.gz"
+    headers = ["id", "tags"]
+
+    if os.path.isfile(file_location + output_file_name):  # pragma: no cover
+        os.remove(file_location + output_file_name)
+
+    # Appending to an existing gzip file doesn't repeat the headers
+    for rows in [[["a", ["x", "y"]]], [["b", {"foo": "bar"}], ["c", None]]]:
+        csv_writer = CsvTableWriter(
+            file_location + output_file_name, headers, compression="gzip"
+        )
+        csv_writer.write(rows)
+        csv_writer.close()
+
+    with gzip.open(file_location + output_file_name, "rt", newline="") as csv_file:
+        reader = csv.reader(csv_file, dialect="excel")
+        assert [row for row in reader] == [
+            ["id", "tags"],
+            ["a", "x,y"],
+            ["b", "{'foo': 'bar'}"],
+            ["c", ""],
+        ]
     os.remove(file_location + output_file_name)
 
+    with pytest.raises(ValueError):
+        CsvTableWriter(file_location + output_file_name, headers, compression="lzma")
+    assert not os.path.isfile(file_location + output_file_name)
+
+
+def test_csv_table_writer_zstd_compression():
+    zstandard = pytest.importorskip("zstandard")
+    file_location = "./"
+    output_file_name = "compressed.csv.zst"
 
-@mock.patch("phdi.tabulation.tables.pq.ParquetWriter")
-@mock.patch("phdi.tabulation.tables.pa.Table")
-def test_write_data_parquet(patched_pa_table, patched_writer):
+    csv_writer = CsvTableWriter(
+        file_location + output_file_name, ["id", "name"], compression="zstd"
+    )
+    csv_writer.write([["a", "Alice"], ["b", None]])
+    csv_writer.close()
+
+    with open(file_location + output_file_name, "rb") as compressed_file:
+        reader = zstandard.ZstdDecompressor().stream_reader(compressed_file)
+        content = reader.read().decode("utf-8")
+    assert content == "id,name\r\na,Alice\r\nb,\r\n"
+    os.remove(file_location + output_file_name)
+
+
+@pytest.mark.parametrize("compression", [None, "gzip", "zstd"])
+def test_csv_table_writer_checkpoint(tmp_path, compression):
+    if compression == "zstd":
+        zstandard = pytest.importorskip("zstandard")
+    path = str(tmp_path / "checkpointed.csv")
+    headers = ["id", "name"]
+
+    csv_writer = CsvTableWriter(path, headers, compression=compression)
+    csv_writer.write([["a", "Alice"]])
+    state = csv_writer.checkpoint()
+    assert state["rows_written"] == 1
+
+    # Rows written after the checkpoint are discarded when the writer is resumed
+    csv_writer.write([["b", "Bob"]])
+    csv_writer.close()
+    csv_writer = CsvTableWriter.from_checkpoint(state)
+    assert csv_writer.rows_written == 1
+    csv_writer.write([["c", "Carol"]])
+    csv_writer.close()
+    assert csv_writer.rows_written == 2
+
+    with open(path, "rb") as csv_file:
+        content = csv_file.read()
+    if compression == "gzip":
+        content = gzip.decompress(content)
+    elif compression == "zstd":
+        content = zstandard.ZstdDecompressor().stream_reader(content).read()
+    assert content.decode("utf-8") == "id,name\r\na,Alice\r\nc,Carol\r\n"
+
+
+def test_write_data_parquet():
     schema = yaml.safe_load(
         open(pathlib.Path(__file__).parent.parent / "assets" / "tabulation_schema.yaml")
     )
@@ -122,27 +217,167 @@ def test_write_data_parquet(patched_pa_table, patched_writer):
     output_file_name = "new_parquet"
     file_format = "parquet"
 
-    # Batch 1 tests creating a new parquet file and returning a writer
+    if os.path.isfile(file_location + output_file_name):  # pragma: no cover
+        os.remove(file_location + output_file_name)
+
+    # Batch 1 tests creating a new parquet writer
     pq_writer = write_data(batch_1, file_location, file_format, output_file_name)
-    patched_pa_table.from_arrays.assert_called_with(batch_1[1:], names=batch_1[0])
-    table = patched_pa_table.from_arrays(table_to_use[1:], table_to_use[0])
-    patched_writer.assert_called_with(file_location + output_file_name, table.schema)
-    patched_writer(
-        file_location + output_file_name, table.schema
-    ).write_table.assert_called_with(table=table)
-
-    # Batch 2 tests appending to existing parquet using previous writer
-    write_data(
+    assert isinstance(pq_writer, ParquetTableWriter)
+    assert pq_writer.headers == table_to_use[0]
+
+    # Batch 2 tests appending to the same parquet file using the previous writer
+    returned_writer = write_data(
         batch_2, file_location, file_format, output_file_name, pq_writer=pq_writer
     )
-    patched_pa_table.from_arrays.assert_called_with(batch_2[1:], names=batch_2[0])
-    table = patched_pa_table.from_arrays(batch_2[1:], batch_2[0])
-    pq_writer.write_table.assert_called_with(table=table)
+    assert returned_writer is pq_writer
+    pq_writer.close()
+    assert pq_writer.rows_written == 3
+
+    # Rows are written as rows, not columns, and lists are serialized
+    table = pq.read_table(file_location + output_file_name)
+    assert table.column_names == table_to_use[0]
+    assert table.to_pylist() == [
+        {
+            "Last Name": "Price929",
+            "City": "Waltham",
+            "Exam ID": "obs1",
+            "General Practitioner": "i-am-not-a-robot",
+        },
+        {
+            "Last Name": "Shepard",
+            "City": "Zakera Ward",
+            "Exam ID": None,
+            "General Practitioner": "no-srsly-i-am-hoomun",
+        },
+        {
+            "Last Name": None,
+            "City": "Faketon",
+            "Exam ID": "obs2,obs3",
+            "General Practitioner": None,
+        },
+    ]
+    os.remove(file_location + output_file_name)
+
+
+def test_parquet_table_writer_row_groups_and_types():
+    file_location = "./"
+    output_file_name = "typed_parquet"
+    headers = ["id", "height", "active", "count", "tags"]
+    rows = [
+        ["a", "170.5", True, 1, ["x", "y"]],
+        ["b", None, False, 2, None],
+        ["c", 180, None, None, ["z"]],
+    ]
+
+    pq_writer = write_data(
+        [headers] + rows[:2],
+        file_location,
+        "parquet",
+        output_file_name,
+        column_types={"height": "number"},
+        row_group_size=2,
+    )
+    # The first two rows fill a row group, so they're flushed immediately
+    assert pq_writer.rows_written == 2
+
+    write_data([headers] + rows[2:], file_location, "parquet", pq_writer=pq_writer)
+    assert pq_writer.rows_written == 2
+    pq_writer.close()
+    assert pq_writer.rows_written == 3
+
+    parquet_file = pq.ParquetFile(file_location + output_file_name)
+    assert parquet_file.metadata.num_row_groups == 2
+    assert parquet_file.schema_arrow.types == [
+        pa.string(),
+        pa.float64(),
+        pa.bool_(),
+        pa.int64(),
+        pa.string(),
+    ]
+    assert parquet_file.read().to_pydict() == {
+        "id": ["a", "b", "c"],
+        "height": [170.5, None, 180.0],
+        "active": [True, False, None],
+        "count": [1, 2, None],
+        "tags": ["x,y", None, "z"],
+    }
+    os.remove(file_location + output_file_name)
 
-    # One from initial test of creating new pq file, and one
-    # from calling it on a mocked table in this test, line 105;
-    # Should NOT be called a third time with batch 2
-    assert patched_writer.call_count == 2
+    # Closing a writer that never received rows still creates the file
+    pq_writer = ParquetTableWriter(file_location + output_file_name, headers)
+    pq_writer.close()
+    assert pq.read_table(file_location + output_file_name).column_names == headers
+    os.remove(file_location + output_file_name)
+
+    with pytest.raises(ValueError):
+        ParquetTableWriter(file_location + output_file_name, headers, row_group_size=0)
+
+
+def test_parquet_table_writer_widens_types(tmp_path):
+    path = str(tmp_path / "widened_parquet")
+    headers = ["count", "active", "score"]
+
+    # Inferred types widen to hold later pages, rather than truncating them
+    pq_writer = ParquetTableWriter(path, headers)
+    pq_writer.write([[1, True, 2], [2, False, None]])
+    pq_writer.write([[3.7, "yes", 5]])
+    pq_writer.write([[None, None, "unknown"]])
+    pq_writer.close()
+    table = pq.read_table(path)
+    assert table.schema.types == [pa.float64(), pa.string(), pa.string()]
+    assert table.to_pydict() == {
+        "count": [1.0, 2.0, 3.7, None],
+        "active": ["True", "False", "yes", None],
+        "score": ["2", None, "5", "unknown"],
+    }
+
+    # Once rows have been flushed under a type, it can't be widened
+    pq_writer = ParquetTableWriter(path, headers, row_group_size=1)
+    pq_writer.write([[1, True, 2]])
+    with pytest.raises(ValueError, match="'count'"):
+        pq_writer.write([[2, False, 3], [3.7, True, 4]])
+    pq_writer.write([[2, False, 3]])
+    pq_writer.close()
+    assert pq.read_table(path).to_pydict() == {
+        "count": [1, 2],
+        "active": [True, False],
+        "score": [2, 3],
+    }
+
+    # Declared types are never widened
+    pq_writer = ParquetTableWriter(path, headers, column_types={"active": "boolean"})
+    pq_writer.write([[1, "true", 2]])
+    with pytest.raises(ValueError, match="'active'"):
+        pq_writer.write([[2, "yes", 3]])
+
+
+def test_parquet_table_writer_checkpoint(tmp_path):
+    path = str(tmp_path / "checkpointed_parquet")
+    headers = ["id", "count"]
+
+    pq_writer = ParquetTableWriter(path, headers, partitioned=True)
+    pq_writer.write([["a", 1], ["b", 2]])
+    state = pq_writer.checkpoint()
+    assert state["files"] == ["part-00000.parquet"]
+    assert state["rows_written"] == 2
+
+    # Part files written after the checkpoint are removed when the writer is resumed
+    pq_writer.write([["c", 3]])
+    pq_writer.close()
+    assert sorted(os.listdir(path)) == ["part-00000.parquet", "part-00001.parquet"]
+    pq_writer = ParquetTableWriter.from_checkpoint(state)
+    assert os.listdir(path) == ["part-00000.parquet"]
+
+    pq_writer.write([["d", 4]])
+    pq_writer.close()
+    assert pq_writer.files == ["part-00000.parquet", "part-00001.parquet"]
+    assert pq_writer.rows_written == 3
+    table = pq.read_table(path)
+    assert table.schema.types == [pa.string(), pa.int64()]
+    assert table.to_pydict() == {"id": ["a", "b", "d"], "count": [1, 2, 4]}
+
+    with pytest.raises(ValueError):
+        ParquetTableWriter(str(tmp_path / "single_file"), headers).checkpoint()
 
 
 def test_write_data_sql():
@@ -168,9 +403,10 @@ def test_write_data_sql():
     if os.path.isfile(file_location + db_file):  # pragma: no cover
         os.remove(file_location + db_file)
 
-    write_data(
+    sql_writer = write_data(
         batch_1, file_location, file_format, db_file=db_file, db_tablename="PATIENT"
     )
+    assert isinstance(sql_writer, SqlTableWriter)
 
     # Check that table was created and row was properly inserted
     conn = sql.connect(file_location + db_file)
@@ -186,14 +422,24 @@ def test_write_data_sql():
             "i-am-not-a-robot",
         )
     ]
+    assert cursor.execute("PRAGMA journal_mode").fetchone() == ("wal",)
     conn.close()
 
-    write_data(
-        batch_2, file_location, file_format, db_file=db_file, db_tablename="PATIENT"
+    # Batch 2 appends over the same connection using the previous writer
+    returned_writer = write_data(
+        batch_2,
+        file_location,
+        file_format,
+        db_file=db_file,
+        db_tablename="PATIENT",
+        sql_writer=sql_writer,
     )
+    assert returned_writer is sql_writer
+    sql_writer.close()
+    assert sql_writer.rows_written == 3
 
     # Check that only new rows were added and data was correctly
-    # stored (including empty strings)
+    # stored (including missing values)
     conn = sql.connect(file_location + db_file)
     cursor = conn.cursor()
     res = cursor.execute("SELECT * FROM PATIENT").fetchall()
@@ -205,14 +451,140 @@ def test_write_data_sql():
             "obs1",
             "i-am-not-a-robot",
         ),
-        ("Shepard", "Zakera Ward", "None", "no-srsly-i-am-hoomun"),
-        ("None", "Faketon", "obs2,obs3", "None"),
+        ("Shepard", "Zakera Ward", None, "no-srsly-i-am-hoomun"),
+        (None, "Faketon", "obs2,obs3", None),
     ]
     conn.close()
 
     os.remove(file_location + db_file)
 
 
+def test_sql_table_writer_typed_columns():
+    file_location = "./"
+    db_file = "typed_db.db"
+    headers = ["id", "height", "active", "count"]
+    rows = [
+        ["a", "170.5", True, 1],
+        ["b", None, False, 2],
+        ["c", 180, None, None],
+    ]
+
+    if os.path.isfile(file_location + db_file):  # pragma: no cover
+        os.remove(file_location + db_file)
+
+    sql_writer = SqlTableWriter(
+        file_location + db_file,
+        "typed table",
+        headers,
+        column_types={"height": "number"},
+        batch_size=2,
+    )
+    sql_writer.write(rows)
+    sql_writer.close()
+    assert sql_writer.rows_written == 3
+
+    conn = sql.connect(file_location + db_file)
+    cursor = conn.cursor()
+    columns = cursor.execute('PRAGMA table_info("typed table")').fetchall()
+    assert [(column[1], column[2]) for column in columns] == [
+        ("id", "TEXT"),
+        ("height", "REAL"),
+        ("active", "INTEGER"),
+        ("count", "INTEGER"),
+    ]
+    assert cursor.execute('SELECT * FROM "typed table"').fetchall() == [
+        ("a", 170.5, 1, 1),
+        ("b", None, 0, 2),
+        ("c", 180.0, None, None),
+    ]
+    conn.close()
+    os.remove(file_location + db_file)
+
+    with pytest.raises(ValueError):
+        SqlTableWriter(file_location + db_file, "typed table", headers, batch_size=0)
+
+
+def test_sql_table_writer_widens_types(tmp_path):
+    db_path = str(tmp_path / "widened.db")
+    headers = ["count", "active", "score"]
+
+    sql_writer = SqlTableWriter(db_path, "widened", headers, batch_size=1)
+    sql_writer.write([[1, True, 2], [2, False, None]])
+    state = sql_writer.checkpoint()
+    sql_writer.write([[3.7, "yes", 5]])
+    sql_writer.write([[None, None, "007"]])
+    assert sql_writer.column_types == [pa.float64(), pa.string(), pa.string()]
+    sql_writer.close()
+
+    connection = sql.connect(db_path)
+    columns = connection.execute('PRAGMA table_info("widened")').fetchall()
+    assert [(column[1], column[2]) for column in columns] == [
+        ("count", "REAL"),
+        ("active", "TEXT"),
+        ("score", "TEXT"),
+    ]
+    assert connection.execute("SELECT * FROM widened;").fetchall() == [
+        (1.0, "True", "2"),
+        (2.0, "False", None),
+        (3.7, "yes", "5"),
+        (None, None, "007"),
+    ]
+    connection.close()
+
+    # Rows keep their rowids, so earlier checkpoints can still be resumed from
+    sql_writer = SqlTableWriter.from_checkpoint(state)
+    sql_writer.close()
+    connection = sql.connect(db_path)
+    assert connection.execute("SELECT COUNT(*) FROM widened;").fetchone() == (2,)
+    connection.close()
+
+    # Declared types are never widened, and a page that can't be written isn't
+    sql_writer = SqlTableWriter(
+        db_path, "declared", headers, column_types={"count": "number"}
+    )
+    sql_writer.write([["1.5", True, 2]])
+    with pytest.raises(ValueError, match="'count'"):
+        sql_writer.write([[2, False, 3], ["unknown", True, 4]])
+    sql_writer.close()
+    connection = sql.connect(db_path)
+    assert connection.execute("SELECT * FROM declared;").fetchall() == [(1.5, 1, 2)]
+    connection.close()
+
+
+def test_sql_table_writer_checkpoint(tmp_path):
+    db_path = str(tmp_path / "checkpointed.db")
+    headers = ["id", "count"]
+
+    # Checkpointing before the table exists discards every row written afterwards
+    sql_writer = SqlTableWriter(db_path, "counts", headers)
+    initial_state = sql_writer.checkpoint()
+    assert initial_state["last_rowid"] == 0
+    sql_writer.write([["a", 1]])
+    state = sql_writer.checkpoint()
+    assert state["last_rowid"] == 1
+    assert state["arrow_types"] == ["string", "int64"]
+
+    sql_writer.write([["b", 2], ["c", 3]])
+    sql_writer.close()
+    sql_writer = SqlTableWriter.from_checkpoint(state)
+    sql_writer.write([["d", 4]])
+    sql_writer.close()
+    assert sql_writer.rows_written == 2
+
+    connection = sql.connect(db_path)
+    assert connection.execute("SELECT * FROM counts;").fetchall() == [
+        ("a", 1),
+        ("d", 4),
+    ]
+    connection.close()
+
+    sql_writer = SqlTableWriter.from_checkpoint(initial_state)
+    sql_writer.close()
+    connection = sql.connect(db_path)
+    assert connection.execute("SELECT * FROM counts;").fetchall() == []
+    connection.close()
+
+
 def test_validate_schema():
     valid_schema = yaml.safe_load(
         open(pathlib.Path(__file__).parent.parent / "assets" / "valid_schema.yaml")
@@ -280,3 +652,16 @@ def test_convert_list_to_string():
         + ",array-array-1-2,2,{'foo': 'bar'}"
     )
     assert _convert_list_to_string(array_source) == array_result
+
+
+def test_get_column_types():
+    schema = yaml.safe_load(
+        open(pathlib.Path(__file__).parent.parent / "assets" / "tabulation_schema.yaml")
+    )
+    assert _get_column_types(schema, "Patients") == {
+        "First Name": "string",
+        "Last Name": "string",
+        "Building Number": "number",
+    }
+    assert _get_column_types(schema, "Physical Exams") == {}
+    assert _get_column_types(schema, "Not A Table") == {}